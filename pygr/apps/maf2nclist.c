@@ -32,7 +32,8 @@ int findseqID(char seqName[],SeqIDMap seqidmap[],int r)
   return -1;
 }
 
-int save_interval(IntervalMap *im,int start,int stop,int iseq,int istart,int istop)
+int save_interval(IntervalMap *im,IntervalCoord start,IntervalCoord stop,int iseq,
+		  IntervalCoord istart,IntervalCoord istop)
 {
   im->start=start;
   im->end=stop;
@@ -44,8 +45,15 @@ int save_interval(IntervalMap *im,int start,int stop,int iseq,int istart,int ist
 }
 
 
+char *stdio_readline(char buf[],int size,void *stream)
+{ /* ReadLineFunc FOR A PLAIN stdio FILE */
+  return fgets(buf,size,(FILE *)stream);
+}
+
+
 int readMAFrecord(IntervalMap im[],int n,SeqIDMap seqidmap[],int nseq,
-		  int lpoStart,int *p_block_len,FILE *ifile,int maxseq,
+		  IntervalCoord lpoStart,int *p_block_len,
+		  ReadLineFunc readline,void *ifile,int maxseq,
 		  long long linecode_count[],int *p_has_continuation)
 {
   int i,start,seqStart,junk,iseq= -1,max_len=0,seqLength,newline=1,l,extend=0;
@@ -53,7 +61,7 @@ int readMAFrecord(IntervalMap im[],int n,SeqIDMap seqidmap[],int nseq,
   char *p,seq[32768],prefix[8],seqName[64],oriFlag[8];
   if (p_has_continuation) /* DEFAULT: NO CONTINUATION */
     *p_has_continuation = 0;
-  while ((p=fgets(tmp,32767,ifile))) {
+  while ((p=readline((char *)tmp,32767,ifile))) {
     l=strlen(tmp);
     if (newline ) {
       if ('s'==tmp[0] && isspace(tmp[1])) { /* READ SEQUENCE ALIGNMENT LINE */
@@ -123,16 +131,109 @@ int readMAFrecord(IntervalMap im[],int n,SeqIDMap seqidmap[],int nseq,
   return n;
 }
 
+/* PARSE THE MAF BLOCKS OF ifile WHOSE "a" LINE STARTS IN [start,end),
+   SAVING EACH AS (n,block_len,IntervalMap[n]) TO outpath, WITH LPO
+   COORDINATES RELATIVE TO THE START OF ITS BLOCK.  start MUST BE 0 OR THE
+   START OF AN "a" LINE.  IF seekfile IS NULL (E.G. A COMPRESSED STREAM),
+   THE WHOLE STREAM IS PARSED AND start, end ARE IGNORED.
+   RETURNS #BLOCKS SAVED, OR -1 ON ERROR */
+int read_maf_chunk(char filename[],ReadLineFunc readline,void *ifile,
+		   FILE *seekfile,PYGR_OFF_T start,PYGR_OFF_T end,
+		   SeqIDMap seqidmap[],int nseq,int maxseq,char outpath[],
+		   long long linecode_count[],char err_msg[])
+{
+  int n,block_len,has_continuation=0,nblock=0,header[2];
+  char tmp[32768],*p;
+  IntervalMap *im=NULL;
+  FILE *ofile=NULL;
+
+  if (seekfile==NULL)
+    start=0;
+  CALLOC(im,maxseq,IntervalMap);
+  if (NULL==(ofile=fopen(outpath,"wb"))) {
+    sprintf(err_msg,"unable to open file %s for writing",outpath);
+    goto handle_error;
+  }
+  if (start==0) { /* CHECK THE HEADER LINE */
+    if (readline(tmp,32767,ifile)==NULL || strncmp(tmp,"##maf",4)) {
+      sprintf(err_msg,"%s: not a MAF file? Bad format.",filename);
+      goto handle_error;
+    }
+  }
+  else if (PYGR_FSEEK(seekfile,start,SEEK_SET)) {
+    sprintf(err_msg,"unable to seek to %lld in %s",(long long)start,filename);
+    goto handle_error;
+  }
+  p=readline(tmp,32767,ifile); /* READ 1ST LINE OF THIS CHUNK */
+  while (p) {
+    if (has_continuation || ('a'==tmp[0] && isspace(tmp[1]))) {
+      n=readMAFrecord(im,0,seqidmap,nseq,0,&block_len,readline,ifile,maxseq,
+		      linecode_count,&has_continuation);
+      if (n<0) { /* UNRECOVERABLE ERROR OCCURRED... */
+	sprintf(err_msg,"MAF block too long!  Increase max size");
+	goto handle_error;
+      }
+      if (n>0) { /* SAVE THE BLOCK */
+	header[0]=n;
+	header[1]=block_len;
+	if (fwrite(header,sizeof(int),2,ofile)!=2
+	    || fwrite(im,sizeof(IntervalMap),n,ofile)!=n) {
+	  sprintf(err_msg,"error writing file %s",outpath);
+	  goto handle_error;
+	}
+	nblock++;
+      }
+      if (has_continuation && seekfile && PYGR_FTELL(seekfile)>end)
+	break; /* NEXT "a" LINE BELONGS TO THE NEXT CHUNK */
+    }
+    if (!has_continuation) {
+      if (seekfile && PYGR_FTELL(seekfile)>=end) /* IN THE NEXT CHUNK */
+	break;
+      p=readline(tmp,32767,ifile);
+    }
+  }
+  if (fclose(ofile)) {
+    ofile=NULL;
+    sprintf(err_msg,"error writing file %s",outpath);
+    goto handle_error;
+  }
+  FREE(im);
+  return nblock;
+ handle_malloc_failure:
+  sprintf(err_msg,"unable to malloc %d intervals",maxseq);
+ handle_error:
+  if (ofile)
+    fclose(ofile);
+  FREE(im);
+  return -1;
+}
+
+
+/* READ THE NEXT BLOCK SAVED BY read_maf_chunk() INTO im.  RETURNS ITS
+   #INTERVALS, -1 AT END OF FILE, OR -2 IF THE FILE IS CORRUPTED */
+int read_maf_block(FILE *ifile,IntervalMap im[],int maxseq,int *p_block_len)
+{
+  int header[2];
+  if (fread(header,sizeof(int),2,ifile)!=2)
+    return -1; /* END OF FILE */
+  if (header[0]<=0 || header[0]>maxseq
+      || fread(im,sizeof(IntervalMap),header[0],ifile)!=header[0])
+    return -2;
+  *p_block_len=header[1];
+  return header[0];
+}
+
+
 int read_axtnet(IntervalMap im[], SeqIDMap seqidmap[], int nseq,
-                FILE *ifile, int maxseq, int *isrc, char *src_prefix,
-                char *dest_prefix)
+                ReadLineFunc readline, void *ifile, int maxseq, int *isrc,
+                char *src_prefix, char *dest_prefix)
 {
   int i,srcStart,srcEnd,destStart,destEnd,junk,junk2,idest=-1;
   int n=0,ivalSrc= -1,ivalDest= -1,lineMax,lineAlloc=0;
   int srcLength, destLength;
   unsigned char tmp[32768];
   char *p, *src_seq=NULL, *dest_seq=NULL, srcName[64], destName[64], oriFlag[8], srcChr[64], destChr[64];
-  while ((p=fgets(tmp,32767,ifile))) {
+  while ((p=readline((char *)tmp,32767,ifile))) {
     if (isdigit(tmp[0])) { /* READ SUMMARY LINE */
       if (9==sscanf(tmp,"%d %63s %d %d %63s %d %d %2s %d",&junk,srcChr,&srcStart,&srcEnd,
 		    destChr,&destStart,&destEnd,oriFlag,&junk2)) {
@@ -169,7 +270,8 @@ int read_axtnet(IntervalMap im[], SeqIDMap seqidmap[], int nseq,
 	  srcStart= srcStart -1;
 	}
 
-	if (fgets(src_seq,lineMax-1,ifile)==NULL || fgets(dest_seq,lineMax-1,ifile)==NULL)
+	if (readline(src_seq,lineMax-1,ifile)==NULL
+	    || readline(dest_seq,lineMax-1,ifile)==NULL)
 	  break; /* NO DATA READ, SO NOTHING TO PROCESS */
 	for (i=0;src_seq[i] && dest_seq[i];i++) {
 	  if (src_seq[i]=='-' || dest_seq[i]=='-') { /* GAP */
@@ -8,21 +8,37 @@ typedef struct {
   char *id;
   int length;
   int ns_id;
-  int offset;
+  IntervalCoord offset;
   int nlmsa_id;
 } SeqIDMap;
 
 
 
 
+/* READS ONE LINE OF AT MOST size-1 CHARACTERS INTO buf, LIKE fgets() */
+typedef char *(*ReadLineFunc)(char buf[],int size,void *stream);
+
+extern char *stdio_readline(char buf[],int size,void *stream);
+
 extern int readMAFrecord(IntervalMap im[],int n,SeqIDMap seqidmap[],int nseq,
-			 int lpoStart,int *p_block_len,FILE *ifile,int maxseq,
+			 IntervalCoord lpoStart,int *p_block_len,
+			 ReadLineFunc readline,void *ifile,int maxseq,
 			 long long linecode_count[],int *p_has_continuation)
      ;
 
+extern int read_maf_chunk(char filename[],ReadLineFunc readline,void *ifile,
+			  FILE *seekfile,PYGR_OFF_T start,PYGR_OFF_T end,
+			  SeqIDMap seqidmap[],int nseq,int maxseq,char outpath[],
+			  long long linecode_count[],char err_msg[])
+     ;
+
+extern int read_maf_block(FILE *ifile,IntervalMap im[],int maxseq,
+			  int *p_block_len)
+     ;
+
 extern int read_axtnet(IntervalMap im[], SeqIDMap seqidmap[], int nseq,
-                FILE *ifile, int maxseq, int *isrc, char *src_prefix,
-                char *dest_prefix)
+                       ReadLineFunc readline, void *ifile, int maxseq,
+                       int *isrc, char *src_prefix, char *dest_prefix)
      ;
 
 extern int seqnameID_qsort_cmp(const void *void_a,const void *void_b)
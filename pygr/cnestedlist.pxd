@@ -24,6 +24,13 @@ cdef extern from "stdio.h":
   int fprintf(FILE *ifile,char *fmt,...)
   char *fgets(char *str,int size,FILE *ifile)
 
+cdef extern from "pythread.h":
+  ctypedef void *PyThread_type_lock
+  PyThread_type_lock PyThread_allocate_lock()
+  void PyThread_free_lock(PyThread_type_lock lock)
+  int PyThread_acquire_lock(PyThread_type_lock lock,int waitflag) nogil
+  void PyThread_release_lock(PyThread_type_lock lock) nogil
+
 cdef extern from "string.h":
   int strcmp(char *s1, char *s2)
   int strncmp(char *s1,char *s2,size_t len)
@@ -32,24 +39,32 @@ cdef extern from "string.h":
   char *strcat(char *,char *)
 
 cdef extern from "intervaldb.h":
+  ctypedef long long IntervalCoord # int UNLESS BUILT WITH PYGR_INTERVAL64
+
   ctypedef struct IntervalMap:
-    int start
-    int end
-    int target_id
-    int target_start
-    int target_end
-    int sublist
+    IntervalCoord start
+    IntervalCoord end
+    IntervalCoord target_id
+    IntervalCoord target_start
+    IntervalCoord target_end
+    IntervalCoord sublist
 
   ctypedef struct IntervalIndex:
-    int start
-    int end
+    IntervalCoord start
+    IntervalCoord end
 
   ctypedef struct SublistHeader:
-    int start
-    int len
+    IntervalCoord start
+    IntervalCoord len
 
   ctypedef struct SubheaderFile:
     pass
+
+  ctypedef struct CompressedIDBFile:
+    int nblocks
+    int ncache
+    long long nhit
+    long long nmiss
   
   ctypedef struct IntervalDBFile:
     int n
@@ -61,10 +76,29 @@ cdef extern from "intervaldb.h":
     SublistHeader *subheader
     SubheaderFile subheader_file
     FILE *ifile_idb
+    IntervalMap *im_map
+    CompressedIDBFile *zfile
 
   ctypedef struct IntervalIterator:
     pass
 
+  ctypedef struct GroupBound:
+    IntervalCoord ipos
+    int is_start
+    int j
+    int is_indel
+    int k
+    IntervalCoord start
+    IntervalCoord end
+    IntervalCoord target_start
+    IntervalCoord target_end
+
+  ctypedef struct GroupResult:
+    IntervalCoord start
+    IntervalCoord end
+    int k
+    int clip_end
+
   ctypedef struct FilePtrRecord:
     FILE *ifile
     int left
@@ -75,7 +109,9 @@ cdef extern from "intervaldb.h":
 
 
   int imstart_qsort_cmp(void *void_a,void *void_b)
+  int imslice_qsort_cmp(void *void_a,void *void_b)
   int target_qsort_cmp(void *void_a,void *void_b)
+  int group_bound_qsort_cmp(void *void_a,void *void_b)
   IntervalMap *read_intervals(int n,FILE *ifile) except NULL
   SublistHeader *build_nested_list(IntervalMap im[],int n,int *p_n,int *p_nlists) except NULL
   SublistHeader *build_nested_list_inplace(IntervalMap im[],int n,int *p_n,int *p_nlists) except NULL
@@ -83,16 +119,26 @@ cdef extern from "intervaldb.h":
   IntervalIterator *interval_iterator_alloc() except NULL
   int free_interval_iterator(IntervalIterator *it)
   IntervalIterator *reset_interval_iterator(IntervalIterator *it)
-  int find_intervals(IntervalIterator *it0,int start,int end,IntervalMap im[],int n,SublistHeader subheader[],int nlists,IntervalMap buf[],int nbuf,int *p_nreturn,IntervalIterator **it_return) except -1
+  int find_intervals(IntervalIterator *it0,IntervalCoord start,IntervalCoord end,IntervalMap im[],int n,SublistHeader subheader[],int nlists,IntervalMap buf[],int nbuf,int *p_nreturn,IntervalIterator **it_return) except -1 nogil
   char *write_binary_files(IntervalMap im[],int n,int ntop,int div,SublistHeader *subheader,int nlists,char filestem[])
-  IntervalDBFile *read_binary_files(char filestem[],char err_msg[],int subheader_nblock) except NULL
+  char *build_binary_files_external(char buildfile[],int n,int div,char filestem[],long long max_memory)
+  char *sort_binary_records(char buildfile[],char sortfile[],long long n,long long max_memory)
+  IntervalDBFile *read_binary_files(char filestem[],char err_msg[],int subheader_nblock,int use_mmap,int ncache)
+  char *compress_binary_files(char filestem[])
   int free_interval_dbfile(IntervalDBFile *db_file)
-  int find_file_intervals(IntervalIterator *it0,int start,int end,IntervalIndex ii[],int nii,SublistHeader subheader[],int nlists,SubheaderFile *subheader_file,int ntop,int div,FILE *ifile,IntervalMap buf[],int nbuf,int *p_nreturn,IntervalIterator **it_return) except -1
+  int find_file_intervals(IntervalIterator *it0,IntervalCoord start,IntervalCoord end,IntervalDBFile *db_file,IntervalMap buf[],int nbuf,int *p_nreturn,IntervalIterator **it_return) except -1 nogil
+  int idb_file_is_threadsafe(IntervalDBFile *db_file)
+  int scan_idb_records(IntervalDBFile *db_file,int *p_isub,IntervalCoord *p_i,IntervalMap buf[],int nbuf) nogil
+  int FIND_FILE_MALLOC_ERR
+  int merge_target_bounds(IntervalMap im[],int n,IntervalCoord maxgap,IntervalCoord maxinsert,IntervalCoord mininsert,IntervalCoord maxsize,int merge_all,GroupBound bounds[],int *p_nseq)
+  int group_bound_sweep(GroupBound bounds[],int nbound,int nseq,int ngroup,int source_only,int indel_cut,double min_aligned,double p_min_aligned,GroupResult **p_result) except -1
   int write_padded_binary(IntervalMap im[],int n,int div,FILE *ifile)
   int read_imdiv(FILE *ifile,IntervalMap imdiv[],int div,int i_div,int ntop)
   int save_text_file(char filestem[],char basestem[],char err_msg[],FILE *ofile)
   int text_file_to_binaries(FILE *infile,char buildpath[],char err_msg[])
   int C_int_max
+  IntervalCoord C_coord_max
+  int C_idb_format_version
 
 
 
@@ -104,15 +150,23 @@ cdef extern from "apps/maf2nclist.h":
     char *id
     int length
     int ns_id
-    int offset
+    IntervalCoord offset
     int nlmsa_id
 
+  ctypedef char *(*ReadLineFunc)(char buf[],int size,void *stream)
+  char *stdio_readline(char buf[],int size,void *stream)
   int readMAFrecord(IntervalMap im[],int n,SeqIDMap seqidmap[],int nseq,
-                    int lpoStart,int *p_block_len,FILE *ifile,int maxseq,
+                    IntervalCoord lpoStart,int *p_block_len,
+                    ReadLineFunc readline,void *ifile,int maxseq,
                     long long linecode_count[],int *p_has_continuation)
+  int read_maf_chunk(char filename[],ReadLineFunc readline,void *ifile,
+                     FILE *seekfile,long long start,long long end,
+                     SeqIDMap seqidmap[],int nseq,int maxseq,char outpath[],
+                     long long linecode_count[],char err_msg[])
+  int read_maf_block(FILE *ifile,IntervalMap im[],int maxseq,int *p_block_len)
   int read_axtnet(IntervalMap im[], SeqIDMap seqidmap[], int nseq,
-                  FILE *ifile, int maxseq, int *isrc, char *src_prefix,
-                  char *dest_prefix)
+                  ReadLineFunc readline, void *ifile, int maxseq, int *isrc,
+                  char *src_prefix, char *dest_prefix)
   int seqnameID_qsort_cmp(void *void_a,void *void_b)
   int seqidmap_qsort_cmp(void *void_a,void *void_b)
 
@@ -130,29 +184,46 @@ cdef class IntervalDB:
 cdef class IntervalDBIterator:
   cdef IntervalIterator *it,*it_alloc
   cdef IntervalMap im_buf[1024]
-  cdef int ihit,nhit,start,end
+  cdef int ihit,nhit
+  cdef IntervalCoord start,end
   cdef IntervalDB db
+  cdef PyThread_type_lock lock
 
-  cdef int cnext(self)
+  cdef int cnext(self) except -2
 
 cdef class IntervalFileDB:
-  cdef IntervalDBFile *db
+  cdef IntervalDBFile *db,*db_closed
+  cdef int nsearch
+  cdef PyThread_type_lock lock
+
+  cdef IntervalDBFile *begin_search(self) except NULL
+  cdef int end_search(self,IntervalDBFile *db_file)
+
+cdef class IntervalFileDBScanner:
+  cdef IntervalFileDB db
+  cdef int isub,blockSize
+  cdef IntervalCoord i
 
 cdef class NLMSASequence
 
 cdef class IntervalFileDBIterator:
   cdef IntervalIterator *it,*it_alloc
   cdef IntervalMap *im_buf
-  cdef int ihit,nhit,start,end,nbuf
-  cdef IntervalFileDB db
+  cdef int ihit,nhit,nbuf
+  cdef IntervalCoord start,end
+  cdef IntervalFileDB db,delta_db
   cdef IntervalDB idb
+  cdef PyThread_type_lock lock
 
-  cdef int restart(self,int start,int end,IntervalFileDB db,NLMSASequence ns) except -2
+  cdef int restart(self,IntervalCoord start,IntervalCoord end,IntervalFileDB db,NLMSASequence ns) except -2
   cdef int reset(self) except -2
   cdef int cnext(self,int *pkeep)
   cdef int extend(self,int ikeep)
-  cdef int saveInterval(self,int start,int end,int target_id,
-                        int target_start,int target_end)
+  cdef int saveInterval(self,IntervalCoord start,IntervalCoord end,
+                        int target_id,IntervalCoord target_start,
+                        IntervalCoord target_end)
+  cdef int searchFile(self,int ibuf) except -1
+  cdef int loadBlock(self,int *pkeep) except -2
   cdef int nextBlock(self,int *pkeep) except -2
   cdef IntervalMap *getIntervalMap(self)
   cdef int loadAll(self) except -1
@@ -169,23 +240,40 @@ cdef class NLMSA:
   cdef int do_build
   cdef readonly object lpoList,maxLPOcoord
   cdef int lpo_id
-  cdef readonly int maxlen,inlmsa,is_bidirectional,pairwiseMode,in_memory_mode
+  cdef readonly IntervalCoord maxlen
+  cdef readonly int inlmsa,is_bidirectional,pairwiseMode,in_memory_mode
+  cdef readonly int useMmap,compressIdb,cacheBlocks
+  cdef readonly int maxOpenIndexes
+  cdef readonly object openIndexes
+  cdef long long useClock
   cdef public object _persistent_id,_ignoreShadowAttr,__doc__,_saveLocalBuild
   cdef public object inverseDB
 
+  cdef int save_open_index(self,NLMSASequence ns) except -1
   cdef void free_seqidmap(self,int nseq0,SeqIDMap *seqidmap)
   cdef void save_nbuild(self,int nbuild[])
   cdef NLMSASequence add_seqidmap_to_union(self,int j,SeqIDMap seqidmap[],
                                            NLMSASequence ns,FILE *build_ifile[],
                                            int nbuild[])
+  cdef NLMSASequence save_maf_block(self,IntervalMap im[],int n,int block_len,
+                                    SeqIDMap seqidmap[],NLMSASequence ns_lpo,
+                                    FILE *build_ifile[],int nbuild[],maxint)
+  cdef NLMSASequence read_maf_parallel(self,mafFiles,maxint,int nprocs,
+                                       SeqIDMap seqidmap[],int nseq0,
+                                       NLMSASequence ns_lpo,
+                                       FILE *build_ifile[],int nbuild[],
+                                       long long linecode_count[])
 
 cdef class NLMSASequence:
-  cdef readonly int id,length,nbuild,is_lpo,is_union
+  cdef readonly int id,nbuild,is_lpo,is_union,appending
+  cdef readonly IntervalCoord length
   cdef readonly object offset
   cdef readonly object seq
   cdef readonly object name
-  cdef IntervalFileDB db
+  cdef IntervalFileDB db,delta_db
   cdef IntervalDB idb
+  cdef int isOpen
+  cdef long long lastUse
   cdef FILE *build_ifile
   cdef readonly object filestem
   cdef readonly NLMSA nlmsaLetters
@@ -194,8 +282,10 @@ cdef class NLMSASequence:
   cdef int saveInterval(self,IntervalMap im[],int n,int expand_self,FILE *ifile)
 
 cdef class NLMSASlice:
-  cdef readonly int start,stop,id
-  cdef int n,nseqBounds,nrealseq,offset
+  cdef readonly IntervalCoord start,stop
+  cdef readonly int id
+  cdef int n,nseqBounds,nrealseq
+  cdef IntervalCoord offset
   cdef IntervalMap *im
   cdef IntervalMap *seqBounds
   cdef readonly NLMSASequence nlmsaSequence
@@ -204,7 +294,9 @@ cdef class NLMSASlice:
   cdef object weakestLink
 
   cdef int findSeqBounds(self,int id,int ori)
-  cdef object get_seq_interval(self, NLMSA nl, int targetID, int start, int stop)
+  cdef object get_seq_interval(self, NLMSA nl, int targetID, IntervalCoord start,
+                               IntervalCoord stop)
+  cdef object group_results(self, GroupResult *results, int n, seqs, ivals)
 
 cdef class NLMSASliceLetters:
   cdef readonly NLMSASlice nlmsaSlice
@@ -2,10 +2,31 @@ import sequence
 import nlmsa_utils
 import logger
 
+# groupByIntervals() OPTIONS THAT split() CAN APPLY DIRECTLY IN C
+_splitMergeOptions = ('maxgap', 'maxinsert', 'mininsert', 'mergeMost',
+                      'maxsize', 'mergeAll', 'pMinAligned')
+
+
+cdef PyThread_type_lock new_lock() except NULL:
+  cdef PyThread_type_lock lock
+  lock = PyThread_allocate_lock()
+  if lock == NULL:
+    raise MemoryError('unable to allocate thread lock')
+  return lock
+
+cdef int acquire_lock(PyThread_type_lock lock) except -1:
+  'acquire lock, releasing the GIL only if we have to wait for it'
+  if not PyThread_acquire_lock(lock, 0): # HELD BY ANOTHER THREAD
+    with nogil:
+      PyThread_acquire_lock(lock, 1)
+  return 0
+
 
 cdef class IntervalDBIterator:
 
-  def __new__(self, int start, int end, IntervalDB db not None):
+  def __new__(self, IntervalCoord start, IntervalCoord end,
+              IntervalDB db not None):
+    self.lock = new_lock()
     self.it = interval_iterator_alloc()
     self.it_alloc = self.it
     self.start = start
@@ -15,15 +36,23 @@ cdef class IntervalDBIterator:
   def __iter__(self):
     return self
 
-  cdef int cnext(self): # C VERSION OF ITERATOR next METHOD RETURNS INDEX
-    cdef int i
+  cdef int cnext(self) except -2: # C VERSION OF ITERATOR next METHOD RETURNS INDEX
+    cdef int i, nhit
+    cdef IntervalIterator *it
     if self.ihit >= self.nhit: # TRY TO GET ONE MORE BUFFER CHUNK OF HITS
-      if self.it == NULL: # ITERATOR IS EXHAUSTED
-        return -1
-      find_intervals(self.it, self.start, self.end, self.db.im, self.db.ntop,
-                     self.db.subheader, self.db.nlists, self.im_buf, 1024,
-                     &(self.nhit), &(self.it)) # GET NEXT BUFFER CHUNK
-      self.ihit = 0 # START ITERATING FROM START OF BUFFER
+      acquire_lock(self.lock) # ONLY ONE THREAD AT A TIME MAY REFILL im_buf
+      try:
+        it = self.it
+        if self.ihit >= self.nhit and it != NULL: # NO OTHER THREAD REFILLED IT
+          with nogil:
+            find_intervals(it, self.start, self.end, self.db.im, self.db.ntop,
+                           self.db.subheader, self.db.nlists, self.im_buf, 1024,
+                           &nhit, &it) # GET NEXT BUFFER CHUNK
+          self.it = it
+          self.ihit = 0 # START ITERATING FROM START OF BUFFER
+          self.nhit = nhit
+      finally:
+        PyThread_release_lock(self.lock)
     if self.ihit < self.nhit: # RETURN NEXT ITEM FROM BUFFER
       i = self.ihit
       self.ihit = self.ihit + 1 # ADVANCE THE BUFFER COUNTER
@@ -44,6 +73,8 @@ cdef class IntervalDBIterator:
   def __dealloc__(self):
     'remember: dealloc cannot call other methods!'
     free_interval_iterator(self.it_alloc)
+    if self.lock:
+      PyThread_free_lock(self.lock)
 
 
 cdef class IntervalDB:
@@ -109,11 +140,11 @@ cdef class IntervalDB:
     self.im = im_new
     self.runBuildMethod(**kwargs)
 
-  def find_overlap(self, int start, int end):
+  def find_overlap(self, IntervalCoord start, IntervalCoord end):
     self.check_nonempty() # RAISE EXCEPTION IF NO DATA
     return IntervalDBIterator(start, end, self)
 
-  def find_overlap_list(self, int start, int end):
+  def find_overlap_list(self, IntervalCoord start, IntervalCoord end):
     cdef int i, nhit
     cdef IntervalIterator *it, *it_alloc
     cdef IntervalMap im_buf[1024]
@@ -122,9 +153,10 @@ cdef class IntervalDB:
     it_alloc = it
     l = [] # LIST OF RESULTS TO HAND BACK
     while it:
-      find_intervals(it, start, end, self.im, self.ntop,
-                     self.subheader, self.nlists, im_buf, 1024,
-                     &(nhit), &(it)) # GET NEXT BUFFER CHUNK
+      with nogil:
+        find_intervals(it, start, end, self.im, self.ntop,
+                       self.subheader, self.nlists, im_buf, 1024,
+                       &(nhit), &(it)) # GET NEXT BUFFER CHUNK
       for i from 0 <= i < nhit:
         l.append((im_buf[i].start, im_buf[i].end, im_buf[i].target_id, im_buf[i].target_start, im_buf[i].target_end))
     free_interval_iterator(it_alloc)
@@ -137,12 +169,18 @@ cdef class IntervalDB:
       msg = 'empty IntervalDB, not searchable!'
       raise IndexError(msg)
 
-  def write_binaries(self, filestem, div=256):
+  def write_binaries(self, filestem, div=256, compress=False):
+    '''save as binary index files for IntervalFileDB.  compress=True
+    stores the .idb records as delta-encoded, varint-packed blocks of
+    div records each (a .idbz file), which IntervalFileDB decompresses
+    block by block as queries need them.'''
     cdef char *err_msg
     err_msg = write_binary_files(self.im, self.n, self.ntop, div,
                                  self.subheader, self.nlists, filestem)
     if err_msg:
       raise IOError(err_msg)
+    if compress:
+      compress_binaries(filestem)
 
   def __dealloc__(self):
     'remember: dealloc cannot call other methods!'
@@ -164,10 +202,12 @@ cdef class IntervalDB:
 
 cdef class IntervalFileDBIterator:
 
-  def __new__(self, int start, int end, IntervalFileDB db=None,
+  def __new__(self, IntervalCoord start, IntervalCoord end,
+              IntervalFileDB db=None,
               NLMSASequence ns=None,
               int nbuffer=1024, rawIvals=None):
     cdef int i
+    self.lock = new_lock()
     self.it_alloc = interval_iterator_alloc()
     self.restart(start, end, db, ns)
     if rawIvals is not None and len(rawIvals) > nbuffer:
@@ -185,19 +225,23 @@ cdef class IntervalFileDBIterator:
         i = i + 1
       self.nhit = i # TOTAL NUMBER OF INTERVALS STORED
 
-  cdef int restart(self, int start, int end, IntervalFileDB db,
-                   NLMSASequence ns) except -2:
+  cdef int restart(self, IntervalCoord start, IntervalCoord end,
+                   IntervalFileDB db, NLMSASequence ns) except -2:
     'reuse this iterator for another search without reallocing memory'
     self.nhit = 0 # FLUSH ANY EXISTING DATA
     self.start = start
     self.end = end
     self.db = db
+    self.delta_db = None
     if ns is not None:
       if ns.idb is not None:
         self.idb = ns.idb
       elif ns.db is None:
         ns.forceLoad()
       self.db = ns.db
+      self.delta_db = ns.delta_db # APPENDED INTERVALS, SEARCHED AFTER db
+      ns.nlmsaLetters.useClock = ns.nlmsaLetters.useClock + 1
+      ns.lastUse = ns.nlmsaLetters.useClock # FOR LEAST-RECENTLY-QUERIED CLOSING
     self.it = self.it_alloc # REUSE OUR CURRENT ITERATOR
     reset_interval_iterator(self.it) # RESET IT FOR REUSE
     return 0
@@ -224,8 +268,9 @@ cdef class IntervalFileDBIterator:
       self.nbuf = 2 * self.nbuf
     return istart # RETURN START OF EMPTY BLOCK WHERE WE CAN ADD NEW DATA
 
-  cdef int saveInterval(self, int start, int end, int target_id,
-                        int target_start, int target_end):
+  cdef int saveInterval(self, IntervalCoord start, IntervalCoord end,
+                        int target_id, IntervalCoord target_start,
+                        IntervalCoord target_end):
     'save an interval, expanding array if necessary'
     cdef int i
     if self.nhit >= self.nbuf: # EXPAND ARRAY IF NECESSARY
@@ -239,28 +284,68 @@ cdef class IntervalFileDBIterator:
     self.nhit = i + 1
     return self.nhit
 
+  cdef int searchFile(self, int ibuf) except -1:
+    '''get the next chunk of hits from self.db into im_buf[ibuf:],
+    without holding the GIL; all the search state is in this iterator'''
+    cdef int nbuf, nhit
+    cdef IntervalCoord start, end
+    cdef IntervalIterator *it
+    cdef IntervalDBFile *db_file
+    cdef IntervalMap *buf
+    db_file = self.db.begin_search()
+    it = self.it
+    start = self.start
+    end = self.end
+    buf = self.im_buf + ibuf
+    nbuf = self.nbuf - ibuf
+    try:
+      with nogil:
+        find_file_intervals(it, start, end, db_file, buf, nbuf, &nhit, &it)
+    finally:
+      self.db.end_search(db_file)
+    self.it = it
+    self.nhit = nhit
+    return nhit
+
   cdef int nextBlock(self, int *pkeep) except -2:
-    'load one more block of overlapping intervals'
-    cdef int i
+    'load one more block of overlapping intervals; see loadBlock()'
+    acquire_lock(self.lock)
+    try:
+      return self.loadBlock(pkeep)
+    finally:
+      PyThread_release_lock(self.lock)
+
+  cdef int loadBlock(self, int *pkeep) except -2:
+    '''load one more block of overlapping intervals.  Caller must hold
+    self.lock, since the search runs without the GIL'''
+    cdef int i, n
+    cdef IntervalIterator *it
     if self.it == NULL: # ITERATOR IS EXHAUSTED
       return -1
+    self.ihit = self.nhit # OTHER THREADS MUST NOT READ im_buf UNTIL WE'RE DONE
     if pkeep and pkeep[0] >= 0 and pkeep[0] < self.nhit: #MUST KEEP [ikeep:] SLICE
       i = self.extend(pkeep[0]) # MOVE SLICE TO THE FRONT
     else: # WE CAN USE THE WHOLE BUFFER
       i = 0
     if self.db is not None: # ON-DISK DATABASE
-      find_file_intervals(self.it, self.start, self.end,
-                          self.db.db[0].ii, self.db.db[0].nii,
-                          self.db.db[0].subheader, self.db.db[0].nlists,
-                          &(self.db.db[0].subheader_file),
-                          self.db.db[0].ntop, self.db.db[0].div,
-                          self.db.db[0].ifile_idb,
-                          self.im_buf + i, self.nbuf - i,
-                          &(self.nhit), &(self.it)) # GET NEXT BUFFER CHUNK
+      self.searchFile(i) # GET NEXT BUFFER CHUNK
+      if self.it == NULL and self.delta_db is not None: # NOW SEARCH DELTA
+        self.db = self.delta_db
+        self.delta_db = None
+        self.it = self.it_alloc # REUSE OUR CURRENT ITERATOR
+        reset_interval_iterator(self.it)
+        n = i + self.nhit # FILL REST OF BUFFER, SINCE extend() EXPECTS IT FULL
+        if n < self.nbuf:
+          self.searchFile(n)
+          self.nhit = self.nhit + n - i # HITS FROM BOTH BASE AND DELTA
     elif self.idb is not None: # IN-MEMORY DATABASE
-      find_intervals(self.it, self.start, self.end, self.idb.im, self.idb.ntop,
-                     self.idb.subheader, self.idb.nlists, self.im_buf + i, self.nbuf - i,
-                     &(self.nhit), &(self.it)) # GET NEXT BUFFER CHUNK
+      it = self.it
+      with nogil:
+        find_intervals(it, self.start, self.end, self.idb.im, self.idb.ntop,
+                       self.idb.subheader, self.idb.nlists, self.im_buf + i,
+                       self.nbuf - i, &n, &it) # GET NEXT BUFFER CHUNK
+      self.it = it
+      self.nhit = n
     else:
       raise IOError('Iterator has no database!  Please provide a db argument.')
     self.nhit = self.nhit + i # TOTAL #HITS IN THE BUFFER
@@ -289,15 +374,24 @@ cdef class IntervalFileDBIterator:
     cdef int len, ikeep
     len = 1
     ikeep = 0 # DON'T LET extend DISCARD ANY HITS, KEEP THEM ALL!
-    while len > 0: # LOAD BLOCKS UNTIL NO MORE...
-      len = self.nextBlock(&ikeep) # LOAD ANOTHER BLOCK OF INTERVALS
+    acquire_lock(self.lock)
+    try:
+      while len > 0: # LOAD BLOCKS UNTIL NO MORE...
+        len = self.loadBlock(&ikeep) # LOAD ANOTHER BLOCK OF INTERVALS
+    finally:
+      PyThread_release_lock(self.lock)
     return self.nhit
 
   cdef int cnext(self, int *pkeep): # C VERSION OF ITERATOR next METHOD
     'get one more overlapping interval'
     cdef int i
     if self.ihit >= self.nhit: # TRY TO GET ONE MORE BUFFER CHUNK OF HITS
-      self.nextBlock(pkeep) # LOAD THE NEXT BLOCK IF ANY
+      acquire_lock(self.lock)
+      try:
+        if self.ihit >= self.nhit: # NO OTHER THREAD LOADED ONE WHILE WE WAITED
+          self.loadBlock(pkeep) # LOAD THE NEXT BLOCK IF ANY
+      finally:
+        PyThread_release_lock(self.lock)
     if self.ihit < self.nhit: # RETURN NEXT ITEM FROM BUFFER
       i = self.ihit
       self.ihit = self.ihit + 1 # ADVANCE THE BUFFER COUNTER
@@ -364,39 +458,113 @@ cdef class IntervalFileDBIterator:
     free_interval_iterator(self.it_alloc)
     if self.im_buf:
       free(self.im_buf)
+    if self.lock:
+      PyThread_free_lock(self.lock)
 
 
 cdef class IntervalFileDB:
 
-  def __new__(self, filestem=None, mode='r'):
+  def __new__(self, filestem=None, mode='r', useMmap=False, cacheBlocks=64):
+    self.lock = new_lock()
     if filestem is not None and mode == 'r':
-      self.open(filestem)
+      self.open(filestem, useMmap, cacheBlocks)
+
+  cdef IntervalDBFile *begin_search(self) except NULL:
+    '''get our IntervalDBFile for a search that will run without the GIL,
+    acquiring self.lock first unless it is safe for concurrent searches
+    (memory-mapped, uncompressed).  Caller must pass it to end_search()'''
+    cdef IntervalDBFile *db_file
+    db_file = self.db
+    if db_file == NULL:
+      raise IndexError('empty IntervalFileDB, not searchable!')
+    self.nsearch = self.nsearch + 1 # close() MUST NOT FREE IT UNDER US
+    if not idb_file_is_threadsafe(db_file): # FILE POSITION / BLOCK CACHE
+      acquire_lock(self.lock)
+    return db_file
+
+  cdef int end_search(self, IntervalDBFile *db_file):
+    'release db_file obtained from begin_search()'
+    if not idb_file_is_threadsafe(db_file):
+      PyThread_release_lock(self.lock)
+    self.nsearch = self.nsearch - 1
+    if self.nsearch == 0 and self.db_closed != NULL: # DEFERRED BY close()
+      free_interval_dbfile(self.db_closed)
+      self.db_closed = NULL
+    return 0
 
-  def open(self, filestem):
+  def open(self, filestem, useMmap=False, cacheBlocks=64):
+    '''open the binary index files.  useMmap=True maps the .idb and
+    .subhead files read-only into memory (shared by all processes using
+    them), so queries read records directly from the page cache instead of
+    via seek+read calls.  Falls back silently to regular file reads
+    on platforms where mmap is unavailable.  For a compressed database,
+    the cacheBlocks most recently used blocks are kept decompressed.'''
     cdef char err_msg[1024]
-    self.db = read_binary_files(filestem, err_msg, 1024)
+    cdef int use_mmap
+    if self.db_closed != NULL: # close() COULD ONLY PARK ONE db AT A TIME
+      raise IOError('IntervalFileDB: cannot reopen until searches of the closed database finish')
+    if useMmap:
+      use_mmap = 1
+    else:
+      use_mmap = 0
+    self.db = read_binary_files(filestem, err_msg, 1024, use_mmap, cacheBlocks)
     if self.db == NULL:
       raise IOError(err_msg)
 
-  def find_overlap(self, int start, int end):
+  def is_mmapped(self):
+    'True if our .idb file is memory-mapped'
+    self.check_nonempty() # RAISE EXCEPTION IF NO DATA
+    return self.db[0].im_map != NULL
+
+  def is_compressed(self):
+    'True if our records are stored as a compressed .idbz file'
+    self.check_nonempty() # RAISE EXCEPTION IF NO DATA
+    return self.db[0].zfile != NULL
+
+  def cache_info(self):
+    '''decompressed block cache statistics, as a dict with keys hits,
+    misses and maxsize; None if the database is not compressed'''
+    self.check_nonempty() # RAISE EXCEPTION IF NO DATA
+    if self.db[0].zfile == NULL:
+      return None
+    return dict(hits=self.db[0].zfile[0].nhit, misses=self.db[0].zfile[0].nmiss,
+                maxsize=self.db[0].zfile[0].ncache)
+
+  def __len__(self):
+    self.check_nonempty() # RAISE EXCEPTION IF NO DATA
+    return self.db[0].n
+
+  def scan(self, int blockSize=65536):
+    '''iterate over all our intervals in on-disk order (not coordinate
+    order), as numpy record arrays of up to blockSize intervals, using
+    large sequential reads instead of nested list searches'''
+    return IntervalFileDBScanner(self, blockSize)
+
+  def find_overlap(self, IntervalCoord start, IntervalCoord end):
     self.check_nonempty() # RAISE EXCEPTION IF NO DATA
     return IntervalFileDBIterator(start, end, self)
 
-  def find_overlap_list(self, int start, int end):
+  def find_overlap_list(self, IntervalCoord start, IntervalCoord end):
     cdef int i, nhit
     cdef IntervalIterator *it, *it_alloc
+    cdef IntervalDBFile *db_file
     cdef IntervalMap im_buf[1024]
     self.check_nonempty() # RAISE EXCEPTION IF NO DATA
     it = interval_iterator_alloc()
     it_alloc = it
     l = [] # LIST OF RESULTS TO HAND BACK
     while it:
-      find_file_intervals(it, start, end, self.db[0].ii, self.db[0].nii,
-                          self.db[0].subheader, self.db[0].nlists,
-                          &(self.db[0].subheader_file),
-                          self.db[0].ntop, self.db[0].div,
-                          self.db[0].ifile_idb, im_buf, 1024,
-                          &(nhit), &(it)) # GET NEXT BUFFER CHUNK
+      try:
+        db_file = self.begin_search()
+      except:
+        free_interval_iterator(it_alloc)
+        raise
+      try:
+        with nogil:
+          find_file_intervals(it, start, end, db_file, im_buf, 1024,
+                              &(nhit), &(it)) # GET NEXT BUFFER CHUNK
+      finally:
+        self.end_search(db_file)
       for i from 0 <= i < nhit:
         l.append((im_buf[i].start, im_buf[i].end, im_buf[i].target_id,
                   im_buf[i].target_start, im_buf[i].target_end))
@@ -409,13 +577,68 @@ cdef class IntervalFileDB:
 
   def close(self):
     if self.db:
-      free_interval_dbfile(self.db)
+      if self.nsearch > 0: # ANOTHER THREAD IS SEARCHING IT: LET IT FREE IT
+        self.db_closed = self.db # open() REFUSES TO REOPEN UNTIL IT'S FREED
+      else:
+        free_interval_dbfile(self.db)
     self.db = NULL
 
   def __dealloc__(self):
     'remember: dealloc cannot call other methods!'
     if self.db:
       free_interval_dbfile(self.db)
+    if self.db_closed:
+      free_interval_dbfile(self.db_closed)
+    if self.lock:
+      PyThread_free_lock(self.lock)
+
+
+cdef class IntervalFileDBScanner:
+  '''sequential scan of every interval of an IntervalFileDB: its top-level
+  list, then each of its sublists, in on-disk order.  Each iteration returns
+  a numpy record array (see interval_map_dtype()) of up to blockSize
+  intervals, which owns its memory.'''
+
+  def __new__(self, IntervalFileDB db not None, int blockSize=65536):
+    if blockSize <= 0:
+      raise ValueError('blockSize must be positive')
+    self.db = db
+    self.blockSize = blockSize
+    self.isub = -1 # START WITH THE TOP-LEVEL LIST
+    self.i = 0
+
+  def __iter__(self):
+    return self
+
+  def __next__(self): # PYREX USES THIS NON-STANDARD NAME INSTEAD OF next()!!!
+    cdef int n, isub, nbuf
+    cdef IntervalCoord i
+    cdef Py_ssize_t address # WIDE ENOUGH FOR A POINTER, EVEN ON WIN64
+    cdef IntervalDBFile *db_file
+    import numpy
+    self.db.check_nonempty() # RAISE EXCEPTION IF DATABASE CLOSED
+    a = numpy.empty(self.blockSize, interval_map_dtype())
+    address = a.ctypes.data
+    isub = self.isub
+    i = self.i
+    nbuf = self.blockSize
+    db_file = self.db.begin_search() # SHARES FILE POSITION / BLOCK CACHE
+    try:
+      with nogil:
+        n = scan_idb_records(db_file, &isub, &i, <IntervalMap *>address, nbuf)
+    finally:
+      self.db.end_search(db_file)
+    self.isub = isub
+    self.i = i
+    if n == FIND_FILE_MALLOC_ERR:
+      raise MemoryError('unable to allocate IntervalFileDB read buffer')
+    elif n < 0: # TRUNCATED FILE OR CORRUPT COMPRESSED BLOCK
+      raise IOError('error reading IntervalFileDB records')
+    elif n == 0:
+      raise StopIteration
+    elif n < self.blockSize: # LAST BLOCK: DON'T HOLD ONTO UNUSED MEMORY
+      return a[:n].copy()
+    return a
 
 
 cdef class NLMSASliceLetters:
@@ -441,14 +664,81 @@ cdef class NLMSASliceLetters:
     return iter(self.items())
 
 
+cdef int seq_lpo_join(NLMSASequence ns, IntervalCoord start, IntervalCoord stop,
+                      int id, IntervalCoord offset, IntervalFileDBIterator it,
+                      IntervalFileDBIterator it2) except -2:
+  '''two-stage join of [start:stop] of sequence id in union ns:
+  seq --> LPO --> seq.  Saves all the resulting intervals in it,
+  using it2 for the LPO queries.  Both iterators are restarted here,
+  so they can be reused for any number of queries.
+  Returns #intervals saved in it.'''
+  cdef int i, j, n
+  cdef IntervalCoord start_max, end_min, start2, stop2, istart, istop
+  cdef NLMSASequence ns_lpo
+  cdef IntervalMap *im2
+  if start < 0: # NEED TO TRANSLATE OFFSETS TO MINUS ORIENTATION
+    offset = -offset
+  if ns.nlmsaLetters.pairwiseMode == 1: # TRANSLATE SEQ DIRECTLY TO LPO
+    it.restart(start, stop, None, None)
+    it.saveInterval(start, stop, ns.id - 1, start + offset, stop + offset)
+    n = 1 # JUST THE SINGLE IDENTITY MAPPING FROM SEQ TO LPO
+  else: # PERFORM NORMAL SEQ --> LPO QUERY
+    it.restart(start + offset, stop + offset, None, ns)
+    n = it.loadAll() # GET ALL OVERLAPPING INTERVALS
+    if n <= 0:
+      return 0
+    for i from 0 <= i < n: # CLIP INTERVALS TO FIT [start:stop]
+      it.im_buf[i].start = it.im_buf[i].start - offset # XLATE TO SRC SEQ COORDS
+      it.im_buf[i].end = it.im_buf[i].end - offset
+      if stop < it.im_buf[i].end: # TRUNCATE TO FIT WITHIN [start:stop]
+        it.im_buf[i].target_end = it.im_buf[i].target_end \
+                                 + stop - it.im_buf[i].end # CALCULATE NEW ENDPOINT
+        it.im_buf[i].end = stop
+      if start > it.im_buf[i].start: # CALCULATE NEW STARTPOINT
+        it.im_buf[i].target_start = it.im_buf[i].target_start \
+                                 + start - it.im_buf[i].start
+        it.im_buf[i].start = start
+
+  if ns.is_lpo: # TARGET INTERVALS MUST BE LPO, MUST MAP TO REAL SEQUENCES
+    return it.nhit
+  ns_lpo =ns.nlmsaLetters.seqlist[ns.nlmsaLetters.lpo_id] # DEFAULT LPO
+  for i from 0 <= i < n:
+    if it.im_buf[i].target_id != ns_lpo.id: # SWITCHING TO A DIFFERENT LPO?
+      ns_lpo = ns.nlmsaLetters.seqlist[it.im_buf[i].target_id]
+      if not ns_lpo.is_lpo:
+        raise ValueError('sequence mapped to non-LPO target??')
+    it2.restart(it.im_buf[i].target_start, # REUSE WITHOUT REALLOCING MEMORY
+                it.im_buf[i].target_end, None, ns_lpo)
+    it2.loadAll() # GET ALL OVERLAPPING INTERVALS
+    if it2.nhit <= 0: # NO HITS, SO TRY THE NEXT INTERVAL???
+      continue
+    im2 = it2.im_buf # ARRAY FROM THIS ITERATOR
+    for j from 0 <= j < it2.nhit: # MAP EACH INTERVAL BACK TO ns
+      if it.im_buf[i].target_start > im2[j].start: # GET INTERSECTION INTERVAL
+        start_max = it.im_buf[i].target_start
+      else:
+        start_max = im2[j].start
+      if it.im_buf[i].target_end < im2[j].end:
+        end_min = it.im_buf[i].target_end
+      else:
+        end_min = im2[j].end
+      istart = it.im_buf[i].start + start_max - it.im_buf[i].target_start # SRC COORDS
+      istop = it.im_buf[i].start + end_min - it.im_buf[i].target_start
+      start2 = im2[j].target_start + start_max - im2[j].start # COORDS IN TARGET
+      stop2 = im2[j].target_start + end_min - im2[j].start
+      if im2[j].target_id != id or istart != start2 or \
+         ns.nlmsaLetters.pairwiseMode == 1: # DISCARD SELF-MATCH
+        it.saveInterval(istart, istop, im2[j].target_id, start2, stop2) # SAVE IT!
+      assert ns_lpo.id != im2[j].target_id
+  return it.nhit
+
+
 cdef class NLMSASlice:
 
-  def __new__(self, NLMSASequence ns not None, int start, int stop,
-              int id=-1, int offset=0, seq=None):
-    cdef int i, j, n, start_max, end_min, start2, stop2, nseq, istart, istop, localQuery
-    cdef NLMSASequence ns_lpo
+  def __new__(self, NLMSASequence ns not None, IntervalCoord start,
+              IntervalCoord stop, int id=-1, IntervalCoord offset=0, seq=None):
+    cdef int i, n, localQuery
     cdef IntervalFileDBIterator it, it2
-    cdef IntervalMap *im, *im2
     cdef int cacheMax
 
     if seq is None: # GET FROM NLMSASequence
@@ -471,66 +761,9 @@ cdef class NLMSASlice:
       if id < 0:
         id = ns.id
       self.id = id
-      it2 = None
-      if start < 0: # NEED TO TRANSLATE OFFSETS TO MINUS ORIENTATION
-        offset = -offset
-      if ns.nlmsaLetters.pairwiseMode == 1: # TRANSLATE SEQ DIRECTLY TO LPO
-        it = IntervalFileDBIterator(start, stop, rawIvals=((start, stop, ns.id - 1,
-                                                        start + offset, stop + offset), ))
-        n = 1 # JUST THE SINGLE IDENTITY MAPPING FROM SEQ TO LPO
-      else: # PERFORM NORMAL SEQ --> LPO QUERY
-        it = IntervalFileDBIterator(start + offset, stop + offset, ns=ns)
-        n = it.loadAll() # GET ALL OVERLAPPING INTERVALS
-        if n <= 0:
-          raise nlmsa_utils.EmptySliceError('this interval is not aligned!')
-        for i from 0 <= i < n: # CLIP INTERVALS TO FIT [start:stop]
-          it.im_buf[i].start = it.im_buf[i].start - offset # XLATE TO SRC SEQ COORDS
-          it.im_buf[i].end = it.im_buf[i].end - offset
-          if stop < it.im_buf[i].end: # TRUNCATE TO FIT WITHIN [start:stop]
-            it.im_buf[i].target_end = it.im_buf[i].target_end \
-                                     + stop - it.im_buf[i].end # CALCULATE NEW ENDPOINT
-            it.im_buf[i].end = stop
-          if start > it.im_buf[i].start: # CALCULATE NEW STARTPOINT
-            it.im_buf[i].target_start = it.im_buf[i].target_start \
-                                     + start - it.im_buf[i].start
-            it.im_buf[i].start = start
-
-      if ns.is_lpo: # TARGET INTERVALS MUST BE LPO, MUST MAP TO REAL SEQUENCES
-        it2 = IntervalFileDBIterator(start, stop) # HOLDER FOR SUBSEQUENT MERGE
-      else:
-        ns_lpo =ns.nlmsaLetters.seqlist[ns.nlmsaLetters.lpo_id] # DEFAULT LPO
-        for i from 0 <= i < n:
-          if it.im_buf[i].target_id != ns_lpo.id: # SWITCHING TO A DIFFERENT LPO?
-            ns_lpo = ns.nlmsaLetters.seqlist[it.im_buf[i].target_id]
-            if not ns_lpo.is_lpo:
-              raise ValueError('sequence mapped to non-LPO target??')
-          if it2 is None: # NEED TO ALLOCATE NEW ITERATOR
-            it2=IntervalFileDBIterator(it.im_buf[i].target_start,
-                                       it.im_buf[i].target_end, ns = ns_lpo)
-          else: # JUST REUSE THIS ITERATOR WITHOUT REALLOCING MEMORY
-            it2.restart(it.im_buf[i].target_start,
-                        it.im_buf[i].target_end, None, ns_lpo)
-          it2.loadAll() # GET ALL OVERLAPPING INTERVALS
-          if it2.nhit <= 0: # NO HITS, SO TRY THE NEXT INTERVAL???
-            continue
-          im2 = it2.im_buf # ARRAY FROM THIS ITERATOR
-          for j from 0 <= j < it2.nhit: # MAP EACH INTERVAL BACK TO ns
-            if it.im_buf[i].target_start > im2[j].start: # GET INTERSECTION INTERVAL
-              start_max = it.im_buf[i].target_start
-            else:
-              start_max = im2[j].start
-            if it.im_buf[i].target_end < im2[j].end:
-              end_min = it.im_buf[i].target_end
-            else:
-              end_min = im2[j].end
-            istart = it.im_buf[i].start + start_max - it.im_buf[i].target_start # SRC COORDS
-            istop = it.im_buf[i].start + end_min - it.im_buf[i].target_start
-            start2 = im2[j].target_start + start_max - im2[j].start # COORDS IN TARGET
-            stop2 = im2[j].target_start + end_min - im2[j].start
-            if im2[j].target_id != id or istart != start2 or \
-               ns.nlmsaLetters.pairwiseMode == 1: # DISCARD SELF-MATCH
-              it.saveInterval(istart, istop, im2[j].target_id, start2, stop2) # SAVE IT!
-            assert ns_lpo.id != im2[j].target_id
+      it = IntervalFileDBIterator(start, stop)
+      it2 = IntervalFileDBIterator(start, stop) # HOLDER FOR SUBSEQUENT MERGE
+      seq_lpo_join(ns, start, stop, id, offset, it, it2)
 
     if it.nhit <= 0:
       raise nlmsa_utils.EmptySliceError('this interval is not aligned!')
@@ -540,7 +773,7 @@ cdef class NLMSASlice:
 
     self.im = it.getIntervalMap() # RELEASE THIS ARRAY FROM THE ITERATOR
     self.n = it.nhit # TOTAL #INTERVALS SAVED FROM JOIN
-    qsort(self.im, self.n, sizeof(IntervalMap), imstart_qsort_cmp) # ORDER BY start
+    qsort(self.im, self.n, sizeof(IntervalMap), imslice_qsort_cmp) # ORDER BY start
 
     n = 0
     for i from 0 <= i < self.nseqBounds: # COUNT NON-LPO SEQUENCES
@@ -588,7 +821,7 @@ cdef class NLMSASlice:
       self.seqBounds = NULL
 
   cdef object get_seq_interval(self, NLMSA nl, int targetID,
-                               int start, int stop):
+                               IntervalCoord start, IntervalCoord stop):
     'get seq interval and ensure cache owner keeps it in the cache'
     if start < stop:
       ival = nl.seqInterval(targetID, start, stop)
@@ -600,6 +833,42 @@ cdef class NLMSASlice:
       pass
     return ival
 
+  cdef object group_results(self, GroupResult *results, int n, seqs, ivals):
+    '''convert group_bound_sweep() results to source intervals, or
+    (source, target, mergeIntervals) tuples.  seqs gives the sequence
+    (or its nlmsa_id, until needed) for each j, and ivals the (j, ival)
+    for each k'''
+    cdef int i
+    cdef IntervalCoord start, end, targetStart, targetEnd
+    cdef NLMSA nl
+    nl = self.nlmsaSequence.nlmsaLetters # GET TOPLEVEL LETTERS OBJECT
+    l = []
+    for i from 0 <= i < n:
+      start = results[i].start
+      end = results[i].end
+      if results[i].k < 0: # sourceOnly: JUST SAVE MERGED SOURCE INTERVAL
+        l.append(sequence.absoluteSlice(self.seq, start, end))
+        continue
+      j, ival = ivals[results[i].k]
+      seq = seqs[j]
+      if isinstance(seq, int): # ONLY CREATE SEQUENCES THAT WE REPORT
+        seq = self.get_seq_interval(nl, seq, 0, 0)
+        seqs[j] = seq
+      targetStart = ival[2] + start - ival[0] # TRUNCATE TARGET IVAL START
+      targetEnd = ival[3]
+      mergeIntervals = ival[4]
+      if not results[i].clip_end: # INTERVAL STOP: ONLY ITS START IS CLIPPED
+        if start > ival[0]:
+          mergeIntervals = self.clip_interval_list(start, None, mergeIntervals)
+      elif start > ival[0] or end < ival[1]: # CLIPPED TO MASKED REGION
+        if end < ival[1]: # TRUNCATE TARGET IVAL END
+          targetEnd = targetEnd + end - ival[1]
+        mergeIntervals = self.clip_interval_list(start, end, mergeIntervals)
+      l.append((sequence.absoluteSlice(self.seq, start, end),
+                sequence.relativeSlice(seq, targetStart, targetEnd),
+                mergeIntervals))
+    return l
+
   ########################################### ITERATOR METHODS
   def edges(self, mergeAll=False, **kwargs):
     'get list of tuples (srcIval, destIval, edge) aligned in this slice'
@@ -666,6 +935,104 @@ alignment intervals to an NLMSA after calling its build() method.''')
           l.append((ival1, ival2)) # SAVE THE INTERVAL MATCH
     return l
 
+  ######################################## NUMPY ARRAY METHODS
+  def intervalArray(self):
+    '''return the raw intervals of this slice (see rawIvals()) as a
+    read-only numpy record array (see interval_map_dtype()) that shares
+    this slice's memory, without creating any per-interval objects'''
+    return interval_map_array(self, <Py_ssize_t>self.im, self.n)
+
+  def seqBoundsArray(self):
+    '''return the covering interval of each sequence / orientation
+    aligned to this slice, as a read-only numpy record array sharing
+    this slice's memory, ordered by target_id'''
+    return interval_map_array(self, <Py_ssize_t>self.seqBounds, self.nseqBounds)
+
+  def matchIntervalArray(self, seq=None):
+    '''vectorized version of matchIntervals(): return the raw intervals
+    aligned to real (i.e. non-LPO) sequences as a numpy record array.
+    If seq is not None, only intervals of seq in its orientation are
+    included.  Each field (start, end, target_id etc.) is an array.'''
+    cdef int target_id
+    cdef NLMSASequence ns
+    import numpy
+    nl = self.nlmsaSequence.nlmsaLetters # GET TOPLEVEL LETTERS OBJECT
+    a = self.intervalArray()
+    mask = numpy.logical_not(numpy.in1d(a['target_id'],
+                                        [ns.id for ns in nl.lpoList]))
+    if seq is not None:
+      target_id = nl.seqs.getID(seq) # CHECK IF IN OUR ALIGNMENT
+      mask = mask & (a['target_id'] == target_id)
+      if seq.orientation > 0:
+        mask = mask & (a['target_start'] >= 0)
+      else:
+        mask = mask & (a['target_start'] < 0)
+    return a[mask]
+
+  def conservationArrays(self):
+    '''columnar conservation analysis of this slice: return a tuple
+    (seqs, aligned, identical).  seqs lists the covering interval of each
+    real (non-LPO) sequence / orientation aligned here; aligned and
+    identical are boolean numpy arrays of shape (len(seqs), stop - start),
+    where row i, column j tells whether position start + j is aligned to
+    seqs[i], and whether the aligned letters are identical (ignoring case).
+    Each sequence string is read only once, then compared as a whole.'''
+    cdef NLMSA nl
+    cdef NLMSASequence ns
+    import numpy
+    nl = self.nlmsaSequence.nlmsaLetters # GET TOPLEVEL LETTERS OBJECT
+    bounds = self.seqBoundsArray()
+    bounds = bounds[numpy.logical_not(numpy.in1d(bounds['target_id'],
+                                                 [ns.id for ns in nl.lpoList]))]
+    seqs = [self.get_seq_interval(nl, int(b['target_id']), int(b['target_start']),
+                                  int(b['target_end'])) for b in bounds]
+    width = self.stop - self.start
+    aligned = numpy.zeros((len(seqs), width), numpy.bool_)
+    identical = numpy.zeros((len(seqs), width), numpy.bool_)
+    a = self.matchIntervalArray()
+    if len(a) == 0:
+      return seqs, aligned, identical
+    # ROW OF EACH INTERVAL: seqBounds ARE ORDERED BY (target_id, ORIENTATION)
+    keys = 2 * bounds['target_id'].astype(numpy.int64) + \
+           (bounds['target_start'] >= 0)
+    row = numpy.searchsorted(keys, 2 * a['target_id'].astype(numpy.int64) +
+                             (a['target_start'] >= 0))
+    # ONE BUFFER HOLDING ALL THE ALIGNED SEQUENCE STRINGS, ROW BY ROW
+    strings = [str(ival).upper() for ival in seqs]
+    lengths = numpy.array([len(t) for t in strings], numpy.int64)
+    buf = numpy.frombuffer(''.join(strings), numpy.uint8)
+    rowStart = numpy.cumsum(lengths) - lengths
+    src = numpy.frombuffer(str(sequence.absoluteSlice(self.seq, self.start,
+                                                      self.stop)).upper(),
+                           numpy.uint8)
+    # EXPAND EVERY INTERVAL INTO ITS INDIVIDUAL ALIGNED LETTER PAIRS
+    n = (a['end'] - a['start']).astype(numpy.int64)
+    offset = numpy.arange(n.sum()) - numpy.repeat(numpy.cumsum(n) - n, n)
+    col = numpy.repeat(a['start'] - self.start, n) + offset
+    pos = numpy.repeat(rowStart[row] + a['target_start'] -
+                       bounds['target_start'][row], n) + offset
+    row = numpy.repeat(row, n)
+    inside = (col >= 0) & (col < width) # RAW INTERVALS ARE NOT CLIPPED
+    col = col[inside]
+    row = row[inside]
+    pos = pos[inside]
+    aligned[row, col] = True
+    same = src[col] == buf[pos]
+    identical[row[same], col[same]] = True
+    return seqs, aligned, identical
+
+  def conservationProfile(self):
+    '''return (pAligned, pIdentity): float numpy arrays giving, for each
+    position of this slice, the fraction of the sequences aligned here
+    (see conservationArrays()) that are aligned to it, and that are
+    identical to it.'''
+    import numpy
+    seqs, aligned, identical = self.conservationArrays()
+    if len(seqs) == 0:
+      return (numpy.zeros(self.stop - self.start),
+              numpy.zeros(self.stop - self.start))
+    return aligned.mean(axis=0), identical.mean(axis=0)
+
   ############################## MAXIMUM INTERVAL METHODS
   cdef int findSeqBounds(self, int id, int ori):
     'find the specified sequence / orientation using binary search'
@@ -745,7 +1112,8 @@ alignment intervals to an NLMSA after calling its build() method.''')
       - pAlignedMin: a fractional minimum alignment threshold e.g. (0.9)
       - pIdentityMin: a fractional minimum identity threshold e.g. (0.9)
       '''
-    cdef int i, j, n, gap, insert, targetStart, targetEnd, start, end, maskStart, maskEnd
+    cdef int i, j, n
+    cdef IntervalCoord gap, insert, targetStart, targetEnd, start, end, maskStart, maskEnd
     cdef NLMSA nl
     nl = self.nlmsaSequence.nlmsaLetters # GET TOPLEVEL LETTERS OBJECT
     if mergeMost: # BE REASONABLE: DON'T MERGE A WHOLE CHROMOSOME
@@ -924,89 +1292,109 @@ alignment intervals to an NLMSA after calling its build() method.''')
       seqs is a list of sequences in the group.
       Must return a list of (sourceIval,targetIval).  See the docs.
     '''
-    cdef int i, j, start, end, targetStart, targetEnd, ipos, id
-    cdef float f
+    cdef int i, j, k, id, nbound, nresult, srcOnly, cutIndels
+    cdef GroupBound *bounds
+    cdef GroupResult *results
     cdef NLMSA nl
     nl = self.nlmsaSequence.nlmsaLetters # GET TOPLEVEL LETTERS OBJECT
     if seqGroups is None:
       seqGroups = [seqIntervals] # JUST USE THE WHOLE SET
+    srcOnly = 0
+    if sourceOnly:
+      srcOnly = 1
+    cutIndels = 0
+    if indelCut:
+      cutIndels = 1
     result = []
-    import mapping # GET ACCESS TO DictQueue CLASS
     for seqs in seqGroups: # PROCESS EACH SEQ GROUP
-      bounds = []
-      j = 0
-      for seq in seqs: # CONSTRUCT INTERVAL BOUNDS LIST
+      if seqMethod is not None: # USER-SUPPLIED GROUPING FUNCTION
+        result = result + self.groupSeqMethod(seqIntervals, seqs, seqMethod,
+                                              sourceOnly=sourceOnly,
+                                              minAligned=minAligned,
+                                              pMinAligned=pMinAligned,
+                                              indelCut=indelCut, **kwargs)
+        continue # DON'T USE GENERIC GROUPING METHOD BELOW
+      groupSeqs = [] # SEQUENCE (OR ITS ID, UNTIL NEEDED) FOR EACH j
+      ivals = [] # (j, ival) FOR EACH k
+      for seq in seqs:
         if isinstance(seq, int): # seqIntervals USES INT INDEX VALUES
-          id = seq # SAVE THE ID
-          seq = self.get_seq_interval(nl, id, 0, 0) # GET THE SEQUENCE OBJECT
+          id = seq
         else: # EXPECT USER TO SUPPLY ACTUAL SEQUENCE OBJECTS
           id = nl.seqs.getID(seq)
           seq = seq.pathForward # ENSURE WE HAVE TOP-LEVEL SEQ OBJECT
         try:
-          ivals = seqIntervals[id]
+          l = seqIntervals[id]
         except KeyError: # SEQUENCE NOT IN THIS ALIGNMENT REGION, SO SKIP
           continue
-        isIndel = False
-        for ival in ivals:
-          bounds.append((ival[1], False, j, seq, isIndel, ival))
-          bounds.append((ival[0], True, j, seq, isIndel, ival))
-          isIndel = True
-        j = j + 1 # SEQUENCE COUNTER ENSURES ORDER OF SEQS IN SORTED LIST
-      bounds.sort() # ASCENDING ORDER OF source_pos, SORT stop B4 start
-      if seqMethod is not None:
-        result = result + seqMethod(bounds, seqs, sourceOnly=sourceOnly,
-                                    msaSlice=self, minAligned=minAligned,
-                                    pMinAligned=pMinAligned,
-                                    indelCut=indelCut, **kwargs)
-        continue # DON'T USE GENERIC GROUPING METHOD BELOW
-      seqStart = mapping.DictQueue() # setitem PUSHES, delitem POPS
-      maskStart = None
-      for bound in bounds: # GENERIC GROUPING: APPLY MASKING, sourceOnly
-        ipos, isStart, j, seq, isIndel = bound[0:5]
-        if isStart: # INTERVAL START
-          seqStart[seq] = bound[5] # JUST RECORD START OF INTERVAL
-        else: # INTERVAL STOP
-          start, end, targetStart, targetEnd, mergeIntervals = bound[5]
-          if maskStart is not None and not sourceOnly: # SAVE TARGET IVAL
-            if maskStart > start: # TRUNCATE TARGET IVAL START
-              targetStart = targetStart + maskStart - start
-              start = maskStart
-              mergeIntervals = self.clip_interval_list(maskStart, None, mergeIntervals)
-            result.append((sequence.absoluteSlice(self.seq, start, end),
-                           sequence.relativeSlice(seq, targetStart,
-                                                  targetEnd), mergeIntervals))
-          del seqStart[seq] # POP THIS SEQ FROM START DICT
-
-        f = len(seqStart) # #ALIGNED SEQS IN THIS REGION
-        if f < minAligned or f / len(seqs) < pMinAligned: # APPLY MASKING
-          if maskStart is not None:
-            if sourceOnly: # JUST SAVE MERGED SOURCE INTERVAL
-              result.append(sequence.absoluteSlice(self.seq, maskStart, end))
-            else: # REPORT TARGET IVALS WITHIN (maskStart,end) REGION
-              for seq in seqStart: # CANNOT USE items() BECAUSE THIS IS A QUEUE!
-                (start, i, targetStart, targetEnd, mergeIntervals) = seqStart[seq]
-                pleaseClip = False
-                if maskStart > start: # TRUNCATE TARGET IVAL START
-                  targetStart = targetStart + maskStart - start
-                  start = maskStart
-                  pleaseClip = True
-                if end < i: # TRUNCATE TARGET IVAL END
-                  targetEnd = targetEnd + end - i
-                  pleaseClip = True
-                if pleaseClip:
-                  mergeIntervals = self.clip_interval_list(maskStart, end, mergeIntervals)
-                result.append((sequence.absoluteSlice(self.seq, start, end),
-                               sequence.relativeSlice(seq, targetStart,
-                                                      targetEnd), mergeIntervals))
-            maskStart = None # REGION NOW BELOW THRESHOLD
-        elif maskStart is None:
-          maskStart = ipos # START OF REGION ABOVE THRESHOLD
-        if maskStart is not None and sourceOnly and indelCut and \
-           isIndel and maskStart < ipos:
-          result.append(sequence.absoluteSlice(self.seq, maskStart, ipos))
-          maskStart = ipos
+        for ival in l:
+          ivals.append((len(groupSeqs), ival))
+        groupSeqs.append(seq)
+      if len(ivals) == 0: # NOTHING TO GROUP
+        continue
+      nbound = 2 * len(ivals)
+      bounds = <GroupBound *>malloc(nbound * sizeof(GroupBound))
+      if bounds == NULL:
+        raise MemoryError('unable to allocate GroupBound array')
+      results = NULL
+      try:
+        i = 0
+        k = 0
+        for ival in ivals: # CONSTRUCT INTERVAL BOUNDS ARRAY
+          j = ival[0]
+          bounds[i].j = j
+          bounds[i].k = k
+          bounds[i].is_indel = i > 0 and bounds[i - 1].j == j
+          bounds[i].start = ival[1][0]
+          bounds[i].end = ival[1][1]
+          bounds[i].target_start = ival[1][2]
+          bounds[i].target_end = ival[1][3]
+          bounds[i].ipos = bounds[i].end
+          bounds[i].is_start = 0
+          bounds[i + 1] = bounds[i]
+          bounds[i + 1].ipos = bounds[i].start
+          bounds[i + 1].is_start = 1
+          i = i + 2
+          k = k + 1
+        # ASCENDING ORDER OF source_pos, SORT stop B4 start
+        qsort(bounds, nbound, sizeof(GroupBound), group_bound_qsort_cmp)
+        nresult = group_bound_sweep(bounds, nbound, len(groupSeqs), len(seqs),
+                                    srcOnly, cutIndels, minAligned,
+                                    pMinAligned, &results)
+        result = result + self.group_results(results, nresult, groupSeqs,
+                                             ivals)
+      finally:
+        free(bounds)
+        if results:
+          free(results)
     return result
 
+  def groupSeqMethod(self, seqIntervals, seqs, seqMethod, **kwargs):
+    'apply a user-supplied seqMethod to the sorted bounds of one seq group'
+    cdef int j, id
+    cdef NLMSA nl
+    nl = self.nlmsaSequence.nlmsaLetters # GET TOPLEVEL LETTERS OBJECT
+    bounds = []
+    j = 0
+    for seq in seqs: # CONSTRUCT INTERVAL BOUNDS LIST
+      if isinstance(seq, int): # seqIntervals USES INT INDEX VALUES
+        id = seq # SAVE THE ID
+        seq = self.get_seq_interval(nl, id, 0, 0) # GET THE SEQUENCE OBJECT
+      else: # EXPECT USER TO SUPPLY ACTUAL SEQUENCE OBJECTS
+        id = nl.seqs.getID(seq)
+        seq = seq.pathForward # ENSURE WE HAVE TOP-LEVEL SEQ OBJECT
+      try:
+        ivals = seqIntervals[id]
+      except KeyError: # SEQUENCE NOT IN THIS ALIGNMENT REGION, SO SKIP
+        continue
+      isIndel = False
+      for ival in ivals:
+        bounds.append((ival[1], False, j, seq, isIndel, ival))
+        bounds.append((ival[0], True, j, seq, isIndel, ival))
+        isIndel = True
+      j = j + 1 # SEQUENCE COUNTER ENSURES ORDER OF SEQS IN SORTED LIST
+    bounds.sort() # ASCENDING ORDER OF source_pos, SORT stop B4 start
+    return seqMethod(bounds, seqs, msaSlice=self, **kwargs)
+
   def clip_interval_list(self, start, end, l):
     'truncate list of 1:1 intervals using start,end'
     if l is None:
@@ -1031,21 +1419,83 @@ alignment intervals to an NLMSA after calling its build() method.''')
   def split(self, minAligned=0, **kwargs):
     '''Use groupByIntervals() and groupBySequences() methods to
     divide this slice into subslices using indel rules etc.'''
-    seqIntervals = self.groupByIntervals(**kwargs)
-    kwargs['sourceOnly'] = True
-    kwargs['indelCut'] = True
-    ivals = self.groupBySequences(seqIntervals, minAligned=minAligned,
-                                  **kwargs)
+    for k in kwargs:
+      if k not in _splitMergeOptions: # NEEDS THE FULL GROUP-BY METHODS
+        seqIntervals = self.groupByIntervals(**kwargs)
+        kwargs['sourceOnly'] = True
+        kwargs['indelCut'] = True
+        ivals = self.groupBySequences(seqIntervals, minAligned=minAligned,
+                                      **kwargs)
+        coords = [(ival.start, ival.stop) for ival in ivals]
+        break
+    else: # ONLY MERGE RULES, SO GROUP DIRECTLY ON OUR IntervalMap ARRAY
+      coords = self.split_coords(minAligned, **kwargs)
     l = []
-    for ival in ivals:
-      if ival.start == self.start and ival.stop == self.stop:
+    for start, stop in coords:
+      if start == self.start and stop == self.stop:
         l.append(self) # SAME INTERVAL, SO JUST RETURN self
       else:
-        subslice = NLMSASlice(self.nlmsaSequence, ival.start, ival.stop,
+        subslice = NLMSASlice(self.nlmsaSequence, start, stop,
                             self.id, self.offset, self.seq)
         l.append(subslice)
     return l
 
+  def split_coords(self, double minAligned=0., IntervalCoord maxgap=0,
+                   IntervalCoord maxinsert=0, IntervalCoord mininsert=0,
+                   mergeMost=False, maxsize=500000000, mergeAll=True,
+                   double pMinAligned=0.):
+    '''get (start, stop) source coordinates of the split() subslices,
+    applying the groupByIntervals() merge rules and the sourceOnly,
+    indelCut groupBySequences() rules in C, without creating any
+    sequence interval objects'''
+    cdef int i, n, nseq, nbound, nresult, mergeFlag
+    cdef IntervalCoord cmaxsize
+    cdef IntervalMap *im
+    cdef GroupBound *bounds
+    cdef GroupResult *results
+    cdef NLMSA nl
+    nl = self.nlmsaSequence.nlmsaLetters # GET TOPLEVEL LETTERS OBJECT
+    if mergeMost: # BE REASONABLE: DON'T MERGE A WHOLE CHROMOSOME
+      maxgap = 10000
+      maxinsert = 10000
+      mininsert = -10 # ALLOW SOME OVERLAP IN INTERVAL ALIGNMENTS
+      maxsize = 50000
+    if maxsize > C_coord_max:
+      maxsize = C_coord_max
+    cmaxsize = maxsize
+    mergeFlag = 0
+    if mergeAll:
+      mergeFlag = 1
+    im = <IntervalMap *>malloc(self.n * sizeof(IntervalMap))
+    bounds = <GroupBound *>malloc(2 * self.n * sizeof(GroupBound))
+    results = NULL
+    try:
+      if im == NULL or bounds == NULL:
+        raise MemoryError('unable to allocate split() arrays')
+      n = 0
+      for i from 0 <= i < self.n: # COPY NON-LPO INTERVALS
+        if nl.seqlist.is_lpo(self.im[i].target_id):
+          continue # IT IS AN LPO, SO SKIP IT
+        memcpy(im + n, self.im + i, sizeof(IntervalMap))
+        im[n].sublist = i # SAVE ORIGINAL ORDER FOR MERGING
+        n = n + 1
+      nbound = merge_target_bounds(im, n, maxgap, maxinsert, mininsert,
+                                   cmaxsize, mergeFlag, bounds, &nseq)
+      qsort(bounds, nbound, sizeof(GroupBound), group_bound_qsort_cmp)
+      nresult = group_bound_sweep(bounds, nbound, nseq, nseq, 1, 1,
+                                  minAligned, pMinAligned, &results)
+      l = []
+      for i from 0 <= i < nresult:
+        l.append((results[i].start, results[i].end))
+    finally:
+      if im:
+        free(im)
+      if bounds:
+        free(bounds)
+      if results:
+        free(results)
+    return l
+
   def regions(self, dummyArg=None, **kwargs):
     '''get LPO region(s) corresponding to this interval
     Same group-by rules apply here as for the split() method.'''
@@ -1090,6 +1540,37 @@ alignment intervals to an NLMSA after calling its build() method.''')
     return l
 
 
+def interval_map_dtype():
+  '''numpy dtype for raw intervals, with fields
+  start, end, target_id, target_start, target_end'''
+  import numpy
+  coord = 'i%d' % sizeof(IntervalCoord)
+  return numpy.dtype(dict(names=('start', 'end', 'target_id', 'target_start',
+                                 'target_end'),
+                          formats=(coord,) * 5,
+                          offsets=[i * sizeof(IntervalCoord) for i in range(5)],
+                          itemsize=sizeof(IntervalMap)))
+
+
+class _IntervalMapMemory(object):
+  '''numpy array interface to an IntervalMap array owned by owner,
+  which is kept alive as long as any array using this memory'''
+  def __init__(self, owner, address, n):
+    self.owner = owner
+    self.__array_interface__ = dict(shape=(n,), version=3,
+                                    typestr='|V%d' % sizeof(IntervalMap),
+                                    data=(address, True)) # READ-ONLY
+
+
+def interval_map_array(owner, address, n):
+  'return numpy record array view of n IntervalMaps at address, owned by owner'
+  import numpy
+  dtype = interval_map_dtype()
+  if n <= 0:
+    return numpy.zeros(0, dtype)
+  return numpy.asarray(_IntervalMapMemory(owner, address, n)).view(dtype)
+
+
 def advanceStartStop(int ipos, NLMSASlice nlmsaSlice not None,
                      int istart, int istop):
   cdef int i
@@ -1314,8 +1795,12 @@ cdef class NLMSASequence:
         nl.lpoList.append(self) # ADD TO THE LPO LIST
     self.idb = None # DEFAULT: NOT USING IN-MEMORY DATABASE.
     self.db = None # DEFAULT: WAIT TO OPEN DB UNTIL ACTUALLY NEEDED
+    self.delta_db = None
     if mode == 'r': # IMMEDIATELY OPEN DATABASE, UNLIKE onDemand MODE
-      self.db = IntervalFileDB(filestem, mode)
+      self.forceLoad()
+    elif mode == 'a': # EXISTING DATABASE, NEW INTERVALS GO TO ITS DELTA
+      _finish_compaction(filestem) # DON'T APPEND TO A DELTA BEING DISCARDED
+      self.appending = 1 # DELTA .build FILE IS OPENED ON FIRST WRITE
     elif mode == 'memory': # OPEN IN-MEMORY DATABASE
       self.idb = IntervalDB()
     elif mode == 'w': # WRITE .build FILE
@@ -1332,14 +1817,33 @@ cdef class NLMSASequence:
       fclose(self.build_ifile)
 
   def forceLoad(self):
-    'force database to be initialized, if not already open'
-    self.db = IntervalFileDB(self.filestem, 'r')
+    'force database (and its delta, if any) to be initialized'
+    import os.path
+    db = IntervalFileDB(self.filestem, 'r', self.nlmsaLetters.useMmap,
+                        self.nlmsaLetters.cacheBlocks)
+    if os.path.exists(self.filestem + '.delta.size'): # HAS APPENDED INTERVALS
+      delta_db = IntervalFileDB(self.filestem + '.delta', 'r',
+                                self.nlmsaLetters.useMmap,
+                                self.nlmsaLetters.cacheBlocks)
+    else:
+      delta_db = None
+    # NO PYTHON CODE RUNS FROM HERE TO OUR RETURN, SO ANOTHER SERVER
+    # THREAD CANNOT CLOSE THESE AGAIN BEFORE OUR CALLER GETS THEM
+    self.nlmsaLetters.save_open_index(self) # STAY WITHIN OPEN FILE BUDGET
+    self.db = db
+    self.delta_db = delta_db
 
   def close(self):
     'free memory and close files associated with this sequence index'
+    if self.isOpen: # NO LONGER COUNTS AGAINST THE OPEN FILE BUDGET
+      self.nlmsaLetters.openIndexes.remove(self)
+      self.isOpen = 0
     if self.db is not None:
       self.db.close() # CLOSE THE DATABASE, RELEASE MEMORY
       self.db = None # DISCONNECT FROM DATABASE
+    if self.delta_db is not None:
+      self.delta_db.close()
+      self.delta_db = None
     if self.idb is not None:
       self.idb.close() # CLOSE THE DATABASE, RELEASE MEMORY
       self.idb = None # DISCONNECT FROM DATABASE
@@ -1347,22 +1851,44 @@ cdef class NLMSASequence:
       fclose(self.build_ifile)
       self.build_ifile = NULL
 
-  def buildFiles(self, **kwargs):
-    'build nested list from saved unsorted alignment data'
-    cdef IntervalDB db
+  def closeBuildFile(self):
+    'finish writing our .build file, so it can be built into a nested list'
     if self.build_ifile == NULL:
       raise IOError('not opened in write mode')
     fclose(self.build_ifile)
     self.build_ifile = NULL
-    filename = self.filestem + '.build'
-    db = IntervalDB() # CREATE EMPTY NL IN MEMORY
-    if self.nbuild > 0:
-      db.buildFromUnsortedFile(filename, self.nbuild, **kwargs) # BUILD FROM .build
-    db.write_binaries(self.filestem) # SAVE AS IntervalDBFile
-    db.close() # DUMP NESTEDLIST FROM MEMORY
-    import os
-    os.remove(filename) # REMOVE OUR .build FILE, NO LONGER NEEDED
-    self.db = IntervalFileDB(self.filestem) # NOW OPEN THE IntervalFileDB
+
+  def openDeltaBuildFile(self):
+    '''start a .build file for intervals appended to this existing
+    database, beginning with the intervals of its current delta, if any'''
+    cdef IntervalFileDB delta_db
+    import os.path
+    filename = self.filestem + '.delta.build'
+    self.build_ifile = fopen(filename, 'wb') # binary file
+    if self.build_ifile == NULL:
+      errmsg = 'unable to open in write mode: ' + filename
+      raise IOError(errmsg)
+    self.nbuild = 0
+    if os.path.exists(self.filestem + '.delta.size'): # MERGE INTO NEW DELTA
+      delta_db = IntervalFileDB(self.filestem + '.delta')
+      try:
+        self.nbuild = dump_intervals(delta_db, self.build_ifile)
+      finally:
+        delta_db.close()
+
+  def buildStem(self):
+    'filestem that our .build file will be built into'
+    if self.appending:
+      return self.filestem + '.delta'
+    return self.filestem
+
+  def buildFiles(self, maxMemory=None, **kwargs):
+    'build nested list from saved unsorted alignment data'
+    self.closeBuildFile()
+    build_index_files(self.buildStem(), self.nbuild,
+                      self.nlmsaLetters.compressIdb, kwargs, maxMemory)
+    self.db = None # NEW IntervalFileDB WILL BE OPENED ON DEMAND
+    self.delta_db = None
     return self.nbuild # return count of intervals
 
   def buildInMemory(self, **kwargs):
@@ -1395,6 +1921,9 @@ cdef class NLMSASequence:
     'save mapping [k.start:k.stop] --> (id,start,stop)'
     cdef int i
     cdef IntervalMap im_tmp
+    if self.build_ifile == NULL and self.appending and \
+           self.nlmsaLetters.do_build: # FIRST INTERVAL APPENDED TO OUR DELTA
+      self.openDeltaBuildFile()
     if self.build_ifile: # SAVE TO BUILD FILE
       im_tmp.start, im_tmp.end = (k.start, k.stop)
       im_tmp.target_id, im_tmp.target_start, im_tmp.target_end = t
@@ -1456,19 +1985,36 @@ cdef class NLMSA:
                trypath=None, bidirectional=True, pairwiseMode=-1,
                bidirectionalRule=nlmsa_utils.prune_self_mappings,
                use_virtual_lpo=None, maxLPOcoord=None,
-               inverseDB=None, alignedIvals=None, **kwargs):
+               inverseDB=None, alignedIvals=None, useMmap=False,
+               compressIdb=False, cacheBlocks=64, nprocs=1,
+               maxOpenIndexes=None, **kwargs):
     try:
       import resource # WE MAY NEED TO OPEN A LOT OF FILES...
       resource.setrlimit(resource.RLIMIT_NOFILE, (maxOpenFiles, -1))
     except: # BUT THIS IS OPTIONAL...
       pass
+    if mode == 'a' and (mafFiles is not None or axtFiles is not None):
+      raise ValueError("mode='a' cannot read mafFiles or axtFiles; build "
+                       "them into a new NLMSA with mode='w'")
+    if maxOpenIndexes is None: # LEAVE ROOM FOR DELTAS AND OTHER FILES
+      maxOpenIndexes = max(maxOpenFiles / 4, 1)
+    self.maxOpenIndexes = maxOpenIndexes
+    self.openIndexes = [] # NLMSASequences WITH OPEN IntervalFileDBs
+    self.useClock = 0
     self.lpoList = [] # EMPTY LIST OF LPO
-    self.seqs = nlmsa_utils.NLMSASeqDict(self, pathstem, mode, **kwargs)
+    manifest = None
+    seqIndex = None
+    if mode == 'r': # ONE READ GETS ALL OUR INDEX INFO, IF WE HAVE A MANIFEST
+      manifest = nlmsa_utils.read_manifest(pathstem)
+      if manifest is not None:
+        seqIndex = manifest.seqIndex
+    self.seqs = nlmsa_utils.NLMSASeqDict(self, pathstem, mode,
+                                         seqIndex=seqIndex, **kwargs)
     self.seqlist = self.seqs.seqlist
     self.pathstem = pathstem
     self.inverseDB = inverseDB
     if maxlen is None:
-      maxlen = C_int_max - 65536 # C_int_max MAXIMUM VALUE REPRESENTABLE BY int
+      maxlen = C_coord_max - 65536 # MAXIMUM VALUE REPRESENTABLE BY IntervalCoord
       if axtFiles is not None:
         maxlen = maxlen / 2
     self.maxlen = maxlen
@@ -1476,6 +2022,15 @@ cdef class NLMSA:
     self._ignoreShadowAttr = {'sourceDB': None, 'targetDB': None} # SCHEMA INFO
     self.seqDict = seqDict # SAVE FOR USER TO ACCESS...
     self.in_memory_mode = 0
+    if useMmap: # MEMORY-MAP OUR INDEX FILES WHEN OPENING THEM
+      self.useMmap = 1
+    else:
+      self.useMmap = 0
+    if compressIdb: # BUILD COMPRESSED .idbz FILES
+      self.compressIdb = 1
+    else:
+      self.compressIdb = 0
+    self.cacheBlocks = cacheBlocks
     if bidirectional:
       self.is_bidirectional = 1
     else:
@@ -1498,14 +2053,32 @@ cdef class NLMSA:
     if mode == 'r': # OPEN FROM DISK FILES
       if self.seqDict is None:
         self.seqDict = nlmsa_utils.read_seq_dict(pathstem, trypath)
-      self.read_indexes(self.seqDict)
+      self.read_indexes(self.seqDict, manifest=manifest)
+      self.read_attrs(manifest)
+    elif mode == 'a': # ADD INTERVALS TO AN EXISTING ON-DISK NLMSA
+      if self.seqDict is None:
+        self.seqDict = nlmsa_utils.read_seq_dict(pathstem, trypath)
+        try: # LET USER ADD NEW SEQUENCES TO OUR SEQDICT...
+          self.seqDict.addAll = True
+        except AttributeError: # THAT WAS PURELY OPTIONAL...
+          pass
+      self.read_indexes(self.seqDict, 'a')
+      self.inlmsa = -1
       self.read_attrs()
+      if self.inlmsa < 0: # NO SAVED COUNTER: START AFTER OUR LARGEST ID
+        self.inlmsa = max(nPad, self.seqs.maxID() + 1)
+      self.do_build = 1
+      for ns in self.seqlist: # KEEP ADDING SEQUENCES TO THE LAST UNION
+        if ns.is_union:
+          self.currentUnion = ns
+      if self.currentUnion is None:
+        self.newSequence(is_union=1)
     elif mode == 'w': # WRITE TO DISK FILES
       self.do_build = 1
       self.lpo_id = 0
       if mafFiles is not None:
         self.newSequence() # CREATE INITIAL LPO
-        self.readMAFfiles(mafFiles, maxint)
+        self.readMAFfiles(mafFiles, maxint, nprocs)
       elif axtFiles is not None:
         self.newSequence() # CREATE INITIAL LPO
         self.readAxtNet(axtFiles, bidirectionalRule)
@@ -1533,6 +2106,34 @@ cdef class NLMSA:
     elif mode != 'xmlrpc':
       raise ValueError('unknown mode %s' % mode)
 
+  cdef int save_open_index(self, NLMSASequence ns) except -1:
+    '''record that ns is opening its IntervalFileDB; if that exceeds our
+    maxOpenIndexes budget, drop the least recently queried open index
+    (it reopens on demand if queried again)'''
+    cdef int i,imin
+    cdef NLMSASequence ns2,nsmin
+    if ns.isOpen: # ALREADY COUNTED
+      return 0
+    while self.maxOpenIndexes > 0 and \
+          len(self.openIndexes) >= self.maxOpenIndexes:
+      imin = 0
+      nsmin = self.openIndexes[0]
+      for i from 1 <= i < len(self.openIndexes):
+        ns2 = self.openIndexes[i]
+        if ns2.lastUse < nsmin.lastUse:
+          imin = i
+          nsmin = ns2
+      self.openIndexes[imin] = self.openIndexes[-1] # O(1) REMOVAL
+      self.openIndexes.pop()
+      nsmin.isOpen = 0
+      # DON'T CALL close(): AN ACTIVE ITERATOR MAY STILL BE READING THESE.
+      # THEIR FILES CLOSE WHEN THE LAST REFERENCE TO THEM IS DROPPED
+      nsmin.db = None
+      nsmin.delta_db = None
+    self.openIndexes.append(ns)
+    ns.isOpen = 1
+    return 0
+
   def close(self):
     'close our shelve index files'
     cdef NLMSASequence ns
@@ -1553,54 +2154,48 @@ cdef class NLMSA:
   def __setstate__(self, state):
     self.__init__(**state) #JUST PASS KWARGS TO CONSTRUCTOR
 
-  def read_indexes(self, seqDict):
-    'open all nestedlist indexes in this LPO database for immediate use'
+  def read_indexes(self, seqDict, mode='onDemand', manifest=None):
+    '''open all nestedlist indexes in this LPO database for immediate use.
+    mode='a' lets new intervals be appended to each index.  Reads the
+    NLMSASequence table from manifest if given, else .NLMSAindex'''
+    cdef int id
     cdef NLMSASequence ns
-    try:
-      ifile = file(self.pathstem + '.NLMSAindex', 'rU') # text file
-    except IOError:
-      ifile = file(self.pathstem + 'NLMSAindex', 'rU') # FOR BACKWARDS COMPATIBILITY
-    try:
-      for line in ifile:
-        id, name, is_union, length = line.strip().split('\t')
-        id = int(id)
-        is_union = int(is_union)
-        if id != len(self.seqlist):
-          raise IOError('corrupted NLMSAIndex???')
-        filestem = self.pathstem + str(id)
-        seq = None # DEFAULT: NO ACTUAL SEQUENCE ASSOCIATED WITH LPO OR UNION
-        if name == 'NLMSA_LPO_Internal': # AN LPO REFERENCE
-          self.lpo_id = id
-        elif not is_union: # REGULAR SEQUENCE
-          try:
-            seq = seqDict[name]
-          except KeyError:
-            raise KeyError('unable to find sequence %s in seqDict!' % name)
-        # CREATE THE SEQ INTERFACE, BUT DELAY OPENING THE IntervalDBFile
-        ns = NLMSASequence(self, filestem, seq, 'onDemand', is_union) # UNTIL NEEDED
-        ns.length = int(length) # SAVE STORED LENGTH
-        self.addToSeqlist(ns, seq)
-    finally:
-      ifile.close()
-
-  def read_attrs(self):
-    'read pickled attribute dictionary from file and apply to self'
-    import pickle
-    try:
-      ifile = file(self.pathstem + '.attrDict', 'rb') # pickle is binary file!
-    except IOError: # BACKWARDS COMPATIBILITY: OLD NLMSA HAS NOT ATTRDICT
-      return
-    try:
-      d = pickle.load(ifile)
-      for k, v in d.items():
-        if k == 'is_bidirectional':
-          self.is_bidirectional = v
-        elif k == 'pairwiseMode':
-          self.pairwiseMode = v
-        else:
-          setattr(self, k, v)
-    finally:
-      ifile.close()
+    if manifest is not None:
+      sequences = manifest.sequences
+    else:
+      sequences = nlmsa_utils.read_nlmsa_index(self.pathstem)
+    for id from 0 <= id < len(sequences):
+      name, is_union, length = sequences[id]
+      filestem = self.pathstem + str(id)
+      seq = None # DEFAULT: NO ACTUAL SEQUENCE ASSOCIATED WITH LPO OR UNION
+      if name == 'NLMSA_LPO_Internal': # AN LPO REFERENCE
+        self.lpo_id = id
+      elif not is_union: # REGULAR SEQUENCE
+        try:
+          seq = seqDict[name]
+        except KeyError:
+          raise KeyError('unable to find sequence %s in seqDict!' % name)
+      # CREATE THE SEQ INTERFACE, BUT DELAY OPENING THE IntervalDBFile
+      ns = NLMSASequence(self, filestem, seq, mode, is_union) # UNTIL NEEDED
+      ns.length = length # SAVE STORED LENGTH
+      self.addToSeqlist(ns, seq)
+
+  def read_attrs(self, manifest=None):
+    '''apply saved attributes to self, from manifest if given, else
+    from the pickled .attrDict file'''
+    if manifest is not None:
+      d = manifest.attrs
+    else: # BACKWARDS COMPATIBILITY: OLD NLMSA MAY HAVE NO ATTRDICT
+      d = nlmsa_utils.read_attr_dict(self.pathstem)
+    for k, v in d.items():
+      if k == 'is_bidirectional':
+        self.is_bidirectional = v
+      elif k == 'pairwiseMode':
+        self.pairwiseMode = v
+      elif k == 'inlmsa':
+        self.inlmsa = v
+      else:
+        setattr(self, k, v)
 
   def addToSeqlist(self, NLMSASequence ns, seq=None):
     'add an NLMSASequence to our seqlist, and set its id'
@@ -1688,8 +2283,85 @@ See the NLMSA documentation for more details.\n''')
       for ns, myslice in l: # ONLY RETURN ONE SLICE OBJECT
           return NLMSASlice(ns, myslice.start, myslice.stop)
 
+  def query_many(self, ivals):
+    '''query a batch of sequence intervals in one call.  ivals can be a
+    list of sequence intervals, or of (seq, start, stop) tuples.
+    Returns a list with one entry per query, in the same order as ivals:
+    a list of raw numeric intervals in the same format as
+    NLMSASlice.rawIvals(), or an empty list if the query is not aligned
+    (or its sequence is not in this alignment).  Use nlmsa[ival] to get
+    a full NLMSASlice for any query whose results you want to look at.
+
+    The queries are sorted by coordinate system and start position, and
+    run with the same pair of iterators, so there is no per-query
+    allocation of search buffers, slice objects or exceptions, and the
+    index blocks are read in file order.'''
+    cdef int j, id
+    cdef IntervalCoord start, stop, offset, ustart
+    cdef NLMSASequence ns
+    cdef IntervalFileDBIterator it, it2
+    if self.do_build:
+      raise ValueError('you must call build() before querying this NLMSA')
+    try: # XMLRPC CLIENT: LET THE SERVER DO THE JOIN
+      doSlice = self.doSlice
+    except AttributeError:
+      doSlice = None
+    queries = []
+    results = []
+    for ival in ivals:
+      if isinstance(ival, tuple): # (seq, start, stop)
+        seq, start, stop = ival
+      else: # A SEQUENCE INTERVAL
+        seq, start, stop = ival, ival.start, ival.stop
+      results.append([])
+      if doSlice is not None:
+        if isinstance(ival, tuple):
+          ival = sequence.absoluteSlice(seq, start, stop)
+        try:
+          id, results[-1] = doSlice(ival)
+        except (KeyError, nlmsa_utils.EmptySliceError): # NOT ALIGNED
+          pass
+        continue
+      try:
+        id, ns, offset = self.seqs[seq] # GET UNION INFO FOR THIS SEQ
+      except KeyError: # SEQUENCE NOT IN THIS ALIGNMENT
+        continue
+      if start < 0: # SORT IN POSITIVE ORIENTATION UNION COORDS
+        ustart = offset - stop
+      else:
+        ustart = start + offset
+      queries.append((ns.id, ustart, len(results) - 1, start, stop, id, offset,
+                      ns))
+    queries.sort()
+    it = IntervalFileDBIterator(0, 0)
+    it2 = IntervalFileDBIterator(0, 0)
+    for t in queries:
+      start, stop, id, offset, ns = t[3:]
+      if seq_lpo_join(ns, start, stop, id, offset, it, it2) <= 0:
+        continue # NOT ALIGNED
+      qsort(it.im_buf, it.nhit, sizeof(IntervalMap), imslice_qsort_cmp)
+      l = results[t[2]]
+      for j from 0 <= j < it.nhit:
+        l.append((it.im_buf[j].start, it.im_buf[j].end, it.im_buf[j].target_id,
+                  it.im_buf[j].target_start, it.im_buf[j].target_end))
+    return results
+
   def __iter__(self):
-    raise NotImplementedError('you cannot iterate over NLMSAs')
+    raise NotImplementedError('you cannot iterate over NLMSAs; try scan()')
+
+  def scan(self, sort=True, blockSize=65536, maxMemory=64000000):
+    '''iterate over every interval stored in this on-disk NLMSA, reading
+    each sequence index file sequentially instead of querying it.  Yields
+    (ns, ivals) for each NLMSASequence ns, where ivals is a numpy record
+    array (see interval_map_dtype()) of up to blockSize of its raw
+    intervals.  Their start and end are in ns's coordinate system.
+    sort=True yields each ns's intervals in order of start, sorting them
+    in memory if they fit in maxMemory bytes, or else on disk in runs of
+    about maxMemory bytes; sort=False yields them in on-disk order, one
+    block at a time.'''
+    if self.do_build or self.in_memory_mode:
+      raise ValueError('scan() requires a built, on-disk NLMSA')
+    return nlmsa_utils.generate_nlmsa_scan(self, sort, blockSize, maxMemory)
 
   def edges(self, *args, **kwargs):
     return nlmsa_utils.generate_nlmsa_edges(self, *args, **kwargs)
@@ -1722,14 +2394,18 @@ See the NLMSA documentation for more details.\n''')
         ns.nbuild=nbuild[ns.id]  # SAVE INTERVAL COUNTS BACK TO REGULAR SEQUENCES
         #logger.debug('nbuild[%d] = %s' % (i, ns.nbuild))
 
-  def readMAFfiles(self, mafFiles, maxint):
-    'read alignment from a set of MAF files'
-    cdef int i, j, nseq0, nseq1, n, nseq, block_len
+  def readMAFfiles(self, mafFiles, maxint, nprocs=1):
+    '''read alignment from a set of MAF files.  nprocs > 1 parses them
+    in chunks in a pool of that many worker processes, and also builds
+    the nested lists in parallel.'''
+    cdef int i, n, nseq0, block_len
     cdef SeqIDMap *seqidmap
     cdef char tmp[32768], *p, a_header[4]
     cdef FILE *ifile
-    cdef IntervalMap im[4096], im_tmp
-    cdef NLMSASequence ns_lpo, ns # ns IS OUR CURRENT UNION
+    cdef ReadLineFunc readline
+    cdef void *pstream
+    cdef IntervalMap im[4096]
+    cdef NLMSASequence ns_lpo
     cdef FILE *build_ifile[4096]
     cdef int nbuild[4096], has_continuation
     cdef long long linecode_count[256]
@@ -1752,78 +2428,78 @@ Something is probably wrong with creation / reading of this sequence.
 Check the input!''' % (pythonStr, seqInfo.length))
       i = i + 1
     qsort(seqidmap, nseq0, sizeof(SeqIDMap), seqidmap_qsort_cmp) # SORT BY id
-    ns = None
 
-    im_tmp.sublist = -1 # DEFAULT
-    strcpy(a_header, "a ") # MAKE C STRING
-    for filename in mafFiles:
-      logger.info('Processing MAF file: ' + filename)
-      ifile = fopen(filename, 'r') # text file
-      if ifile == NULL:
-        self.free_seqidmap(nseq0, seqidmap)
-        self.save_nbuild(nbuild)
-        raise IOError('unable to open file %s' % filename)
-      if fgets(tmp, 32767, ifile) == NULL or strncmp(tmp, "##maf", 4): # HEADER LINE
+    if nprocs > 1:
+      try:
+        import multiprocessing
+      except ImportError: # PYTHON < 2.6: JUST READ SERIALLY
+        logger.warn('multiprocessing unavailable, reading MAF files serially')
+        nprocs = 1
+      for mafFile in mafFiles:
+        if not isinstance(mafFile, str): # CAN'T HAND A STREAM TO A WORKER
+          logger.warn('mafFiles include file-like objects, reading serially')
+          nprocs = 1
+          break
+    if nprocs > 1:
+      try:
+        ns_lpo = self.read_maf_parallel(mafFiles, maxint, nprocs, seqidmap,
+                                        nseq0, ns_lpo, build_ifile, nbuild,
+                                        linecode_count)
+      except:
         self.free_seqidmap(nseq0, seqidmap)
         self.save_nbuild(nbuild)
-        raise IOError('%s: not a MAF file? Bad format.' % filename)
-      p = fgets(tmp, 32767, ifile) # READ 1ST DATA LINE OF THE MAF FILE
-      while p: # GOT ANOTHER LINE TO PROCESS
-        if has_continuation or 0 == strncmp(tmp, a_header, 2): # ALIGNMENT HEADER: READ ALIGNMENT
-          n = readMAFrecord(im, 0, seqidmap, nseq0, ns_lpo.length, # READ ONE MAF BLOCK
-                            &block_len, ifile, 4096, linecode_count, &has_continuation)
-          if n < 0: # UNRECOVERABLE ERROR OCCURRED...
-            self.free_seqidmap(nseq0, seqidmap)
-            self.save_nbuild(nbuild)
-            raise ValueError('MAF block too long!  Increase max size')
-          elif n == 0:
-            continue
-
-          if self.maxlen - ns_lpo.length <= block_len or \
-             ns_lpo.nbuild > maxint: # TOO BIG! MUST CREATE A NEW LPO
-            j = ns_lpo.length # RECORD THE OLD OFFSET
-            ns_lpo = self.newSequence() # CREATE A NEW LPO SEQUENCE
-            for i from 0 <= i < n: # TRANSLATE THESE INTERVALS BACK TO ZERO OFFSET
-              if im[i].start >= 0: # FORWARD INTERVAL
-                im[i].start = im[i].start - j
-                im[i].end = im[i].end - j
-              else: # REVERSE INTERVAL
-                im[i].start = im[i].start + j
-                im[i].end = im[i].end + j
-
-          for i from 0 <= i < n: # SAVE EACH INTERVAL IN UNION -> LPO MAP
-            j = im[i].target_id
-            if seqidmap[j].nlmsa_id <= 0: # NEW SEQUENCE, NEED TO ADD TO UNION
-              if ns is None or self.maxlen - ns.length <= seqidmap[j].length:
-                ns = self.newSequence(None, is_union=1) # CREATE NEW UNION TO HOLD IT
-                build_ifile[ns.id] = ns.build_ifile # KEEP PTR SO WE CAN WRITE DIRECTLY!
-                nbuild[ns.id] = 0
-              seqidmap[j].ns_id = ns.id # SET IDs TO ADD THIS SEQ TO THE UNION
-              seqidmap[j].nlmsa_id = self.inlmsa
-              seqidmap[j].offset = ns.length
-              self.inlmsa = self.inlmsa + 1 # ADVANCE SEQUENCE ID COUNTER
-              ns.length = ns.length + seqidmap[j].length # EXPAND UNION SIZE
-
-            im[i].target_id = seqidmap[j].nlmsa_id # USE THE CORRECT ID
-            if im[i].target_start < 0: # OFFSET REVERSE ORI
-              im_tmp.start = -seqidmap[j].offset + im[i].target_start
-              im_tmp.end = -seqidmap[j].offset + im[i].target_end
-            else: # OFFSET FORWARD ORI
-              im_tmp.start = seqidmap[j].offset + im[i].target_start
-              im_tmp.end = seqidmap[j].offset + im[i].target_end
-            im_tmp.target_id = ns_lpo.id
-            im_tmp.target_start = im[i].start
-            im_tmp.target_end = im[i].end
-            j=seqidmap[j].ns_id # USE NLMSA ID OF THE UNION
-            ns_lpo.saveInterval(&im_tmp, 1, 0, build_ifile[j]) # SAVE SEQ -> LPO
-            nbuild[j] = nbuild[j] + 1
-
-          ns_lpo.saveInterval(im, n, 1, ns_lpo.build_ifile) # SAVE LPO -> SEQ
-          ns_lpo.nbuild = ns_lpo.nbuild+n # INCREMENT COUNT OF SAVED INTERVALS
-        if not has_continuation:
-          p = fgets(tmp, 32767, ifile) # TRY TO READ ANOTHER LINE...
-      fclose(ifile) # CLOSE THIS MAF FILE
-      #logger.debug('nbuild[0] = ' + ns_lpo.nbuild)
+        raise
+      mafFiles = () # ALREADY READ
+    strcpy(a_header, "a ") # MAKE C STRING
+    try:
+      for mafFile in mafFiles:
+        try:
+          filename, stream = nlmsa_utils.open_alignment_file(mafFile)
+        except IOError:
+          raise IOError('unable to open file %s' % mafFile)
+        logger.info('Processing MAF file: %s' % filename)
+        ifile = NULL
+        if stream is None: # PLAIN TEXT FILE: READ IT DIRECTLY
+          ifile = fopen(filename, 'r') # text file
+          if ifile == NULL:
+            raise IOError('unable to open file %s' % filename)
+          readline = stdio_readline
+          pstream = <void *>ifile
+        else: # COMPRESSED FILE OR PYTHON STREAM: READ LINES VIA PYTHON
+          reader = [stream, None]
+          readline = python_readline
+          pstream = <void *>reader
+        try:
+          if readline(tmp, 32767, pstream) == NULL or strncmp(tmp, "##maf", 4): # HEADER LINE
+            if stream is not None: # A READ ERROR IS NOT A FORMAT ERROR
+              check_reader(reader)
+            raise IOError('%s: not a MAF file? Bad format.' % filename)
+          p = readline(tmp, 32767, pstream) # READ 1ST DATA LINE OF THE MAF FILE
+          while p: # GOT ANOTHER LINE TO PROCESS
+            if has_continuation or 0 == strncmp(tmp, a_header, 2): # ALIGNMENT HEADER: READ ALIGNMENT
+              n = readMAFrecord(im, 0, seqidmap, nseq0, 0, # READ ONE MAF BLOCK
+                                &block_len, readline, pstream, 4096,
+                                linecode_count, &has_continuation)
+              if n < 0: # UNRECOVERABLE ERROR OCCURRED...
+                raise ValueError('MAF block too long!  Increase max size')
+              elif n == 0:
+                continue
+              ns_lpo = self.save_maf_block(im, n, block_len, seqidmap, ns_lpo,
+                                           build_ifile, nbuild, maxint)
+            if not has_continuation:
+              p = readline(tmp, 32767, pstream) # TRY TO READ ANOTHER LINE...
+        finally: # CLOSE THIS MAF FILE
+          if ifile:
+            fclose(ifile)
+          elif stream is not mafFile: # WE OPENED IT, SO CLOSE IT
+            stream.close()
+        if stream is not None:
+          check_reader(reader) # RAISE ANY ERROR WHILE READING THE STREAM
+        #logger.debug('nbuild[0] = ' + ns_lpo.nbuild)
+    except: # DUMP THE SEQUENCE LOOKUP ARRAY, SAVE THE INTERVAL COUNTS SO FAR
+      self.free_seqidmap(nseq0, seqidmap)
+      self.save_nbuild(nbuild)
+      raise
     for i from 0 <= i < 256: # PRINT WARNINGS ABOUT NON-ALIGNMENT LINES
       if linecode_count[i] > 0:
         logger.warn("Non-alignment text lines ignored: prefix %s, count %d" %
@@ -1834,7 +2510,107 @@ Check the input!''' % (pythonStr, seqInfo.length))
                           seqidmap[i].nlmsa_id)
     self.free_seqidmap(nseq0, seqidmap)
     self.save_nbuild(nbuild)
-    self.build() # WILL TAKE CARE OF CLOSING ALL build_ifile STREAMS
+    self.build(nprocs=nprocs) # WILL TAKE CARE OF CLOSING ALL build_ifile STREAMS
+
+  cdef NLMSASequence save_maf_block(self, IntervalMap im[], int n,
+                                    int block_len, SeqIDMap seqidmap[],
+                                    NLMSASequence ns_lpo, FILE *build_ifile[],
+                                    int nbuild[], maxint):
+    '''save one parsed MAF block, whose LPO coordinates start at zero, as
+    LPO -> seq and union -> LPO intervals.  Returns the current LPO.'''
+    cdef int i, j
+    cdef IntervalCoord offset
+    cdef IntervalMap im_tmp
+    if self.maxlen - ns_lpo.length <= block_len or \
+       ns_lpo.nbuild > maxint: # TOO BIG! MUST CREATE A NEW LPO
+      ns_lpo = self.newSequence() # CREATE A NEW LPO SEQUENCE
+    offset = ns_lpo.length # APPEND THIS BLOCK TO THE END OF THE LPO
+    for i from 0 <= i < n:
+      if im[i].start >= 0: # FORWARD INTERVAL
+        im[i].start = im[i].start + offset
+        im[i].end = im[i].end + offset
+      else: # REVERSE INTERVAL
+        im[i].start = im[i].start - offset
+        im[i].end = im[i].end - offset
+
+    im_tmp.sublist = -1 # DEFAULT
+    for i from 0 <= i < n: # SAVE EACH INTERVAL IN UNION -> LPO MAP
+      j = im[i].target_id
+      if seqidmap[j].nlmsa_id <= 0: # NEW SEQUENCE, NEED TO ADD TO UNION
+        self.add_seqidmap_to_union(j, seqidmap, self.currentUnion,
+                                   build_ifile, nbuild)
+      im[i].target_id = seqidmap[j].nlmsa_id # USE THE CORRECT ID
+      if im[i].target_start < 0: # OFFSET REVERSE ORI
+        im_tmp.start = -seqidmap[j].offset + im[i].target_start
+        im_tmp.end = -seqidmap[j].offset + im[i].target_end
+      else: # OFFSET FORWARD ORI
+        im_tmp.start = seqidmap[j].offset + im[i].target_start
+        im_tmp.end = seqidmap[j].offset + im[i].target_end
+      im_tmp.target_id = ns_lpo.id
+      im_tmp.target_start = im[i].start
+      im_tmp.target_end = im[i].end
+      j=seqidmap[j].ns_id # USE NLMSA ID OF THE UNION
+      ns_lpo.saveInterval(&im_tmp, 1, 0, build_ifile[j]) # SAVE SEQ -> LPO
+      nbuild[j] = nbuild[j] + 1
+
+    ns_lpo.saveInterval(im, n, 1, ns_lpo.build_ifile) # SAVE LPO -> SEQ
+    ns_lpo.nbuild = ns_lpo.nbuild+n # INCREMENT COUNT OF SAVED INTERVALS
+    return ns_lpo
+
+  cdef NLMSASequence read_maf_parallel(self, mafFiles, maxint, int nprocs,
+                                       SeqIDMap seqidmap[], int nseq0,
+                                       NLMSASequence ns_lpo,
+                                       FILE *build_ifile[], int nbuild[],
+                                       long long linecode_count[]):
+    '''parse mafFiles in chunks in a pool of nprocs worker processes,
+    then save their blocks in file order.  Returns the current LPO.'''
+    cdef int i, n, block_len
+    cdef FILE *ifile
+    cdef IntervalMap im[4096]
+    import multiprocessing
+    import os
+    seqnames = [] # WORKERS LOOK UP SEQUENCES IN THE SAME SORTED ORDER
+    for i from 0 <= i < nseq0:
+      seqnames.append(seqidmap[i].id)
+    tasks = []
+    for filename, start, end in nlmsa_utils.split_maf_files(mafFiles,
+                                                            4 * nprocs):
+      tasks.append((filename, start, end,
+                    '%s.maf%d' % (self.pathstem, len(tasks))))
+    pool = multiprocessing.Pool(nprocs, _init_maf_worker, (seqnames,))
+    try:
+      lastFile = None
+      results = pool.imap(_read_maf_chunk, tasks) # RETURNED IN FILE ORDER
+      for t in tasks:
+        linecodes = results.next() # WAIT FOR THIS CHUNK
+        if t[0] != lastFile:
+          logger.info('Processing MAF file: ' + t[0])
+          lastFile = t[0]
+        ifile = fopen(t[3], 'rb') # BLOCKS PARSED BY THE WORKER
+        if ifile == NULL:
+          raise IOError('unable to open file %s' % t[3])
+        try:
+          n = read_maf_block(ifile, im, 4096, &block_len)
+          while n > 0:
+            ns_lpo = self.save_maf_block(im, n, block_len, seqidmap, ns_lpo,
+                                         build_ifile, nbuild, maxint)
+            n = read_maf_block(ifile, im, 4096, &block_len)
+        finally:
+          fclose(ifile)
+        if n == -2:
+          raise IOError('corrupted MAF block file %s' % t[3])
+        os.remove(t[3])
+        for i from 0 <= i < 256:
+          linecode_count[i] = linecode_count[i] + linecodes[i]
+      pool.close()
+    except:
+      pool.terminate()
+      for t in tasks: # CLEAN UP ANY REMAINING CHUNK FILES
+        if os.path.exists(t[3]):
+          os.remove(t[3])
+      raise
+    pool.join()
+    return ns_lpo
 
   cdef NLMSASequence add_seqidmap_to_union(self, int j, SeqIDMap seqidmap[],
                                            NLMSASequence ns, FILE *build_ifile[],
@@ -1861,6 +2637,8 @@ Check the input!''' % (pythonStr, seqInfo.length))
     cdef SeqIDMap *seqidmap
     cdef char tmp[32768], *p, comment[4], src_prefix[64], dest_prefix[64]
     cdef FILE *ifile
+    cdef ReadLineFunc readline
+    cdef void *pstream
     cdef IntervalMap im[4096], im_tmp
     cdef NLMSASequence ns_src # SOURCE UNION VS DEST UNION
     cdef FILE *build_ifile[4096]
@@ -1882,89 +2660,113 @@ Check the input!''' % (pythonStr, seqInfo.length))
     strcpy(comment, "#") # MAKE C STRING
     import string
     import os.path
-    for filename in axtFiles:
-      logger.info('Processing axtnet file: ' + filename)
-      try:
-        if filename[-8:] == '.net.axt':
-          t = string.split(os.path.basename(filename)[:-8], '.')[-2:]
-        elif filename[-4:] == '.axt':
-          t = string.split(os.path.basename(filename)[:-4], '.')[-2:]
-      except:
-        raise IOError('%s is not correct axtNet file name. Correct name is (chrid.)source.target.net.axt.' % filename)
-      #t = prefix_fun(filename) # CALL PYTHON FUNCTION TO OBTAIN PREFIXES
-      if bidirectionalRule is None: # DETERMINE IF UNI- VS. BI-DIRECTIONAL
-        is_bidirectional = self.is_bidirectional # JUST USE GLOBAL SETTING
-      else: # GET SETTING FROM USER-SUPPLIED FUNCTION
-        is_bidirectional = bidirectionalRule(t[0], t[1], self.is_bidirectional)
-      strcpy(src_prefix, t[0]) # KEEP THEM IN STATIC C STRINGS FOR SPEED
-      strcpy(dest_prefix, t[1])
-      ifile = fopen(filename, 'r') # text file
-      if ifile == NULL:
-        self.free_seqidmap(nseq0, seqidmap)
-        self.save_nbuild(nbuild)
-        raise IOError('unable to open file %s' % filename)
-      while True:
-        n = read_axtnet(im, seqidmap, nseq0, ifile, 4096, &isrc, src_prefix, dest_prefix)
-        if n < 0: # UNRECOVERABLE ERROR OCCURRED...
-          self.free_seqidmap(nseq0, seqidmap)
-          self.save_nbuild(nbuild)
-          raise ValueError('axtNet block too long!  Increase max size')
-        elif n == 0: # NO MORE DATA TO READ
-          break
-
-        if seqidmap[isrc].nlmsa_id <= 0: # NEW SEQUENCE, NEED TO ADD TO UNION
-          ns_src = self.add_seqidmap_to_union(isrc, seqidmap, ns_src, build_ifile, nbuild)
-
-        for i from 0 <= i < n: # SAVE EACH INTERVAL IN SRC -> DEST MAP
-          j = im[i].target_id
-          #logger.debug('A: %s %s %s %s %s %s' % (im[i].start, im[i].end,
-          #                                       im[i].target_id,
-          #                                       im[i].target_start,
-          #                                       im[i].target_end,
-          #                                       im_tmp.sublist))
-          #logger.debug('B: %s %s %s %s %s %s %s' % (seqidmap[isrc].nlmsa_id, i,
-          #                                          j, seqidmap[j].id,
-          #                                          seqidmap[j].ns_id,
-          #                                          seqidmap[j].offset,
-          #                                          seqidmap[j].nlmsa_id))
-          if seqidmap[j].nlmsa_id <= 0: # NEW SEQUENCE, NEED TO ADD TO UNION
-            ns_src = self.add_seqidmap_to_union(j, seqidmap, ns_src, build_ifile, nbuild)
-          im[i].target_id = seqidmap[j].nlmsa_id # USE THE CORRECT ID
-          if is_bidirectional: # SAVE DEST -> SRC ALIGNMENT MAPPING
-            if im[i].target_start < 0: # OFFSET REVERSE ORI
-              im_tmp.start = -seqidmap[j].offset + im[i].target_start
-              im_tmp.end = -seqidmap[j].offset + im[i].target_end
-            else: # OFFSET FORWARD ORI
-              im_tmp.start = seqidmap[j].offset + im[i].target_start
-              im_tmp.end = seqidmap[j].offset + im[i].target_end
-            im_tmp.target_id = seqidmap[isrc].nlmsa_id
-            im_tmp.target_start = im[i].start
-            im_tmp.target_end = im[i].end
-            #logger.debug('C: %s %s %s %s %s' % (im_tmp.target_id,
-            #                                    im_tmp.target_start,
-            #                                    im_tmp.target_end,
-            #                                    seqidmap[j].ns_id, j))
-            j = seqidmap[j].ns_id - 1 # SAVE ALL ALIGNMENTS TO THE VIRTUAL LPO
-            ns_src.saveInterval(&im_tmp, 1, 0, build_ifile[j]) # SAVE DEST -> SRC
-            nbuild[j] = nbuild[j] + 1
-          if im[i].start < 0: # OFFSET FORWARD ORI
-            im[i].start = -seqidmap[isrc].offset + im[i].start
-            im[i].end = -seqidmap[isrc].offset + im[i].end
-          else: # OFFSET FORWARD ORI
-            im[i].start = seqidmap[isrc].offset + im[i].start
-            im[i].end = seqidmap[isrc].offset + im[i].end
-          #logger.debug('D: %s %s %s %s %s %s' % (im_tmp.start, im_tmp.end,
-          #                                       im_tmp.target_id,
-          #                                       im_tmp.target_start,
-          #                                       im_tmp.target_end,
-          #                                       im_tmp.sublist))
-
-        # SAVE THE RECORD. read_axtnet FUNCTION READS SRC/DEST AT THE SAME TIME
-        j = seqidmap[isrc].ns_id - 1 # SAVE ALL ALIGNMENTS TO THE VIRTUAL LPO
-        ns_src.saveInterval(im, n, 0, build_ifile[j]) # SAVE SRC -> DEST
-        nbuild[j] = nbuild[j] + n # INCREMENT COUNT OF SAVED INTERVALS
-
-      fclose(ifile) # CLOSE THIS AXTNET FILE
+    try:
+      for axtFile in axtFiles:
+        ifile = NULL
+        filename, stream = nlmsa_utils.open_alignment_file(axtFile)
+        try:
+          if filename is None:
+            raise IOError('axtNet stream %s needs a name attribute giving its file name' % axtFile)
+          logger.info('Processing axtnet file: %s' % filename)
+          axtName = filename
+          if axtName[-3:] == '.gz': # PREFIXES ARE IN THE NAME WITHOUT SUFFIX
+            axtName = axtName[:-3]
+          elif axtName[-4:] == '.bgz':
+            axtName = axtName[:-4]
+          try:
+            if axtName[-8:] == '.net.axt':
+              t = string.split(os.path.basename(axtName)[:-8], '.')[-2:]
+            elif axtName[-4:] == '.axt':
+              t = string.split(os.path.basename(axtName)[:-4], '.')[-2:]
+          except:
+            raise IOError('%s is not correct axtNet file name. Correct name is (chrid.)source.target.net.axt.' % filename)
+          #t = prefix_fun(filename) # CALL PYTHON FUNCTION TO OBTAIN PREFIXES
+          if bidirectionalRule is None: # DETERMINE IF UNI- VS. BI-DIRECTIONAL
+            is_bidirectional = self.is_bidirectional # JUST USE GLOBAL SETTING
+          else: # GET SETTING FROM USER-SUPPLIED FUNCTION
+            is_bidirectional = bidirectionalRule(t[0], t[1], self.is_bidirectional)
+          strcpy(src_prefix, t[0]) # KEEP THEM IN STATIC C STRINGS FOR SPEED
+          strcpy(dest_prefix, t[1])
+          if stream is None: # PLAIN TEXT FILE: READ IT DIRECTLY
+            ifile = fopen(filename, 'r') # text file
+            if ifile == NULL:
+              raise IOError('unable to open file %s' % filename)
+            readline = stdio_readline
+            pstream = <void *>ifile
+          else: # COMPRESSED FILE OR PYTHON STREAM: READ LINES VIA PYTHON
+            reader = [stream, None]
+            readline = python_readline
+            pstream = <void *>reader
+          while True:
+            n = read_axtnet(im, seqidmap, nseq0, readline, pstream, 4096, &isrc,
+                            src_prefix, dest_prefix)
+            if n < 0: # UNRECOVERABLE ERROR OCCURRED...
+              raise ValueError('axtNet block too long!  Increase max size')
+            elif n == 0: # NO MORE DATA TO READ
+              break
+
+            if seqidmap[isrc].nlmsa_id <= 0: # NEW SEQUENCE, NEED TO ADD TO UNION
+              ns_src = self.add_seqidmap_to_union(isrc, seqidmap, ns_src, build_ifile, nbuild)
+
+            for i from 0 <= i < n: # SAVE EACH INTERVAL IN SRC -> DEST MAP
+              j = im[i].target_id
+              #logger.debug('A: %s %s %s %s %s %s' % (im[i].start, im[i].end,
+              #                                       im[i].target_id,
+              #                                       im[i].target_start,
+              #                                       im[i].target_end,
+              #                                       im_tmp.sublist))
+              #logger.debug('B: %s %s %s %s %s %s %s' % (seqidmap[isrc].nlmsa_id, i,
+              #                                          j, seqidmap[j].id,
+              #                                          seqidmap[j].ns_id,
+              #                                          seqidmap[j].offset,
+              #                                          seqidmap[j].nlmsa_id))
+              if seqidmap[j].nlmsa_id <= 0: # NEW SEQUENCE, NEED TO ADD TO UNION
+                ns_src = self.add_seqidmap_to_union(j, seqidmap, ns_src, build_ifile, nbuild)
+              im[i].target_id = seqidmap[j].nlmsa_id # USE THE CORRECT ID
+              if is_bidirectional: # SAVE DEST -> SRC ALIGNMENT MAPPING
+                if im[i].target_start < 0: # OFFSET REVERSE ORI
+                  im_tmp.start = -seqidmap[j].offset + im[i].target_start
+                  im_tmp.end = -seqidmap[j].offset + im[i].target_end
+                else: # OFFSET FORWARD ORI
+                  im_tmp.start = seqidmap[j].offset + im[i].target_start
+                  im_tmp.end = seqidmap[j].offset + im[i].target_end
+                im_tmp.target_id = seqidmap[isrc].nlmsa_id
+                im_tmp.target_start = im[i].start
+                im_tmp.target_end = im[i].end
+                #logger.debug('C: %s %s %s %s %s' % (im_tmp.target_id,
+                #                                    im_tmp.target_start,
+                #                                    im_tmp.target_end,
+                #                                    seqidmap[j].ns_id, j))
+                j = seqidmap[j].ns_id - 1 # SAVE ALL ALIGNMENTS TO THE VIRTUAL LPO
+                ns_src.saveInterval(&im_tmp, 1, 0, build_ifile[j]) # SAVE DEST -> SRC
+                nbuild[j] = nbuild[j] + 1
+              if im[i].start < 0: # OFFSET FORWARD ORI
+                im[i].start = -seqidmap[isrc].offset + im[i].start
+                im[i].end = -seqidmap[isrc].offset + im[i].end
+              else: # OFFSET FORWARD ORI
+                im[i].start = seqidmap[isrc].offset + im[i].start
+                im[i].end = seqidmap[isrc].offset + im[i].end
+              #logger.debug('D: %s %s %s %s %s %s' % (im_tmp.start, im_tmp.end,
+              #                                       im_tmp.target_id,
+              #                                       im_tmp.target_start,
+              #                                       im_tmp.target_end,
+              #                                       im_tmp.sublist))
+
+            # SAVE THE RECORD. read_axtnet FUNCTION READS SRC/DEST AT THE SAME TIME
+            j = seqidmap[isrc].ns_id - 1 # SAVE ALL ALIGNMENTS TO THE VIRTUAL LPO
+            ns_src.saveInterval(im, n, 0, build_ifile[j]) # SAVE SRC -> DEST
+            nbuild[j] = nbuild[j] + n # INCREMENT COUNT OF SAVED INTERVALS
+        finally: # CLOSE THIS AXTNET FILE
+          if ifile:
+            fclose(ifile)
+          elif stream is not None and stream is not axtFile: # WE OPENED IT
+            stream.close()
+        if stream is not None:
+          check_reader(reader) # RAISE ANY ERROR WHILE READING THE STREAM
+    except: # DUMP THE SEQUENCE LOOKUP ARRAY, SAVE THE INTERVAL COUNTS SO FAR
+      self.free_seqidmap(nseq0, seqidmap)
+      self.save_nbuild(nbuild)
+      raise
 
     for i from 0 <= i <nseq0: # INDEX SEQUENCES THAT WERE ALIGNED
       if seqidmap[i].nlmsa_id > 0: # ALIGNED, SO RECORD IT
@@ -1974,33 +2776,78 @@ Check the input!''' % (pythonStr, seqInfo.length))
     self.save_nbuild(nbuild)
     self.build() # WILL TAKE CARE OF CLOSING ALL build_ifile STREAMS
 
-  def buildFiles(self, saveSeqDict=False, **kwargs):
-    'build nestedlist databases on-disk, and .seqDict index if desired'
+  def buildFiles(self, saveSeqDict=False, nprocs=1, maxMemory=None,
+                 packSeqIndex=False, **kwargs):
+    '''build nestedlist databases on-disk, and .seqDict index if desired.
+    nprocs > 1 builds the databases in parallel in a pool of that many
+    processes, if the multiprocessing module is available.
+    maxMemory limits the bytes used to sort each database (see
+    build_index_files()).  packSeqIndex=True also saves the sequence
+    index as a packed .seqIndex file (see nlmsa_utils.pack_seq_index()).'''
+    cdef int id
     cdef NLMSASequence ns
-    self.seqs.reopenReadOnly() # SAVE INDEXES AND OPEN READ-ONLY
+    self.seqs.reopenReadOnly(packIndex=packSeqIndex) # SAVE AND OPEN READ-ONLY
     ntotal = 0
+    buildList = [] # INDEXES WITH NEW INTERVALS TO BUILD
+    nappend = 0 # NUMBER OF EXISTING INDEXES, IF WE ARE APPENDING
+    for ns in self.seqlist:
+      if ns.appending:
+        nappend = nappend + 1
+      if ns.build_ifile != NULL or not ns.appending: # SKIP UNCHANGED INDEXES
+        buildList.append(ns)
+    if nprocs > 1 and len(buildList) > 1:
+      try:
+        import multiprocessing
+      except ImportError: # PYTHON < 2.6: JUST BUILD SERIALLY
+        logger.warn('multiprocessing unavailable, building serially')
+        nprocs = 1
+    if nprocs > 1 and len(buildList) > 1:
+      tasks = []
+      for ns in buildList:
+        ns.closeBuildFile()
+        tasks.append((ns.nbuild, ns.buildStem(), self.compressIdb, kwargs,
+                      maxMemory))
+      tasks.sort(reverse=True) # START THE BIGGEST BUILDS FIRST
+      pool = multiprocessing.Pool(nprocs)
+      try:
+        for n in pool.imap_unordered(_build_index_files_task, tasks):
+          ntotal = ntotal + n
+        pool.close()
+      except:
+        pool.terminate()
+        raise
+      pool.join() # NEW IntervalFileDBs WILL BE OPENED ON DEMAND
+    else:
+      for ns in buildList: # BUILD EACH IntervalFileDB ONE BY ONE
+        ntotal = ntotal + ns.buildFiles(maxMemory, **kwargs)
+    sequences = [] # (name, is_union, length) FOR EACH NLMSASequence
+    for ns in self.seqlist:
+      if ns.is_lpo:
+        sequences.append(('NLMSA_LPO_Internal', 0, ns.length))
+      elif ns.is_union:
+        sequences.append(('NLMSA_UNION_Internal', 1, ns.length))
+      else:
+        sequences.append((ns.name, 0, ns.length))
     ifile=file(self.pathstem + '.NLMSAindex', 'w') # text file
     try:
-      for ns in self.seqlist: # BUILD EACH IntervalFileDB ONE BY ONE
-        ntotal = ntotal + ns.buildFiles(**kwargs)
-        if ns.is_lpo:
-          ifile.write('%d\t%s\t%d\t%d\n' % (ns.id, 'NLMSA_LPO_Internal', 0, ns.length))
-        elif ns.is_union:
-          ifile.write('%d\t%s\t%d\t%d\n' % (ns.id, 'NLMSA_UNION_Internal', 1, ns.length))
-        else:
-          ifile.write('%d\t%s\t%d\t%d\n' % (ns.id, ns.name, 0, ns.length))
+      for id from 0 <= id < len(sequences):
+        ifile.write('%d\t%s\t%d\t%d\n' % ((id,) + sequences[id]))
     finally:
       ifile.close()
-    if ntotal == 0:
+    if ntotal == 0 and nappend == 0:
       raise nlmsa_utils.EmptyAlignmentError('empty alignment!')
     import pickle
     import sys
+    attrs = dict(is_bidirectional=self.is_bidirectional,
+                 pairwiseMode=self.pairwiseMode, inlmsa=self.inlmsa)
     ifile = file(self.pathstem + '.attrDict', 'wb') # pickle is binary file!
     try:
-      pickle.dump(dict(is_bidirectional=self.is_bidirectional,
-                       pairwiseMode=self.pairwiseMode), ifile)
+      pickle.dump(attrs, ifile)
     finally:
       ifile.close()
+    # BINARY MANIFEST OF ALL THE ABOVE, FOR OPENING WITH A SINGLE READ
+    nlmsa_utils.write_manifest(self.pathstem, sequences, attrs,
+                               self.seqs.seqIDdict.iteritems())
     logger.info('Index files saved.')
     if saveSeqDict:
       self.save_seq_dict()
@@ -2011,12 +2858,25 @@ But if you wish to open this NLMSA independently of worldbase,
 you should call NLMSA.save_seq_dict() to save the seqDict info to a file,
 or in the future pass the saveSeqDict=True option to NLMSA.build().''')
 
+  def compact(self, maxMemory=None):
+    '''fold all intervals appended in mode='a' into the main on-disk
+    indexes (see compact_nlmsa()), so queries search one nested list
+    per sequence again.'''
+    cdef NLMSASequence ns
+    if self.do_build or self.in_memory_mode:
+      raise ValueError('you must call build() before compacting this NLMSA')
+    for ns in self.seqlist: # CLOSE ALL OUR INDEXES SO THEY REOPEN ON DEMAND
+      ns.close()
+    compact_nlmsa(self.pathstem, maxMemory)
+
   def save_seq_dict(self):
     'save seqDict to a worldbase-aware pickle file'
     nlmsa_utils.save_seq_dict(self.pathstem, self.seqDict)
 
-  def build(self, **kwargs):
-    'build nestedlist databases from saved mappings and initialize for use'
+  def build(self, nprocs=1, maxMemory=None, **kwargs):
+    '''build nestedlist databases from saved mappings and initialize for use.
+    For an on-disk NLMSA, nprocs > 1 runs the builds in parallel, and
+    maxMemory (bytes) caps the memory used to sort each database.'''
     if self.do_build == 0:
       raise ValueError('not opened in write mode')
     try: # TURN OFF AUTOMATIC ADDING OF SEQUENCES TO OUR SEQDICT...
@@ -2030,7 +2890,7 @@ or in the future pass the saveSeqDict=True option to NLMSA.build().''')
       if ntotal == 0:
         raise nlmsa_utils.EmptyAlignmentError('empty alignment!')
     else:
-      self.buildFiles(**kwargs)
+      self.buildFiles(nprocs=nprocs, maxMemory=maxMemory, **kwargs)
     self.do_build = 0
 
   def seqInterval(self, int iseq, int istart, int istop):
@@ -2047,9 +2907,282 @@ or in the future pass the saveSeqDict=True option to NLMSA.build().''')
       raise ValueError('this mapping is not invertible')
 
 
+def _check_build_method(buildInPlace=True):
+  '''check kwargs for IntervalDB.runBuildMethod() in an external sort,
+  which builds the same nested lists as either of its methods'''
+  pass
+
+
+def build_index_files(filestem, nbuild, compress=False, kwargs={},
+                      maxMemory=None):
+  '''build the nested list database filestem from the nbuild unsorted
+  intervals in its .build file, and remove the .build file.
+  kwargs are passed to IntervalDB.buildFromUnsortedFile(), except for
+  div, the number of records per .index block, which is passed to
+  IntervalDB.write_binaries().
+  If the intervals would need more than maxMemory bytes to sort in
+  memory, they are instead sorted on disk in runs of about maxMemory
+  bytes, merged, and streamed straight into the binary files.'''
+  cdef IntervalDB db
+  cdef char *err_msg
+  buildpath = filestem + '.build'
+  kwargs = kwargs.copy()
+  div = kwargs.pop('div', 256)
+  if maxMemory is not None and nbuild * sizeof(IntervalMap) > maxMemory:
+    _check_build_method(**kwargs) # SAME ARGUMENTS AS AN IN-MEMORY BUILD
+    err_msg = build_binary_files_external(buildpath, nbuild, div, filestem,
+                                          maxMemory)
+    if err_msg:
+      raise IOError(err_msg)
+    if compress:
+      compress_binaries(filestem)
+  else:
+    db = IntervalDB() # CREATE EMPTY NL IN MEMORY
+    if nbuild > 0:
+      db.buildFromUnsortedFile(buildpath, nbuild, **kwargs)
+    db.write_binaries(filestem, div, compress) # SAVE AS IntervalDBFile
+    db.close() # DUMP NESTEDLIST FROM MEMORY
+  import os
+  os.remove(buildpath) # REMOVE OUR .build FILE, NO LONGER NEEDED
+  return nbuild
+
+
+cdef int dump_intervals(IntervalFileDB db, FILE *ofile) except -1:
+  '''write all the intervals of db to ofile in .build format, one
+  buffer at a time.  Returns the number of intervals written.'''
+  cdef int i, n
+  cdef IntervalFileDBIterator it
+  it = IntervalFileDBIterator(-C_coord_max, C_coord_max, db)
+  n = 0
+  while it.nextBlock(NULL) > 0:
+    for i from 0 <= i < it.nhit:
+      it.im_buf[i].sublist = -1 # DISCARD NESTING OF THE OLD DATABASE
+    if write_padded_binary(it.im_buf, it.nhit, 1, ofile) != it.nhit:
+      raise IOError('write_padded_binary failed???')
+    n = n + it.nhit
+  return n
+
+
+_INDEX_FILE_SUFFIXES = ('.size', '.index', '.subhead', '.idb', '.idbz', '.zindex')
+
+def compact_index_files(filestem, maxMemory=None):
+  '''fold the delta database of appended intervals for filestem into
+  its main database, and remove the delta.  The new database is built
+  under a temporary name and then swapped in by _finish_compaction().
+  Returns the total number of intervals, or None if there is no delta.'''
+  cdef IntervalFileDB db, delta_db
+  cdef FILE *ofile
+  import os
+  import os.path
+  _finish_compaction(filestem) # IN CASE AN EARLIER SWAP WAS INTERRUPTED
+  deltastem = filestem + '.delta'
+  if not os.path.exists(deltastem + '.size'):
+    return None
+  tmpstem = filestem + '.compact'
+  buildpath = tmpstem + '.build'
+  db = IntervalFileDB(filestem)
+  delta_db = IntervalFileDB(deltastem)
+  try:
+    compress = db.is_compressed()
+    ofile = fopen(buildpath, 'wb') # binary file
+    if ofile == NULL:
+      raise IOError('unable to open in write mode: ' + buildpath)
+    try:
+      nbuild = dump_intervals(db, ofile)
+      nbuild = nbuild + dump_intervals(delta_db, ofile)
+    finally:
+      fclose(ofile)
+  finally:
+    db.close()
+    delta_db.close()
+  build_index_files(tmpstem, nbuild, compress, {}, maxMemory)
+  file(tmpstem + '.ready', 'w').close() # NEW DATABASE IS COMPLETE
+  _finish_compaction(filestem)
+  return nbuild
+
+
+def _finish_compaction(filestem):
+  '''swap the compacted database built under filestem.compact, if its
+  .ready marker says it is complete, in place of the main database and
+  its delta.  The delta goes first (.size first, since that is how its
+  presence is detected), so no intermediate state has its intervals
+  twice; then the new files are renamed in, .size last, so an old .size
+  never describes more records than the files it is read with.  After
+  a crash at any point, calling this again completes the swap.'''
+  import os
+  import os.path
+  tmpstem = filestem + '.compact'
+  if not os.path.exists(tmpstem + '.ready'):
+    return
+  for suffix in _INDEX_FILE_SUFFIXES: # DISCARD THE DELTA, .size FIRST
+    if os.path.exists(filestem + '.delta' + suffix):
+      os.remove(filestem + '.delta' + suffix)
+  for suffix in _INDEX_FILE_SUFFIXES[::-1]: # REPLACE THE OLD DATABASE
+    if os.path.exists(tmpstem + suffix):
+      os.rename(tmpstem + suffix, filestem + suffix)
+  os.remove(tmpstem + '.ready')
+
+
+def sort_index_files(stems, sortpath, maxMemory, useMmap=False):
+  '''write every interval of the on-disk nested list databases stems to
+  sortpath as raw IntervalMap records, in order of start, sorting them
+  on disk in runs of about maxMemory bytes.  Returns the number of
+  intervals.'''
+  cdef IntervalFileDB db
+  cdef char *err_msg
+  import os
+  buildpath = sortpath + '.build'
+  n = 0
+  try:
+    ofile = file(buildpath, 'wb')
+    try:
+      for stem in stems: # SEQUENTIAL READS, NOT NESTED LIST SEARCHES
+        db = IntervalFileDB(stem, useMmap=useMmap)
+        try:
+          for a in db.scan():
+            a.tofile(ofile)
+            n = n + len(a)
+        finally:
+          db.close()
+    finally:
+      ofile.close()
+    err_msg = sort_binary_records(buildpath, sortpath, n, maxMemory)
+    if err_msg:
+      raise IOError(err_msg)
+  finally:
+    if os.path.exists(buildpath):
+      os.remove(buildpath)
+  return n
+
+
+def _build_index_files_task(t):
+  'run build_index_files() for a worker process'
+  nbuild, filestem, compress, kwargs, maxMemory = t
+  return build_index_files(filestem, nbuild, compress, kwargs, maxMemory)
+
+
+cdef char *python_readline(char buf[], int size, void *stream):
+  '''ReadLineFunc for reading a Python file-like object, passed as a
+  [fileobj, None] list.  An exception is saved in the list, for
+  check_reader() to raise, and treated as end of file.'''
+  cdef int n
+  reader = <object>stream
+  try:
+    line = reader[0].readline(size - 1)
+  except:
+    import sys
+    reader[1] = sys.exc_info()
+    return NULL
+  n = len(line)
+  if n == 0: # END OF FILE
+    return NULL
+  memcpy(buf, <char *>line, n)
+  buf[n] = 0
+  return buf
+
+
+def check_reader(reader):
+  'raise any exception python_readline() saved while reading this stream'
+  if reader[1] is not None:
+    raise reader[1][0], reader[1][1], reader[1][2]
+
+
+_maf_worker_state = {}
+
+def _init_maf_worker(seqnames):
+  'save the sorted sequence names for a MAF parsing worker process'
+  _maf_worker_state['seqnames'] = seqnames
+
+
+def _read_maf_chunk(t):
+  '''parse the MAF blocks in filename[start:end] to the binary block
+  file outpath, for a worker process of NLMSA.readMAFfiles().
+  Returns its counts of non-alignment lines, by prefix.'''
+  cdef int i, nseq0
+  cdef SeqIDMap *seqidmap
+  cdef char err_msg[1024]
+  cdef long long linecode_count[256]
+  cdef FILE *ifile
+  filename, start, end, outpath = t
+  seqnames = _maf_worker_state['seqnames']
+  nseq0 = len(seqnames)
+  seqidmap = <SeqIDMap *>calloc(nseq0 + 1, sizeof(SeqIDMap))
+  if seqidmap == NULL:
+    raise MemoryError('unable to allocate SeqIDMap[%d]' % nseq0)
+  for i from 0 <= i < nseq0: # POINT TO OUR PYTHON STRINGS, NO COPYING
+    seqName = seqnames[i]
+    seqidmap[i].id = seqName
+  memset(<void *>linecode_count, 0, sizeof(linecode_count))
+  filename, stream = nlmsa_utils.open_alignment_file(filename)
+  if stream is None: # PLAIN TEXT FILE: READ OUR CHUNK OF IT DIRECTLY
+    ifile = fopen(filename, 'rb')
+    if ifile == NULL:
+      free(seqidmap)
+      raise IOError('unable to open file %s' % filename)
+    i = read_maf_chunk(filename, stdio_readline, <void *>ifile, ifile,
+                       start, end, seqidmap, nseq0, 4096, outpath,
+                       linecode_count, err_msg)
+    fclose(ifile)
+  else: # COMPRESSED: READ THE WHOLE STREAM
+    reader = [stream, None]
+    i = read_maf_chunk(filename, python_readline, <void *>reader, NULL,
+                       0, 0, seqidmap, nseq0, 4096, outpath,
+                       linecode_count, err_msg)
+    stream.close()
+    check_reader(reader)
+  free(seqidmap)
+  if i < 0:
+    raise IOError(err_msg)
+  l = []
+  for i from 0 <= i < 256:
+    l.append(linecode_count[i])
+  return l
+
+
+def compress_binaries(filestem):
+  '''convert the .idb file of an IntervalFileDB to compressed .idbz
+  blocks.  Does nothing if it is already compressed.'''
+  cdef char *err_msg
+  err_msg = compress_binary_files(filestem)
+  if err_msg:
+    raise IOError(err_msg)
+
+
+def compress_nlmsa(pathstem):
+  'convert all the .idb files of an on-disk NLMSA to compressed .idbz'
+  try:
+    ifile = file(pathstem + '.NLMSAindex', 'rU') # text file
+  except IOError:
+    ifile = file(pathstem + 'NLMSAindex', 'rU')
+  try:
+    for line in ifile:
+      id = line.strip().split('\t')[0]
+      compress_binaries(pathstem + id)
+  finally:
+    ifile.close()
+
+
+def compact_nlmsa(pathstem, maxMemory=None):
+  '''fold the intervals appended to an on-disk NLMSA (see NLMSA mode='a')
+  into its main nested list databases.  This only needs the index files,
+  so it can be run in a separate process from the one(s) using the NLMSA;
+  NLMSA objects that are open while it runs should be reopened afterwards.'''
+  try:
+    ifile = file(pathstem + '.NLMSAindex', 'rU') # text file
+  except IOError:
+    ifile = file(pathstem + 'NLMSAindex', 'rU')
+  try:
+    ids = [line.strip().split('\t')[0] for line in ifile]
+  finally:
+    ifile.close()
+  for id in ids:
+    compact_index_files(pathstem + id, maxMemory)
+
+
 def dump_textfile(pathstem, outfilename=None):
   'dump NLMSA binary files to a text file'
-  cdef int n, nlmsaID, nsID, offset, is_bidirectional, pairwiseMode, nprefix
+  cdef int n, nlmsaID, nsID, is_bidirectional, pairwiseMode, nprefix
+  cdef long long offset # UNION OFFSETS MAY EXCEED int IN 64-BIT BUILDS
   cdef FILE *outfile
   cdef char err_msg[2048], tmp[2048], seqDictID[256]
   err_msg[0] = 0 # ENSURE STRING IS EMPTY
@@ -2118,7 +3251,7 @@ to textfile_to_binaries() on the destination machine.''')
       nlmsaID = t[0]
       nsID = t[1]
       offset = t[2]
-      if fprintf(outfile, "SEQID\t%s\t%d\t%d\t%d\n", tmp,
+      if fprintf(outfile, "SEQID\t%s\t%d\t%d\t%lld\n", tmp,
                  nlmsaID, nsID, offset) < 0:
         raise IOError('error writing to file %s' %outfilename)
     try:
@@ -2145,7 +3278,8 @@ to textfile_to_binaries() on the destination machine.''')
 
 def textfile_to_binaries(filename, seqDict=None, prefixDict=None, buildpath=''):
   'convert pathstem.txt textfile to NLMSA binary files'
-  cdef int i, n, nlmsaID, nsID, offset, is_bidirectional, pairwiseMode, nprefix
+  cdef int i, n, nlmsaID, nsID, is_bidirectional, pairwiseMode, nprefix
+  cdef long long offset
   cdef FILE *infile
   cdef char err_msg[2048], line[32768], tmp[2048], basestem[2048], seqDictID[2048]
   if seqDict is not None:
@@ -2219,7 +3353,7 @@ dictionary argument: %s''' % missing)
     for i from 0 <= i <n: # seqIDDict READING
       if fgets(line, 32767, infile) == NULL:
         raise IOError('error or EOF reading %s' % filename)
-      if 4 != sscanf(line, "SEQID\t%s\t%d %d %d", tmp,
+      if 4 != sscanf(line, "SEQID\t%s\t%d %d %lld", tmp,
                    &nlmsaID, &nsID, &offset):
         raise IOError('bad format in %s' % filename)
       seqIDdict[tmp] = (nlmsaID, nsID, offset) # SAVE THIS ENTRY
@@ -2246,6 +3380,7 @@ dictionary argument: %s''' % missing)
     ifile = file(buildpath1 + '.NLMSAindex', "w") # text file
     ifile.write(NLMSAindexText) # LAST, WRITE TOP INDEX FILE
     ifile.close()
+    nlmsa_utils.save_manifest(buildpath1)
   finally:
     fclose(infile)
   return buildpath1 # ACTUAL PATH TO NLMSA INDEX FILESET
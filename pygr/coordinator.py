@@ -22,16 +22,60 @@ def get_hostname(host=None):
         return host # JUST USE HOSTNAME AS REPORTED BY gethostname()
 
 
-def get_server(host, port, logRequests=False):
+class ThreadPoolMixIn:
+    """Mix-in for SocketServer classes that handles each request in one of
+    a fixed pool of nthreads daemon worker threads, instead of serially.
+    The served objects must be safe for concurrent use."""
+    nthreads = 4
+
+    def process_request(self, request, client_address):
+        'queue the request for the next free worker thread'
+        try:
+            requests = self.requestQueue
+        except AttributeError: # START THE POOL ON THE FIRST REQUEST
+            import Queue
+            import threading
+            requests = self.requestQueue = Queue.Queue()
+            for i in range(self.nthreads):
+                t = threading.Thread(target=self.process_request_worker)
+                t.setDaemon(True)
+                t.start()
+        requests.put((request, client_address))
+
+    def process_request_worker(self):
+        'handle queued requests, one at a time, for ever'
+        while True:
+            request, client_address = self.requestQueue.get()
+            try:
+                self.finish_request(request, client_address)
+            except:
+                self.handle_error(request, client_address)
+            self.close_request(request)
+
+
+class ThreadPoolXMLRPCServer(ThreadPoolMixIn, SimpleXMLRPCServer):
+    'SimpleXMLRPCServer that runs requests in a pool of worker threads'
+
+    def __init__(self, addr, nthreads=4, **kwargs):
+        self.nthreads = nthreads
+        SimpleXMLRPCServer.__init__(self, addr, **kwargs)
+
+
+def get_server(host, port, logRequests=False, nthreads=1):
     """Start xmlrpc server on requested host:port.
 
     Return bound SimpleXMLRPCServer server obj and port it's bound to.
 
-    Set port=0 to bind to a random port number.
+    Set port=0 to bind to a random port number.  If nthreads > 1,
+    requests are handled concurrently by a pool of nthreads threads.
     """
     if host is None: # use localhost as default
         host = 'localhost'
-    server = SimpleXMLRPCServer((host, port), logRequests=logRequests)
+    if nthreads > 1:
+        server = ThreadPoolXMLRPCServer((host, port), nthreads,
+                                        logRequests=logRequests)
+    else:
+        server = SimpleXMLRPCServer((host, port), logRequests=logRequests)
     port = server.socket.getsockname()[1]
     logging.info("Running XMLRPC server on port %d..." % port)
     return server, port
@@ -268,14 +312,15 @@ class XMLRPCServerBase(object):
     _dispatch = safe_dispatch # RESTRICT XMLRPC TO JUST THE METHODS LISTED HERE
 
     def __init__(self, name, host='', port=5000, logRequests=False,
-                 server=None):
+                 server=None, nthreads=1):
         self.host = host
         self.name = name
         if server is not None:
             self.server = server
             self.port = port
         else:
-            self.server, self.port = get_server(host, port, logRequests)
+            self.server, self.port = get_server(host, port, logRequests,
+                                                nthreads)
         self.server.register_instance(self)
         self.objDict = {}
 
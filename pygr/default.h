@@ -10,10 +10,18 @@
    back to regular fseek version.  On other platforms use POSIX fseeko */
 #ifdef __MSVCRT__
 #define PYGR_FSEEK(IFILE,OFFSET,WHENCE) fseeko64(IFILE,OFFSET,WHENCE)
+#define PYGR_FTELL(IFILE) ftello64(IFILE)
 #elif defined(_WIN32)
 #define PYGR_FSEEK(IFILE,OFFSET,WHENCE) fseek(IFILE,OFFSET,WHENCE)
+#define PYGR_FTELL(IFILE) ftell(IFILE)
 #else
 #define PYGR_FSEEK(IFILE,OFFSET,WHENCE) fseeko(IFILE,OFFSET,WHENCE)
+#define PYGR_FTELL(IFILE) ftello(IFILE)
+#endif
+
+/* MEMORY-MAPPED READ ACCESS TO INDEX FILES IS AVAILABLE ON POSIX SYSTEMS */
+#if !defined(_WIN32)
+#define PYGR_HAVE_MMAP 1
 #endif
 
 #ifdef BUILD_C_LIBRARY
@@ -41,6 +49,14 @@
 /* USE THESE DEFINITIONS FOR BUILDING A PYTHON EXTENSION MODULE  *****************************/
 
 
+/* C SEARCH CODE MAY RUN WITH THE GIL RELEASED, SO ACQUIRE IT BEFORE
+   SETTING A PYTHON EXCEPTION (THIS IS SAFE IF WE ALREADY HOLD IT) */
+#define SET_PYTHON_ERROR(EXC,ERRSTR) {\
+    PyGILState_STATE gil_stateZZ=PyGILState_Ensure(); \
+    PyErr_SetString(EXC,ERRSTR); \
+    PyGILState_Release(gil_stateZZ); \
+  }
+
 /* IF YOU USE CALLOC, YOUR FUNCTION MUST DEFINE A HANDLER WITH LABEL
    handle_malloc_failure:
    THIS HANDLER SHOULD RELEASE ANY TEMPORARILY ALLOCATED MEMORY AND
@@ -54,16 +70,16 @@
 #define CALLOC(memptr,N,ATYPE) \
   if ((N)<=0) {\
     char errstr[1024]; \
-    sprintf(errstr,"%s, line %d: *** invalid memory request: %s[%d].\n",\
-              __FILE__,__LINE__,STRINGIFY(memptr),(N));   \
-    PyErr_SetString(PyExc_ValueError,errstr); \
+    sprintf(errstr,"%s, line %d: *** invalid memory request: %s[%lld].\n",\
+              __FILE__,__LINE__,STRINGIFY(memptr),(long long)(N));   \
+    SET_PYTHON_ERROR(PyExc_ValueError,errstr); \
     MALLOC_FAILURE_ACTION;\
   }\
   else if (NULL == ((memptr)=(ATYPE *)calloc((size_t)(N),sizeof(ATYPE))))  { \
     char errstr[1024]; \
-    sprintf(errstr,"%s, line %d: memory request failed: %s[%d].\n",\
-              __FILE__,__LINE__,STRINGIFY(memptr),(N));   \
-    PyErr_SetString(PyExc_MemoryError,errstr); \
+    sprintf(errstr,"%s, line %d: memory request failed: %s[%lld].\n",\
+              __FILE__,__LINE__,STRINGIFY(memptr),(long long)(N));   \
+    SET_PYTHON_ERROR(PyExc_MemoryError,errstr); \
     MALLOC_FAILURE_ACTION;\
   }
 
@@ -71,18 +87,18 @@
 #define REALLOC(memptr,N,ATYPE) \
   if ((N)<=0) {\
     char errstr[1024]; \
-    sprintf(errstr,"%s, line %d: *** invalid memory request: %s[%d].\n",\
-              __FILE__,__LINE__,STRINGIFY(memptr),(N));   \
-    PyErr_SetString(PyExc_ValueError,errstr); \
+    sprintf(errstr,"%s, line %d: *** invalid memory request: %s[%lld].\n",\
+              __FILE__,__LINE__,STRINGIFY(memptr),(long long)(N));   \
+    SET_PYTHON_ERROR(PyExc_ValueError,errstr); \
     MALLOC_FAILURE_ACTION;\
   }\
   else {\
     void *tmp_realloc_ptrZZ; \
     if (NULL == (tmp_realloc_ptrZZ=realloc((memptr),(size_t)(N)*sizeof(ATYPE))))  { \
       char errstr[1024]; \
-      sprintf(errstr,"%s, line %d: memory request failed: %s[%d].\n",\
-                __FILE__,__LINE__,STRINGIFY(memptr),(N));   \
-      PyErr_SetString(PyExc_MemoryError,errstr); \
+      sprintf(errstr,"%s, line %d: memory request failed: %s[%lld].\n",\
+                __FILE__,__LINE__,STRINGIFY(memptr),(long long)(N));   \
+      SET_PYTHON_ERROR(PyExc_MemoryError,errstr); \
       MALLOC_FAILURE_ACTION;\
     } \
     else \
@@ -92,31 +108,32 @@
 
 #else
 /* USE THESE DEFINITIONS FOR BUILDING A C LIBRARY *****************************/
+#define SET_PYTHON_ERROR(EXC,ERRSTR) fprintf(stderr,"%s\n",ERRSTR)
 #define MALLOC_FAILURE_ACTION abort()
 #define CALLOC(memptr,N,ATYPE) \
   if ((N)<=0) {\
-    fprintf(stderr,"%s, line %d: *** invalid memory request: %s[%d].\n",\
-              __FILE__,__LINE__,STRINGIFY(memptr),(N));   \
+    fprintf(stderr,"%s, line %d: *** invalid memory request: %s[%lld].\n",\
+              __FILE__,__LINE__,STRINGIFY(memptr),(long long)(N));   \
     MALLOC_FAILURE_ACTION;\
   }\
   else if (NULL == ((memptr)=(ATYPE *)calloc((size_t)(N),sizeof(ATYPE))))  { \
-    fprintf(stderr,"%s, line %d: memory request failed: %s[%d].\n",\
-              __FILE__,__LINE__,STRINGIFY(memptr),(N));   \
+    fprintf(stderr,"%s, line %d: memory request failed: %s[%lld].\n",\
+              __FILE__,__LINE__,STRINGIFY(memptr),(long long)(N));   \
     MALLOC_FAILURE_ACTION;\
   }
 
 /* IF realloc FAILS, memptr REMAINS VALID, BUT MALLOC_FAILURE_ACTION IS INVOKED. */
 #define REALLOC(memptr,N,ATYPE) \
   if ((N)<=0) {\
-    fprintf(stderr,"%s, line %d: *** invalid memory request: %s[%d].\n",\
-              __FILE__,__LINE__,STRINGIFY(memptr),(N));   \
+    fprintf(stderr,"%s, line %d: *** invalid memory request: %s[%lld].\n",\
+              __FILE__,__LINE__,STRINGIFY(memptr),(long long)(N));   \
     MALLOC_FAILURE_ACTION;\
   }\
   else {\
     void *tmp_realloc_ptrZZ; \
     if (NULL == (tmp_realloc_ptrZZ=realloc((memptr),(size_t)(N)*sizeof(ATYPE))))  { \
-      fprintf(stderr,"%s, line %d: memory request failed: %s[%d].\n",\
-                __FILE__,__LINE__,STRINGIFY(memptr),(N));   \
+      fprintf(stderr,"%s, line %d: memory request failed: %s[%lld].\n",\
+                __FILE__,__LINE__,STRINGIFY(memptr),(long long)(N));   \
       MALLOC_FAILURE_ACTION;\
     } \
     else \
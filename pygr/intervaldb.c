@@ -1,14 +1,23 @@
 
 #include "intervaldb.h"
+#ifdef PYGR_HAVE_MMAP
+#include <sys/types.h>
+#include <sys/stat.h>
+#include <sys/mman.h>
+#endif
 
 int C_int_max=INT_MAX; /* KLUDGE TO LET PYREX CODE ACCESS VALUE OF INT_MAX MACRO */
+IntervalCoord C_coord_max=INTERVAL_COORD_MAX; /* LARGEST COORDINATE WE CAN STORE */
+int C_idb_format_version=IDB_FORMAT_VERSION; /* .idb RECORD LAYOUT WE READ & WRITE */
 
 IntervalMap *read_intervals(int n,FILE *ifile)
 {
   int i=0;
   IntervalMap *im=NULL;
   CALLOC(im,n,IntervalMap); /* ALLOCATE THE WHOLE ARRAY */
-  while (i<n && fscanf(ifile," %d %d %d %d %d",&im[i].start,&im[i].end,
+  while (i<n && fscanf(ifile," " INTERVAL_COORD_FMT " " INTERVAL_COORD_FMT
+		       " " INTERVAL_COORD_FMT " " INTERVAL_COORD_FMT
+		       " " INTERVAL_COORD_FMT,&im[i].start,&im[i].end,
 		       &im[i].target_id,&im[i].target_start,
 		       &im[i].target_end)==5) {
     im[i].sublist= -1; /* DEFAULT: NO SUBLIST */
@@ -48,7 +57,7 @@ int imstart_qsort_cmp(const void *void_a,const void *void_b)
 #ifdef MERGE_INTERVAL_ORIENTATIONS
 int im_qsort_cmp(const void *void_a,const void *void_b)
 { /* MERGE FORWARD AND REVERSE INTERVALS AS IF THEY WERE ALL IN FORWARD ORI */
-  int a_start,a_end,b_start,b_end;
+  IntervalCoord a_start,a_end,b_start,b_end;
   IntervalMap *a=(IntervalMap *)void_a,*b=(IntervalMap *)void_b;
   SET_INTERVAL_POSITIVE(*a,a_start,a_end);
   SET_INTERVAL_POSITIVE(*b,b_start,b_end);
@@ -82,6 +91,24 @@ int sublist_qsort_cmp(const void *void_a,const void *void_b)
 
 
 
+int imslice_qsort_cmp(const void *void_a,const void *void_b)
+{ /* imstart_qsort_cmp ORDER, WITH TIES BROKEN BY TARGET, SO THAT A SLICE'S
+     INTERVALS ALWAYS COME BACK IN THE SAME ORDER */
+  IntervalMap *a=(IntervalMap *)void_a,*b=(IntervalMap *)void_b;
+  int cmp=imstart_qsort_cmp(void_a,void_b);
+  if (cmp)
+    return cmp;
+  else if (a->target_id!=b->target_id)
+    return a->target_id<b->target_id ? -1 : 1;
+  else if (a->target_start!=b->target_start)
+    return a->target_start<b->target_start ? -1 : 1;
+  else if (a->target_end!=b->target_end)
+    return a->target_end<b->target_end ? -1 : 1;
+  else
+    return 0;
+}
+
+
 int target_qsort_cmp(const void *void_a,const void *void_b)
 { /* SORT IN target_id ORDER, SECONDARILY BY target_start */
   IntervalMap *a=(IntervalMap *)void_a,*b=(IntervalMap *)void_b;
@@ -316,7 +343,7 @@ IntervalMap *interval_map_alloc(int n)
 
 
 
-int find_overlap_start(int start,int end,IntervalMap im[],int n)
+int find_overlap_start(IntervalCoord start,IntervalCoord end,IntervalMap im[],int n)
 {
   int l=0,mid,r;
 
@@ -337,7 +364,7 @@ int find_overlap_start(int start,int end,IntervalMap im[],int n)
 
 
 
-int find_index_start(int start,int end,IntervalIndex im[],int n)
+int find_index_start(IntervalCoord start,IntervalCoord end,IntervalIndex im[],int n)
 {
   int l=0,mid,r;
 
@@ -354,7 +381,7 @@ int find_index_start(int start,int end,IntervalIndex im[],int n)
 
 
 
-int find_suboverlap_start(int start,int end,int isub,IntervalMap im[],
+int find_suboverlap_start(IntervalCoord start,IntervalCoord end,int isub,IntervalMap im[],
 			  SublistHeader subheader[],int nlists)
 {
   int i;
@@ -397,7 +424,8 @@ IntervalIterator *reset_interval_iterator(IntervalIterator *it)
 
 void reorient_intervals(int n,IntervalMap im[],int ori_sign)
 {
-  int i,tmp;
+  int i;
+  IntervalCoord tmp;
   for (i=0;i<n;i++) {
     if ((im[i].start>=0 ? 1:-1)!=ori_sign) { /* ORIENTATION MISMATCH */
       tmp=im[i].start; /* SO REVERSE THIS INTERVAL MAPPING */
@@ -410,7 +438,7 @@ void reorient_intervals(int n,IntervalMap im[],int ori_sign)
   }
 }
 
-int find_intervals(IntervalIterator *it0,int start,int end,
+int find_intervals(IntervalIterator *it0,IntervalCoord start,IntervalCoord end,
 		   IntervalMap im[],int n,
 		   SublistHeader subheader[],int nlists,
 		   IntervalMap buf[],int nbuf,
@@ -418,6 +446,7 @@ int find_intervals(IntervalIterator *it0,int start,int end,
 {
   IntervalIterator *it=NULL,*it2=NULL;
   int ibuf=0,j,k,ori_sign=1;
+  IntervalCoord tmp;
   if (!it0) { /* ALLOCATE AN ITERATOR IF NOT SUPPLIED*/
     CALLOC(it,1,IntervalIterator);
   }
@@ -426,9 +455,9 @@ int find_intervals(IntervalIterator *it0,int start,int end,
 
 #if defined(ALL_POSITIVE_ORIENTATION) || defined(MERGE_INTERVAL_ORIENTATIONS)
   if (start<0) { /* NEED TO CONVERT TO POSITIVE ORIENTATION */
-    j=start;
+    tmp=start;
     start= -end;
-    end= -j;
+    end= -tmp;
     ori_sign = -1;
   }
 #endif
@@ -529,29 +558,94 @@ int read_subheader_block(SublistHeader subheader[],int isub,int nblock,
 }
 
 
+/* GET n RECORDS STARTING AT RECORD ipos OF THE DATABASE INTO it->im.
+   IF THE .idb FILE IS MEMORY-MAPPED, JUST POINT it->im INTO THE MAPPING,
+   OTHERWISE READ OR DECOMPRESS THEM INTO THE ITERATOR'S OWN BUFFER OF SIZE div */
+int read_idb_records(IntervalDBFile *db_file,IntervalIterator *it,
+		     PYGR_OFF_T ipos,int n)
+{
+  int i,j,nblock,div=db_file->div;
+  IntervalMap *im;
+  if (db_file->im_map) { /* ZERO-COPY: NO SEEK, NO READ, NO BUFFER */
+    if (it->im && !it->im_mapped) /* DUMP BUFFER FROM A PRIOR stdio SEARCH */
+      free(it->im);
+    it->im=db_file->im_map+ipos;
+    it->im_mapped=1;
+    return n;
+  }
+  if (!it->im || it->im_mapped) { /* NO ALLOCATION? ALLOCATE OUR BLOCK SIZE div */
+    it->im=NULL;
+    it->im_mapped=0;
+    CALLOC(it->im,db_file->div,IntervalMap); /* ALWAYS ALLOCATE div BUFFERSIZE */
+  }
+  if (db_file->zfile) { /* COPY FROM DECOMPRESSED BLOCKS (AT MOST TWO) */
+    for (i=0;i<n;i+=nblock) {
+      j=(ipos+i)%div; /* OFFSET WITHIN ITS BLOCK */
+      nblock=div-j;
+      if (nblock>n-i)
+	nblock=n-i;
+      if (!(im=read_idbz_block(db_file->zfile,(ipos+i)/div,div)))
+	return db_file->zfile->err; /* MALLOC OR READ ERROR */
+      memcpy(it->im+i,im+j,nblock*sizeof(IntervalMap));
+    }
+    return n;
+  }
+  ipos *= sizeof(IntervalMap); /* CALCULATE FILE POSITION IN BYTES */
+  PYGR_FSEEK(db_file->ifile_idb,ipos,SEEK_SET);
+  if (fread(it->im,sizeof(IntervalMap),n,db_file->ifile_idb)!=(size_t)n)
+    return FIND_FILE_READ_ERR; /* TRUNCATED OR UNREADABLE .idb FILE */
+  return n;
+ handle_malloc_failure:
+  return FIND_FILE_MALLOC_ERR;
+}
 
 
-int find_file_start(IntervalIterator *it,int start,int end,int isub,
-		    IntervalIndex ii[],int nii,
-		    SublistHeader *subheader,int nlists,
-                    SubheaderFile *subheader_file,
-		    int ntop,int div,FILE *ifile)
+/* GET BLOCK i_DIV OF A LIST ENDING AT RECORD ntop INTO it->im */
+int read_idb_block(IntervalDBFile *db_file,IntervalIterator *it,
+		   int i_div,IntervalCoord ntop)
+{
+  int block,div=db_file->div;
+  PYGR_OFF_T ipos;
+  ipos=div; /* CALCULATE POSITION IN RECORDS */
+  ipos*=i_div;
+  if (ipos+div<=ntop) /* GET A WHOLE BLOCK */
+    block=div;
+  else /* JUST READ PARTIAL BLOCK AT END */
+    block=ntop%div;
+  return read_idb_records(db_file,it,ipos,block);
+}
+
+
+/* GET PTR TO subheader[isub], LOADING ITS BLOCK FROM DISK IF NEEDED */
+SublistHeader *get_subheader(IntervalDBFile *db_file,int isub)
 {
-  int i_div= -1,offset=0,offset_div=0;
-  if (isub<0)  /* TOP-LEVEL SEARCH: USE THE INDEX */
-    i_div=find_index_start(start,end,ii,nii);
-  else { /* GET PTR TO subheader[isub] */
 #ifdef ON_DEMAND_SUBLIST_HEADER
-    if (isub<subheader_file->start /* isub OUTSIDE OUR CURRENT BLOCK */
-	|| isub>=subheader_file->start+subheader_file->nblock)
-      subheader_file->start=  /* LOAD NEW BLOCK FROM DISK */
-	read_subheader_block(subheader_file->subheader,isub,
-			     subheader_file->nblock,nlists,
-			     subheader_file->ifile);
-    subheader=subheader_file->subheader + (isub-subheader_file->start);
+  SubheaderFile *subheader_file= &(db_file->subheader_file);
+  if (subheader_file->map) /* MEMORY-MAPPED: THE WHOLE HEADER IS AVAILABLE */
+    return subheader_file->map + isub;
+  if (isub<subheader_file->start /* isub OUTSIDE OUR CURRENT BLOCK */
+      || isub>=subheader_file->start+subheader_file->nblock)
+    subheader_file->start=  /* LOAD NEW BLOCK FROM DISK */
+      read_subheader_block(subheader_file->subheader,isub,
+			   subheader_file->nblock,db_file->nlists,
+			   subheader_file->ifile);
+  return subheader_file->subheader + (isub-subheader_file->start);
 #else
-    subheader += isub; /* POINT TO OUR SUBHEADER */
+  return db_file->subheader + isub; /* POINT TO OUR SUBHEADER */
 #endif
+}
+
+
+int find_file_start(IntervalIterator *it,IntervalCoord start,IntervalCoord end,
+		    int isub,IntervalDBFile *db_file)
+{
+  int i_div= -1,offset_div=0,n,div=db_file->div,nii=db_file->nii;
+  IntervalCoord offset=0,ntop=db_file->ntop;
+  SublistHeader *subheader=db_file->subheader;
+  if (isub<0)  /* TOP-LEVEL SEARCH: USE THE INDEX */
+    i_div=find_index_start(start,end,db_file->ii,nii);
+  else {
+    subheader=get_subheader(db_file,isub);
     if (subheader->len>div) { /* BIG SUBLIST, SO USE THE INDEX */
       offset=subheader->start;
       offset_div=offset/div;/* offset GUARANTEED TO BE MULTIPLE OF div */
@@ -559,43 +653,55 @@ int find_file_start(IntervalIterator *it,int start,int end,int isub,
       nii=ntop/div; /* CALCULATE SUBLIST INDEX SIZE */
       if (ntop%div) /* ONE EXTRA ENTRY FOR PARTIAL BLOCK */
 	nii++;    
-      i_div=find_index_start(start,end,ii+offset_div,nii);
+      i_div=find_index_start(start,end,db_file->ii+offset_div,nii);
     }
   }
 
-  if (!it->im) { /* NO ALLOCATION? ALLOCATE OUR BLOCK SIZE div */
-    CALLOC(it->im,div,IntervalMap); /* ALWAYS ALLOCATE div BUFFERSIZE */
-  }
   if (i_div>=0) { /* READ A SPECIFIC BLOCK OF SIZE div */
-    it->n=read_imdiv(ifile,it->im,div,i_div+offset_div,ntop+offset);
+    n=read_idb_block(db_file,it,i_div+offset_div,ntop+offset);
     it->ntop=ntop+offset; /* END OF THIS LIST IN THE BINARY FILE */
     it->nii=nii+offset_div; /* SAVE INFORMATION FOR READING SUBSEQUENT BLOCKS */
     it->i_div=i_div+offset_div; /* INDEX OF THIS BLOCK IN THE BINARY FILE */
   }
   else { /* A SMALL SUBLIST: READ THE WHOLE LIST INTO MEMORY */
-    read_sublist(ifile,subheader,it->im); /* GUARANTEED TO BE <=div ITEMS */
-    it->n=subheader->len;
+    /* GUARANTEED TO BE <=div ITEMS */
+    n=read_idb_records(db_file,it,subheader->start,subheader->len);
     it->nii=1;
     it->i_div=0; /* INDICATE THAT THERE ARE NO ADDITIONAL BLOCKS TO READ*/
   }
+  if (FIND_FILE_ERROR(n))
+    return n; /* SIGNAL THAT MEMORY OR READ ERROR OCCURRED */
+  it->n=n;
 
   it->i=find_overlap_start(start,end,it->im,it->n);
   return it->i;
- handle_malloc_failure:
-  return -2; /* SIGNAL THAT MEMORY ERROR OCCURRED */
 }
 
 
-int find_file_intervals(IntervalIterator *it0,int start,int end,
-			IntervalIndex ii[],int nii,
-			SublistHeader subheader[],int nlists,
-			SubheaderFile *subheader_file,
-			int ntop,int div,FILE *ifile,
+/* TRUE IF SEARCHING db_file ONLY READS SHARED MEMORY MAPPINGS, I.E. IT
+   HAS NO FILE POSITION, BLOCK BUFFER OR BLOCK CACHE THAT SEARCHES UPDATE.
+   SEVERAL THREADS CAN THEN SEARCH IT AT ONCE, EACH WITH ITS OWN ITERATOR */
+int idb_file_is_threadsafe(IntervalDBFile *db_file)
+{
+  if (!db_file->im_map || db_file->zfile)
+    return 0;
+#ifdef ON_DEMAND_SUBLIST_HEADER
+  if (db_file->nlists>0 && !db_file->subheader_file.map)
+    return 0;
+#endif
+  return 1;
+}
+
+
+int find_file_intervals(IntervalIterator *it0,
+			IntervalCoord start,IntervalCoord end,
+			IntervalDBFile *db_file,
 			IntervalMap buf[],int nbuf,
 			int *p_nreturn,IntervalIterator **it_return)
 {
   IntervalIterator *it=NULL,*it2=NULL;
-  int k,ibuf=0,ori_sign=1,ov=0;
+  int ibuf=0,ori_sign=1,ov=0;
+  IntervalCoord k;
   if (!it0) { /* ALLOCATE AN ITERATOR IF NOT SUPPLIED*/
     CALLOC(it,1,IntervalIterator);
   }
@@ -612,9 +718,8 @@ int find_file_intervals(IntervalIterator *it0,int start,int end,
 #endif
 
   if (it->n == 0)  /* DEFAULT: SEARCH THE TOP NESTED LIST */
-    if (find_file_start(it,start,end,-1,ii,nii,subheader,nlists,
-			subheader_file,ntop,div,ifile) == FIND_FILE_MALLOC_ERR)
-      goto handle_malloc_failure;
+    if (FIND_FILE_ERROR(ov=find_file_start(it,start,end,-1,db_file)))
+      goto handle_find_file_error;
   
   do { /* ITERATOR STACK LOOP */
     while (it->i_div < it->nii) { /* BLOCK ITERATION LOOP */
@@ -625,11 +730,10 @@ int find_file_intervals(IntervalIterator *it0,int start,int end,
 	k=it->im[it->i].sublist; /* GET SUBLIST OF i IF ANY */
 	it->i++; /* ADVANCE TO NEXT INTERVAL */
 	PUSH_ITERATOR_STACK(it,it2,IntervalIterator); /* RECURSE TO SUBLIST */
-	if (k>=0 && (ov=find_file_start(it2,start,end,k,ii,nii,subheader,nlists,
-					subheader_file,ntop,div,ifile))>=0)
+	if (k>=0 && (ov=find_file_start(it2,start,end,k,db_file))>=0)
 	  it=it2; /* PUSH THE ITERATOR STACK */
-	if (FIND_FILE_MALLOC_ERR == ov)
-	  goto handle_malloc_failure;
+	if (FIND_FILE_ERROR(ov))
+	  goto handle_find_file_error;
 	
 	if (ibuf>=nbuf)  /* FILLED THE BUFFER, RETURN THE RESULTS SO FAR */
 	  goto finally_return_result;
@@ -637,7 +741,11 @@ int find_file_intervals(IntervalIterator *it0,int start,int end,
       it->i_div++; /* TRY GOING TO NEXT BLOCK */
       if (it->i == it->n  /* USED WHOLE BLOCK, SO THERE MIGHT BE MORE */
 	  && it->i_div < it->nii) { /* CONTINUE TO NEXT BLOCK */
-	it->n=read_imdiv(ifile,it->im,div,it->i_div,it->ntop); /*READ NEXT BLOCK*/
+	it->n=read_idb_block(db_file,it,it->i_div,it->ntop); /*READ NEXT BLOCK*/
+	if (FIND_FILE_ERROR(it->n)) {
+	  ov=it->n;
+	  goto handle_find_file_error;
+	}
 	it->i=0; /* PROCESS IT FROM ITS START */
       }
     }
@@ -653,6 +761,9 @@ int find_file_intervals(IntervalIterator *it0,int start,int end,
   *p_nreturn=ibuf; /* #INTERVALS FOUND IN THIS PASS */
   *it_return=it; /* HAND BACK ITERATOR FOR CONTINUING THE SEARCH, IF ANY */
   return 0; /* SIGNAL THAT NO ERROR OCCURRED */
+ handle_find_file_error:
+  if (FIND_FILE_READ_ERR == ov) /* MALLOC FAILURES ALREADY SET MemoryError */
+    SET_PYTHON_ERROR(PyExc_IOError,"error reading interval database file: truncated or corrupt");
  handle_malloc_failure:
   return -1;
 }
@@ -662,6 +773,77 @@ int find_file_intervals(IntervalIterator *it0,int start,int end,
 
 
 
+/* COPY n RECORDS STARTING AT RECORD ipos INTO buf, IN ONE SEQUENTIAL READ
+   (OR COPY FROM THE MEMORY MAPPING OR FROM CONSECUTIVE DECOMPRESSED BLOCKS) */
+int copy_idb_records(IntervalDBFile *db_file,PYGR_OFF_T ipos,int n,
+		     IntervalMap buf[])
+{
+  int i,j,nblock,div=db_file->div;
+  IntervalMap *im;
+  if (db_file->im_map) {
+    memcpy(buf,db_file->im_map+ipos,n*sizeof(IntervalMap));
+    return n;
+  }
+  if (db_file->zfile) {
+    for (i=0;i<n;i+=nblock) {
+      j=(ipos+i)%div; /* OFFSET WITHIN ITS BLOCK */
+      nblock=div-j;
+      if (nblock>n-i)
+	nblock=n-i;
+      if (!(im=read_idbz_block(db_file->zfile,(ipos+i)/div,div)))
+	return db_file->zfile->err; /* MALLOC OR READ ERROR */
+      memcpy(buf+i,im+j,nblock*sizeof(IntervalMap));
+    }
+    return n;
+  }
+  ipos *= sizeof(IntervalMap); /* CALCULATE FILE POSITION IN BYTES */
+  PYGR_FSEEK(db_file->ifile_idb,ipos,SEEK_SET); /* NO-OP IF ALREADY THERE */
+  return fread(buf,sizeof(IntervalMap),n,db_file->ifile_idb);
+}
+
+
+/* SEQUENTIAL SCAN OF ALL INTERVALS OF THE DATABASE IN ON-DISK ORDER: THE
+   TOP-LEVEL LIST, THEN EACH SUBLIST IN TURN, SKIPPING ONLY THE PADDING
+   BETWEEN THEM.  *p_isub (-1 FOR THE TOP-LEVEL LIST) AND *p_i (OFFSET
+   WITHIN THAT LIST) SAVE THE SCAN POSITION BETWEEN CALLS, AND SHOULD
+   START AT -1 AND 0.  COPIES UP TO nbuf RECORDS INTO buf, RETURNING THE
+   NUMBER COPIED, 0 AT THE END OF THE DATABASE, OR FIND_FILE_MALLOC_ERR
+   OR FIND_FILE_READ_ERR */
+int scan_idb_records(IntervalDBFile *db_file,int *p_isub,IntervalCoord *p_i,
+		     IntervalMap buf[],int nbuf)
+{
+  int n=0,k;
+  IntervalCoord start,len;
+  SublistHeader *subheader;
+  while (n<nbuf && *p_isub<db_file->nlists) {
+    if (*p_isub<0) { /* THE TOP-LEVEL LIST IS AT THE START OF THE FILE */
+      start=0;
+      len=db_file->ntop;
+    }
+    else {
+      subheader=get_subheader(db_file,*p_isub);
+      start=subheader->start;
+      len=subheader->len;
+    }
+    k=nbuf-n;
+    if (k>len- *p_i)
+      k=len- *p_i;
+    if (k>0) {
+      k=copy_idb_records(db_file,start+ *p_i,k,buf+n);
+      if (k<=0) /* READ ERROR OR TRUNCATED FILE */
+	return k<0 ? k : FIND_FILE_READ_ERR;
+      n+=k;
+      *p_i+=k;
+    }
+    if (*p_i>=len) { /* FINISHED THIS LIST, GO ON TO THE NEXT */
+      (*p_isub)++;
+      *p_i=0;
+    }
+  }
+  return n;
+}
+
+
 /* FUNCTIONS FOR READING AND WRITING OF THE BINARY DATABASE FILES */
 
 int write_padded_binary(IntervalMap im[],int n,int div,FILE *ifile)
@@ -713,33 +895,38 @@ int repack_subheaders(IntervalMap im[],int n,int div,
 }
 
 
-int write_binary_index(IntervalMap im[],int n,int div,FILE *ifile)
-{
-  int i,j,nsave=0;
-  for (i=0;i<n;i+=div) {
+void write_index_entry(IntervalMap *first,IntervalMap *last,FILE *ifile)
+{ /* SAVE THE SPAN OF ONE div BLOCK, FROM first TO last RECORD */
 #ifdef MERGE_INTERVAL_ORIENTATIONS
-    if (im[i].start>=0) /* FORWARD ORI */
+  IntervalCoord pos;
+  if (first->start>=0) /* FORWARD ORI */
 #endif
-      fwrite(&(im[i].start),sizeof(int),1,ifile);  /*SAVE start */
+    fwrite(&(first->start),sizeof(IntervalCoord),1,ifile);  /*SAVE start */
 #ifdef MERGE_INTERVAL_ORIENTATIONS
-    else { /* REVERSE ORI */
-      j= - im[i].end;
-      fwrite(&j,sizeof(int),1,ifile);  /*SAVE start */
-    }
+  else { /* REVERSE ORI */
+    pos= - first->end;
+    fwrite(&pos,sizeof(IntervalCoord),1,ifile);  /*SAVE start */
+  }
+  if (last->start>=0)  /* FORWARD ORI */
 #endif
+    fwrite(&(last->end),sizeof(IntervalCoord),1,ifile);  /*SAVE end */
+#ifdef MERGE_INTERVAL_ORIENTATIONS
+  else { /* REVERSE ORI */
+    pos= - last->start;
+    fwrite(&pos,sizeof(IntervalCoord),1,ifile);  /*SAVE end */
+  }
+#endif
+}
+
+
+int write_binary_index(IntervalMap im[],int n,int div,FILE *ifile)
+{
+  int i,j,nsave=0;
+  for (i=0;i<n;i+=div) {
     j=i+div-1;
     if (j>=n)
       j=n-1;
-#ifdef MERGE_INTERVAL_ORIENTATIONS
-    if (im[j].start>=0)  /* FORWARD ORI */
-#endif
-      fwrite(&(im[j].end),sizeof(int),1,ifile);  /*SAVE end */
-#ifdef MERGE_INTERVAL_ORIENTATIONS
-    else { /* REVERSE ORI */
-      j= - im[j].start;
-      fwrite(&j,sizeof(int),1,ifile);  /*SAVE end */
-    }
-#endif
+    write_index_entry(im+i,im+j,ifile);
     nsave++;
   }
   return nsave;
@@ -807,7 +994,8 @@ char *write_binary_files(IntervalMap im[],int n,int ntop,int div,
     sprintf(err_msg,"unable to open file %s for writing",path);
     return err_msg;
   }
-  fprintf(ifile,"%d %d %d %d %d\n",n,ntop,div,nlists,nii);
+  fprintf(ifile,"%d %d %d %d %d %d\n",n,ntop,div,nlists,nii,
+	  IDB_FORMAT_VERSION);
   fclose(ifile);
 
   return NULL; /* RETURN CODE SIGNALS SUCCESS!! */
@@ -815,14 +1003,922 @@ char *write_binary_files(IntervalMap im[],int n,int ntop,int div,
 
 
 
-IntervalDBFile *read_binary_files(char filestem[],char err_msg[],
-				  int subheader_nblock)
+/****************************************************************
+ *
+ *   EXTERNAL-MEMORY BUILD: FOR .build FILES TOO BIG TO SORT IN RAM
+ *
+ *   1. SORT THE .build RECORDS AS SORTED RUNS SPILLED TO DISK + K-WAY MERGE
+ *   2. ONE STREAMING PASS ASSIGNS EACH INTERVAL TO ITS CONTAINING LIST
+ *   3. SORT AGAIN BY LIST, SO EACH LIST'S INTERVALS ARE CONTIGUOUS
+ *   4. STREAM THE LISTS OUT IN THE SAME LAYOUT AS write_binary_files()
+ *
+ *   ONLY THE SORT BUFFER, THE CONTAINMENT STACK AND ONE int PER SUBLIST
+ *   ARE HELD IN MEMORY.
+ */
+
+#ifdef MERGE_INTERVAL_ORIENTATIONS
+#define BUILD_ORDER_CMP im_qsort_cmp
+#else
+#define BUILD_ORDER_CMP imstart_qsort_cmp
+#endif
+
+/* TRUE IF A IS NESTED INSIDE B, ASSUMING B PRECEDES A IN BUILD ORDER */
+#define IS_CONTAINED_IN(A,B) (!(END_POSITIVE(A)>END_POSITIVE(B) \
+  || (END_POSITIVE(A)==END_POSITIVE(B) && START_POSITIVE(A)==START_POSITIVE(B))))
+
+int listed_qsort_cmp(const void *void_a,const void *void_b)
+{ /* SORT IN LIST ORDER (TOP LEVEL FIRST), SECONDARILY IN BUILD ORDER */
+  ListedInterval *a=(ListedInterval *)void_a,*b=(ListedInterval *)void_b;
+  if (a->list<b->list)
+    return -1;
+  else if (a->list>b->list)
+    return 1;
+  else
+    return BUILD_ORDER_CMP(&(a->im),&(b->im));
+}
+
+
+void reorient_positive_records(void *buf,int n)
+{ /* PREPARE RAW .build RECORDS THE SAME WAY build_nested_list() DOES */
+#ifdef ALL_POSITIVE_ORIENTATION
+  reorient_intervals(n,(IntervalMap *)buf,1);
+#endif
+}
+
+
+/* DELETE RUN FILES runstem.first ... runstem.(last-1), IGNORING ANY THAT
+   WERE NEVER WRITTEN OR ARE ALREADY GONE */
+void remove_sorted_runs(char runstem[],int first,int last)
 {
-  int n,ntop,div,nlists,nii;
   char path[2048];
-  IntervalIndex *ii=NULL;
-  SublistHeader *subheader=NULL;
-  IntervalDBFile *idb_file=NULL;
+  for (;first<last;first++) {
+    sprintf(path,"%s.%d",runstem,first);
+    remove(path);
+  }
+}
+
+
+/* SORT n FIXED-SIZE RECORDS FROM ifile IN CHUNKS OF nmax RECORDS, SAVING
+   EACH SORTED CHUNK AS RUN FILE runstem.0, runstem.1 ...
+   RETURNS THE NUMBER OF RUNS WRITTEN, OR -1 ON ERROR (DELETING THEM) */
+int write_sorted_runs(FILE *ifile,long long n,size_t recsize,int nmax,
+		      int (*cmp)(const void *,const void *),
+		      void (*prepare)(void *,int),
+		      char runstem[],char err_msg[])
+{
+  int nrun=0,nread;
+  long long ntotal=0;
+  char *buf=NULL,path[2048];
+  FILE *ofile;
+
+  if (NULL==(buf=(char *)malloc((size_t)nmax*recsize))) {
+    sprintf(err_msg,"unable to malloc %d records for sorting",nmax);
+    return -1;
+  }
+  while (ntotal<n && (nread=fread(buf,recsize,nmax,ifile))>0) {
+    if (prepare)
+      prepare(buf,nread);
+    qsort(buf,nread,recsize,cmp);
+    sprintf(path,"%s.%d",runstem,nrun);
+    if (NULL==(ofile=fopen(path,"wb"))) {
+      sprintf(err_msg,"unable to open file %s for writing",path);
+      goto handle_error;
+    }
+    if (fwrite(buf,recsize,nread,ofile)!=nread) {
+      fclose(ofile);
+      sprintf(err_msg,"error writing sorted run to %s",path);
+      goto handle_error;
+    }
+    fclose(ofile);
+    nrun++;
+    ntotal+=nread;
+  }
+  free(buf);
+  if (ntotal!=n) { /* TRUNCATED INPUT */
+    sprintf(err_msg,"expected %lld records, but only read %lld",n,ntotal);
+    remove_sorted_runs(runstem,0,nrun);
+    return -1;
+  }
+  return nrun;
+ handle_error:
+  free(buf);
+  remove_sorted_runs(runstem,0,nrun+1); /* INCLUDING ANY PARTIAL RUN */
+  return -1;
+}
+
+
+/* RESTORE THE HEAP PROPERTY BELOW SLOT j: SMALLEST CURRENT RECORD ON TOP */
+void merge_heap_down(ExternalSortRun **heap,int nheap,int j,size_t recsize,
+		     int (*cmp)(const void *,const void *))
+{
+  int c;
+  ExternalSortRun *tmp;
+  while ((c=2*j+1)<nheap) {
+    if (c+1<nheap && cmp(EXTSORT_RECORD(heap[c+1],recsize),
+			 EXTSORT_RECORD(heap[c],recsize))<0)
+      c++; /* USE THE SMALLER CHILD */
+    if (cmp(EXTSORT_RECORD(heap[c],recsize),
+	    EXTSORT_RECORD(heap[j],recsize))>=0)
+      break;
+    tmp=heap[j];
+    heap[j]=heap[c];
+    heap[c]=tmp;
+    j=c;
+  }
+}
+
+
+/* K-WAY MERGE OF RUN FILES runstem.first ... runstem.(first+nrun-1) INTO
+   ofile, USING A READ BUFFER OF nbuf RECORDS PER RUN.  THE RUN FILES ARE
+   DELETED AFTERWARDS.  RETURNS 0 ON SUCCESS, -1 ON ERROR */
+int merge_sorted_runs(char runstem[],int first,int nrun,FILE *ofile,
+		      size_t recsize,int nbuf,
+		      int (*cmp)(const void *,const void *),char err_msg[])
+{
+  int i,nheap=0,status= -1;
+  char path[2048];
+  ExternalSortRun *runs=NULL,**heap=NULL;
+
+  if (nrun<=0)
+    return 0; /* NOTHING TO MERGE */
+  CALLOC(runs,nrun,ExternalSortRun);
+  CALLOC(heap,nrun,ExternalSortRun *);
+  for (i=0;i<nrun;i++) { /* OPEN EACH RUN AND READ ITS FIRST BUFFER */
+    sprintf(path,"%s.%d",runstem,first+i);
+    if (NULL==(runs[i].ifile=fopen(path,"rb"))) {
+      sprintf(err_msg,"unable to open sorted run %s",path);
+      goto cleanup;
+    }
+    if (NULL==(runs[i].buf=(char *)malloc((size_t)nbuf*recsize))) {
+      sprintf(err_msg,"unable to malloc merge buffer for %d runs",nrun);
+      goto cleanup;
+    }
+    runs[i].n=fread(runs[i].buf,recsize,nbuf,runs[i].ifile);
+    if (runs[i].n>0)
+      heap[nheap++]=runs+i;
+  }
+  for (i=nheap/2-1;i>=0;i--) /* HEAPIFY */
+    merge_heap_down(heap,nheap,i,recsize,cmp);
+  while (nheap>0) {
+    if (fwrite(EXTSORT_RECORD(heap[0],recsize),recsize,1,ofile)!=1) {
+      sprintf(err_msg,"error writing merged records");
+      goto cleanup;
+    }
+    if (++heap[0]->i>=heap[0]->n) { /* BUFFER USED UP: READ MORE */
+      heap[0]->i=0;
+      heap[0]->n=fread(heap[0]->buf,recsize,nbuf,heap[0]->ifile);
+      if (heap[0]->n<=0) /* THIS RUN IS EXHAUSTED */
+	heap[0]=heap[--nheap];
+    }
+    merge_heap_down(heap,nheap,0,recsize,cmp);
+  }
+  status=0; /* SUCCESS */
+ cleanup:
+  for (i=0;i<nrun;i++) {
+    if (runs[i].ifile) {
+      fclose(runs[i].ifile);
+      sprintf(path,"%s.%d",runstem,first+i);
+      remove(path);
+    }
+    FREE(runs[i].buf);
+  }
+  FREE(runs);
+  FREE(heap);
+  return status;
+ handle_malloc_failure:
+  FREE(runs);
+  sprintf(err_msg,"unable to malloc merge heap for %d runs",nrun);
+  return -1;
+}
+
+
+/* SORT n FIXED-SIZE RECORDS FROM infile INTO outfile, HOLDING AT MOST
+   ABOUT max_memory BYTES OF RECORDS IN MEMORY AT ONCE.  SORTED RUNS ARE
+   SPILLED TO runstem.0, runstem.1 ... AND DELETED AS THEY ARE MERGED
+   (OR ON ANY ERROR).  RETURNS 0 ON SUCCESS, -1 ON ERROR */
+int external_sort(char infile[],char outfile[],long long n,size_t recsize,
+		  int (*cmp)(const void *,const void *),
+		  void (*prepare)(void *,int),long long max_memory,
+		  char runstem[],char err_msg[])
+{
+  int nmax,nrun,first=0,nbuf;
+  long long nmem;
+  char path[2048];
+  FILE *ifile,*ofile;
+
+  nmem=max_memory/(long long)recsize; /* #RECORDS THAT FIT IN BUDGET */
+  if (nmem<EXTSORT_MIN_RECORDS)
+    nmem=EXTSORT_MIN_RECORDS;
+  if (nmem>n)
+    nmem=n>0 ? n : 1;
+  if (nmem>INT_MAX/(long long)recsize)
+    nmem=INT_MAX/(long long)recsize;
+  nmax=(int)nmem;
+
+  if (NULL==(ifile=fopen(infile,"rb"))) {
+    sprintf(err_msg,"unable to open file %s for reading",infile);
+    return -1;
+  }
+  nrun=write_sorted_runs(ifile,n,recsize,nmax,cmp,prepare,runstem,err_msg);
+  fclose(ifile);
+  if (nrun<0)
+    return -1;
+
+  nbuf=nmax/(EXTSORT_MAX_FANIN+1); /* SHARE THE BUDGET AMONG THE RUNS */
+  if (nbuf<1)
+    nbuf=1;
+  while (nrun-first>EXTSORT_MAX_FANIN) { /* TOO MANY RUNS: MERGE IN PASSES */
+    sprintf(path,"%s.%d",runstem,nrun);
+    if (NULL==(ofile=fopen(path,"wb"))) {
+      sprintf(err_msg,"unable to open file %s for writing",path);
+      goto handle_error;
+    }
+    if (merge_sorted_runs(runstem,first,EXTSORT_MAX_FANIN,ofile,recsize,nbuf,
+			  cmp,err_msg)) {
+      fclose(ofile);
+      goto handle_error;
+    }
+    if (fclose(ofile)) {
+      sprintf(err_msg,"error writing file %s",path);
+      goto handle_error;
+    }
+    first+=EXTSORT_MAX_FANIN;
+    nrun++; /* THE MERGED RUN JOINS THE QUEUE */
+  }
+  if (NULL==(ofile=fopen(outfile,"wb"))) {
+    sprintf(err_msg,"unable to open file %s for writing",outfile);
+    goto handle_error;
+  }
+  if (merge_sorted_runs(runstem,first,nrun-first,ofile,recsize,nbuf,
+			cmp,err_msg)) {
+    fclose(ofile);
+    goto handle_error;
+  }
+  if (fclose(ofile)) {
+    sprintf(err_msg,"error writing file %s",outfile);
+    return -1;
+  }
+  return 0;
+ handle_error: /* DELETE THE REMAINING RUNS, AND ANY PARTIAL MERGED RUN */
+  remove_sorted_runs(runstem,first,nrun+1);
+  return -1;
+}
+
+
+/* READ SORTED INTERVALS FROM infile, DETERMINE WHICH LIST EACH BELONGS TO
+   USING THE SAME CONTAINMENT STACK AS build_nested_list(), AND WRITE THEM
+   AS ListedInterval TO outfile.  SUBLISTS ARE NUMBERED IN ORDER OF THEIR
+   PARENT'S POSITION.  RETURNS THE ARRAY OF SUBLIST LENGTHS (A DUMMY
+   ARRAY IF THERE ARE NO SUBLISTS), OR NULL ON ERROR */
+int *assign_interval_lists(char infile[],char outfile[],int *p_ntop,
+			   int *p_nlists,char err_msg[])
+{
+  int depth=0,nstack=0,nlists=0,ncounts=0,ntop=0,has_prev=0;
+  int *counts=NULL;
+  IntervalMap *stack=NULL;
+  ListedInterval prev,cur;
+  FILE *ifile=NULL,*ofile=NULL;
+
+  nstack=ncounts=1024;
+  CALLOC(stack,nstack,IntervalMap);
+  CALLOC(counts,ncounts,int);
+  if (NULL==(ifile=fopen(infile,"rb"))) {
+    sprintf(err_msg,"unable to open file %s for reading",infile);
+    goto handle_error;
+  }
+  if (NULL==(ofile=fopen(outfile,"wb"))) {
+    sprintf(err_msg,"unable to open file %s for writing",outfile);
+    goto handle_error;
+  }
+  while (fread(&(cur.im),sizeof(IntervalMap),1,ifile)==1) {
+    if (has_prev) {
+      if (IS_CONTAINED_IN(cur.im,prev.im)) { /* prev HAS A SUBLIST */
+	if (nlists>=ncounts) {
+	  ncounts*=2;
+	  REALLOC(counts,ncounts,int);
+	}
+	counts[nlists]=0;
+	prev.im.sublist=nlists++;
+	if (depth>=nstack) {
+	  nstack*=2;
+	  REALLOC(stack,nstack,IntervalMap);
+	}
+	stack[depth++]=prev.im; /* PUSH ONTO RECURSIVE STACK */
+      }
+      if (fwrite(&prev,sizeof(ListedInterval),1,ofile)!=1) {
+	sprintf(err_msg,"error writing file %s",outfile);
+	goto handle_error;
+      }
+      if (prev.list<0) /* COUNT THE LIST ENTRIES */
+	ntop++;
+      else
+	counts[prev.list]++;
+    }
+    while (depth>0 && !IS_CONTAINED_IN(cur.im,stack[depth-1]))
+      depth--; /* POP RECURSIVE STACK */
+    cur.list= (depth>0) ? stack[depth-1].sublist : -1;
+    cur.im.sublist= -1; /* DEFAULT: NO SUBLIST */
+    prev=cur;
+    has_prev=1;
+  }
+  if (has_prev) { /* SAVE THE LAST INTERVAL */
+    if (fwrite(&prev,sizeof(ListedInterval),1,ofile)!=1) {
+      sprintf(err_msg,"error writing file %s",outfile);
+      goto handle_error;
+    }
+    if (prev.list<0)
+      ntop++;
+    else
+      counts[prev.list]++;
+  }
+  fclose(ifile);
+  ifile=NULL;
+  if (fclose(ofile)) {
+    ofile=NULL;
+    sprintf(err_msg,"error writing file %s",outfile);
+    goto handle_error;
+  }
+  FREE(stack);
+  *p_ntop=ntop;
+  *p_nlists=nlists;
+  return counts;
+ handle_malloc_failure:
+  sprintf(err_msg,"unable to malloc list stack for %d sublists",nlists);
+ handle_error:
+  if (ifile)
+    fclose(ifile);
+  if (ofile)
+    fclose(ofile);
+  FREE(stack);
+  FREE(counts);
+  return NULL;
+}
+
+
+/* WRITE THE LIST-SORTED ListedInterval RECORDS FROM listfile AS THE .idb,
+   .index AND .subhead FILES, IN EXACTLY THE LAYOUT write_binary_files()
+   PRODUCES: TOP LEVEL LIST, THEN SUBLISTS BIGGER THAN div (PADDED), THEN
+   THE SMALL SUBLISTS.  RETURNS THE NUMBER OF INDEX ENTRIES, OR -1 */
+int write_listed_binaries(char listfile[],int ntop,int nlists,int counts[],
+			  int div,char filestem[],char err_msg[])
+{
+  int i,j=0,ipass,len=0,nii=0,npad,*sub_map=NULL;
+  IntervalCoord list,pos;
+  char path[2048];
+  ListedInterval li;
+  IntervalMap first,block_first;
+  SublistHeader sh_tmp;
+  FILE *ifile=NULL,*ifile_idb=NULL,*ifile_index=NULL,*ifile_subheader=NULL;
+
+  if (nlists>0) { /* SAME ORDERING AS repack_subheaders() */
+    CALLOC(sub_map,nlists,int);
+    for (i=j=0;i<nlists;i++)
+      if (counts[i]>div)
+	sub_map[i]=j++;
+    for (i=0;i<nlists;i++)
+      if (counts[i]<=div)
+	sub_map[i]=j++;
+  }
+  sprintf(path,"%s.subhead",filestem); /* SAVE THE SUBHEADER LIST */
+  if (NULL==(ifile_subheader=fopen(path,"wb"))) {
+    sprintf(err_msg,"unable to open file %s for writing",path);
+    goto handle_error;
+  }
+  pos=ntop+(ntop%div ? div-ntop%div : 0); /* TOP LEVEL LIST IS PADDED */
+  for (ipass=0;ipass<2;ipass++) /* BIG SUBLISTS, THEN SMALL ONES */
+    for (i=0;i<nlists;i++)
+      if ((counts[i]>div)==(ipass==0)) {
+	sh_tmp.start=pos; /* FILE LOCATION WHERE THIS SUBLIST STORED */
+	sh_tmp.len=counts[i]; /* SAVE THE TRUE SUBLIST LENGTH, UNPADDED */
+	fwrite(&sh_tmp,sizeof(SublistHeader),1,ifile_subheader);
+	pos+=counts[i];
+	if (counts[i]>div && counts[i]%div) /* BIG LIST: PADDED */
+	  pos+=div-counts[i]%div;
+      }
+  fclose(ifile_subheader);
+  ifile_subheader=NULL;
+
+  sprintf(path,"%s.idb",filestem); /* SAVE THE DATABASE */
+  if (NULL==(ifile_idb=fopen(path,"wb"))) {
+    sprintf(err_msg,"unable to open file %s for writing",path);
+    goto handle_error;
+  }
+  sprintf(path,"%s.index",filestem); /* SAVE THE COMPACTED INDEX */
+  if (NULL==(ifile_index=fopen(path,"wb"))) {
+    sprintf(err_msg,"unable to open file %s for writing",path);
+    goto handle_error;
+  }
+  if (NULL==(ifile=fopen(listfile,"rb"))) {
+    sprintf(err_msg,"unable to open file %s for reading",listfile);
+    goto handle_error;
+  }
+  for (ipass=0;ipass<2;ipass++) { /* PASS 0: TOP & BIG LISTS; 1: SMALL ONES */
+    rewind(ifile);
+    list= -2; /* NO LIST YET */
+    while (fread(&li,sizeof(ListedInterval),1,ifile)==1) {
+      if ((li.list<0 || counts[li.list]>div)!=(ipass==0))
+	continue; /* THIS LIST IS WRITTEN IN THE OTHER PASS */
+      if (li.list!=list) { /* START OF A NEW LIST */
+	list=li.list;
+	len= (list<0) ? ntop : counts[list];
+	j=0;
+      }
+      if (li.im.sublist>=0) /* ADJUST TO REPACKED SUBLIST LOCATION */
+	li.im.sublist=sub_map[li.im.sublist];
+      if (fwrite(&(li.im),sizeof(IntervalMap),1,ifile_idb)!=1) {
+	sprintf(err_msg,"error writing file %s.idb",filestem);
+	goto handle_error;
+      }
+      if (ipass==1) /* SMALL LIST: NO PADDING, NO INDEX */
+	continue;
+      if (j==0)
+	first=li.im;
+      if (j%div==0)
+	block_first=li.im;
+      j++;
+      if (j%div==0 || j==len) { /* END OF A div BLOCK */
+	write_index_entry(&block_first,&(li.im),ifile_index);
+	nii++;
+      }
+      if (j==len && len%div) { /* END OF LIST: PAD TO EXACT MULTIPLE OF div */
+	for (npad=div-len%div;npad>0;npad--) /* THIS IS JUST PADDING */
+	  fwrite(&first,sizeof(IntervalMap),1,ifile_idb);
+      }
+    }
+  }
+  fclose(ifile);
+  fclose(ifile_index);
+  if (fclose(ifile_idb)) {
+    sprintf(err_msg,"error writing file %s.idb",filestem);
+    FREE(sub_map);
+    return -1;
+  }
+  FREE(sub_map);
+  return nii;
+ handle_malloc_failure:
+  sprintf(err_msg,"unable to malloc %d subheaders",nlists);
+ handle_error:
+  if (ifile)
+    fclose(ifile);
+  if (ifile_idb)
+    fclose(ifile_idb);
+  if (ifile_index)
+    fclose(ifile_index);
+  if (ifile_subheader)
+    fclose(ifile_subheader);
+  FREE(sub_map);
+  return -1;
+}
+
+
+/* BUILD THE BINARY DATABASE filestem FROM THE n UNSORTED RECORDS OF
+   buildfile, USING AT MOST ABOUT max_memory BYTES FOR SORTING.  TEMPORARY
+   FILES ARE CREATED NEXT TO filestem AND REMOVED WHEN DONE.
+   RETURNS NULL ON SUCCESS, OR AN ERROR MESSAGE */
+char *build_binary_files_external(char buildfile[],int n,int div,
+				  char filestem[],long long max_memory)
+{
+  int ntop=0,nlists=0,nii,*counts=NULL;
+  char sortfile[2048],listfile[2048],runstem[2048],path[2048];
+  FILE *ifile;
+  static char err_msg[1024];
+
+  sprintf(sortfile,"%s.sorted",filestem);
+  sprintf(listfile,"%s.listed",filestem);
+  sprintf(runstem,"%s.run",filestem);
+  if (external_sort(buildfile,sortfile,n,sizeof(IntervalMap),BUILD_ORDER_CMP,
+		    reorient_positive_records,max_memory,runstem,err_msg))
+    goto handle_error;
+  counts=assign_interval_lists(sortfile,listfile,&ntop,&nlists,err_msg);
+  remove(sortfile);
+  if (counts==NULL)
+    goto handle_error;
+  if (external_sort(listfile,sortfile,n,sizeof(ListedInterval),
+		    listed_qsort_cmp,NULL,max_memory,runstem,err_msg))
+    goto handle_error;
+  remove(listfile);
+  nii=write_listed_binaries(sortfile,ntop,nlists,counts,div,filestem,err_msg);
+  remove(sortfile);
+  FREE(counts);
+  if (nii<0)
+    return err_msg;
+
+  sprintf(path,"%s.size",filestem); /* SAVE BASIC SIZE INFO*/
+  if (NULL==(ifile=fopen(path,"w"))) { /* text file */
+    sprintf(err_msg,"unable to open file %s for writing",path);
+    return err_msg;
+  }
+  fprintf(ifile,"%d %d %d %d %d %d\n",n,ntop,div,nlists,nii,
+	  IDB_FORMAT_VERSION);
+  fclose(ifile);
+  return NULL; /* RETURN CODE SIGNALS SUCCESS!! */
+ handle_error:
+  remove(sortfile);
+  remove(listfile);
+  FREE(counts);
+  return err_msg;
+}
+
+
+
+/* SORT THE n RAW IntervalMap RECORDS OF buildfile INTO sortfile IN BUILD
+   ORDER (I.E. BY start), USING AT MOST ABOUT max_memory BYTES FOR SORTING.
+   RETURNS NULL ON SUCCESS, OR AN ERROR MESSAGE */
+char *sort_binary_records(char buildfile[],char sortfile[],long long n,
+			  long long max_memory)
+{
+  char runstem[2048];
+  static char err_msg[1024];
+
+  sprintf(runstem,"%s.run",sortfile);
+  if (external_sort(buildfile,sortfile,n,sizeof(IntervalMap),BUILD_ORDER_CMP,
+		    NULL,max_memory,runstem,err_msg))
+    return err_msg;
+  return NULL;
+}
+
+
+
+/* MAP AN OPEN BINARY FILE READ-ONLY INTO MEMORY, SHARED WITH OTHER PROCESSES.
+   RETURNS NULL IF MAPPING IS NOT SUPPORTED OR FAILED, IN WHICH CASE THE
+   CALLER SHOULD SIMPLY KEEP USING stdio ON ifile */
+void *map_binary_file(FILE *ifile,size_t *p_size)
+{
+#ifdef PYGR_HAVE_MMAP
+  struct stat st;
+  void *p;
+  if (fstat(fileno(ifile),&st)!=0 || st.st_size<=0
+      || (PYGR_OFF_T)(size_t)st.st_size!=st.st_size) /* TOO BIG TO MAP */
+    return NULL;
+  p=mmap(NULL,(size_t)st.st_size,PROT_READ,MAP_SHARED,fileno(ifile),0);
+  if (p==MAP_FAILED)
+    return NULL;
+  *p_size=(size_t)st.st_size;
+  return p;
+#else
+  return NULL;
+#endif
+}
+
+
+void unmap_binary_file(void *p,size_t size)
+{
+#ifdef PYGR_HAVE_MMAP
+  if (p)
+    munmap(p,size);
+#endif
+}
+
+
+
+/****************************************************************
+ *
+ *   COMPRESSED .idbz STORAGE
+ *
+ *   THE .idb RECORD ARRAY IS CUT INTO BLOCKS OF div RECORDS, THE SAME
+ *   BLOCKS THAT THE .index DESCRIBES AND THAT SEARCHES READ.  EACH BLOCK
+ *   IS STORED AS DELTA-ENCODED VARINTS, AND .zindex GIVES THE FILE
+ *   OFFSET OF EVERY BLOCK, SO ANY BLOCK CAN BE DECODED ON ITS OWN.
+ */
+
+/* SIGNED VALUES ARE ZIGZAG-MAPPED SO SMALL |x| GET SHORT VARINTS */
+#define ZIGZAG_ENCODE(x) (((unsigned long long)(x)<<1) \
+			  ^ (unsigned long long)((long long)(x)>>63))
+#define ZIGZAG_DECODE(u) ((long long)((u)>>1) ^ -(long long)((u)&1))
+
+int put_varint(unsigned char *p,unsigned long long u)
+{
+  int i=0;
+  while (u>=0x80) {
+    p[i++]=(unsigned char)(u|0x80);
+    u>>=7;
+  }
+  p[i++]=(unsigned char)u;
+  return i; /* #BYTES WRITTEN */
+}
+
+
+int get_varint(unsigned char *p,unsigned char *pend,unsigned long long *p_u)
+{
+  unsigned long long u=0;
+  int i=0,shift=0;
+  do {
+    if (p+i>=pend || shift>63) /* TRUNCATED OR CORRUPT BLOCK */
+      return -1;
+    u|=(unsigned long long)(p[i]&0x7f)<<shift;
+    shift+=7;
+  } while (p[i++]&0x80);
+  *p_u=u;
+  return i; /* #BYTES READ */
+}
+
+
+/* ENCODE n RECORDS AS DELTAS FROM THE PREVIOUS RECORD IN THE SAME BLOCK.
+   sublist IS 0 FOR "NO SUBLIST", OTHERWISE 1+ZIGZAG(DELTA FROM THE
+   PREVIOUS SUBLIST ID IN THIS BLOCK) */
+int encode_idb_block(IntervalMap im[],int n,unsigned char *p)
+{
+  int i,nbytes=0;
+  IntervalCoord start=0,target_id=0,target_start=0,sublist=0;
+  for (i=0;i<n;i++) {
+    nbytes+=put_varint(p+nbytes,ZIGZAG_ENCODE(im[i].start-start));
+    nbytes+=put_varint(p+nbytes,ZIGZAG_ENCODE(im[i].end-im[i].start));
+    nbytes+=put_varint(p+nbytes,ZIGZAG_ENCODE(im[i].target_id-target_id));
+    nbytes+=put_varint(p+nbytes,
+		       ZIGZAG_ENCODE(im[i].target_start-target_start));
+    nbytes+=put_varint(p+nbytes,
+		       ZIGZAG_ENCODE(im[i].target_end-im[i].target_start));
+    if (im[i].sublist<0)
+      nbytes+=put_varint(p+nbytes,0);
+    else {
+      nbytes+=put_varint(p+nbytes,1+ZIGZAG_ENCODE(im[i].sublist-sublist));
+      sublist=im[i].sublist;
+    }
+    start=im[i].start;
+    target_id=im[i].target_id;
+    target_start=im[i].target_start;
+  }
+  return nbytes;
+}
+
+
+/* DECODE UP TO n RECORDS FROM p..pend.  RETURNS #RECORDS, OR -1 IF CORRUPT */
+int decode_idb_block(unsigned char *p,unsigned char *pend,
+		     IntervalMap im[],int n)
+{
+  int i,j,k;
+  unsigned long long u[6];
+  IntervalCoord start=0,target_id=0,target_start=0,sublist=0;
+  for (i=0;i<n && p<pend;i++) {
+    for (j=0;j<6;j++) {
+      if ((k=get_varint(p,pend,u+j))<0)
+	return -1;
+      p+=k;
+    }
+    im[i].start=start+ZIGZAG_DECODE(u[0]);
+    im[i].end=im[i].start+ZIGZAG_DECODE(u[1]);
+    im[i].target_id=target_id+ZIGZAG_DECODE(u[2]);
+    im[i].target_start=target_start+ZIGZAG_DECODE(u[3]);
+    im[i].target_end=im[i].target_start+ZIGZAG_DECODE(u[4]);
+    if (u[5]==0)
+      im[i].sublist= -1;
+    else
+      im[i].sublist=sublist=sublist+ZIGZAG_DECODE(u[5]-1);
+    start=im[i].start;
+    target_id=im[i].target_id;
+    target_start=im[i].target_start;
+  }
+  return i;
+}
+
+
+/* CONVERT filestem.idb TO filestem.idbz + filestem.zindex, MARK THE .size
+   FILE AS COMPRESSED, AND REMOVE THE .idb FILE */
+char *compress_binary_files(char filestem[])
+{
+  int n,ntop,div,nlists,nii,compressed,nread,nbytes,iblock=0;
+  long long offset=0;
+  char path[2048];
+  FILE *ifile=NULL,*ofile=NULL,*ofile_index=NULL;
+  IntervalMap *im=NULL;
+  unsigned char *zbuf=NULL;
+  static char err_msg[1024];
+
+  if (read_size_file(filestem,err_msg,&n,&ntop,&div,&nlists,&nii,&compressed))
+    return err_msg;
+  if (compressed) /* NOTHING TO DO */
+    return NULL;
+  CALLOC(im,div,IntervalMap);
+  CALLOC(zbuf,div*IDBZ_MAX_RECORD_BYTES,unsigned char);
+  sprintf(path,"%s.idb",filestem);
+  ifile=fopen(path,"rb"); /* binary file */
+  if (!ifile)
+    goto unable_to_open_file;
+  sprintf(path,"%s.idbz",filestem);
+  ofile=fopen(path,"wb"); /* binary file */
+  if (!ofile)
+    goto unable_to_open_file;
+  sprintf(path,"%s.zindex",filestem);
+  ofile_index=fopen(path,"wb"); /* binary file */
+  if (!ofile_index)
+    goto unable_to_open_file;
+  fwrite(&iblock,sizeof(int),1,ofile_index); /* #BLOCKS, FILLED IN BELOW */
+  while ((nread=fread(im,sizeof(IntervalMap),div,ifile))>0) {
+    fwrite(&offset,sizeof(long long),1,ofile_index); /* BLOCK START */
+    nbytes=encode_idb_block(im,nread,zbuf);
+    if (nbytes!=fwrite(zbuf,1,nbytes,ofile))
+      goto write_error_occurred;
+    offset+=nbytes;
+    iblock++;
+  }
+  fwrite(&offset,sizeof(long long),1,ofile_index); /* END OF LAST BLOCK */
+  fseek(ofile_index,0,SEEK_SET);
+  fwrite(&iblock,sizeof(int),1,ofile_index);
+  fclose(ifile);
+  fclose(ofile);
+  if (fclose(ofile_index))
+    goto write_error_occurred;
+  ifile=ofile=ofile_index=NULL;
+  FREE(im);
+  FREE(zbuf);
+
+  sprintf(path,"%s.size",filestem); /* MARK AS COMPRESSED */
+  ofile=fopen(path,"w"); /* text file */
+  if (!ofile)
+    goto unable_to_open_file;
+  fprintf(ofile,"%d %d %d %d %d %d %d\n",n,ntop,div,nlists,nii,
+	  IDB_FORMAT_VERSION,1);
+  fclose(ofile);
+  sprintf(path,"%s.idb",filestem);
+  remove(path); /* THE RAW RECORDS ARE NO LONGER NEEDED */
+  return NULL; /* RETURN CODE SIGNALS SUCCESS!! */
+ unable_to_open_file:
+  sprintf(err_msg,"unable to open file %s",path);
+  goto cleanup;
+ write_error_occurred:
+  sprintf(err_msg,"error writing file %s! out of disk space?",path);
+ cleanup:
+  if (ifile)
+    fclose(ifile);
+  if (ofile)
+    fclose(ofile);
+  if (ofile_index)
+    fclose(ofile_index);
+  FREE(im);
+  FREE(zbuf);
+  return err_msg;
+ handle_malloc_failure:
+  FREE(im);
+  sprintf(err_msg,"unable to malloc %d-record compression buffer",div);
+  return err_msg;
+}
+
+
+CompressedIDBFile *open_idbz_file(char filestem[],char err_msg[],int div,
+				  int use_mmap,int ncache)
+{
+  int nblocks;
+  char path[2048];
+  long long offset;
+  PYGR_OFF_T file_size;
+  FILE *ifile=NULL;
+  CompressedIDBFile *zfile=NULL;
+
+  CALLOC(zfile,1,CompressedIDBFile);
+  sprintf(path,"%s.zindex",filestem); /* READ THE BLOCK OFFSETS */
+  ifile=fopen(path,"rb"); /* binary file */
+  if (!ifile)
+    goto unable_to_open_file;
+  if (1!=fread(&nblocks,sizeof(int),1,ifile) || nblocks<0)
+    goto fread_error_occurred;
+  zfile->nblocks=nblocks;
+  CALLOC(zfile->offset,nblocks+1,PYGR_OFF_T);
+  for (nblocks=0;nblocks<=zfile->nblocks;nblocks++) {
+    if (1!=fread(&offset,sizeof(long long),1,ifile))
+      goto fread_error_occurred;
+    zfile->offset[nblocks]=offset;
+  }
+  fclose(ifile);
+  ifile=NULL;
+
+  sprintf(path,"%s.idbz",filestem); /* OPEN THE COMPRESSED DATABASE */
+  ifile=fopen(path,"rb"); /* binary file */
+  if (!ifile)
+    goto unable_to_open_file;
+  if (use_mmap /* DECODE DIRECTLY FROM THE PAGE CACHE */
+      && (zfile->map=(unsigned char *)map_binary_file(ifile,&(zfile->map_size)))) {
+    fclose(ifile);
+    ifile=NULL;
+  }
+  else {
+    zfile->ifile=ifile;
+    zfile->zbuf_size=div*IDBZ_MAX_RECORD_BYTES;
+    CALLOC(zfile->zbuf,zfile->zbuf_size,unsigned char);
+  }
+  if (zfile->map)
+    file_size=(PYGR_OFF_T)zfile->map_size;
+  else if (PYGR_FSEEK(ifile,0,SEEK_END)!=0
+	   || (file_size=PYGR_FTELL(ifile))<0)
+    goto fread_error_occurred;
+  if (zfile->offset[0]<0 || zfile->offset[zfile->nblocks]>file_size)
+    goto bad_block_offset; /* EVERY BLOCK MUST LIE WITHIN THE .idbz */
+  for (nblocks=0;nblocks<zfile->nblocks;nblocks++)
+    if (zfile->offset[nblocks]>zfile->offset[nblocks+1])
+      goto bad_block_offset;
+  if (ncache<1)
+    ncache=1;
+  zfile->ncache=ncache;
+  CALLOC(zfile->cache,ncache,IDBBlockCache);
+  for (nblocks=0;nblocks<ncache;nblocks++)
+    zfile->cache[nblocks].iblock= -1; /* EMPTY SLOT */
+  return zfile;
+ unable_to_open_file:
+  if (err_msg)
+    sprintf(err_msg,"unable to open file %s",path);
+  free_idbz_file(zfile);
+  return NULL;
+ fread_error_occurred:
+  if (err_msg)
+    sprintf(err_msg,"error or EOF reading file %s",path);
+  if (ifile!=zfile->ifile)
+    fclose(ifile);
+  free_idbz_file(zfile);
+  return NULL;
+ bad_block_offset:
+  if (err_msg)
+    sprintf(err_msg,"%s.zindex is corrupt: its block offsets do not fit"
+	    " in the .idbz file",filestem);
+  free_idbz_file(zfile); /* CLOSES ifile IF STILL OPEN */
+  return NULL;
+ handle_malloc_failure:
+  if (err_msg)
+    sprintf(err_msg,"unable to malloc block index for %s",path);
+  if (ifile && (!zfile || ifile!=zfile->ifile))
+    fclose(ifile);
+  free_idbz_file(zfile);
+  return NULL;
+}
+
+
+int free_idbz_file(CompressedIDBFile *zfile)
+{
+  int i;
+  if (!zfile)
+    return 0;
+  if (zfile->ifile)
+    fclose(zfile->ifile);
+  unmap_binary_file(zfile->map,zfile->map_size);
+  if (zfile->cache)
+    for (i=0;i<zfile->ncache;i++)
+      FREE(zfile->cache[i].im);
+  FREE(zfile->cache);
+  FREE(zfile->offset);
+  FREE(zfile->zbuf);
+  free(zfile);
+  return 0;
+}
+
+
+/* GET DECOMPRESSED BLOCK iblock, FROM THE CACHE IF POSSIBLE.  ON A MISS,
+   THE LEAST RECENTLY USED SLOT IS REUSED.  RETURNS NULL ON ERROR, SETTING
+   zfile->err TO FIND_FILE_MALLOC_ERR OR FIND_FILE_READ_ERR */
+IntervalMap *read_idbz_block(CompressedIDBFile *zfile,int iblock,int div)
+{
+  int i;
+  size_t nbytes;
+  unsigned char *p;
+  IDBBlockCache *slot=NULL;
+
+  zfile->clock++;
+  for (i=0;i<zfile->ncache;i++) {
+    if (zfile->cache[i].iblock==iblock) { /* CACHE HIT */
+      zfile->cache[i].last_use=zfile->clock;
+      zfile->nhit++;
+      return zfile->cache[i].im;
+    }
+    if (!slot || zfile->cache[i].last_use<slot->last_use)
+      slot=zfile->cache+i; /* OLDEST SLOT SO FAR */
+  }
+  zfile->err=FIND_FILE_READ_ERR; /* UNLESS A MALLOC FAILS BELOW */
+  if (iblock<0 || iblock>=zfile->nblocks)
+    return NULL;
+  nbytes=zfile->offset[iblock+1]-zfile->offset[iblock];
+  if (zfile->map)
+    p=zfile->map+zfile->offset[iblock];
+  else {
+    if (nbytes>zfile->zbuf_size)
+      return NULL;
+    PYGR_FSEEK(zfile->ifile,zfile->offset[iblock],SEEK_SET);
+    if (nbytes!=fread(zfile->zbuf,1,nbytes,zfile->ifile))
+      return NULL;
+    p=zfile->zbuf;
+  }
+  if (!slot->im) {
+    CALLOC(slot->im,div,IntervalMap);
+  }
+  slot->iblock= -1; /* IN CASE DECODING FAILS */
+  if (decode_idb_block(p,p+nbytes,slot->im,div)<0)
+    return NULL;
+  slot->iblock=iblock;
+  slot->last_use=zfile->clock;
+  zfile->nmiss++;
+  return slot->im;
+ handle_malloc_failure:
+  zfile->err=FIND_FILE_MALLOC_ERR;
+  return NULL;
+}
+
+
+
+/* READ THE .size FILE OF AN INTERVAL DATABASE, CHECKING THAT ITS RECORD
+   LAYOUT MATCHES THE ONE THIS MODULE WAS COMPILED FOR.  FILES WITHOUT A
+   VERSION FIELD PREDATE VERSIONING, AND ALWAYS USED 32-BIT int RECORDS.
+   AN OPTIONAL 7TH FIELD FLAGS A COMPRESSED .idbz DATABASE */
+int read_size_file(char filestem[],char err_msg[],int *p_n,int *p_ntop,
+		   int *p_div,int *p_nlists,int *p_nii,int *p_compressed)
+{
+  int nread,version=1;
+  char path[2048];
   FILE *ifile=NULL;
 
   sprintf(path,"%s.size",filestem); /* READ BASIC SIZE INFO*/
@@ -830,10 +1926,41 @@ IntervalDBFile *read_binary_files(char filestem[],char err_msg[],
   if (!ifile) {
     if (err_msg)
       sprintf(err_msg,"unable to open file %s",path);
-    return NULL;
+    return -1;
   }
-  fscanf(ifile,"%d %d %d %d %d",&n,&ntop,&div,&nlists,&nii);
+  *p_compressed=0;
+  nread=fscanf(ifile,"%d %d %d %d %d %d %d",p_n,p_ntop,p_div,p_nlists,p_nii,
+	       &version,p_compressed);
   fclose(ifile);
+  if (nread<5) {
+    if (err_msg)
+      sprintf(err_msg,"error or EOF reading file %s",path);
+    return -1;
+  }
+  if (version!=IDB_FORMAT_VERSION) {
+    if (err_msg)
+      sprintf(err_msg,"%s is in .idb format version %d, but this module"
+	      " reads version %d; convert it with dump_textfile()",
+	      path,version,IDB_FORMAT_VERSION);
+    return -1;
+  }
+  return 0;
+}
+
+
+
+IntervalDBFile *read_binary_files(char filestem[],char err_msg[],
+				  int subheader_nblock,int use_mmap,int ncache)
+{
+  int n,ntop,div,nlists,nii,compressed;
+  char path[2048];
+  IntervalIndex *ii=NULL;
+  SublistHeader *subheader=NULL;
+  IntervalDBFile *idb_file=NULL;
+  FILE *ifile=NULL;
+
+  if (read_size_file(filestem,err_msg,&n,&ntop,&div,&nlists,&nii,&compressed))
+    return NULL;
 
   CALLOC(ii,nii+1,IntervalIndex);
   if (nii>0) {
@@ -858,11 +1985,18 @@ IntervalDBFile *read_binary_files(char filestem[],char err_msg[],
       return NULL;
     }
 #ifdef ON_DEMAND_SUBLIST_HEADER
-    CALLOC(subheader,subheader_nblock,SublistHeader);
-    idb_file->subheader_file.subheader=subheader;
-    idb_file->subheader_file.nblock=subheader_nblock;
-    idb_file->subheader_file.start = -subheader_nblock; /* NO BLOCK LOADED */
-    idb_file->subheader_file.ifile=ifile;
+    if (use_mmap  /* NO NEED FOR A BLOCK BUFFER OR AN OPEN FILE */
+	&& (idb_file->subheader_file.map=(SublistHeader *)
+	    map_binary_file(ifile,&(idb_file->subheader_file.map_size)))) {
+      fclose(ifile);
+    }
+    else {
+      CALLOC(subheader,subheader_nblock,SublistHeader);
+      idb_file->subheader_file.subheader=subheader;
+      idb_file->subheader_file.nblock=subheader_nblock;
+      idb_file->subheader_file.start = -subheader_nblock; /* NO BLOCK LOADED */
+      idb_file->subheader_file.ifile=ifile;
+    }
 #else
     CALLOC(subheader,nlists,SublistHeader); /* LOAD THE ENTIRE SUBHEADER */
     fread(subheader,sizeof(SublistHeader),nlists,ifile);  /*SAVE LIST */
@@ -879,14 +2013,28 @@ IntervalDBFile *read_binary_files(char filestem[],char err_msg[],
     idb_file->nii++; /* ONE EXTRA ENTRY FOR PARTIAL BLOCK */
   idb_file->ii=ii;
   idb_file->subheader=subheader;
+  if (compressed) { /* BLOCKS WILL BE DECODED FROM .idbz ON DEMAND */
+    idb_file->zfile=open_idbz_file(filestem,err_msg,div,use_mmap,ncache);
+    if (!idb_file->zfile) {
+      free_interval_dbfile(idb_file);
+      return NULL;
+    }
+    return idb_file;
+  }
   sprintf(path,"%s.idb",filestem); /* OPEN THE DATABASE */
   idb_file->ifile_idb=fopen(path,"rb"); /* binary file */
   if (!idb_file->ifile_idb) {
     if (err_msg)
       sprintf(err_msg,"unable to open file %s",path);
-    free(idb_file);
+    free_interval_dbfile(idb_file);
     return NULL;
   }
+  if (use_mmap  /* MAPPING REPLACES ALL SEEKS AND READS ON THIS FILE */
+      && (idb_file->im_map=(IntervalMap *)
+	  map_binary_file(idb_file->ifile_idb,&(idb_file->im_map_size)))) {
+    fclose(idb_file->ifile_idb);
+    idb_file->ifile_idb=NULL;
+  }
   return idb_file;
  handle_malloc_failure:
   FREE(ii); /* DUMP OUR MEMORY */
@@ -901,9 +2049,13 @@ int free_interval_dbfile(IntervalDBFile *db_file)
 {
   if (db_file->ifile_idb)
     fclose(db_file->ifile_idb);
+  unmap_binary_file(db_file->im_map,db_file->im_map_size);
+  free_idbz_file(db_file->zfile);
 #ifdef ON_DEMAND_SUBLIST_HEADER
   if (db_file->subheader_file.ifile)
     fclose(db_file->subheader_file.ifile);
+  unmap_binary_file(db_file->subheader_file.map,
+		    db_file->subheader_file.map_size);
 #endif
   FREE(db_file->ii);
   FREE(db_file->subheader);
@@ -917,20 +2069,17 @@ int free_interval_dbfile(IntervalDBFile *db_file)
 int save_text_file(char filestem[],char basestem[],
 		   char err_msg[],FILE *ofile)
 {
-  int i,n,ntop,div,nlists,nii,npad;
+  int i,n,ntop,div,nlists,nii,compressed;
+  IntervalCoord npad;
   char path[2048];
-  IntervalMap im;
+  IntervalMap im,*pim;
   IntervalIndex ii;
   SublistHeader subheader;
   FILE *ifile=NULL;
+  CompressedIDBFile *zfile=NULL;
 
-  sprintf(path,"%s.size",filestem); /* READ BASIC SIZE INFO*/
-  ifile=fopen(path,"r"); /* text file */
-  if (!ifile) 
-    goto unable_to_open_file;
-  if (5!=fscanf(ifile,"%d %d %d %d %d",&n,&ntop,&div,&nlists,&nii))
-    goto fread_error_occurred;
-  fclose(ifile);
+  if (read_size_file(filestem,err_msg,&n,&ntop,&div,&nlists,&nii,&compressed))
+    return -1;
   npad=ntop%div;
   if (npad>0) /* PAD TO AN EXACT MULTIPLE OF div */
     npad=ntop+(div-npad);
@@ -949,7 +2098,8 @@ int save_text_file(char filestem[],char basestem[],
     for (i=0;i<nii;i++) {
       if (1!=fread(&ii,sizeof(IntervalIndex),1,ifile))
 	goto fread_error_occurred;
-      if (fprintf(ofile,"I %d %d\n",ii.start,ii.end)<0)
+      if (fprintf(ofile,"I " INTERVAL_COORD_FMT " " INTERVAL_COORD_FMT "\n",
+		  ii.start,ii.end)<0)
 	goto write_error_occurred;
     }
     fclose(ifile);
@@ -963,7 +2113,8 @@ int save_text_file(char filestem[],char basestem[],
     for (i=0;i<nlists;i++) {
       if (1!=fread(&subheader,sizeof(SublistHeader),1,ifile))
 	goto fread_error_occurred;
-      if (fprintf(ofile,"S %d %d\n",subheader.start,subheader.len)<0)
+      if (fprintf(ofile,"S " INTERVAL_COORD_FMT " " INTERVAL_COORD_FMT "\n",
+		  subheader.start,subheader.len)<0)
 	goto write_error_occurred;
       npad=subheader.start+subheader.len;
     }
@@ -971,19 +2122,37 @@ int save_text_file(char filestem[],char basestem[],
   }
 
   if (npad>0) {
-    sprintf(path,"%s.idb",filestem); /* READ THE DATABASE */
-    ifile=fopen(path,"rb"); /* binary file */
-    if (!ifile) 
-      goto unable_to_open_file;
+    if (compressed) { /* DECODE EACH BLOCK JUST ONCE */
+      if (!(zfile=open_idbz_file(filestem,err_msg,div,0,1)))
+	return -1;
+      sprintf(path,"%s.idbz",filestem);
+    }
+    else {
+      sprintf(path,"%s.idb",filestem); /* READ THE DATABASE */
+      ifile=fopen(path,"rb"); /* binary file */
+      if (!ifile) 
+	goto unable_to_open_file;
+    }
     for (i=0;i<npad;i++) {
-      if (1!=fread(&im,sizeof(IntervalMap),1,ifile))
+      if (zfile) {
+	if (!(pim=read_idbz_block(zfile,i/div,div)))
+	  goto fread_error_occurred;
+	im=pim[i%div];
+      }
+      else if (1!=fread(&im,sizeof(IntervalMap),1,ifile))
 	goto fread_error_occurred;
-      if (fprintf(ofile,"M %d %d %d %d %d %d\n",im.start,im.end,
+      if (fprintf(ofile,"M " INTERVAL_COORD_FMT " " INTERVAL_COORD_FMT
+		  " " INTERVAL_COORD_FMT " " INTERVAL_COORD_FMT
+		  " " INTERVAL_COORD_FMT " " INTERVAL_COORD_FMT "\n",
+		  im.start,im.end,
 		  im.target_id,im.target_start,
 		  im.target_end,im.sublist)<0)
 	goto write_error_occurred;
     }
-    fclose(ifile);
+    if (zfile)
+      free_idbz_file(zfile);
+    else
+      fclose(ifile);
   }
   return 0; /* INDICATES NO ERROR OCCURRED */
  unable_to_open_file:
@@ -991,10 +2160,12 @@ int save_text_file(char filestem[],char basestem[],
     sprintf(err_msg,"unable to open file %s",path);
   return -1;
  fread_error_occurred:
+  free_idbz_file(zfile);
   if (err_msg)
     sprintf(err_msg,"error or EOF reading file %s",path);
   return -1;
  write_error_occurred:
+  free_idbz_file(zfile);
   if (err_msg)
     sprintf(err_msg,"error writing output file! out of disk space?");
   return -1;
@@ -1004,7 +2175,8 @@ int save_text_file(char filestem[],char basestem[],
 
 int text_file_to_binaries(FILE *infile,char buildpath[],char err_msg[])
 {
-  int i,n,ntop,div,nlists,nii,npad;
+  int i,n,ntop,div,nlists,nii;
+  IntervalCoord npad;
   char path[2048],line[32768],filestem[2048];
   IntervalMap im;
   IntervalIndex ii;
@@ -1020,7 +2192,8 @@ int text_file_to_binaries(FILE *infile,char buildpath[],char err_msg[])
   ifile=fopen(path,"w"); /* text file */
   if (!ifile) 
     goto unable_to_open_file;
-  if (fprintf(ifile,"%d %d %d %d %d\n",n,ntop,div,nlists,nii)<0)
+  if (fprintf(ifile,"%d %d %d %d %d %d\n",n,ntop,div,nlists,nii,
+	      IDB_FORMAT_VERSION)<0)
     goto write_error_occurred;
   fclose(ifile);
   npad=ntop%div;
@@ -1037,7 +2210,8 @@ int text_file_to_binaries(FILE *infile,char buildpath[],char err_msg[])
     for (i=0;i<nii;i++) {
       if (NULL==fgets(line,32767,infile))
 	goto fread_error_occurred;
-      if (2!=sscanf(line,"I %d %d",&(ii.start),&(ii.end)))
+      if (2!=sscanf(line,"I " INTERVAL_COORD_FMT " " INTERVAL_COORD_FMT,
+		    &(ii.start),&(ii.end)))
 	goto fread_error_occurred;
       if (1!=fwrite(&ii,sizeof(IntervalIndex),1,ifile))
 	goto write_error_occurred;
@@ -1053,7 +2227,8 @@ int text_file_to_binaries(FILE *infile,char buildpath[],char err_msg[])
     for (i=0;i<nlists;i++) {
       if (NULL==fgets(line,32767,infile))
 	goto fread_error_occurred;
-      if (2!=sscanf(line,"S %d %d",&(subheader.start),&(subheader.len)))
+      if (2!=sscanf(line,"S " INTERVAL_COORD_FMT " " INTERVAL_COORD_FMT,
+		    &(subheader.start),&(subheader.len)))
 	goto fread_error_occurred;
       if (1!=fwrite(&subheader,sizeof(SublistHeader),1,ifile))
 	goto write_error_occurred;
@@ -1069,7 +2244,10 @@ int text_file_to_binaries(FILE *infile,char buildpath[],char err_msg[])
   for (i=0;i<npad;i++) {
     if (NULL==fgets(line,32767,infile))
       goto fread_error_occurred;
-    if (6!=sscanf(line,"M %d %d %d %d %d %d",&(im.start),&(im.end),
+    if (6!=sscanf(line,"M " INTERVAL_COORD_FMT " " INTERVAL_COORD_FMT
+		  " " INTERVAL_COORD_FMT " " INTERVAL_COORD_FMT
+		  " " INTERVAL_COORD_FMT " " INTERVAL_COORD_FMT,
+		  &(im.start),&(im.end),
 		  &(im.target_id),&(im.target_start),
 		  &(im.target_end),&(im.sublist)))
       goto fread_error_occurred;
@@ -1095,3 +2273,216 @@ int text_file_to_binaries(FILE *infile,char buildpath[],char err_msg[])
 }
 
 
+/* GROUP-BY ENGINE FOR NLMSASlice.groupBySequences() AND split():
+   WORKS DIRECTLY ON ARRAYS OF INTERVAL BOUNDS, SO THAT PYTHON SEQUENCE
+   INTERVAL OBJECTS ONLY NEED TO BE CREATED FOR THE REPORTED GROUPS */
+
+int group_bound_qsort_cmp(const void *void_a,const void *void_b)
+{ /* ASCENDING SOURCE POSITION, stop B4 start, THEN SEQUENCE ORDER */
+  GroupBound *a=(GroupBound *)void_a,*b=(GroupBound *)void_b;
+  if (a->ipos!=b->ipos)
+    return (a->ipos<b->ipos) ? -1 : 1;
+  if (a->is_start!=b->is_start)
+    return (a->is_start<b->is_start) ? -1 : 1;
+  if (a->j!=b->j)
+    return (a->j<b->j) ? -1 : 1;
+  if (a->is_indel!=b->is_indel)
+    return (a->is_indel<b->is_indel) ? -1 : 1;
+  if (a->start!=b->start)
+    return (a->start<b->start) ? -1 : 1;
+  if (a->end!=b->end)
+    return (a->end<b->end) ? -1 : 1;
+  if (a->target_start!=b->target_start)
+    return (a->target_start<b->target_start) ? -1 : 1;
+  if (a->target_end!=b->target_end)
+    return (a->target_end<b->target_end) ? -1 : 1;
+  if (a->k!=b->k)
+    return (a->k<b->k) ? -1 : 1;
+  return 0;
+}
+
+
+int target_order_qsort_cmp(const void *void_a,const void *void_b)
+{ /* SORT IN target_id ORDER, KEEPING ORIGINAL ORDER SAVED IN sublist */
+  IntervalMap *a=(IntervalMap *)void_a,*b=(IntervalMap *)void_b;
+  if (a->target_id!=b->target_id)
+    return (a->target_id<b->target_id) ? -1 : 1;
+  if (a->sublist!=b->sublist)
+    return (a->sublist<b->sublist) ? -1 : 1;
+  return 0;
+}
+
+
+static void save_group_bounds(GroupBound *bound,int j,int k,int is_indel,
+			      IntervalMap *im)
+{ /* SAVE stop AND start BOUNDS OF ONE MERGED INTERVAL */
+  bound[0].ipos=im->end;
+  bound[0].is_start=0;
+  bound[1].ipos=im->start;
+  bound[1].is_start=1;
+  bound[0].j=bound[1].j=j;
+  bound[0].k=bound[1].k=k;
+  bound[0].is_indel=bound[1].is_indel=is_indel;
+  bound[0].start=bound[1].start=im->start;
+  bound[0].end=bound[1].end=im->end;
+  bound[0].target_start=bound[1].target_start=im->target_start;
+  bound[0].target_end=bound[1].target_end=im->target_end;
+}
+
+
+/* APPLY THE groupByIntervals() MERGE RULES TO im[], WHICH MUST GIVE THE
+   ORIGINAL ORDER OF EACH INTERVAL IN ITS sublist FIELD.  SORTS im[] BY
+   target_id, AND SAVES A stop AND start BOUND FOR EACH MERGED INTERVAL
+   IN bounds[], WHICH MUST HAVE ROOM FOR 2*n BOUNDS.  SAVES THE NUMBER
+   OF DISTINCT TARGETS IN *p_nseq, AND RETURNS THE NUMBER OF BOUNDS */
+int merge_target_bounds(IntervalMap im[],int n,IntervalCoord maxgap,
+			IntervalCoord maxinsert,IntervalCoord mininsert,
+			IntervalCoord maxsize,int merge_all,
+			GroupBound bounds[],int *p_nseq)
+{
+  int i,j= -1,k=0,nbound=0,is_indel=0;
+  IntervalMap cur;
+  IntervalCoord gap,insert;
+
+  qsort(im,n,sizeof(IntervalMap),target_order_qsort_cmp);
+  for (i=0;i<n;i++) {
+    if (i==0 || im[i].target_id!=cur.target_id) { /* FIRST IVAL OF A TARGET */
+      if (i>0) { /* SAVE LAST MERGED IVAL OF PREVIOUS TARGET */
+	save_group_bounds(bounds+nbound,j,k++,is_indel,&cur);
+	nbound+=2;
+      }
+      memcpy(&cur,im+i,sizeof(IntervalMap));
+      is_indel=0;
+      j++;
+      continue;
+    }
+    gap=im[i].start-cur.end; /* current.start - last.end */
+    insert=im[i].target_start-cur.target_end;
+    if (!merge_all && (gap>maxgap || insert>maxinsert || insert<mininsert
+		       || im[i].end-cur.start>maxsize
+		       || im[i].target_end-cur.target_start>maxsize)) {
+      save_group_bounds(bounds+nbound,j,k++,is_indel,&cur); /* SPLIT */
+      nbound+=2;
+      memcpy(&cur,im+i,sizeof(IntervalMap));
+      is_indel=1; /* NOT THE FIRST INTERVAL OF THIS TARGET */
+    }
+    else { /* MERGE: EXTEND TO THE END OF THIS INTERVAL */
+      cur.end=im[i].end;
+      cur.target_end=im[i].target_end;
+    }
+  }
+  if (n>0) { /* SAVE THE LAST MERGED IVAL */
+    save_group_bounds(bounds+nbound,j,k,is_indel,&cur);
+    nbound+=2;
+  }
+  *p_nseq=j+1;
+  return nbound;
+}
+
+
+#define SAVE_GROUP_RESULT(START,END,K,CLIP_END) \
+  if (nresult>=nalloc) { \
+    nalloc=nalloc ? 2*nalloc : 1024; \
+    REALLOC(result,nalloc,GroupResult); \
+  } \
+  result[nresult].start=(START); \
+  result[nresult].end=(END); \
+  result[nresult].k=(K); \
+  result[nresult].clip_end=(CLIP_END); \
+  nresult++;
+
+/* GENERIC groupBySequences() SWEEP OVER bounds[], SORTED WITH
+   group_bound_qsort_cmp.  EACH SEQUENCE j<nseq KEEPS A FIFO QUEUE OF ITS
+   OPEN INTERVALS k; REGIONS WHERE FEWER THAN min_aligned SEQUENCES, OR
+   LESS THAN A FRACTION p_min_aligned OF THE ngroup SEQUENCES IN THE
+   GROUP, ARE ALIGNED ARE MASKED.  REPORTS SOURCE INTERVALS (k= -1) IN
+   source_only MODE, OTHERWISE THE CLIPPED SOURCE INTERVAL OF EACH TARGET
+   INTERVAL k.  SAVES A NEWLY ALLOCATED ARRAY IN *p_result AND RETURNS ITS
+   LENGTH, OR -1 ON MEMORY ERROR */
+int group_bound_sweep(GroupBound bounds[],int nbound,int nseq,int ngroup,
+		      int source_only,int indel_cut,double min_aligned,
+		      double p_min_aligned,GroupResult **p_result)
+{
+  int i,j,k,nopen=0,has_mask=0,nresult=0,nalloc=0;
+  int *qhead=NULL,*qtail=NULL,*qnext=NULL;
+  IntervalCoord ipos,end=0,mask_start=0,*kstart=NULL;
+  GroupResult *result=NULL;
+
+  if (nseq>0) {
+    CALLOC(qhead,nseq,int);
+    CALLOC(qtail,nseq,int);
+    for (j=0;j<nseq;j++)
+      qhead[j]= -1;
+  }
+  if (nbound>0) {
+    CALLOC(qnext,nbound,int); /* k IS ALWAYS LESS THAN nbound */
+    CALLOC(kstart,nbound,IntervalCoord);
+  }
+  for (i=0;i<nbound;i++) {
+    ipos=bounds[i].ipos;
+    j=bounds[i].j;
+    k=bounds[i].k;
+    if (bounds[i].is_start) { /* PUSH ONTO THIS SEQUENCE'S QUEUE */
+      qnext[k]= -1;
+      kstart[k]=bounds[i].start;
+      if (qhead[j]<0) {
+	qhead[j]=k;
+	nopen++;
+      }
+      else
+	qnext[qtail[j]]=k;
+      qtail[j]=k;
+    }
+    else { /* INTERVAL STOP: POP THIS SEQUENCE'S QUEUE */
+      end=bounds[i].end;
+      if (has_mask && !source_only) { /* SAVE TARGET IVAL */
+	SAVE_GROUP_RESULT(mask_start>bounds[i].start ? mask_start
+			  : bounds[i].start,end,k,0);
+      }
+      if (qhead[j]>=0) {
+	qhead[j]=qnext[qhead[j]];
+	if (qhead[j]<0)
+	  nopen--;
+      }
+    }
+    if ((double)nopen<min_aligned 
+	|| (double)nopen/ngroup<p_min_aligned) { /* APPLY MASKING */
+      if (has_mask) {
+	if (source_only) { /* JUST SAVE MERGED SOURCE INTERVAL */
+	  if (mask_start<end) { /* indel_cut MAY HAVE LEFT NOTHING TO SAVE */
+	    SAVE_GROUP_RESULT(mask_start,end,-1,0);
+	  }
+	}
+	else /* REPORT OPEN TARGET IVALS WITHIN (mask_start,end) REGION */
+	  for (j=0;j<nseq;j++)
+	    if ((k=qhead[j])>=0) {
+	      SAVE_GROUP_RESULT(mask_start>kstart[k] ? mask_start
+				: kstart[k],end,k,1);
+	    }
+	has_mask=0; /* REGION NOW BELOW THRESHOLD */
+      }
+    }
+    else if (!has_mask) { /* START OF REGION ABOVE THRESHOLD */
+      mask_start=ipos;
+      has_mask=1;
+    }
+    if (has_mask && source_only && indel_cut && bounds[i].is_indel
+	&& mask_start<ipos) {
+      SAVE_GROUP_RESULT(mask_start,ipos,-1,0);
+      mask_start=ipos;
+    }
+  }
+  FREE(qhead);
+  FREE(qtail);
+  FREE(qnext);
+  FREE(kstart);
+  *p_result=result;
+  return nresult;
+ handle_malloc_failure:
+  FREE(qhead);
+  FREE(qtail);
+  FREE(qnext);
+  FREE(kstart);
+  FREE(result);
+  return -1;
+}
@@ -4,26 +4,44 @@
 #include "default.h"
 #include <limits.h>
 
+/* TYPE USED FOR COORDINATES AND FILE RECORD POSITIONS IN INTERVAL DATABASES.
+   BUILD WITH -DPYGR_INTERVAL64 TO GET 64-BIT COORDINATES, SO THAT VERY LARGE
+   GENOMES OR UNION COORDINATE SYSTEMS CAN STAY IN ONE COORDINATE SPACE.
+   THE TWO RECORD LAYOUTS ARE SAVED AS DIFFERENT .idb FORMAT VERSIONS */
+#ifdef PYGR_INTERVAL64
+typedef long long IntervalCoord;
+#define INTERVAL_COORD_MAX LLONG_MAX
+#define INTERVAL_COORD_FMT "%lld"
+#define IDB_FORMAT_VERSION 2
+#else
+typedef int IntervalCoord;
+#define INTERVAL_COORD_MAX INT_MAX
+#define INTERVAL_COORD_FMT "%d"
+#define IDB_FORMAT_VERSION 1
+#endif
+
 extern int C_int_max;
+extern IntervalCoord C_coord_max;
+extern int C_idb_format_version;
 
 typedef struct {
-  int start;
-  int end;
-  int target_id;
-  int target_start;
-  int target_end;
-  int sublist;
+  IntervalCoord start;
+  IntervalCoord end;
+  IntervalCoord target_id;
+  IntervalCoord target_start;
+  IntervalCoord target_end;
+  IntervalCoord sublist;
 } IntervalMap;
 
 
 typedef struct {
-  int start;
-  int end;
+  IntervalCoord start;
+  IntervalCoord end;
 } IntervalIndex;
 
 typedef struct {
-  int start;
-  int len;
+  IntervalCoord start;
+  IntervalCoord len;
 } SublistHeader;
 
 typedef struct {
@@ -39,8 +57,32 @@ typedef struct { /* FOR REAL-TIME DISK ACCESS TO SUBLIST HEADER FILE*/
   int nblock;
   int start;
   FILE *ifile;
+  SublistHeader *map; /* NON-NULL IF FILE IS MEMORY-MAPPED */
+  size_t map_size;
 } SubheaderFile;
 
+typedef struct { /* ONE SLOT OF THE DECOMPRESSED BLOCK CACHE */
+  int iblock; /* .idb BLOCK HELD IN THIS SLOT, OR -1 IF EMPTY */
+  unsigned long last_use; /* LRU CLOCK VALUE OF LAST ACCESS */
+  IntervalMap *im; /* THE DECOMPRESSED RECORDS, div OF THEM */
+} IDBBlockCache;
+
+typedef struct { /* FOR ACCESS TO A COMPRESSED .idbz FILE */
+  FILE *ifile;
+  unsigned char *map; /* NON-NULL IF FILE IS MEMORY-MAPPED */
+  size_t map_size;
+  PYGR_OFF_T *offset; /* FILE OFFSET OF EACH BLOCK, PLUS ONE FOR END OF FILE */
+  int nblocks;
+  unsigned char *zbuf; /* READ BUFFER FOR ONE COMPRESSED BLOCK */
+  size_t zbuf_size;
+  IDBBlockCache *cache;
+  int ncache;
+  unsigned long clock;
+  long long nhit; /* CACHE STATISTICS */
+  long long nmiss;
+  int err; /* WHY THE LAST read_idbz_block FAILED: MALLOC OR READ ERROR */
+} CompressedIDBFile;
+
 typedef struct {
   int n;
   int ntop;
@@ -51,20 +93,55 @@ typedef struct {
   SublistHeader *subheader;
   SubheaderFile subheader_file;
   FILE *ifile_idb;
+  IntervalMap *im_map; /* NON-NULL IF .idb FILE IS MEMORY-MAPPED */
+  size_t im_map_size;
+  CompressedIDBFile *zfile; /* NON-NULL IF STORED AS COMPRESSED .idbz */
 } IntervalDBFile;
 
 typedef struct IntervalIterator_S {
   int i;
   int n;
   int nii;
-  int ntop;
+  IntervalCoord ntop;
   int i_div;
+  int im_mapped; /* im POINTS INTO A MEMORY-MAPPED FILE: DON'T FREE IT */
   IntervalMap *im;
   struct IntervalIterator_S *up;
   struct IntervalIterator_S *down;
 } IntervalIterator;
 
 
+typedef struct { /* INTERVAL TAGGED WITH THE LIST IT BELONGS TO */
+  IntervalMap im;
+  IntervalCoord list; /* -1 FOR THE TOP LEVEL LIST, OTHERWISE SUBLIST ID */
+} ListedInterval;
+
+typedef struct { /* ONE SORTED RUN BEING READ BY THE K-WAY MERGE */
+  FILE *ifile;
+  char *buf;
+  int n; /* #RECORDS IN buf */
+  int i; /* CURRENT RECORD IN buf */
+} ExternalSortRun;
+
+typedef struct { /* ONE END OF AN ALIGNED INTERVAL, FOR GROUP-BY SWEEPS */
+  IntervalCoord ipos; /* SOURCE POSITION OF THIS BOUND */
+  int is_start;
+  int j; /* INDEX OF ITS SEQUENCE IN THE GROUP */
+  int is_indel; /* NOT THE FIRST INTERVAL OF ITS SEQUENCE */
+  int k; /* INDEX OF ITS INTERVAL */
+  IntervalCoord start; /* THE INTERVAL ITSELF */
+  IntervalCoord end;
+  IntervalCoord target_start;
+  IntervalCoord target_end;
+} GroupBound;
+
+typedef struct { /* ONE SOURCE INTERVAL REPORTED BY A GROUP-BY SWEEP */
+  IntervalCoord start;
+  IntervalCoord end;
+  int k; /* INDEX OF ITS TARGET INTERVAL, OR -1 IN source_only MODE */
+  int clip_end; /* TRUE IF MASKING CUT THE TARGET INTERVAL AT end */
+} GroupResult;
+
 typedef struct {
   FILE *ifile;
   int left;
@@ -74,7 +151,10 @@ typedef struct {
 } FilePtrRecord;
 
 extern int imstart_qsort_cmp(const void *void_a,const void *void_b);
+extern int imslice_qsort_cmp(const void *void_a,const void *void_b);
 extern int target_qsort_cmp(const void *void_a,const void *void_b);
+extern int group_bound_qsort_cmp(const void *void_a,const void *void_b);
+extern int target_order_qsort_cmp(const void *void_a,const void *void_b);
 extern IntervalMap *read_intervals(int n,FILE *ifile);
 extern SublistHeader *build_nested_list(IntervalMap im[],int n,
 					int *p_n,int *p_nlists);
@@ -85,22 +165,53 @@ extern IntervalDB *build_interval_db(IntervalMap im[],int n);
 extern IntervalIterator *interval_iterator_alloc(void);
 extern int free_interval_iterator(IntervalIterator *it);
 extern IntervalIterator *reset_interval_iterator(IntervalIterator *it);
-extern int find_intervals(IntervalIterator *it0,int start,int end,IntervalMap im[],int n,SublistHeader subheader[],int nlists,IntervalMap buf[],int nbuf,int *p_nreturn,IntervalIterator **it_return);
+extern int find_intervals(IntervalIterator *it0,IntervalCoord start,IntervalCoord end,IntervalMap im[],int n,SublistHeader subheader[],int nlists,IntervalMap buf[],int nbuf,int *p_nreturn,IntervalIterator **it_return);
 extern int read_imdiv(FILE *ifile,IntervalMap imdiv[],int div,int i_div,int ntop);
 extern IntervalMap *read_sublist(FILE *ifile,SublistHeader *subheader,IntervalMap *im);
-extern int find_file_intervals(IntervalIterator *it0,int start,int end,
-			       IntervalIndex ii[],int nii,
-			       SublistHeader subheader[],int nlists,
-			       SubheaderFile *subheader_file,
-			       int ntop,int div,FILE *ifile,
+extern int read_idb_records(IntervalDBFile *db_file,IntervalIterator *it,
+			    PYGR_OFF_T ipos,int n);
+extern int read_idb_block(IntervalDBFile *db_file,IntervalIterator *it,
+			  int i_div,IntervalCoord ntop);
+extern SublistHeader *get_subheader(IntervalDBFile *db_file,int isub);
+extern int copy_idb_records(IntervalDBFile *db_file,PYGR_OFF_T ipos,int n,
+			    IntervalMap buf[]);
+extern int scan_idb_records(IntervalDBFile *db_file,int *p_isub,
+			    IntervalCoord *p_i,IntervalMap buf[],int nbuf);
+extern int idb_file_is_threadsafe(IntervalDBFile *db_file);
+extern int find_file_intervals(IntervalIterator *it0,
+			       IntervalCoord start,IntervalCoord end,
+			       IntervalDBFile *db_file,
 			       IntervalMap buf[],int nbuf,
 			       int *p_nreturn,IntervalIterator **it_return);
 extern int write_padded_binary(IntervalMap im[],int n,int div,FILE *ifile);
 extern char *write_binary_files(IntervalMap im[],int n,int ntop,int div,
 				SublistHeader *subheader,int nlists,char filestem[]);
+extern char *build_binary_files_external(char buildfile[],int n,int div,
+					 char filestem[],long long max_memory);
+extern char *sort_binary_records(char buildfile[],char sortfile[],long long n,
+				 long long max_memory);
+extern int read_size_file(char filestem[],char err_msg[],int *p_n,int *p_ntop,
+			  int *p_div,int *p_nlists,int *p_nii,int *p_compressed);
 extern IntervalDBFile *read_binary_files(char filestem[],char err_msg[],
-					 int subheader_nblock);
+					 int subheader_nblock,int use_mmap,
+					 int ncache);
+extern IntervalMap *read_idbz_block(CompressedIDBFile *zfile,int iblock,
+				    int div);
+extern char *compress_binary_files(char filestem[]);
+extern int merge_target_bounds(IntervalMap im[],int n,IntervalCoord maxgap,
+			       IntervalCoord maxinsert,IntervalCoord mininsert,
+			       IntervalCoord maxsize,int merge_all,
+			       GroupBound bounds[],int *p_nseq);
+extern int group_bound_sweep(GroupBound bounds[],int nbound,int nseq,
+			     int ngroup,int source_only,int indel_cut,
+			     double min_aligned,double p_min_aligned,
+			     GroupResult **p_result);
+extern CompressedIDBFile *open_idbz_file(char filestem[],char err_msg[],int div,
+					 int use_mmap,int ncache);
+extern int free_idbz_file(CompressedIDBFile *zfile);
 extern int free_interval_dbfile(IntervalDBFile *db_file);
+extern void *map_binary_file(FILE *ifile,size_t *p_size);
+extern void unmap_binary_file(void *p,size_t size);
 
 extern int save_text_file(char filestem[],char err_msg[],
 			  char basestem[],FILE *ofile);
@@ -108,18 +219,25 @@ extern int text_file_to_binaries(FILE *infile,char buildpath[],char err_msg[]);
 extern void reorient_intervals(int n,IntervalMap im[],int ori_sign);
 
 #define FIND_FILE_MALLOC_ERR -2
+#define FIND_FILE_READ_ERR -3 /* SHORT READ OR UNDECODABLE .idbz BLOCK */
+#define FIND_FILE_ERROR(N) ((N)==FIND_FILE_MALLOC_ERR || (N)==FIND_FILE_READ_ERR)
+#define IDBZ_DEFAULT_CACHE 64 /* #DECOMPRESSED BLOCKS CACHED PER DATABASE */
+#define IDBZ_MAX_RECORD_BYTES 60 /* 6 FIELDS, <=10 VARINT BYTES EACH */
+#define EXTSORT_MAX_FANIN 128 /* MAX #RUNS MERGED IN ONE PASS */
+#define EXTSORT_MIN_RECORDS 16 /* SMALLEST SORTED RUN WE BOTHER WITH */
+#define EXTSORT_RECORD(RUN,RECSIZE) ((RUN)->buf+(size_t)(RUN)->i*(RECSIZE))
 
 #define ITERATOR_STACK_TOP(it) while (it->up) it=it->up;
 #define FREE_ITERATOR_STACK(it,it2,it_next) \
   for (it2=it->down;it2;it2=it_next) { \
     it_next=it2->down; \
-    if (it2->im) \
+    if (it2->im && !it2->im_mapped) \
       free(it2->im); \
     free(it2); \
   } \
   for (it2=it;it2;it2=it_next) { \
     it_next=it2->up; \
-    if (it2->im) \
+    if (it2->im && !it2->im_mapped) \
       free(it2->im); \
     free(it2); \
   }
@@ -1,5 +1,8 @@
+import bisect
 import os
+import struct
 import types
+import zlib
 import classutil
 import logger
 from UserDict import DictMixin
@@ -104,6 +107,15 @@ class EmptySlice:
     def rawIvals(self):
         return []
 
+    def intervalArray(self):
+        from cnestedlist import interval_map_array
+        return interval_map_array(None, 0, 0)
+
+    seqBoundsArray = intervalArray
+
+    def matchIntervalArray(self, seq=None):
+        return self.intervalArray()
+
 
 class _NLMSASeqDict_ValueWrapper(object):
     """A wrapper class for NLMSASeqDict to use to store 3-tuples in its cache.
@@ -127,6 +139,295 @@ class _NLMSASeqDict_ValueWrapper(object):
         return self.v[n]
 
 _DEFAULT_SEQUENCE_CACHE_SIZE=100
+# Packed .seqIndex file: a header, then one (nlmsaID, nsID, offset) record
+# per sequence ordered by seqID, then the sorted nlmsaIDs, then the record
+# number for each of those, then the sorted seqIDs separated by newlines.
+# All integers are little-endian 64-bit.
+_SEQ_INDEX_HEADER = struct.Struct('<16sq') # MAGIC STRING, #SEQUENCES
+_SEQ_INDEX_MAGIC = 'NLMSASeqIndex01\n'
+_SEQ_INDEX_RECORD = struct.Struct('<qqq')
+
+
+def seq_index_data(items):
+    '''return a packed sequence index as a string, from an iterable of
+    (seqID, (nlmsaID, nsID, offset)) items, e.g. seqIDdict.iteritems()'''
+    items = [(str(seqID), t) for seqID, t in items]
+    items.sort()
+    n = len(items)
+    ids = [(t[0], i) for i, (seqID, t) in enumerate(items)]
+    ids.sort()
+    return ''.join([_SEQ_INDEX_HEADER.pack(_SEQ_INDEX_MAGIC, n),
+                    ''.join([_SEQ_INDEX_RECORD.pack(*t) for seqID, t in items]),
+                    struct.pack('<%dq' % n, *[t[0] for t in ids]),
+                    struct.pack('<%dq' % n, *[t[1] for t in ids]),
+                    '\n'.join([seqID for seqID, t in items])])
+
+
+def write_seq_index(filename, items):
+    '''write a packed sequence index to filename, from an iterable of
+    (seqID, (nlmsaID, nsID, offset)) items, e.g. seqIDdict.iteritems()'''
+    data = seq_index_data(items)
+    ofile = file(filename, 'wb')
+    try:
+        ofile.write(data)
+    finally:
+        ofile.close()
+
+
+def pack_seq_index(pathstem):
+    '''write the packed pathstem.seqIndex for an on-disk NLMSA from its
+    .seqIDdict shelve index.  NLMSA opens it instead of the shelve indexes
+    when reading the alignment.'''
+    seqIDdict = classutil.open_shelve(pathstem + '.seqIDdict', 'r')
+    try:
+        write_seq_index(pathstem + '.seqIndex', seqIDdict.iteritems())
+    finally:
+        seqIDdict.close()
+
+
+class PackedSeqIndex(object):
+    '''read-only packed sequence index written by write_seq_index().
+    The sorted seqID and nlmsaID tables are read in bulk when it is
+    opened, for O(log n) binary search with bisect; the records are read
+    from the memory-mapped file as needed.  Alternatively, data can be a
+    string that holds the packed index from position offset to its end.'''
+
+    def __init__(self, filename, data=None, offset=0):
+        if data is None:
+            import mmap
+            ifile = file(filename, 'rb')
+            try:
+                data = mmap.mmap(ifile.fileno(), 0, access=mmap.ACCESS_READ)
+            finally:
+                ifile.close()
+            self.isMapped = True
+        else:
+            self.isMapped = False
+        self.data = data
+        self.offset = offset
+        magic, self.n = _SEQ_INDEX_HEADER.unpack_from(self.data, offset)
+        if magic != _SEQ_INDEX_MAGIC:
+            self.close()
+            raise IOError('%s is not a packed sequence index' % filename)
+        pos = offset + _SEQ_INDEX_HEADER.size + self.n * _SEQ_INDEX_RECORD.size
+        self.nlmsaIDs = struct.unpack_from('<%dq' % self.n, self.data, pos)
+        self.recnoStart = pos + 8 * self.n
+        if self.n > 0:
+            self.seqIDs = self.data[self.recnoStart + 8 * self.n:].split('\n')
+        else:
+            self.seqIDs = []
+
+    def record(self, i):
+        'return (seqID, nlmsaID, nsID, offset) for record i'
+        return (self.seqIDs[i], ) + _SEQ_INDEX_RECORD.unpack_from(
+            self.data, self.offset + _SEQ_INDEX_HEADER.size
+            + i * _SEQ_INDEX_RECORD.size)
+
+    def find_seqID(self, seqID):
+        'return (seqID, nlmsaID, nsID, offset) for seqID, or raise KeyError'
+        i = bisect.bisect_left(self.seqIDs, seqID)
+        if i < self.n and self.seqIDs[i] == seqID:
+            return self.record(i)
+        raise KeyError(seqID)
+
+    def find_nlmsaID(self, nlmsaID):
+        'return (seqID, nlmsaID, nsID, offset) for nlmsaID, or raise KeyError'
+        i = bisect.bisect_left(self.nlmsaIDs, nlmsaID)
+        if i < self.n and self.nlmsaIDs[i] == nlmsaID:
+            return self.record(struct.unpack_from('<q', self.data,
+                                                  self.recnoStart + 8 * i)[0])
+        raise KeyError(nlmsaID)
+
+    def close(self):
+        if self.data is not None:
+            if self.isMapped:
+                self.data.close()
+            self.data = None
+
+
+class PackedSeqIDDict(object):
+    'seqID --> (nlmsaID, nsID, offset) mapping from a PackedSeqIndex'
+
+    def __init__(self, index):
+        self.index = index
+
+    def __getitem__(self, seqID):
+        return self.index.find_seqID(str(seqID))[1:]
+
+    def __contains__(self, seqID):
+        try:
+            self[seqID]
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self):
+        return self.index.n
+
+    def __iter__(self):
+        for i in xrange(self.index.n):
+            yield self.index.record(i)[0]
+
+    def iteritems(self):
+        for i in xrange(self.index.n):
+            t = self.index.record(i)
+            yield t[0], t[1:]
+
+    def close(self):
+        self.index.close()
+
+
+class PackedIDDict(PackedSeqIDDict):
+    'str(nlmsaID) --> (seqID, nsID) mapping from a PackedSeqIndex'
+
+    def __getitem__(self, k):
+        try:
+            nlmsaID = int(k)
+        except ValueError:
+            raise KeyError(k)
+        seqID, nlmsaID, nsID, offset = self.index.find_nlmsaID(nlmsaID)
+        return seqID, nsID
+
+    def __iter__(self):
+        for seqID, t in self.iteritems():
+            yield str(t[0])
+
+
+# NLMSA .manifest file: a header, then one (is_union, length) record per
+# NLMSASequence in id order, then their names separated by newlines, then
+# a packed sequence index (see seq_index_data()).  The header holds the
+# saved NLMSA attributes, with a bit in its mask for each one present, and
+# the CRC32 of everything after the header.  All integers are little-endian.
+_MANIFEST_HEADER = struct.Struct('<16sIIqqqqq') # MAGIC, CRC32, ATTR MASK,
+                        # #NLMSASequences, NAMES SIZE, ATTR VALUES...
+_MANIFEST_MAGIC = 'NLMSAManifest01\n'
+_MANIFEST_RECORD = struct.Struct('<qq')
+_MANIFEST_ATTRS = ('is_bidirectional', 'pairwiseMode', 'inlmsa')
+
+
+def write_manifest(pathstem, sequences, attrs, seqItems):
+    '''write pathstem.manifest, from a list of (name, is_union, length)
+    for each NLMSASequence in id order, a dict of NLMSA attributes, and
+    an iterable of (seqID, (nlmsaID, nsID, offset)) items'''
+    names = '\n'.join([t[0] for t in sequences])
+    body = ''.join([''.join([_MANIFEST_RECORD.pack(int(is_union), length)
+                             for name, is_union, length in sequences]),
+                    names, seq_index_data(seqItems)])
+    mask = 0
+    values = []
+    for i, k in enumerate(_MANIFEST_ATTRS):
+        if k in attrs:
+            mask = mask | (1 << i)
+            values.append(int(attrs[k]))
+        else:
+            values.append(0)
+    ofile = file(pathstem + '.manifest', 'wb')
+    try:
+        ofile.write(_MANIFEST_HEADER.pack(_MANIFEST_MAGIC,
+                                          zlib.crc32(body) & 0xffffffff, mask,
+                                          len(sequences), len(names), *values))
+        ofile.write(body)
+    finally:
+        ofile.close()
+
+
+class NLMSAManifest(object):
+    '''an NLMSA .manifest file, read with a single read call.  Its
+    sequences attribute lists (name, is_union, length) for each
+    NLMSASequence, attrs is a dict of the saved NLMSA attributes, and
+    seqIndex is a PackedSeqIndex of its sequence IDs.'''
+
+    def __init__(self, filename):
+        ifile = file(filename, 'rb')
+        try:
+            data = ifile.read()
+        finally:
+            ifile.close()
+        if len(data) < _MANIFEST_HEADER.size:
+            raise IOError('%s is truncated' % filename)
+        t = _MANIFEST_HEADER.unpack_from(data)
+        magic, crc, mask, nseq, namesSize = t[:5]
+        if magic != _MANIFEST_MAGIC:
+            raise IOError('%s is not an NLMSA manifest' % filename)
+        pos = _MANIFEST_HEADER.size
+        if zlib.crc32(buffer(data, pos)) & 0xffffffff != crc:
+            raise IOError('%s is corrupted (bad checksum)' % filename)
+        self.attrs = {}
+        for i, k in enumerate(_MANIFEST_ATTRS):
+            if mask & (1 << i):
+                self.attrs[k] = t[5 + i]
+        records = struct.unpack_from('<%dq' % (2 * nseq), data, pos)
+        pos = pos + nseq * _MANIFEST_RECORD.size
+        if nseq > 0:
+            names = data[pos:pos + namesSize].split('\n')
+        else:
+            names = []
+        self.sequences = [(names[i], records[2 * i], records[2 * i + 1])
+                          for i in xrange(nseq)]
+        self.seqIndex = PackedSeqIndex(filename, data, pos + namesSize)
+
+
+def read_manifest(pathstem):
+    '''return the NLMSAManifest of an on-disk NLMSA, or None if it has
+    no readable .manifest file'''
+    filename = pathstem + '.manifest'
+    if not os.path.exists(filename):
+        return None
+    try:
+        return NLMSAManifest(filename)
+    except (IOError, struct.error), e:
+        logger.warn('%s; using the other index files instead' % e)
+        return None
+
+
+def read_nlmsa_index(pathstem):
+    '''return a list of (name, is_union, length) for each NLMSASequence,
+    from the text .NLMSAindex file of an on-disk NLMSA'''
+    try:
+        ifile = file(pathstem + '.NLMSAindex', 'rU') # text file
+    except IOError:
+        ifile = file(pathstem + 'NLMSAindex', 'rU') # BACKWARDS COMPATIBILITY
+    try:
+        sequences = []
+        for line in ifile:
+            id, name, is_union, length = line.strip().split('\t')
+            if int(id) != len(sequences):
+                raise IOError('corrupted NLMSAIndex???')
+            sequences.append((name, int(is_union), int(length)))
+    finally:
+        ifile.close()
+    return sequences
+
+
+def read_attr_dict(pathstem):
+    '''return the pickled .attrDict of an on-disk NLMSA, or an empty
+    dict if it has none (old NLMSAs)'''
+    import pickle
+    try:
+        ifile = file(pathstem + '.attrDict', 'rb') # pickle is binary file!
+    except IOError:
+        return {}
+    try:
+        return pickle.load(ifile)
+    finally:
+        ifile.close()
+
+
+def save_manifest(pathstem):
+    '''write the .manifest file of an existing on-disk NLMSA from its
+    other index files, so that opening it for reading needs only the
+    manifest and the seqDict'''
+    if os.path.exists(pathstem + '.seqIndex'):
+        seqIDdict = PackedSeqIDDict(PackedSeqIndex(pathstem + '.seqIndex'))
+    else:
+        seqIDdict = classutil.open_shelve(pathstem + '.seqIDdict', 'r')
+    try:
+        write_manifest(pathstem, read_nlmsa_index(pathstem),
+                       read_attr_dict(pathstem), seqIDdict.iteritems())
+    finally:
+        seqIDdict.close()
+
+
 class NLMSASeqDict(object, DictMixin):
     """Index sequences by pathForward, and use list to keep reverse mapping.
 
@@ -136,7 +437,8 @@ class NLMSASeqDict(object, DictMixin):
     """
 
     def __init__(self, nlmsa, filename, mode, idDictClass=None,
-                 maxSequenceCacheSize=_DEFAULT_SEQUENCE_CACHE_SIZE):
+                 maxSequenceCacheSize=_DEFAULT_SEQUENCE_CACHE_SIZE,
+                 seqIndex=None):
         self._cache = classutil.RecentValueDictionary(maxSequenceCacheSize)
         self.seqlist = NLMSASeqList(self)
         self.nlmsa = nlmsa
@@ -145,10 +447,10 @@ class NLMSASeqDict(object, DictMixin):
             idDictClass = dict
         elif mode == 'w': # new database
             mode = 'n'
+        elif mode == 'a': # add to existing database
+            mode = 'w'
         if idDictClass is None: # use persistent id dictionary storage
-            self.seqIDdict = classutil.open_shelve(filename + '.seqIDdict',
-                                                   mode)
-            self.IDdict = classutil.open_shelve(filename + '.idDict', mode)
+            self.open_index(mode, seqIndex)
         else: # user supplied class for id dictionary storage
             self.seqIDdict = idDictClass()
             self.IDdict = idDictClass()
@@ -167,6 +469,10 @@ class NLMSASeqDict(object, DictMixin):
         self.seqIDdict[id] = nlmsaID, nsID, offset
         self.IDdict[str(nlmsaID)] = id, nsID
 
+    def maxID(self):
+        'return the largest nlmsaID in this index, or -1 if empty'
+        return max([int(k) for k in self.IDdict] + [-1])
+
     def getIDcoords(self, seq):
         'return nlmsaID,start,stop for a given seq ival.'
         nlmsaID = self.getID(seq)
@@ -227,13 +533,31 @@ class NLMSASeqDict(object, DictMixin):
         do_close() # close both shelve objects
         self.IDdict.close()
 
-    def reopenReadOnly(self, mode='r'):
-        'save existing data and reopen in read-only mode'
-        self.close()
+    def open_index(self, mode, seqIndex=None):
+        '''open our persistent id dictionaries; in mode 'r' use seqIndex
+        (e.g. from the NLMSA manifest) or the packed .seqIndex file if
+        there is one, instead of the shelve files'''
+        if mode == 'r' and (seqIndex is not None or
+                            os.path.exists(self.filename + '.seqIndex')):
+            if seqIndex is not None:
+                index = seqIndex
+            else:
+                index = PackedSeqIndex(self.filename + '.seqIndex')
+            self.seqIDdict = PackedSeqIDDict(index)
+            self.IDdict = PackedIDDict(index)
+            return
         self.seqIDdict = classutil.open_shelve(self.filename + '.seqIDdict',
                                                mode)
         self.IDdict = classutil.open_shelve(self.filename + '.idDict', mode)
 
+    def reopenReadOnly(self, mode='r', packIndex=False):
+        '''save existing data and reopen in read-only mode.  packIndex=True
+        writes a packed .seqIndex file, which is also updated if it exists'''
+        self.close()
+        if packIndex or os.path.exists(self.filename + '.seqIndex'):
+            pack_seq_index(self.filename)
+        self.open_index(mode)
+
     def getUnionSlice(self, seq):
         'get union coords for this seq interval, adding seq to index if needed'
         try:
@@ -402,6 +726,68 @@ def prune_self_mappings(src_prefix, dest_prefix, is_bidirectional):
         return 1
 
 
+def is_gzip_file(path):
+    'True if path is a gzip (or bgzip) compressed file'
+    ifile = file(path, 'rb')
+    try:
+        return ifile.read(2) == '\x1f\x8b'
+    finally:
+        ifile.close()
+
+
+def open_alignment_file(f):
+    '''return (name, stream) for reading the alignment file f, which may be
+    the path of a plain, gzip or bgzip file, or a file-like object with a
+    readline() method.  stream is None for a plain file path, which the
+    parsers read directly with C stdio.'''
+    if not isinstance(f, types.StringTypes): # ALREADY A FILE-LIKE OBJECT
+        return getattr(f, 'name', None), f
+    if is_gzip_file(f): # DECOMPRESS AS WE READ IT
+        import gzip
+        return f, gzip.GzipFile(f, 'rb')
+    return f, None
+
+
+def next_maf_block(ifile, pos):
+    '''return the file offset of the first MAF alignment block ("a" line)
+    starting at or after pos, or the file size if there is none'''
+    ifile.seek(pos - 1)
+    ifile.readline() # SKIP TO THE START OF THE NEXT LINE
+    while True:
+        offset = ifile.tell()
+        line = ifile.readline()
+        if not line or (line[0] == 'a' and line[1:2].isspace()):
+            return offset
+
+
+def split_maf_files(mafFiles, nchunks):
+    '''split mafFiles into about nchunks (filename, start, end) byte ranges
+    of similar size, each starting at an alignment block, so that they
+    can be parsed independently.  A compressed file is one chunk.'''
+    sizes = [os.path.getsize(filename) for filename in mafFiles]
+    chunkSize = max(1, sum(sizes) / nchunks)
+    chunks = []
+    for filename, size in zip(mafFiles, sizes):
+        if is_gzip_file(filename): # CAN'T SEEK INTO IT
+            chunks.append((filename, 0, size))
+            continue
+        ifile = file(filename, 'rb')
+        try:
+            start = 0
+            pos = chunkSize
+            while pos < size:
+                end = next_maf_block(ifile, pos)
+                if end >= size:
+                    break
+                chunks.append((filename, start, end))
+                start = end
+                pos = max(pos + chunkSize, end + 1)
+            chunks.append((filename, start, size))
+        finally:
+            ifile.close()
+    return chunks
+
+
 def nlmsa_textdump_unpickler(filepath, kwargs):
     from cnestedlist import textfile_to_binaries, NLMSA
     logger.info('Saving NLMSA indexes from textdump: %s' % filepath)
@@ -450,6 +836,88 @@ def generate_nlmsa_edges(self, *args, **kwargs):
             yield results
 
 
+def scan_index_files(filestem, sort=True, blockSize=65536, useMmap=False,
+                     maxMemory=64000000):
+    """iterate over all intervals in the on-disk nested list database
+    filestem, plus its delta of appended intervals if any, as numpy record
+    arrays of up to blockSize intervals read with large sequential reads.
+    If sort is true, they are yielded in order of their source coordinates:
+    if they take more than maxMemory bytes they are first sorted on disk,
+    in a temporary directory, in runs of about maxMemory bytes (see
+    cnestedlist.sort_index_files()), otherwise they are sorted in memory.
+    Otherwise they are yielded in on-disk order, holding only one block in
+    memory."""
+    import numpy
+    from cnestedlist import IntervalFileDB, interval_map_dtype, \
+         sort_index_files
+    stems = [filestem]
+    if os.path.exists(filestem + '.delta.size'): # HAS APPENDED INTERVALS
+        stems.append(filestem + '.delta')
+    if not sort:
+        for stem in stems:
+            db = IntervalFileDB(stem, useMmap=useMmap)
+            try:
+                for a in db.scan(blockSize):
+                    yield a
+            finally:
+                db.close()
+        return
+    n = 0
+    for stem in stems:
+        db = IntervalFileDB(stem)
+        try:
+            n += len(db)
+        finally:
+            db.close()
+    if n == 0:
+        return
+    dtype = interval_map_dtype()
+    if n * dtype.itemsize > maxMemory: # TOO BIG: SORT ON DISK
+        import shutil
+        import tempfile
+        tmpdir = tempfile.mkdtemp(prefix='pygr-scan')
+        try:
+            sortpath = os.path.join(tmpdir, 'sorted')
+            sort_index_files(stems, sortpath, maxMemory, useMmap)
+            ifile = file(sortpath, 'rb')
+            try:
+                while True:
+                    a = numpy.fromfile(ifile, dtype, blockSize)
+                    if len(a) == 0:
+                        break
+                    yield a
+            finally:
+                ifile.close()
+        finally:
+            shutil.rmtree(tmpdir)
+        return
+    arrays = []
+    for stem in stems:
+        db = IntervalFileDB(stem, useMmap=useMmap)
+        try:
+            if len(db) > 0: # READ THE WHOLE DATABASE IN ONE BLOCK
+                arrays.extend(db.scan(len(db)))
+        finally:
+            db.close()
+    a = numpy.concatenate(arrays)
+    del arrays
+    start = numpy.where(a['start'] < 0, -a['end'], a['start']) # POSITIVE ORI
+    end = numpy.where(a['start'] < 0, -a['start'], a['end'])
+    a = a[numpy.lexsort((-end, start))] # SAME ORDER AS THE ON-DISK SORT
+    for i in xrange(0, len(a), blockSize):
+        yield a[i:i + blockSize]
+
+
+def generate_nlmsa_scan(self, sort=True, blockSize=65536,
+                        maxMemory=64000000):
+    """iterate over the intervals of every sequence index of an on-disk
+    NLMSA as (ns, ivals) pairs; see scan_index_files()"""
+    for ns in self.seqlist:
+        for ivals in scan_index_files(ns.filestem, sort, blockSize,
+                                      self.useMmap, maxMemory):
+            yield ns, ivals
+
+
 def get_interval(seq, start, end, ori):
     "trivial function to get the interval seq[start:end] with requested ori"
     if ori < 0:
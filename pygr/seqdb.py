@@ -65,7 +65,9 @@ The seqLenDict interface
 ------------------------
 
 The seqLenDict attribute is specific to a SequenceFileDB, where it
-provides a file-backed storage of length and offset sequence metadata.
+provides a file-backed storage of length and offset sequence metadata
+(a seqfmt.SeqLenIndex on the '.seqidx' file, or a shelve on the
+'.seqlen' file of databases built by older versions of pygr).
 It is used to implement a key optimization in SequenceFileDB, in which
 a sequence's offset within a file is used to read only the required
 part of the sequence into memory.  This optimization is particularly
@@ -142,6 +144,8 @@ Some long term issues:
 from __future__ import generators
 import sys
 import os
+import bisect
+import threading
 import UserDict
 import weakref
 
@@ -177,6 +181,241 @@ class _SequenceDBInverse(object):
             return False
 
 
+class SequenceSliceCache(object):
+    """Cache of sequence strings for intervals that owner objects expect
+    to be accessed, as requested by SequenceDB.cacheHint().
+
+    Each distinct hinted interval is indexed separately (identical
+    hints from different owners share one), sorted by start together
+    with the running maximum of their stops, so finding one that
+    contains a requested slice is a binary search plus a backward scan
+    over just the intervals that could still reach the slice's stop.
+    Overlapping hints are never merged, so a cached string is no longer
+    than the hint it was read for.  An interval's sequence string is
+    read from its database the first time a slice within it is
+    requested; the least recently used strings are discarded to keep
+    their total size within maxBytes.  An interval is dropped once
+    every owner that hinted it has been garbage-collected.  hits,
+    misses and loads count cache lookups and string reads.
+
+    """
+    # link fields of a cached interval
+    _START, _STOP, _OWNERS, _SEQ, _PREV, _NEXT = range(6)
+
+    def __init__(self, maxBytes=16000000):
+        self.maxBytes = maxBytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.seqDict = {} # seqID --> ([starts], [maxStops], [intervals])
+        self.owners = {} # id(owner) --> (weakref to owner, [hints])
+        self.dead = [] # weakrefs of garbage-collected owners
+        self.head = [None] * 6 # sentinel of doubly-linked LRU list
+        self.head[self._PREV] = self.head[self._NEXT] = self.head
+        self.lock = threading.Lock()
+
+    def add_hints(self, owner, hints):
+        """Save list of (seqID, start, stop) hints for owner, replacing
+        any it saved before."""
+        self.lock.acquire()
+        try:
+            self._drop_dead()
+            try:
+                ref, oldHints = self.owners.pop(id(owner))
+            except KeyError:
+                pass
+            else:
+                self._release(ref, oldHints)
+            ref = weakref.KeyedRef(owner, self._owner_died, id(owner))
+            self.owners[id(owner)] = (ref, hints)
+            for seqID, start, stop in hints:
+                self._add(ref, seqID, start, stop)
+        finally:
+            self.lock.release()
+
+    def _owner_died(self, ref):
+        # just queue it: this may run in the middle of any of our
+        # methods, so its hints are released by the next one called
+        self.dead.append(ref)
+
+    def _drop_dead(self):
+        'release the hints of garbage-collected owners; call with lock held'
+        while self.dead:
+            ref = self.dead.pop()
+            t = self.owners.get(ref.key)
+            if t is not None and t[0] is ref: # not replaced by a new owner
+                del self.owners[ref.key]
+                self._release(ref, t[1])
+
+    def _locate(self, seqID, start, stop):
+        'return index of the interval hinted as seqID[start:stop], or -1'
+        starts, maxStops, ivals = self.seqDict[seqID]
+        i = bisect.bisect_left(starts, start)
+        while i < len(ivals) and ivals[i][self._START] == start:
+            if ivals[i][self._STOP] == stop:
+                return i
+            i += 1
+        return -1
+
+    def _add(self, ref, seqID, start, stop):
+        'add interval hinted by ref to our index'
+        starts, maxStops, ivals = self.seqDict.setdefault(seqID, ([], [], []))
+        i = self._locate(seqID, start, stop)
+        if i >= 0: # another owner hinted the same interval
+            ivals[i][self._OWNERS].append(ref)
+            return
+        i = bisect.bisect_right(starts, start)
+        starts.insert(i, start)
+        maxStops.insert(i, stop)
+        ivals.insert(i, [start, stop, [ref], None, None, None])
+        if i > 0 and maxStops[i - 1] > stop:
+            maxStops[i] = maxStops[i - 1]
+        for j in range(i + 1, len(maxStops)): # raise the running maximum
+            if maxStops[j] >= stop:
+                break
+            maxStops[j] = stop
+
+    def _find(self, seqID, start, stop):
+        """return an interval containing seqID[start:stop], or None;
+        prefers one already cached, then one small enough to cache"""
+        try:
+            starts, maxStops, ivals = self.seqDict[seqID]
+        except KeyError:
+            return None
+        found = None
+        i = bisect.bisect_right(starts, start) - 1
+        while i >= 0 and maxStops[i] >= stop: # ivals[:i+1] may contain it
+            ival = ivals[i]
+            if stop <= ival[self._STOP]:
+                if ival[self._SEQ] is not None:
+                    return ival
+                if found is None or (found[self._STOP] - found[self._START]
+                                     > self.maxBytes):
+                    found = ival
+            i -= 1
+        return found
+
+    def _release(self, ref, hints):
+        'remove ref as an owner of each of its hints; call with lock held'
+        for seqID, start, stop in hints:
+            try:
+                i = self._locate(seqID, start, stop)
+            except KeyError:
+                continue
+            if i < 0:
+                continue
+            starts, maxStops, ivals = self.seqDict[seqID]
+            ival = ivals[i]
+            refs = ival[self._OWNERS]
+            for j in range(len(refs)):
+                if refs[j] is ref:
+                    del refs[j]
+                    break
+            if not refs: # no owner left, so drop it
+                del starts[i]
+                del maxStops[i]
+                del ivals[i]
+                if not ivals:
+                    del self.seqDict[seqID]
+                else:
+                    self._update_max_stops(maxStops, ivals, i)
+                self._discard(ival)
+                ival[self._OWNERS] = None
+
+    def _update_max_stops(self, maxStops, ivals, i):
+        'recompute the running maximum of the stops from ivals[i] on'
+        for j in range(i, len(ivals)):
+            stop = ivals[j][self._STOP]
+            if j > 0 and maxStops[j - 1] > stop:
+                stop = maxStops[j - 1]
+            maxStops[j] = stop
+
+    def get(self, seq, start, stop):
+        """Return string of seq[start:stop] from the cache, reading the
+        hinted interval that contains it if needed, or raise IndexError
+        if no hint contains it."""
+        self.lock.acquire()
+        try:
+            self._drop_dead()
+            ival = self._find(seq.id, start, stop)
+            if ival is None:
+                self.misses += 1
+                raise IndexError('interval not found in cache')
+            ivalStart, ivalStop = ival[self._START], ival[self._STOP]
+            if ivalStop - ivalStart > self.maxBytes: # too big to cache
+                self.misses += 1
+                ival = None
+            else:
+                self.hits += 1
+                s = ival[self._SEQ]
+                if s is not None: # move to most recently used
+                    self._unlink(ival)
+                    self._append(ival)
+                    return s[start - ivalStart:stop - ivalStart]
+                refs = list(ival[self._OWNERS])
+        finally:
+            self.lock.release()
+        if ival is None:
+            return seq.strslice(start, stop, useCache=False)
+        # read it without holding our lock
+        s = seq.strslice(ivalStart, ivalStop, useCache=False)
+        for ref in refs: # does owner want to reference this cached seq?
+            try:
+                save_f = ref().cache_reference
+            except AttributeError: # no (or owner is gone)
+                continue
+            save_f(seq) # let owner control caching in our _weakValueDict
+        self.lock.acquire()
+        try:
+            self.loads += 1
+            if ival[self._OWNERS] and ival[self._SEQ] is None: # still ours
+                ival[self._SEQ] = s
+                self._append(ival)
+                self.nbytes += len(s)
+                while self.nbytes > self.maxBytes: # drop least recently used
+                    self._discard(self.head[self._NEXT])
+        finally:
+            self.lock.release()
+        return s[start - ivalStart:stop - ivalStart]
+
+    def _append(self, ival):
+        last = self.head[self._PREV]
+        ival[self._PREV] = last
+        ival[self._NEXT] = self.head
+        last[self._NEXT] = ival
+        self.head[self._PREV] = ival
+
+    def _unlink(self, ival):
+        ival[self._PREV][self._NEXT] = ival[self._NEXT]
+        ival[self._NEXT][self._PREV] = ival[self._PREV]
+
+    def _discard(self, ival):
+        'discard the cached string of ival, if any'
+        if ival[self._SEQ] is not None:
+            self._unlink(ival)
+            self.nbytes -= len(ival[self._SEQ])
+            ival[self._SEQ] = None
+
+    def clear(self):
+        'discard all cached strings, but keep the hints'
+        self.lock.acquire()
+        try:
+            while self.head[self._NEXT] is not self.head:
+                self._discard(self.head[self._NEXT])
+        finally:
+            self.lock.release()
+
+    def __len__(self):
+        'number of distinct cached intervals'
+        self.lock.acquire()
+        try:
+            self._drop_dead()
+            return sum([len(t[2]) for t in self.seqDict.values()])
+        finally:
+            self.lock.release()
+
+
 class SequenceDB(object, UserDict.DictMixin):
     """Base class for sequence databases.
 
@@ -188,7 +427,9 @@ class SequenceDB(object, UserDict.DictMixin):
         use autoGC=0 to turn this off.
       - cacheHint() system for caching a given set of sequence
         intervals associated with an owner object, which are flushed
-        from cache if the owner object is garbage-collected.
+        from cache if the owner object is garbage-collected.  The cached
+        strings are limited to maxCacheBytes in total (see the
+        sliceCache attribute, a SequenceSliceCache).
 
     For subclassing, note that self.seqInfoDict must be set before
     SequenceDB.__init__ is called!
@@ -207,13 +448,15 @@ class SequenceDB(object, UserDict.DictMixin):
     # define ~ (invert) operator to return a lazily-created _SequenceDBInverse
     __invert__ = classutil.lazy_create_invert(_SequenceDBInverse)
 
-    def __init__(self, autoGC=True, dbname=None, **kwargs):
+    def __init__(self, autoGC=True, dbname=None, maxCacheBytes=16000000,
+                 **kwargs):
         """Initialize seq db from filepath or ifile."""
         if autoGC: # automatically garbage collect unused objects
             self._weakValueDict = classutil.RecentValueDictionary(autoGC)
         else:
             self._weakValueDict = {}    # object cache @CTB not tested
         self.autoGC = autoGC
+        self.sliceCache = SequenceSliceCache(maxCacheBytes)
 
         # override itemClass and itemSliceClass if specified
         self.itemClass = kwargs.get('itemClass', self.itemClass)
@@ -252,49 +495,29 @@ class SequenceDB(object, UserDict.DictMixin):
     def cacheHint(self, ivalDict, owner):
         """Save a cache hint dict: {id: (start, stop)}.
 
-        @CTB document!
+        Slices of these intervals are then read from self.sliceCache,
+        which keeps them until owner is garbage-collected.
         """
-        d={}
-        # @CTB refactor, test
-        # Build the cache dictionary for owner.
+        hints = []
         for id, ival in ivalDict.items():
             if ival[0] < 0: # FORCE IVAL INTO POSITIVE ORIENTATION
                 ival=(-ival[1], -ival[0])        # @CTB untested
             if ival[1]-ival[0] > self._cache_max: # TRUNCATE EXCESSIVE LENGTH
                 ival=(ival[0], ival[0] + self._cache_max) # @CTB untested
-            d[id]=[ival[0], ival[1]]
+            hints.append((id, ival[0], ival[1]))
         try:
-            self._cache[owner] = d # ADD TO EXISTING CACHE
-        except AttributeError:
-            self._cache = weakref.WeakKeyDictionary()  # AUTOMATICALLY REMOVE
-            self._cache[owner] = d # FROM CACHE IF owner GOES OUT OF SCOPE
+            sliceCache = self.sliceCache
+        except AttributeError: # subclass did not call SequenceDB.__init__
+            sliceCache = self.sliceCache = SequenceSliceCache()
+        sliceCache.add_hints(owner, hints)
 
     def strsliceCache(self, seq, start, stop):
         """Get strslice using cache hints, if any available."""
         try:
-            cacheDict=self._cache
+            sliceCache = self.sliceCache
         except AttributeError:
             raise IndexError('no cache present')
-        for owner, d in cacheDict.items():
-            try:
-                ival = d[seq.id]
-            except KeyError:
-                continue # NOT IN THIS CACHE, SO SKIP  @CTB untested
-            ival_start, ival_stop = ival[:2]
-            if start >= ival_start and stop <= ival_stop: # CONTAINED IN ival
-                try:
-                    s = ival[2] # get seq string from our cache
-                except IndexError: # use strslice() to retrieve from storage
-                    s = seq.strslice(ival_start, ival_stop, useCache=False)
-                    ival.append(s)
-                    try: # does owner want to reference this cached seq?
-                        save_f = owner.cache_reference
-                    except AttributeError:
-                        pass # no, so nothing to do
-                    else: # let owner control caching in our _weakValueDict
-                        save_f(seq)     # # @CTB untested
-                return s[start - ival_start:stop - ival_start]
-        raise IndexError('interval not found in cache') # @CTB untested
+        return sliceCache.get(seq, start, stop)
 
     # these methods should all be implemented on all SequenceDBs.
     def close(self):
@@ -336,6 +559,10 @@ class SequenceDB(object, UserDict.DictMixin):
     def clear_cache(self):
         """Empty the cache."""
         self._weakValueDict.clear()
+        try:
+            self.sliceCache.clear()
+        except AttributeError:
+            pass
 
     # these methods should not be implemented for read-only database.
     clear = setdefault = pop = popitem = copy = update = \
@@ -394,10 +621,13 @@ class FileDBSequence(SequenceBase):
 class SequenceFileDB(SequenceDB):
     """Main class for file-based storage of a sequence database.
 
-    By default, SequenceFileDB uses a seqLenDict, a.k.a. a shelve
-    index of sequence lengths and offsets, to retrieve sequence slices
-    with fseek.  Thus entire chromosomes (for example) do not have to
-    be loaded to retrieve a subslice.
+    By default, SequenceFileDB uses a seqLenDict, a.k.a. an index of
+    sequence lengths and offsets, to retrieve sequence slices with
+    fseek.  This is a memory-mapped binary .seqidx file (see
+    seqfmt.SeqLenIndex), or the shelve .seqlen file of a database built
+    by older versions of pygr, if that is all there is.  Thus entire
+    chromosomes (for example) do not have to be loaded to retrieve a
+    subslice.
 
     Takes one required argument, 'filepath', which should be the name
     of a FASTA file (or a file whose format is understood by your
@@ -407,23 +637,57 @@ class SequenceFileDB(SequenceDB):
     The SequenceFileDB seqInfoDict interface is a wrapper around the
     seqLenDict created by the __init__ function.
 
+    If 'useMmap' is True, the .pureseq file is memory-mapped and strslice
+    slices the mapped file instead of calling seek() and read(), so many
+    threads can read sequence slices at once.
+
+    If 'twoBit' is True, nucleotide sequences are stored 4 bases per
+    byte in a memory-mapped UCSC-format .2bit file (with tables of N and
+    lowercase runs), whose own index serves as the seqLenDict.
+
+    The sequence file may be gzip-compressed.  If 'nthreads' > 1, a new
+    (uncompressed) FASTA file is indexed by up to that many threads.
+
     """
     itemClass = FileDBSequence
+    twoBit = False
 
     # copy _pickleAttrs and add 'filepath'
     _pickleAttrs = SequenceDB._pickleAttrs.copy()
     _pickleAttrs['filepath'] = 0
+    _pickleAttrs['twoBit'] = 0
+    _pickleAttrs['useMmap'] = 0
 
-    def __init__(self, filepath, reader=None, **kwargs):
+    def __init__(self, filepath, reader=None, useMmap=False, twoBit=False,
+                 nthreads=1, **kwargs):
         # make filepath a pickleable attribute.
         self.filepath = classutil.SourceFileName(str(filepath))
-
-        fullpath = self.filepath + '.seqlen'
-        # build the seqLenDict if it doesn't already exist
-        try:
-            seqLenDict = classutil.open_shelve(fullpath, 'r')
-        except NoSuchFileError:
-            seqLenDict = self._create_seqLenDict(fullpath, filepath, reader)
+        self.useMmap = useMmap
+        self._pureseqLock = threading.Lock() # serializes seek() + read()
+
+        if twoBit: # the .2bit file indexes itself; always memory-mapped
+            self.twoBit = self.useMmap = True
+            if not os.path.exists(self.filepath + '.2bit'):
+                logger.debug('Building .2bit sequence file...')
+                _store_seqlen_dict({}, filepath, reader, twoBit=True)
+            seqLenDict = _TwoBitSeqLenDict(
+                seqfmt.read_2bit_index(self._map_pureseq()))
+        else:
+            seqLenDict = None
+            fullpath = self.filepath + '.seqidx'
+            if os.path.exists(fullpath):
+                try:
+                    seqLenDict = seqfmt.SeqLenIndex(fullpath)
+                except IOError, e:
+                    logger.warn('ignoring bad sequence length index: %s'
+                                % e)
+            if seqLenDict is None: # fall back to an older .seqlen shelve
+                try:
+                    seqLenDict = classutil.open_shelve(self.filepath
+                                                       + '.seqlen', 'r')
+                except NoSuchFileError: # build the seqLenDict
+                    seqLenDict = self._create_seqLenDict(fullpath, filepath,
+                                                         reader, nthreads)
 
         self.seqLenDict = seqLenDict
         self.seqInfoDict = _SeqLenDictWrapper(self) # standard interface
@@ -433,7 +697,7 @@ class SequenceFileDB(SequenceDB):
         SequenceDB.__init__(self, filepath=filepath, dbname=dbname, **kwargs)
 
     def close(self):
-        '''close our open shelve index file and _pureseq...'''
+        '''close our open index file and _pureseq...'''
         self.seqLenDict.close()
         try:
             do_close = self._pureseq.close
@@ -441,24 +705,46 @@ class SequenceFileDB(SequenceDB):
             pass # _pureseq not open yet, so nothing to do
         else:
             do_close()
+        # buffers from strslice(asBuffer=True) may still use our mmap, so
+        # it is unmapped when they are all gone; None marks us closed
+        self._pureseqMap = None
 
     def __repr__(self):
         return "<%s '%s'>" % (self.__class__.__name__, self.filepath)
 
-    def _create_seqLenDict(self, dictpath, seqpath, reader=None):
+    def _create_seqLenDict(self, dictpath, seqpath, reader=None, nthreads=1):
         """Create a seqLenDict from 'seqpath' and store in 'dictpath'."""
-        seqLenDict = classutil.open_shelve(dictpath, 'n')
-        try:
-            logger.debug('Building sequence length index...')
-            _store_seqlen_dict(seqLenDict, seqpath, reader)
-        finally:
-            seqLenDict.close() # close after writing, no matter what!
-        return classutil.open_shelve(dictpath, 'r') # re-open read-only
-
-    def strslice(self, seqID, start, end, useCache=True):
-        """Access slice of a sequence efficiently, using seqLenDict info."""
+        seqLenDict = {}
+        logger.debug('Building sequence length index...')
+        _store_seqlen_dict(seqLenDict, seqpath, reader, nthreads=nthreads)
+        seqfmt.write_seqlen_index(dictpath, seqLenDict) # only if it worked
+        return seqfmt.SeqLenIndex(dictpath) # re-open read-only
+
+    def strslice(self, seqID, start, end, useCache=True, asBuffer=False):
+        """Access slice of a sequence efficiently, using seqLenDict info.
+
+        asBuffer=True returns a read-only buffer object instead of a
+        string; with useMmap=True, it refers to the mapped file directly
+        without copying the sequence data."""
         # Retrieve sequence from the .pureseq file based on seqLenDict
         # information.
+        offset = self.seqLenDict[seqID][1]
+        if self.useMmap:
+            try:
+                data = self._pureseqMap
+            except AttributeError:
+                data = self._map_pureseq()
+            if data is None:
+                raise ValueError('I/O operation on closed SequenceFileDB')
+            if self.twoBit: # decode just [start:end] of its record
+                s = seqfmt.twobit_slice(data, offset, start, end)
+                if asBuffer:
+                    return buffer(s)
+                return s
+            if asBuffer:
+                return buffer(data, offset + start, max(end - start, 0))
+            return data[offset + start:offset + end]
+
         try:
             ifile=self._pureseq
         except AttributeError:
@@ -466,10 +752,34 @@ class SequenceFileDB(SequenceDB):
             ifile = file(fullpath, 'rb')
             self._pureseq = ifile
 
-        # Now, read in the actual slice.
-        offset = self.seqLenDict[seqID][1]
-        ifile.seek(offset + start)
-        return ifile.read(end - start)
+        # Now, read in the actual slice.  read() releases the GIL, so
+        # another thread could move the shared file position under us.
+        self._pureseqLock.acquire()
+        try:
+            ifile.seek(offset + start)
+            s = ifile.read(end - start)
+        finally:
+            self._pureseqLock.release()
+        if asBuffer:
+            return buffer(s)
+        return s
+
+    def _map_pureseq(self):
+        """Memory-map our .pureseq (or .2bit) file read-only."""
+        import mmap
+        if self.twoBit:
+            ifile = file(self.filepath + '.2bit', 'rb')
+        else:
+            ifile = file(self.filepath + '.pureseq', 'rb')
+        try:
+            if os.fstat(ifile.fileno()).st_size > 0:
+                data = mmap.mmap(ifile.fileno(), 0, access=mmap.ACCESS_READ)
+            else: # mmap cannot map an empty file
+                data = ''
+        finally:
+            ifile.close()
+        self._pureseqMap = data
+        return data
 
 
 # Some support classes for the SeqLenDict mechanism.
@@ -523,7 +833,7 @@ class BasicSeqInfoDict(object, UserDict.DictMixin):
 class _SeqLenDictWrapper(BasicSeqInfoDict):
     """
     The default storage mechanism for sequences implemented by FileDBSequence
-    and SequenceFileDB puts everything in seqLenDict, a shelve index of
+    and SequenceFileDB puts everything in seqLenDict, an on-disk index of
     lengths and offsets.  This class wraps that dictionary to provide the
     interface that SequenceDB expects to see.
 
@@ -531,6 +841,13 @@ class _SeqLenDictWrapper(BasicSeqInfoDict):
     itemClass = _SeqLenObject
 
 
+class _TwoBitSeqLenDict(dict):
+    """seqLenDict of a .2bit file: seqID --> (length, record offset)."""
+
+    def close(self):
+        pass # nothing to close
+
+
 class _SeqLenDictSaver(object):
     """Support for generic reading functions, called by _store_seqlen_dict.
 
@@ -543,15 +860,27 @@ class _SeqLenDictSaver(object):
     and return a list of sequence info objects with 'id', 'length',
     and 'sequence' attributes for each sequence in the given
     file/filename.  _SeqLenDictSaver will then construct a '.pureseq'
-    file containing the concatenated sequences and fill in the
-    seqLenDict appropriately.
+    file containing the concatenated sequences (or a '.2bit' file, if
+    twoBit is True) and fill in the seqLenDict appropriately.
 
     """
 
-    def __init__(self, reader):
+    def __init__(self, reader, twoBit=False):
         self.reader = reader
+        self.twoBit = twoBit
 
     def __call__(self, d, ifile, filename):
+        if self.twoBit:
+            writer = seqfmt.TwoBitWriter(filename + '.2bit')
+            for o in self.reader(ifile, filename):
+                if o.length != len(o.sequence):
+                    raise ValueError('length does not match sequence: %s,%d'
+                                     % (o.id, o.length))
+                writer.begin(o.id)
+                writer.write(o.sequence)
+            for seqID, length, offset in writer.close():
+                d[seqID] = length, offset
+            return
         offset = 0L
         pureseq_fp = file(filename + '.pureseq', 'wb')
         try:
@@ -567,7 +896,21 @@ class _SeqLenDictSaver(object):
             pureseq_fp.close()
 
 
-def _store_seqlen_dict(d, filename, reader=None, mode='rU'):
+def _open_seqfile(filename, mode='rU'):
+    """Open a sequence file for reading, decompressing it if gzipped."""
+    ifile = file(filename, 'rb')
+    try:
+        magic = ifile.read(2)
+    finally:
+        ifile.close()
+    if magic == '\x1f\x8b': # gzip format
+        import gzip
+        return gzip.GzipFile(filename, 'rb')
+    return file(filename, mode)
+
+
+def _store_seqlen_dict(d, filename, reader=None, mode='rU', twoBit=False,
+                       nthreads=1):
     """Store sequence lengths in a dictionary, e.g. a seqLenDict.
 
     Used by SequenceFileDB._create_seqLenDict.
@@ -578,15 +921,22 @@ def _store_seqlen_dict(d, filename, reader=None, mode='rU'):
     information on building a custom 'reader', and see the seqdb docs
     for an example.
 
-    """
-    # if a custom reader function was passed in, run that.
-    builder = seqfmt.read_fasta_lengths
-    if reader is not None:
-        builder = _SeqLenDictSaver(reader)
+    twoBit=True stores the sequences in a '.2bit' file instead of a
+    '.pureseq' file, using seqfmt.read_fasta_2bit for FASTA files.
 
-    ifile = file(filename, mode)
-    try:
-        builder(d, ifile, filename) # run the builder on our sequence set
+    A gzip-compressed file is decompressed as it is read.  nthreads > 1
+    lets seqfmt.read_fasta_lengths split an uncompressed file between
+    that many threads.
+
+    """
+    ifile = _open_seqfile(filename, mode)
+    try: # run the builder on our sequence set
+        if reader is not None: # a custom reader function was passed in
+            _SeqLenDictSaver(reader, twoBit)(d, ifile, filename)
+        elif twoBit:
+            seqfmt.read_fasta_2bit(d, ifile, filename)
+        else:
+            seqfmt.read_fasta_lengths(d, ifile, filename, nthreads)
     finally:
         ifile.close()
 
@@ -2,13 +2,17 @@
 cdef extern from "stdio.h":
     ctypedef struct FILE:
         pass
+    ctypedef int size_t
     FILE *fopen(char *, char *)
     FILE *fdopen(int, char *)
-    int fclose(FILE *)
+    int fclose(FILE *) nogil
+    int ferror(FILE *) nogil
     int sscanf(char *str, char *fmt, ...)
     int sprintf(char *str, char *fmt, ...)
     char *fgets(char *str, int size, FILE *ifile)
     int fputc(int, FILE *)
+    size_t fread(void *ptr, size_t size, size_t n, FILE *ifile) nogil
+    size_t fwrite(void *ptr, size_t size, size_t n, FILE *ifile) nogil
 
 cdef extern from "ctype.h":
     int isspace(int)
@@ -16,44 +20,954 @@ cdef extern from "ctype.h":
 
 cdef extern from "string.h":
     char *strcpy(char *, char *)
+    int memcmp(void *s1, void *s2, size_t n)
+    void *memcpy(void *dst, void *src, size_t len) nogil
+    void *memset(void *b, int c, size_t len) nogil
+    void *memchr(void *s, int c, size_t n) nogil
 
+cdef extern from "stdlib.h":
+    void *malloc(size_t) nogil
+    void free(void *) nogil
+    void *realloc(void *, size_t) nogil
 
-def read_fasta_lengths(d, pyfile, filename):
-    'read seq lengths from python file object, save into dictionary d'
-    cdef int i
-    cdef long long seqLength, ipos, offset # MUST USE 64-BIT INT!!!
-    cdef char tmp[32768], fastastart[4], *p
-    cdef FILE *ifile, *ifile2
+cdef extern from "Python.h":
+    # except -1 MAKES EVERY CALL CHECK ITS RESULT, SO A NON-BUFFER ARGUMENT
+    # RAISES TypeError INSTEAD OF LEAVING buffer UNSET
+    int PyObject_AsReadBuffer(object obj, void **buffer,
+                              Py_ssize_t *buffer_len) except -1
+    object PyString_FromStringAndSize(char *s, Py_ssize_t len)
+    char *PyString_AS_STRING(object s)
+    FILE *PyFile_AsFile(object f)
+    void PyFile_IncUseCount(object f)
+    void PyFile_DecUseCount(object f)
 
-    ifile = fdopen(pyfile.fileno(), 'r') # get FILE * from python file object
-    if ifile == NULL:
-        raise IOError('unable to open %s' % filename)
+
+cdef char fasta_keep[256] # 1 FOR LETTERS SAVED TO .pureseq, 0 FOR OTHERS
+cdef int i_fasta_keep
+for i_fasta_keep from 0 <= i_fasta_keep < 256: # isprint() AND NOT isspace()
+    fasta_keep[i_fasta_keep] = 32 < i_fasta_keep and i_fasta_keep < 127
+
+cdef enum:
+    FASTA_BLOCK_SIZE = 1048576 # BYTES READ / WRITTEN AT A TIME
+
+
+cdef class FastaIndexer:
+    '''Parse FASTA text, writing the letters of its sequences to the
+    file outfile and recording each sequence's ID, length and offset in
+    outfile.  Call read() (as many times as you like) to parse text from
+    a python file object, then close(), which returns a list of
+    (seqID, length, offset) for each non-empty sequence.  Text is parsed
+    in blocks, and from a real python file object, it is read and parsed
+    without holding the GIL, so several FastaIndexers can run at once in
+    separate threads.'''
+    cdef FILE *ofile
+    cdef char *inbuf, *outbuf, *hdr, *names
+    cdef long long *recs # (nameStart, nameSize, length, offset) PER HEADER
+    cdef Py_ssize_t nout, nhdr, hdrmax, nnames, namesmax, nrec, recmax
+    cdef int atLineStart, inHeader, hasHeader
+    cdef long long seqLength, offset
+    cdef readonly long long ipos # BYTES WRITTEN TO outfile SO FAR
+    cdef object outfile, seqs
+    cdef public object error # EXCEPTION INFO FROM run()
+
+    def __init__(self, outfile):
+        self.outfile = outfile
+        self.seqs = []
+        self.atLineStart = 1
+        self.inbuf = <char *>malloc(FASTA_BLOCK_SIZE)
+        self.outbuf = <char *>malloc(FASTA_BLOCK_SIZE)
+        if self.inbuf == NULL or self.outbuf == NULL:
+            raise MemoryError
+        self.ofile = fopen(outfile, 'wb')
+        if self.ofile == NULL:
+            raise IOError('unable to create %s' % outfile)
+
+    cdef int flush_output(self) nogil:
+        if self.nout > 0:
+            if fwrite(self.outbuf, 1, self.nout, self.ofile) != self.nout:
+                return -2
+            self.nout = 0
+        return 0
+
+    cdef int add_letters(self, char *p, Py_ssize_t n) nogil:
+        cdef Py_ssize_t i, k
+        cdef char *out
+        while n > 0:
+            if self.nout == FASTA_BLOCK_SIZE:
+                if self.flush_output() < 0:
+                    return -2
+            k = FASTA_BLOCK_SIZE - self.nout
+            if k > n:
+                k = n
+            out = self.outbuf + self.nout
+            for i from 0 <= i < k: # COPY, SKIPPING SPACE & CONTROL CHARS
+                out[0] = p[i]
+                out = out + fasta_keep[<unsigned char>p[i]]
+            i = out - (self.outbuf + self.nout) # #LETTERS SAVED
+            self.nout = self.nout + i
+            self.seqLength = self.seqLength + i
+            self.ipos = self.ipos + i
+            p = p + k
+            n = n - k
+        return 0
+
+    cdef int add_header(self, char *p, Py_ssize_t n) nogil:
+        cdef char *hdr
+        if self.nhdr + n > self.hdrmax:
+            hdr = <char *>realloc(self.hdr, 2 * (self.nhdr + n))
+            if hdr == NULL:
+                return -1
+            self.hdr = hdr
+            self.hdrmax = 2 * (self.nhdr + n)
+        memcpy(self.hdr + self.nhdr, p, n)
+        self.nhdr = self.nhdr + n
+        return 0
+
+    cdef int end_seq(self) nogil:
+        'record the header, length and offset of the current sequence'
+        cdef char *names
+        cdef long long *recs
+        if not self.hasHeader:
+            return 0
+        if self.nnames + self.nhdr > self.namesmax:
+            names = <char *>realloc(self.names, 2 * (self.nnames + self.nhdr))
+            if names == NULL:
+                return -1
+            self.names = names
+            self.namesmax = 2 * (self.nnames + self.nhdr)
+        if self.nrec >= self.recmax:
+            recs = <long long *>realloc(self.recs, sizeof(long long) * 4
+                                        * (2 * self.recmax + 64))
+            if recs == NULL:
+                return -1
+            self.recs = recs
+            self.recmax = 2 * self.recmax + 64
+        memcpy(self.names + self.nnames, self.hdr, self.nhdr)
+        recs = self.recs + 4 * self.nrec
+        recs[0] = self.nnames
+        recs[1] = self.nhdr
+        recs[2] = self.seqLength
+        recs[3] = self.offset
+        self.nnames = self.nnames + self.nhdr
+        self.nrec = self.nrec + 1
+        self.hasHeader = 0
+        return 0
+
+    cdef int parse(self, char *p, Py_ssize_t n) nogil:
+        '''parse the next n bytes of FASTA text; return -1 (no memory) or -2
+        (write error) on failure'''
+        cdef char *end, *nl, *q
+        cdef int err
+        end = p + n
+        while p < end:
+            if self.atLineStart and p[0] == c'>': # NEW SEQUENCE
+                err = self.end_seq()
+                if err < 0:
+                    return err
+                self.inHeader = 1
+                self.nhdr = 0
+                p = p + 1
+            nl = <char *>memchr(p, c'\n', end - p) # FIND END OF THIS LINE
+            if nl == NULL:
+                q = end
+            else:
+                q = nl
+            if self.inHeader:
+                err = self.add_header(p, q - p)
+            else:
+                err = self.add_letters(p, q - p)
+            if err < 0:
+                return err
+            if nl == NULL: # LINE CONTINUES IN THE NEXT BLOCK
+                self.atLineStart = 0
+                return 0
+            if self.inHeader: # HEADER DONE, ITS SEQUENCE STARTS HERE
+                self.inHeader = 0
+                self.hasHeader = 1
+                self.offset = self.ipos
+                self.seqLength = 0
+            self.atLineStart = 1
+            p = nl + 1
+        return 0
+
+    cdef int check(self, int err) except -1:
+        'raise an exception for a parse() error, and save finished seqs'
+        cdef Py_ssize_t i
+        cdef long long *recs
+        if err == -1:
+            raise MemoryError
+        elif err < 0:
+            raise IOError('error writing %s' % self.outfile)
+        for i from 0 <= i < self.nrec:
+            recs = self.recs + 4 * i
+            seqID = PyString_FromStringAndSize(self.names + recs[0],
+                                               recs[1]).split()[0]
+            if recs[2] > 0: # IGNORE EMPTY SEQUENCES
+                self.seqs.append((seqID, recs[2], recs[3]))
+        self.nrec = 0
+        self.nnames = 0
+        return 0
+
+    def read(self, pyfile, long long size=-1):
+        'parse size bytes (or all, if size < 0) of python file object pyfile'
+        cdef FILE *ifile
+        cdef Py_ssize_t n, want
+        cdef int err
+        if self.ofile == NULL:
+            raise ValueError('FastaIndexer is closed')
+        if not isinstance(pyfile, file): # E.G. gzip.GzipFile
+            while size != 0:
+                want = FASTA_BLOCK_SIZE
+                if size > 0 and size < want:
+                    want = size
+                s = pyfile.read(want)
+                if not s:
+                    break
+                self.check(self.parse(PyString_AS_STRING(s), len(s)))
+                if size > 0:
+                    size = size - len(s)
+            return
+        ifile = PyFile_AsFile(pyfile)
+        PyFile_IncUseCount(pyfile) # DON'T LET ANOTHER THREAD CLOSE IT
+        try:
+            while size != 0:
+                want = FASTA_BLOCK_SIZE
+                if size > 0 and size < want:
+                    want = size
+                with nogil:
+                    n = fread(self.inbuf, 1, want, ifile)
+                    err = self.parse(self.inbuf, n)
+                self.check(err)
+                if n < want: # END OF FILE, OR ERROR
+                    if ferror(ifile):
+                        raise IOError('error reading %s' % pyfile.name)
+                    break
+                if size > 0:
+                    size = size - n
+        finally:
+            PyFile_DecUseCount(pyfile)
+
+    def run(self, filename, long long start, long long size):
+        '''parse size bytes of filename from offset start, then close().
+        Exceptions are saved as self.error, for use as a thread target.'''
+        try:
+            ifile = file(filename, 'rb')
+            try:
+                ifile.seek(start)
+                self.read(ifile, size)
+            finally:
+                ifile.close()
+            self.close()
+        except:
+            import sys
+            self.error = sys.exc_info()
+
+    def close(self):
+        'finish writing outfile; return list of (seqID, length, offset)'
+        cdef int err
+        if self.ofile != NULL:
+            if self.inHeader: # FILE ENDS WITH AN UNTERMINATED HEADER LINE
+                self.inHeader = 0
+                self.hasHeader = 1
+                self.seqLength = 0
+            err = self.end_seq()
+            if err == 0:
+                err = self.flush_output()
+            if fclose(self.ofile) != 0 and err == 0:
+                err = -2
+            self.ofile = NULL
+            self.check(err)
+        return self.seqs
+
+    def __dealloc__(self):
+        if self.ofile != NULL:
+            fclose(self.ofile)
+        free(self.inbuf)
+        free(self.outbuf)
+        free(self.hdr)
+        free(self.names)
+        free(self.recs)
+
+
+def find_fasta_header(pyfile, long long pos):
+    '''return the offset of the first FASTA header line that starts at or
+    after pos in python file object pyfile (opened in binary mode), or
+    -1 if there is none'''
+    cdef long long i
+    if pos <= 0:
+        pos = 0
+        pyfile.seek(0)
+        last = '\n' # FILE START IS A LINE START
+    else:
+        pyfile.seek(pos - 1)
+        last = pyfile.read(1)
+    while True:
+        s = pyfile.read(65536)
+        if not s:
+            return -1
+        i = (last + s).find('\n>')
+        if i >= 0:
+            return pos + i
+        last = s[-1]
+        pos = pos + len(s)
+
+
+def read_fasta_lengths(d, pyfile, filename, int nthreads=1):
+    '''read seq lengths from python file object, save into dictionary d,
+    and write the sequences to filename.pureseq.  pyfile may also be any
+    object with a read() method, e.g. a gzip.GzipFile.  If nthreads > 1
+    and pyfile is a real file, the file is split at FASTA header lines
+    into up to nthreads pieces, which are parsed at the same time.'''
+    import os
     outfile = filename + '.pureseq'
-    # Save in binary mode, though shouldn't matter.
-    ifile2 = fopen(outfile, 'wb')
-    if ifile2 == NULL:
-        raise IOError('unable to create %s' % (filename + '.pureseq'))
-    id = None
-    ipos = 0
-    seqLength = 0
-    strcpy(fastastart, '>')
-    p = fgets(tmp, 32767, ifile) # read the first line of the FASTA file
-    while p:
-        if fastastart[0] == p[0]: #NEW SEQUENCE
-            if id is not None and seqLength > 0:
-                d[id] = seqLength, offset # SAVE THIS SEQ LENGTH
-            id = str(p + 1).split()[0]
-            offset = ipos
-            seqLength = 0
+    if nthreads <= 1 or not isinstance(pyfile, file):
+        indexer = FastaIndexer(outfile)
+        try:
+            indexer.read(pyfile)
+        finally:
+            seqs = indexer.close()
+        for seqID, length, offset in seqs:
+            d[seqID] = length, offset # SAVE THIS SEQ LENGTH
+        return
+    import threading
+    ifile = file(filename, 'rb') # BINARY, SO FILE OFFSETS ARE EXACT
+    try:
+        ifile.seek(0, 2)
+        size = ifile.tell()
+        starts = [0]
+        for i in range(1, nthreads): # SPLIT AT HEADERS NEAR size * i / n
+            pos = find_fasta_header(ifile, size * i / nthreads)
+            if pos > starts[-1]:
+                starts.append(pos)
+    finally:
+        ifile.close()
+    starts.append(size)
+    indexers = []
+    threads = []
+    try: # REMOVE THE TEMPORARY PIECES HOWEVER WE EXIT
+        try:
+            for i in range(len(starts) - 1): # FIRST PIECE -> outfile
+                if i == 0:
+                    indexers.append(FastaIndexer(outfile))
+                else:
+                    indexers.append(FastaIndexer('%s.%d' % (outfile, i)))
+                t = threading.Thread(target=indexers[i].run,
+                                     args=(filename, starts[i],
+                                           starts[i + 1] - starts[i]))
+                t.start()
+                threads.append(t)
+        finally:
+            for t in threads:
+                t.join()
+            for indexer in indexers:
+                indexer.close() # IN CASE run() NEVER STARTED
+        for indexer in indexers:
+            if indexer.error is not None:
+                raise indexer.error[0], indexer.error[1], indexer.error[2]
+        ofile = file(outfile, 'ab') # APPEND THE OTHER PIECES TO outfile
+        try:
+            offset = 0
+            for i in range(len(indexers)):
+                for seqID, length, ipos in indexers[i].close():
+                    d[seqID] = length, offset + ipos # SAVE THIS SEQ LENGTH
+                offset = offset + indexers[i].ipos
+                if i > 0:
+                    ifile = file('%s.%d' % (outfile, i), 'rb')
+                    try:
+                        s = ifile.read(FASTA_BLOCK_SIZE)
+                        while s:
+                            ofile.write(s)
+                            s = ifile.read(FASTA_BLOCK_SIZE)
+                    finally:
+                        ifile.close()
+        finally:
+            ofile.close()
+    finally:
+        for i in range(1, len(starts) - 1): # INCLUDING ANY NOT YET INDEXED
+            if os.path.exists('%s.%d' % (outfile, i)):
+                os.remove('%s.%d' % (outfile, i))
+
+
+# UCSC .2bit FORMAT: A HEADER, AN INDEX OF (NAME, OFFSET) FOR EACH SEQUENCE,
+# THEN ONE RECORD PER SEQUENCE: dnaSize, nBlockCount, nBlockStarts[],
+# nBlockSizes[], maskBlockCount, maskBlockStarts[], maskBlockSizes[],
+# reserved, THEN THE BASES PACKED 4 PER BYTE (T=0, C=1, A=2, G=3), FIRST
+# BASE IN THE HIGHEST BITS.  WE WRITE ALL INTEGERS LITTLE-ENDIAN (32-BIT,
+# EXCEPT 64-BIT INDEX OFFSETS IN VERSION 1 FILES).  N RUNS AND LOWERCASE
+# (SOFT-MASKED) RUNS ARE STORED AS THE nBlock AND maskBlock TABLES.
+TWOBIT_SIGNATURE = 0x1A412743
+
+cdef char twobit_code[256] # BASE LETTER --> 2-BIT CODE, OR -1 FOR N
+cdef char twobit_bases[1024] # PACKED BYTE --> ITS 4 BASE LETTERS
+
+cdef int init_twobit_tables() except -1:
+    cdef int i, j
+    cdef char *bases
+    bases = 'TCAG'
+    for i from 0 <= i < 256:
+        twobit_code[i] = -1
+    for i from 0 <= i < 4:
+        twobit_code[bases[i]] = i
+        twobit_code[bases[i] | 32] = i # LOWERCASE
+    for i from 0 <= i < 256:
+        for j from 0 <= j < 4:
+            twobit_bases[4 * i + j] = bases[(i >> (6 - 2 * j)) & 3]
+    return 0
+
+init_twobit_tables()
+
+
+cdef unsigned int get_u32(unsigned char *p) nogil:
+    return p[0] | (p[1] << 8) | (p[2] << 16) | (<unsigned int>p[3] << 24)
+
+cdef void put_u32(unsigned char *p, unsigned int i):
+    p[0] = i & 255
+    p[1] = (i >> 8) & 255
+    p[2] = (i >> 16) & 255
+    p[3] = (i >> 24) & 255
+
+
+cdef class TwoBitWriter:
+    '''write sequences to a UCSC .2bit file.  Call begin(seqID) then
+    write() its letters (in as many pieces as you like) for each
+    sequence, then close(), which writes the file and returns a list of
+    (seqID, length, offset of its record in the file).  Letters other
+    than ACGT (in either case) are stored as N.  Empty sequences are
+    omitted.  The records are first written to filename.tmp, since the
+    index that precedes them can only be written at the end.'''
+    cdef object filename, seqID, seqs
+    cdef FILE *ofile
+    cdef long long offset
+    cdef unsigned char *packed
+    cdef unsigned int *nblocks, *mblocks # (start, size) PAIRS
+    cdef long long nbase, npacked
+    cdef int nn, nnmax, nm, nmmax, inN, inMask
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.seqs = []
+        self.ofile = fopen(filename + '.tmp', 'wb')
+        if self.ofile == NULL:
+            raise IOError('unable to create %s' % (filename + '.tmp'))
+
+    def begin(self, seqID):
+        'start a new sequence'
+        self.end()
+        self.seqID = seqID
+        self.nbase = 0
+        self.nn = 0
+        self.nm = 0
+        self.inN = 0
+        self.inMask = 0
+
+    cdef int add_block(self, unsigned int **p_blocks, int *pn, int *pnmax,
+                       unsigned int start) except -1:
+        cdef unsigned int *blocks
+        if pn[0] >= pnmax[0]: # EXPAND THE ARRAY
+            blocks = <unsigned int *>realloc(p_blocks[0], 2 * sizeof(int)
+                                             * (2 * pnmax[0] + 64))
+            if blocks == NULL:
+                raise MemoryError('out of memory')
+            p_blocks[0] = blocks
+            pnmax[0] = 2 * pnmax[0] + 64
+        p_blocks[0][2 * pn[0]] = start
+        p_blocks[0][2 * pn[0] + 1] = 0
+        pn[0] = pn[0] + 1
+        return 0
+
+    cdef int add_letters(self, char *s, int n) except -1:
+        'append n sequence letters (ignoring whitespace) to this sequence'
+        cdef int i, c, code
+        cdef long long npacked
+        cdef unsigned char *packed
+        npacked = (self.nbase + n + 3) / 4
+        if npacked > self.npacked: # EXPAND THE PACKED BASE ARRAY
+            npacked = 2 * npacked + 1024
+            packed = <unsigned char *>realloc(self.packed, npacked)
+            if packed == NULL:
+                raise MemoryError('out of memory')
+            self.packed = packed
+            self.npacked = npacked
+        for i from 0 <= i < n:
+            c = <unsigned char>s[i]
+            if isspace(c) or not isprint(c):
+                continue
+            if self.nbase >= 0xffffffffL:
+                raise ValueError('sequence %s too long for .2bit format'
+                                 % self.seqID)
+            code = twobit_code[c]
+            if code < 0: # N OR OTHER NON-ACGT LETTER
+                if not self.inN:
+                    self.add_block(&self.nblocks, &self.nn, &self.nnmax,
+                                   self.nbase)
+                    self.inN = 1
+                self.nblocks[2 * self.nn - 1] = \
+                    self.nblocks[2 * self.nn - 1] + 1
+                code = 0
+            else:
+                self.inN = 0
+            if c >= c'a' and c <= c'z': # SOFT-MASKED
+                if not self.inMask:
+                    self.add_block(&self.mblocks, &self.nm, &self.nmmax,
+                                   self.nbase)
+                    self.inMask = 1
+                self.mblocks[2 * self.nm - 1] = \
+                    self.mblocks[2 * self.nm - 1] + 1
+            else:
+                self.inMask = 0
+            if self.nbase % 4 == 0:
+                self.packed[self.nbase / 4] = code << 6
+            else:
+                self.packed[self.nbase / 4] = self.packed[self.nbase / 4] \
+                                         | (code << (6 - 2 * (self.nbase % 4)))
+            self.nbase = self.nbase + 1
+        return 0
+
+    def write(self, s):
+        'append the letters of string s to the current sequence'
+        if self.seqID is None:
+            raise ValueError('you must call begin() before write()')
+        self.add_letters(s, len(s))
+
+    cdef int write_blocks(self, unsigned int *blocks, int n, int j) except -1:
+        'write the starts (j=0) or sizes (j=1) of n blocks'
+        cdef int i
+        cdef unsigned char buf[4]
+        for i from 0 <= i < n:
+            put_u32(buf, blocks[2 * i + j])
+            if fwrite(buf, 4, 1, self.ofile) != 1:
+                raise IOError('error writing %s' % (self.filename + '.tmp'))
+        return 0
+
+    cdef int write_u32(self, unsigned int i) except -1:
+        cdef unsigned char buf[4]
+        put_u32(buf, i)
+        if fwrite(buf, 4, 1, self.ofile) != 1:
+            raise IOError('error writing %s' % (self.filename + '.tmp'))
+        return 0
+
+    def end(self):
+        'write the record of the current sequence, if any'
+        cdef long long npacked
+        if self.seqID is None:
+            return
+        if self.nbase > 0:
+            self.seqs.append((self.seqID, self.nbase, self.offset))
+            self.write_u32(self.nbase)
+            self.write_u32(self.nn)
+            self.write_blocks(self.nblocks, self.nn, 0)
+            self.write_blocks(self.nblocks, self.nn, 1)
+            self.write_u32(self.nm)
+            self.write_blocks(self.mblocks, self.nm, 0)
+            self.write_blocks(self.mblocks, self.nm, 1)
+            self.write_u32(0) # RESERVED
+            npacked = (self.nbase + 3) / 4
+            if fwrite(self.packed, 1, npacked, self.ofile) != npacked:
+                raise IOError('error writing %s' % (self.filename + '.tmp'))
+            self.offset = self.offset + 16 + 8 * (self.nn + self.nm) + npacked
+        self.seqID = None
+
+    def close(self):
+        '''write the .2bit file and return a list of (seqID, length,
+        record offset) for its sequences'''
+        cdef FILE *ifile, *ofile
+        cdef long long indexSize, i
+        cdef int version
+        cdef char buf[65536]
+        import os
+        import struct
+        self.end()
+        fclose(self.ofile)
+        self.ofile = NULL
+        indexSize = 16
+        for seqID, length, offset in self.seqs:
+            if len(seqID) > 255:
+                raise ValueError('sequence ID too long for .2bit format: %s'
+                                 % seqID)
+            indexSize = indexSize + 1 + len(seqID) + 4
+        version = 0
+        if indexSize + self.offset > 0xffffffffL: # NEED 64-BIT OFFSETS
+            indexSize = indexSize + 4 * len(self.seqs)
+            version = 1
+        l = [struct.pack('<IIII', TWOBIT_SIGNATURE, version, len(self.seqs), 0)]
+        for seqID, length, offset in self.seqs:
+            if version == 0:
+                l.append(struct.pack('<B%dsI' % len(seqID), len(seqID),
+                                     seqID, indexSize + offset))
+            else:
+                l.append(struct.pack('<B%dsQ' % len(seqID), len(seqID),
+                                     seqID, indexSize + offset))
+        header = ''.join(l)
+        ofile = fopen(self.filename, 'wb')
+        if ofile == NULL:
+            raise IOError('unable to create %s' % self.filename)
+        ifile = fopen(self.filename + '.tmp', 'rb')
+        try:
+            if ifile == NULL:
+                raise IOError('unable to read %s' % (self.filename + '.tmp'))
+            if fwrite(PyString_AS_STRING(header), 1, len(header), ofile) \
+                   != len(header):
+                raise IOError('error writing %s' % self.filename)
+            i = fread(buf, 1, 65536, ifile) # APPEND THE RECORDS
+            while i > 0:
+                if fwrite(buf, 1, i, ofile) != i:
+                    raise IOError('error writing %s' % self.filename)
+                i = fread(buf, 1, 65536, ifile)
+        finally:
+            fclose(ofile)
+            if ifile != NULL:
+                fclose(ifile)
+        os.remove(self.filename + '.tmp')
+        return [(seqID, length, indexSize + offset)
+                for seqID, length, offset in self.seqs]
+
+    def __dealloc__(self):
+        if self.ofile != NULL:
+            fclose(self.ofile)
+        free(self.packed)
+        free(self.nblocks)
+        free(self.mblocks)
+
+
+def read_fasta_2bit(d, pyfile, filename):
+    '''read FASTA sequences from python file object, save them to
+    filename.2bit and save their (length, record offset) into dictionary d'''
+    cdef TwoBitWriter writer
+    writer = TwoBitWriter(filename + '.2bit')
+    for line in pyfile: # pyfile MAY ALSO BE E.G. A gzip.GzipFile
+        if line[:1] == '>': # NEW SEQUENCE
+            writer.begin(line[1:].split()[0])
+        elif writer.seqID is not None:
+            writer.add_letters(line, len(line))
+    for seqID, length, offset in writer.close():
+        d[seqID] = length, offset
+
+
+def read_2bit_index(data):
+    '''return dict of seqID: (length, record offset) for the .2bit file
+    contents data (a string, mmap or other buffer)'''
+    cdef unsigned char *p
+    cdef Py_ssize_t size, pos
+    cdef long long offset
+    cdef unsigned int i, n, version, nameSize
+    cdef void *buf
+    PyObject_AsReadBuffer(data, &buf, &size)
+    p = <unsigned char *>buf
+    if size < 16 or get_u32(p) != TWOBIT_SIGNATURE:
+        raise IOError('not a .2bit file (or wrong byte order)')
+    version = get_u32(p + 4)
+    if version > 1:
+        raise IOError('unknown .2bit version %d' % version)
+    n = get_u32(p + 8)
+    d = {}
+    pos = 16
+    for i from 0 <= i < n:
+        if pos >= size:
+            raise IOError('truncated .2bit index')
+        nameSize = p[pos]
+        if pos + 1 + nameSize + 4 + 4 * version > size:
+            raise IOError('truncated .2bit index')
+        name = PyString_FromStringAndSize(<char *>p + pos + 1, nameSize)
+        pos = pos + 1 + nameSize
+        offset = get_u32(p + pos)
+        if version == 1:
+            offset = offset | (<long long>get_u32(p + pos + 4) << 32)
+        pos = pos + 4 + 4 * version
+        if offset + 16 > size:
+            raise IOError('truncated .2bit file')
+        d[name] = get_u32(p + offset), offset
+    return d
+
+
+cdef unsigned int first_block(unsigned char *starts, unsigned char *sizes,
+                              unsigned int n, long long pos) nogil:
+    'index of the first block that ends after pos'
+    cdef unsigned int lo, hi, mid
+    lo = 0
+    hi = n
+    while lo < hi:
+        mid = (lo + hi) / 2
+        if get_u32(starts + 4 * mid) + <long long>get_u32(sizes + 4 * mid) \
+               <= pos:
+            lo = mid + 1
         else:
-            i = 0
-            while p[i]:
-                if isprint(p[i]) and not isspace(p[i]):
-                    seqLength = seqLength + 1
-                    fputc(p[i], ifile2)
-                    ipos = ipos + 1
-                i = i + 1
-        p = fgets(tmp, 32767, ifile) # read the next line of the FASTA file
-    if id is not None and seqLength>0:
-        d[id] = seqLength, offset # SAVE THIS SEQ LENGTH
-    fclose(ifile2)
+            hi = mid
+    return lo
+
+cdef void fill_blocks(char *out, unsigned char *starts, unsigned char *sizes,
+                      unsigned int n, long long start, long long end,
+                      int mask) nogil:
+    '''set letters of out (holding [start:end]) in the given blocks to N,
+    or to lowercase if mask is true'''
+    cdef unsigned int i
+    cdef long long bstart, bend, j
+    i = first_block(starts, sizes, n, start)
+    while i < n:
+        bstart = get_u32(starts + 4 * i)
+        if bstart >= end:
+            break
+        bend = bstart + get_u32(sizes + 4 * i)
+        if bstart < start:
+            bstart = start
+        if bend > end:
+            bend = end
+        if mask:
+            for j from bstart <= j < bend:
+                out[j - start] = out[j - start] | 32 # LOWERCASE
+        else:
+            memset(out + bstart - start, c'N', bend - bstart)
+        i = i + 1
+
+def twobit_slice(data, long long offset, long long start, long long end):
+    '''decode bases [start:end] of the .2bit record at offset in data
+    (a string, mmap or other buffer), reading only the packed bytes and
+    N / mask blocks that overlap that range'''
+    cdef unsigned char *p, *nstarts, *mstarts, *packed
+    cdef char *out
+    cdef Py_ssize_t size
+    cdef long long dnaSize, i, j, k, n
+    cdef unsigned int nn, nm, b
+    cdef void *buf
+    PyObject_AsReadBuffer(data, &buf, &size)
+    p = <unsigned char *>buf
+    if offset < 0 or offset + 8 > size:
+        raise IOError('bad .2bit record offset')
+    dnaSize = get_u32(p + offset)
+    nn = get_u32(p + offset + 4)
+    nstarts = p + offset + 8
+    if offset + 12 + 8 * <long long>nn > size:
+        raise IOError('truncated .2bit record')
+    nm = get_u32(nstarts + 8 * nn)
+    mstarts = nstarts + 8 * nn + 4
+    packed = mstarts + 8 * nm + 4
+    if packed - p + (dnaSize + 3) / 4 > size:
+        raise IOError('truncated .2bit record')
+    if start < 0: # CLIP TO THE SEQUENCE, LIKE SLICING A STRING
+        start = 0
+    if end > dnaSize:
+        end = dnaSize
+    if end <= start:
+        return ''
+    n = end - start
+    s = PyString_FromStringAndSize(NULL, n)
+    out = PyString_AS_STRING(s)
+    with nogil:
+        i = start
+        k = 0
+        while i < end and i % 4 != 0: # LEADING PARTIAL BYTE
+            out[k] = twobit_bases[4 * packed[i / 4] + i % 4]
+            i = i + 1
+            k = k + 1
+        while i + 4 <= end: # WHOLE BYTES
+            memcpy(out + k, twobit_bases + 4 * packed[i / 4], 4)
+            i = i + 4
+            k = k + 4
+        while i < end: # TRAILING PARTIAL BYTE
+            out[k] = twobit_bases[4 * packed[i / 4] + i % 4]
+            i = i + 1
+            k = k + 1
+        fill_blocks(out, nstarts, nstarts + 4 * nn, nn, start, end, 0)
+        fill_blocks(out, mstarts, mstarts + 4 * nm, nm, start, end, 1)
+    return s
+
+
+# .seqidx FORMAT: A HEADER (16-BYTE MAGIC, 64-BIT RECORD COUNT), THEN ONE
+# RECORD PER SEQUENCE (length, offset, nameOffset, nameSize), SORTED BY
+# SEQUENCE ID, THEN THE SEQUENCE IDS.  nameOffset IS RELATIVE TO THE START
+# OF THE IDS.  ALL INTEGERS ARE 64-BIT LITTLE-ENDIAN.
+SEQLEN_INDEX_MAGIC = 'pygr.seqidx.v01\n'
+cdef enum:
+    SEQLEN_HEADER_SIZE = 24
+    SEQLEN_RECORD_SIZE = 32
+
+cdef long long get_i64(unsigned char *p):
+    return <long long>(get_u32(p) | (<unsigned long long>get_u32(p + 4) << 32))
+
+
+def write_seqlen_index(filename, d):
+    '''write filename, a .seqidx index of dictionary d, which maps
+    seqID --> (length, offset).  Read it with SeqLenIndex.  The index is
+    written to a temporary file that is then renamed to filename, so
+    readers never see a partly written index.'''
+    import os, struct
+    ids = [str(seqID) for seqID in d]
+    ids.sort()
+    records = []
+    nameOffset = 0
+    for seqID in ids:
+        length, offset = d[seqID]
+        records.append(struct.pack('<qqqq', length, offset, nameOffset,
+                                   len(seqID)))
+        nameOffset = nameOffset + len(seqID)
+    tmpname = filename + '.tmp'
+    ofile = file(tmpname, 'wb')
+    try:
+        try:
+            ofile.write(SEQLEN_INDEX_MAGIC + struct.pack('<q', len(ids)))
+            ofile.write(''.join(records))
+            ofile.write(''.join(ids))
+        finally:
+            ofile.close()
+        os.rename(tmpname, filename)
+    except:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+        raise
+
+
+cdef class SeqLenIndex:
+    '''read-only seqID --> (length, offset) mapping, from a .seqidx file
+    written by write_seqlen_index().  The file is memory-mapped, so
+    opening it takes constant time however many sequences it holds, and
+    each lookup is a binary search of its sorted records, in C.'''
+    cdef object data
+    cdef unsigned char *records, *names
+    cdef long long n, namesSize
+
+    def __init__(self, filename):
+        import mmap, os
+        cdef void *buf
+        cdef Py_ssize_t size
+        cdef long long nameOffset, nameSize
+        ifile = file(filename, 'rb')
+        try:
+            if os.fstat(ifile.fileno()).st_size < SEQLEN_HEADER_SIZE:
+                raise IOError('%s is not a sequence length index' % filename)
+            self.data = mmap.mmap(ifile.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            ifile.close()
+        PyObject_AsReadBuffer(self.data, &buf, &size)
+        self.n = get_i64(<unsigned char *>buf + 16)
+        if memcmp(buf, <char *>SEQLEN_INDEX_MAGIC, 16) != 0 or self.n < 0 \
+           or self.n > (size - SEQLEN_HEADER_SIZE) / SEQLEN_RECORD_SIZE:
+            self.data.close()
+            self.data = None
+            raise IOError('%s is not a sequence length index' % filename)
+        self.records = <unsigned char *>buf + SEQLEN_HEADER_SIZE
+        self.names = self.records + SEQLEN_RECORD_SIZE * self.n
+        self.namesSize = size - SEQLEN_HEADER_SIZE \
+                         - SEQLEN_RECORD_SIZE * self.n
+        if self.n > 0: # THE LAST NAME MUST END EXACTLY AT THE END OF FILE
+            nameOffset = get_i64(self.records
+                                 + SEQLEN_RECORD_SIZE * (self.n - 1) + 16)
+            nameSize = get_i64(self.records
+                               + SEQLEN_RECORD_SIZE * (self.n - 1) + 24)
+        else:
+            nameOffset = nameSize = 0
+        if nameOffset < 0 or nameSize < 0 \
+           or nameOffset + nameSize != self.namesSize: # TRUNCATED?
+            self.close()
+            raise IOError('%s: sequence length index is truncated or corrupt'
+                          % filename)
+
+    cdef unsigned char *get_name(self, long long i,
+                                 long long *nameSize) except NULL:
+        cdef long long nameOffset
+        nameOffset = get_i64(self.records + SEQLEN_RECORD_SIZE * i + 16)
+        nameSize[0] = get_i64(self.records + SEQLEN_RECORD_SIZE * i + 24)
+        if nameOffset < 0 or nameSize[0] < 0 \
+           or nameOffset + nameSize[0] > self.namesSize:
+            raise IOError('corrupt sequence length index')
+        return self.names + nameOffset
+
+    cdef long long find(self, k) except -2:
+        'return the record number of seqID k, or -1 if not found'
+        cdef long long lo, hi, mid, nameSize, size
+        cdef unsigned char *name
+        cdef int c
+        if self.records == NULL:
+            raise ValueError('operation on closed SeqLenIndex')
+        if not isinstance(k, str):
+            return -1
+        size = len(k)
+        lo = 0
+        hi = self.n
+        while lo < hi: # BINARY SEARCH, COMPARING IDS AS Python str DOES
+            mid = (lo + hi) / 2
+            name = self.get_name(mid, &nameSize)
+            if nameSize < size:
+                c = memcmp(name, PyString_AS_STRING(k), nameSize)
+                if c == 0:
+                    c = -1
+            else:
+                c = memcmp(name, PyString_AS_STRING(k), size)
+                if c == 0 and nameSize > size:
+                    c = 1
+            if c < 0:
+                lo = mid + 1
+            elif c > 0:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    cdef object get_id(self, long long i):
+        cdef long long nameSize
+        cdef unsigned char *name
+        name = self.get_name(i, &nameSize)
+        return PyString_FromStringAndSize(<char *>name, nameSize)
+
+    def __getitem__(self, k):
+        cdef long long i
+        cdef unsigned char *p
+        i = self.find(k)
+        if i < 0:
+            raise KeyError(k)
+        p = self.records + SEQLEN_RECORD_SIZE * i
+        return get_i64(p), get_i64(p + 8)
+
+    def get(self, k, default=None):
+        try:
+            return self[k]
+        except KeyError:
+            return default
+
+    def __contains__(self, k):
+        return self.find(k) >= 0
+
+    def has_key(self, k):
+        return self.find(k) >= 0
+
+    def __len__(self):
+        if self.records == NULL:
+            raise ValueError('operation on closed SeqLenIndex')
+        return self.n
+
+    def keys(self):
+        'return list of seqIDs, in sorted order'
+        cdef long long i
+        if self.records == NULL:
+            raise ValueError('operation on closed SeqLenIndex')
+        l = []
+        for i from 0 <= i < self.n:
+            l.append(self.get_id(i))
+        return l
+
+    def items(self):
+        'return list of (seqID, (length, offset)), in seqID order'
+        cdef long long i
+        cdef unsigned char *p
+        if self.records == NULL:
+            raise ValueError('operation on closed SeqLenIndex')
+        l = []
+        for i from 0 <= i < self.n:
+            p = self.records + SEQLEN_RECORD_SIZE * i
+            l.append((self.get_id(i), (get_i64(p), get_i64(p + 8))))
+        return l
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def iterkeys(self):
+        return iter(self.keys())
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def close(self):
+        'unmap the index file; the index cannot be used after this'
+        self.records = NULL
+        self.names = NULL
+        if self.data is not None:
+            self.data.close()
+            self.data = None
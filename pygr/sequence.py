@@ -2,6 +2,10 @@
 from __future__ import generators
 import types
 from sequtil import *
+try:
+    import numpy
+except ImportError: # Seq2SeqEdge FALLS BACK TO PYTHON LOOPS WITHOUT IT
+    numpy = None
 
 
 NOT_ON_SAME_PATH = -2
@@ -703,19 +707,43 @@ class Seq2SeqEdge(object):
         'get length of source vs. target interval according to mode'
         return mode(len(self.sourcePath), len(self.targetPath))
 
+    def letterArrays(self):
+        """get numpy arrays (isrc, idest, identical) covering every aligned
+        letter pair of this alignment, in order: the positions of each pair
+        relative to sourcePath.start and targetPath.start, and whether the
+        two letters are identical (ignoring case)."""
+        if self.matchIntervals is None: # THIS IS ALREADY A 1:1 INTERVAL!
+            ivals = [(self.sourcePath.start, self.sourcePath.stop,
+                      self.targetPath.start, self.targetPath.stop)]
+        elif self.matchIntervals is False:
+            raise ValueError('no matchIntervals information!')
+        else:
+            ivals = self.matchIntervals
+        a = numpy.array([t[:3] for t in ivals], numpy.int64).reshape(-1, 3)
+        n = a[:, 1] - a[:, 0]
+        offset = numpy.arange(n.sum()) - numpy.repeat(numpy.cumsum(n) - n, n)
+        isrc = numpy.repeat(a[:, 0] - self.sourcePath.start, n) + offset
+        idest = numpy.repeat(a[:, 2] - self.targetPath.start, n) + offset
+        s1 = numpy.frombuffer(str(self.sourcePath).upper(), numpy.uint8)
+        s2 = numpy.frombuffer(str(self.targetPath).upper(), numpy.uint8)
+        return isrc, idest, s1[isrc] == s2[idest]
+
     def pIdentity(self, mode=max, trapOverflow=True):
         "calculate fractional identity for this pairwise alignment"
-        nid = 0
-        start1 = self.sourcePath.start
-        s1 = str(self.sourcePath).upper()
-        start2 = self.targetPath.start
-        s2 = str(self.targetPath).upper()
-        for srcPath, destPath in self.items():
-            isrc = srcPath.start - start1
-            idest = destPath.start - start2
-            for i in xrange(len(srcPath)):
-                if s1[isrc + i] == s2[idest + i]:
-                    nid += 1
+        if numpy is not None: # COMPARE ALL LETTERS IN ONE VECTOR OPERATION
+            nid = int(self.letterArrays()[2].sum())
+        else:
+            nid = 0
+            start1 = self.sourcePath.start
+            s1 = str(self.sourcePath).upper()
+            start2 = self.targetPath.start
+            s2 = str(self.targetPath).upper()
+            for srcPath, destPath in self.items():
+                isrc = srcPath.start - start1
+                idest = destPath.start - start2
+                for i in xrange(len(srcPath)):
+                    if s1[isrc + i] == s2[idest + i]:
+                        nid += 1
         x = nid / float(self.length(mode))
         if trapOverflow and x > 1.:
             raise ValueError('''pIdentity overflow due to multiple hits
@@ -725,21 +753,26 @@ class Seq2SeqEdge(object):
 
     def longestSegment(self, segment, pIdentityMin=.9, minAlignSize=1,
                        mode=max, **kwargs):
-        besthit = None
-        for i in xrange(len(segment)):
-            ni = 0 # IDENTITY COUNT
-            nm = 0 # MISMATCH COUNT
-            for j in xrange(i, -1, -1):
-                ni += segment[j][2]
-                l = mode(segment[i][0] + segment[i][2] - segment[j][0],
-                       segment[i][1] + segment[i][2] - segment[j][1])
-                pIdentity = float(ni) / l
-                if pIdentity >= pIdentityMin and (besthit is None or
-                                                  ni + nm > besthit[4]):
-                    besthit = (segment[j][0], segment[i][0] + segment[i][2],
-                               segment[j][1], segment[i][1] + segment[i][2],
-                               ni + nm)
-                nm += segment[j][3]
+        if numpy is not None and mode in (max, min): # VECTORIZED SEARCH
+            besthit = self._longest_segment_vector(segment, pIdentityMin,
+                                                   mode)
+        else:
+            besthit = None
+            for i in xrange(len(segment)):
+                ni = 0 # IDENTITY COUNT
+                nm = 0 # MISMATCH COUNT
+                for j in xrange(i, -1, -1):
+                    ni += segment[j][2]
+                    l = mode(segment[i][0] + segment[i][2] - segment[j][0],
+                           segment[i][1] + segment[i][2] - segment[j][1])
+                    pIdentity = float(ni) / l
+                    if pIdentity >= pIdentityMin and (besthit is None or
+                                                      ni + nm > besthit[4]):
+                        besthit = (segment[j][0],
+                                   segment[i][0] + segment[i][2],
+                                   segment[j][1],
+                                   segment[i][1] + segment[i][2], ni + nm)
+                    nm += segment[j][3]
         if besthit is None:
             return None
         elif besthit[4] >= minAlignSize:
@@ -747,8 +780,61 @@ class Seq2SeqEdge(object):
         else:
             return None
 
+    def identitySegments(self):
+        """vectorized version of the identity segment search in
+        conservedSegment(): list of (srcStart, destStart, length, nmismatch)
+        for each unbroken run of identical letters, where nmismatch counts
+        the mismatches since the previous run."""
+        isrc, idest, same = self.letterArrays()
+        hits = numpy.flatnonzero(same)
+        if len(hits) == 0:
+            return []
+        i1 = isrc[hits]
+        i2 = idest[hits]
+        breaks = numpy.flatnonzero((numpy.diff(i1) != 1) |
+                                   (numpy.diff(i2) != 1)) + 1
+        first = numpy.concatenate(([0], breaks))
+        last = numpy.concatenate((breaks - 1, [len(hits) - 1]))
+        nmismatch = numpy.cumsum(~same)[hits] # MISMATCHES BEFORE EACH HIT
+        n = nmismatch[first] - numpy.concatenate(([0], nmismatch[last[:-1]]))
+        return zip((i1[first] + self.sourcePath.start).tolist(),
+                   (i2[first] + self.targetPath.start).tolist(),
+                   (last - first + 1).tolist(), n.tolist())
+
+    def _longest_segment_vector(self, segment, pIdentityMin, mode):
+        """longestSegment() search, vectorized over the start segment j
+        for each end segment i; returns the same besthit"""
+        if len(segment) == 0:
+            return None
+        a = numpy.array(segment, numpy.int64)
+        nid = numpy.concatenate(([0], numpy.cumsum(a[:, 2])))
+        nmis = numpy.concatenate(([0], numpy.cumsum(a[:, 3])))
+        if mode is max:
+            modeFunc = numpy.maximum
+        else:
+            modeFunc = numpy.minimum
+        besthit = None
+        for i in xrange(len(a)):
+            ni = nid[i + 1] - nid[:i + 1] # IDENTITIES IN SEGMENTS j..i
+            l = modeFunc(a[i, 0] + a[i, 2] - a[:i + 1, 0],
+                         a[i, 1] + a[i, 2] - a[:i + 1, 1])
+            ok = numpy.flatnonzero(ni / l.astype(numpy.float64)
+                                   >= pIdentityMin)
+            if len(ok) == 0:
+                continue
+            score = ni[ok] + nmis[i + 1] - nmis[ok + 1]
+            k = len(ok) - 1 - score[::-1].argmax() # TIES: LOOP TRIES BIG j 1ST
+            if besthit is None or score[k] > besthit[4]:
+                j = ok[k]
+                besthit = (int(a[j, 0]), int(a[i, 0] + a[i, 2]),
+                           int(a[j, 1]), int(a[i, 1] + a[i, 2]),
+                           int(score[k]))
+        return besthit
+
     def conservedSegment(self, **kwargs):
         "calculate fractional identity for this pairwise alignment"
+        if numpy is not None: # FIND IDENTITY SEGMENTS IN VECTOR OPERATIONS
+            return self.longestSegment(self.identitySegments(), **kwargs)
         start1 = self.sourcePath.start
         s1 = str(self.sourcePath).upper()
         start2 = self.targetPath.start
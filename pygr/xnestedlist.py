@@ -1,3 +1,8 @@
+import bisect
+import socket
+import struct
+import SocketServer
+import threading
 import cnestedlist
 from nlmsa_utils import EmptySliceError, EmptySlice
 import sequence
@@ -5,7 +10,7 @@ import sequence
 
 class NLMSAServer(cnestedlist.NLMSA):
     'serves NLMSA via serializable method calls for XMLRPC'
-    xmlrpc_methods = {'getSlice': 0, 'getInfo': 0}
+    xmlrpc_methods = {'getSlice': 0, 'getSlices': 0, 'getInfo': 0}
 
     def getSlice(self, seqID, start, stop):
         'perform an interval query and return results as raw ivals'
@@ -35,6 +40,12 @@ class NLMSAServer(cnestedlist.NLMSA):
         # List of aligned ivals, list of (nlmsa_id, (seqID, nsID)).
         return nlmsa_id, ivals, l
 
+    def getSlices(self, queries):
+        '''perform a batch of interval queries, given as a list of
+        (seqID, start, stop), and return a list of getSlice() results'''
+        return [self.getSlice(seqID, start, stop)
+                for seqID, start, stop in queries]
+
     def getInfo(self):
         'return list of tuples describing NLMSASequences in this NLMSA'
         l = []
@@ -43,14 +54,356 @@ class NLMSAServer(cnestedlist.NLMSA):
         return l
 
 
+# Binary protocol: each request and each reply is a frame consisting of
+# a 4-byte payload length followed by the payload, all integers in network
+# byte order.  A request payload starts with a one-letter opcode.  The
+# server answers the frames on a connection strictly in order, so a client
+# may send several requests before reading their replies (pipelining).
+_FRAME_HEADER = struct.Struct('!I')
+_GET_INFO = 'I' # reply: count, then (id, is_lpo, length, is_union) records
+_GET_SLICES = 'S' # count, then (start, stop, seqID) queries
+_INFO_RECORD = struct.Struct('!qBqB')
+_QUERY_RECORD = struct.Struct('!qqH') # FOLLOWED BY seqID STRING
+_SLICE_HEADER = struct.Struct('!BqI') # status, nlmsa_id, #intervals
+_ID_RECORD = struct.Struct('!qqH') # nlmsa_id, nsID, seqID length
+_COUNT = struct.Struct('!I')
+_SLICE_OK, _SLICE_EMPTY, _SLICE_FAILED = 0, 1, 2
+
+
+def _read_frame(ifile):
+    'read one frame from file-like ifile, or return None at EOF'
+    header = ifile.read(_FRAME_HEADER.size)
+    if not header:
+        return None
+    if len(header) < _FRAME_HEADER.size:
+        raise IOError('truncated NLMSA frame header')
+    n = _FRAME_HEADER.unpack(header)[0]
+    payload = ifile.read(n)
+    if len(payload) < n:
+        raise IOError('truncated NLMSA frame')
+    return payload
+
+
+def _frame(payload):
+    'return payload with its length prefix'
+    return _FRAME_HEADER.pack(len(payload)) + payload
+
+
+def pack_slices(results):
+    'encode a list of NLMSAServer.getSlice() results as a binary payload'
+    l = [_COUNT.pack(len(results))]
+    for result in results:
+        if result == 'EMPTY':
+            l.append(_SLICE_HEADER.pack(_SLICE_EMPTY, 0, 0))
+            continue
+        elif result == '':
+            l.append(_SLICE_HEADER.pack(_SLICE_FAILED, 0, 0))
+            continue
+        nlmsa_id, ivals, idList = result
+        l.append(_SLICE_HEADER.pack(_SLICE_OK, nlmsa_id, len(ivals)))
+        flat = [x for t in ivals for x in t] # PACK ALL INTERVALS AT ONCE
+        l.append(struct.pack('!%dq' % len(flat), *flat))
+        l.append(_COUNT.pack(len(idList)))
+        for id, (seqID, nsID) in idList:
+            l.append(_ID_RECORD.pack(id, nsID, len(seqID)))
+            l.append(seqID)
+    return ''.join(l)
+
+
+def unpack_slices(payload):
+    'decode a binary payload into a list of NLMSAServer.getSlice() results'
+    nresult = _COUNT.unpack_from(payload)[0]
+    pos = _COUNT.size
+    results = []
+    for i in range(nresult):
+        status, nlmsa_id, n = _SLICE_HEADER.unpack_from(payload, pos)
+        pos += _SLICE_HEADER.size
+        if status == _SLICE_EMPTY:
+            results.append('EMPTY')
+            continue
+        elif status != _SLICE_OK:
+            results.append('')
+            continue
+        flat = struct.unpack_from('!%dq' % (5 * n), payload, pos)
+        pos += 40 * n
+        ivals = [flat[j:j + 5] for j in range(0, 5 * n, 5)]
+        nid = _COUNT.unpack_from(payload, pos)[0]
+        pos += _COUNT.size
+        idList = []
+        for j in range(nid):
+            id, nsID, length = _ID_RECORD.unpack_from(payload, pos)
+            pos += _ID_RECORD.size
+            idList.append((id, (payload[pos:pos + length], nsID)))
+            pos += length
+        results.append((nlmsa_id, ivals, idList))
+    return results
+
+
+class _BinaryRequestHandler(SocketServer.StreamRequestHandler):
+    'answers binary NLMSA requests on one connection until it is closed'
+
+    def handle(self):
+        querySlots = self.server.querySlots
+        while True:
+            payload = _read_frame(self.rfile)
+            if payload is None: # CLIENT CLOSED THE CONNECTION
+                return
+            querySlots.acquire() # LIMIT #QUERIES RUNNING AT ONCE
+            try:
+                reply = self.get_reply(payload)
+            finally:
+                querySlots.release()
+            if reply is None: # PROTOCOL ERROR, SO DROP THIS CONNECTION
+                return
+            self.wfile.write(_frame(reply))
+            self.wfile.flush()
+
+    def get_reply(self, payload):
+        'return reply payload for one request payload, or None if invalid'
+        nlmsa = self.server.nlmsa
+        op = payload[:1]
+        if op == _GET_INFO:
+            l = nlmsa.getInfo()
+            return _COUNT.pack(len(l)) + \
+                   ''.join([_INFO_RECORD.pack(*t) for t in l])
+        elif op == _GET_SLICES:
+            n = _COUNT.unpack_from(payload, 1)[0]
+            pos = 1 + _COUNT.size
+            queries = []
+            for i in range(n):
+                start, stop, length = _QUERY_RECORD.unpack_from(payload, pos)
+                pos += _QUERY_RECORD.size
+                queries.append((payload[pos:pos + length], start, stop))
+                pos += length
+            return pack_slices(nlmsa.getSlices(queries))
+
+
+class NLMSABinaryServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    '''serves NLMSAServer nlmsa using the binary protocol over persistent
+    TCP connections.  Clients connect with NLMSAClient('nlmsa://host:port').
+    port=0 binds to a free port; the bound port is saved as self.port.
+
+    Each connection is served by its own thread, so an idle persistent
+    connection never blocks other clients, but at most nthreads requests
+    are answered at once.  With nthreads > 1, nlmsa must be opened
+    read-only; open it with useMmap=True so that its index searches run
+    in parallel instead of taking turns.'''
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, nlmsa, host='', port=5001, nthreads=1):
+        self.nlmsa = nlmsa # MUST BE AN NLMSAServer
+        self.nthreads = nthreads
+        self.querySlots = threading.BoundedSemaphore(nthreads)
+        SocketServer.TCPServer.__init__(self, (host, port),
+                                        _BinaryRequestHandler)
+        self.port = self.socket.getsockname()[1]
+
+
+class NLMSABinaryConnection(object):
+    '''client side of the binary NLMSA protocol, with the same getInfo(),
+    getSlice() and getSlices() methods as an NLMSAServer.  getSlices()
+    sends its queries in frames of up to batchSize queries, keeping up to
+    maxPending frames in flight before reading their replies.'''
+
+    def __init__(self, host, port, batchSize=256, maxPending=4):
+        self.sock = socket.create_connection((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.sock.makefile('rb')
+        self.batchSize = batchSize
+        self.maxPending = maxPending
+
+    def _read_reply(self):
+        payload = _read_frame(self.rfile)
+        if payload is None:
+            raise IOError('NLMSA server closed the connection')
+        return payload
+
+    def getInfo(self):
+        self.sock.sendall(_frame(_GET_INFO))
+        payload = self._read_reply()
+        n = _COUNT.unpack_from(payload)[0]
+        return [_INFO_RECORD.unpack_from(payload, _COUNT.size +
+                                         i * _INFO_RECORD.size)
+                for i in range(n)]
+
+    def getSlice(self, seqID, start, stop):
+        return self.getSlices([(seqID, start, stop)])[0]
+
+    def getSlices(self, queries):
+        results = []
+        npending = 0
+        for i in range(0, len(queries), self.batchSize):
+            l = [_GET_SLICES, _COUNT.pack(len(queries[i:i + self.batchSize]))]
+            for seqID, start, stop in queries[i:i + self.batchSize]:
+                seqID = str(seqID)
+                l.append(_QUERY_RECORD.pack(start, stop, len(seqID)))
+                l.append(seqID)
+            if npending >= self.maxPending: # READ A REPLY BEFORE SENDING MORE
+                results += unpack_slices(self._read_reply())
+                npending -= 1
+            self.sock.sendall(_frame(''.join(l)))
+            npending += 1
+        for i in range(npending): # READ ALL THE REMAINING REPLIES
+            results += unpack_slices(self._read_reply())
+        return results
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+
+class SliceCache(object):
+    '''cache of raw interval query results, keyed by sequence ID,
+    orientation and query interval.  A query for a sub-interval of a
+    cached query is answered by clipping the cached intervals.  The least
+    recently used results are discarded to keep the estimated size of
+    the cache within maxBytes.
+
+    No cached query interval of a sequence contains another (saving one
+    discards those it contains), so sorted by start their stops increase
+    too, and the only one that can contain a query is the last one that
+    starts at or before it, found by binary search.'''
+    ivalBytes = 200 # ESTIMATED MEMORY PER CACHED INTERVAL TUPLE
+    entryBytes = 300 # ESTIMATED OVERHEAD PER CACHED QUERY
+
+    def __init__(self, maxBytes=16000000):
+        self.maxBytes = maxBytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.seqDict = {} # (seqID, ori) --> ([starts], [entries]), SORTED
+        self.head = [] # SENTINEL OF DOUBLY-LINKED LRU LIST
+        self.head[:] = [self.head, self.head, None, None]
+
+    def _find(self, seqID, start, stop):
+        'return the cached entry whose query contains [start:stop], or None'
+        try:
+            starts, links = self.seqDict[(seqID, start < 0)]
+        except KeyError:
+            return None
+        i = bisect.bisect_right(starts, start) - 1
+        if i >= 0 and stop <= links[i][2][3]:
+            return links[i]
+        return None
+
+    def get(self, seqID, start, stop):
+        '''return (nlmsa_id, ivals) for seqID[start:stop], where ivals may
+        be empty (i.e. not aligned), or raise KeyError if not cached'''
+        link = self._find(seqID, start, stop)
+        if link is None:
+            self.misses += 1
+            raise KeyError('not cached')
+        key, result = link[2:]
+        self._unlink(link) # MOVE TO MOST RECENTLY USED
+        self._append(link)
+        self.hits += 1
+        if key[2] == start and key[3] == stop:
+            return result[0], list(result[1]) # COPY OF CACHED LIST
+        l = clip_ivals(result[1], start, stop)
+        l.sort(key=_slice_order) # SAME ORDER AS THE SERVER WOULD GIVE
+        return result[0], l
+
+    def save(self, seqID, start, stop, nlmsa_id, ivals):
+        'cache the (nlmsa_id, ivals) query result for seqID[start:stop]'
+        nbytes = self.entryBytes + self.ivalBytes * len(ivals)
+        if nbytes > self.maxBytes:
+            return
+        starts, links = self.seqDict.get((seqID, start < 0), ([], []))
+        i = bisect.bisect_left(starts, start)
+        while i < len(links) and links[i][2][3] <= stop: # CONTAINED IN NEW
+            self._remove(links[i])
+        if i > 0 and stop <= links[i - 1][2][3] or \
+               i < len(links) and starts[i] == start: # ALREADY COVERED
+            return
+        link = [None, None, (seqID, start < 0, start, stop, nbytes),
+                (nlmsa_id, ivals)]
+        self._append(link)
+        self.seqDict[(seqID, start < 0)] = starts, links
+        starts.insert(i, start)
+        links.insert(i, link)
+        self.nbytes += nbytes
+        while self.nbytes > self.maxBytes: # DROP LEAST RECENTLY USED
+            self._remove(self.head[1])
+
+    def _append(self, link):
+        last = self.head[0]
+        link[0] = last
+        link[1] = self.head
+        last[1] = link
+        self.head[0] = link
+
+    def _unlink(self, link):
+        link[0][1] = link[1]
+        link[1][0] = link[0]
+
+    def _remove(self, link):
+        self._unlink(link)
+        key = link[2]
+        starts, links = self.seqDict[key[:2]]
+        i = bisect.bisect_left(starts, key[2])
+        del starts[i]
+        del links[i]
+        if not links:
+            del self.seqDict[key[:2]]
+        self.nbytes -= key[4]
+
+    def __len__(self):
+        return sum([len(t[1]) for t in self.seqDict.values()])
+
+    def clear(self):
+        self.seqDict.clear()
+        self.head[:] = [self.head, self.head, None, None]
+        self.nbytes = 0
+
+    def cache_info(self):
+        'return dict of hits, misses, maxsize and currsize (in bytes)'
+        return dict(hits=self.hits, misses=self.misses,
+                    maxsize=self.maxBytes, currsize=self.nbytes)
+
+
+def _slice_order(t):
+    'sort key giving raw intervals in the order NLMSASlice lists them'
+    return t[0], -t[1], t[2], t[3], t[4]
+
+
+def clip_ivals(ivals, start, stop):
+    '''clip raw intervals (start, end, target_id, target_start, target_end)
+    to [start:stop], discarding those that do not overlap it'''
+    l = []
+    for t in ivals:
+        if t[1] <= start or t[0] >= stop:
+            continue
+        s, e, id, ts, te = t
+        if s < start:
+            ts += start - s
+            s = start
+        if e > stop:
+            te -= e - stop
+            e = stop
+        l.append((s, e, id, ts, te))
+    return l
+
+
 class NLMSAClient(cnestedlist.NLMSA):
-    'client for accessing NLMSAServer via XMLRPC'
+    '''client for accessing NLMSAServer via XMLRPC.  Query results are
+    cached, using up to about maxCacheBytes of memory (0 turns the
+    cache off); the cache is available as self.sliceCache'''
 
-    def __init__(self, url=None, name=None, idDictClass=dict, **kwargs):
+    def __init__(self, url=None, name=None, idDictClass=dict,
+                 maxCacheBytes=16000000, **kwargs):
         cnestedlist.NLMSA.__init__(self, mode='xmlrpc',
                                    idDictClass=idDictClass, **kwargs)
-        import coordinator
-        self.server = coordinator.get_connection(url, name)
+        if maxCacheBytes:
+            self.sliceCache = SliceCache(maxCacheBytes)
+        else:
+            self.sliceCache = None
+        if url is not None and url.startswith('nlmsa://'): # BINARY PROTOCOL
+            host, port = url[len('nlmsa://'):].rstrip('/').split(':')
+            self.server = NLMSABinaryConnection(host, int(port))
+        else:
+            import coordinator
+            self.server = coordinator.get_connection(url, name)
         self.url = url
         self.name = name
         l = self.server.getInfo() # READ NS INFO TABLE
@@ -61,20 +414,80 @@ class NLMSAClient(cnestedlist.NLMSA):
             self.addToSeqlist(ns) # ADD THIS TO THE INDEX
 
     def close(self):
-        pass # required interface, but nothing to do
+        try: # CLOSE OUR BINARY CONNECTION
+            self.server.close()
+        except AttributeError: # XMLRPC: NOTHING TO DO
+            pass
 
     def doSlice(self, seq):
         '''getSlice from the server, and create an NLMSASlice object
         from results'''
-        result = self.server.getSlice(self.seqs.getSeqID(seq), seq.start,
-                                      seq.stop)
+        seqID = self.seqs.getSeqID(seq)
+        if self.sliceCache is not None:
+            try:
+                id, l = self.sliceCache.get(seqID, seq.start, seq.stop)
+            except KeyError:
+                pass
+            else:
+                if not l:
+                    raise EmptySliceError
+                return id, l
+        result = self.server.getSlice(seqID, seq.start, seq.stop)
+        return self.save_slice_result(result, seqID, seq.start, seq.stop)
+
+    def query_many(self, ivals):
+        '''query a batch of sequence intervals with a single getSlices()
+        call to the server.  Same interface as NLMSA.query_many()'''
+        try:
+            getSlices = self.server.getSlices
+        except AttributeError: # OLDER XMLRPC SERVER: QUERY ONE AT A TIME
+            return cnestedlist.NLMSA.query_many(self, ivals)
+        queries = []
+        for ival in ivals:
+            if isinstance(ival, tuple): # (seq, start, stop)
+                seq, start, stop = ival
+            else: # A SEQUENCE INTERVAL
+                seq, start, stop = ival, ival.start, ival.stop
+            try:
+                t = (self.seqs.getSeqID(seq), start, stop)
+            except KeyError: # SEQUENCE NOT IN OUR seqDict
+                t = None
+            if t is not None and self.sliceCache is not None:
+                try:
+                    t = self.sliceCache.get(*t)[1] # ANSWER FROM CACHE
+                except KeyError:
+                    pass
+            queries.append(t)
+        l = getSlices([t for t in queries if isinstance(t, tuple)])
+        l.reverse() # SO WE CAN pop() RESULTS IN ORDER
+        results = []
+        for t in queries:
+            if t is None:
+                results.append([])
+            elif isinstance(t, list): # CACHED RESULT
+                results.append(t)
+            else:
+                try:
+                    results.append(self.save_slice_result(l.pop(), *t)[1])
+                except (KeyError, EmptySliceError): # NOT ALIGNED
+                    results.append([])
+        return results
+
+    def save_slice_result(self, result, seqID=None, start=0, stop=0):
+        '''save sequence info from a getSlice() result to our index,
+        cache it as the result for seqID[start:stop] if seqID is given,
+        and return its nlmsa_id and raw intervals'''
         if result == '':
             raise KeyError('this interval is not aligned!')
         elif result == 'EMPTY':
+            if seqID is not None and self.sliceCache is not None:
+                self.sliceCache.save(seqID, start, stop, -1, [])
             raise EmptySliceError
         id, l, d = result
-        for nlmsaID, (seqID, nsID) in d: # SAVE SEQ INFO TO INDEX
-            self.seqs.saveSeq(seqID, nsID, 0, nlmsaID)
+        for nlmsaID, (seqID2, nsID) in d: # SAVE SEQ INFO TO INDEX
+            self.seqs.saveSeq(seqID2, nsID, 0, nlmsaID)
+        if seqID is not None and self.sliceCache is not None:
+            self.sliceCache.save(seqID, start, stop, id, l)
         return id, l # HAND BACK THE RAW INTEGER INTERVAL DATA
 
     def __getitem__(self, k):
@@ -1,5 +1,6 @@
+import os
 import unittest
-from testlib import testutil, PygrTestProgram
+from testlib import testutil, PygrTestProgram, SkipTest
 from pygr import cnestedlist, nlmsa_utils, seqdb, sequence
 
 
@@ -35,6 +36,217 @@ class NestedList_Test(unittest.TestCase):
         # fails on windows
         #tempdir.remove()  @CTB
 
+    def test_filedb_mmap(self):
+        "NestedList filedb with memory-mapped index files"
+        ivals = [(i, i + 50 + (i % 7) * 20, 1, i, i + 50 + (i % 7) * 20)
+                 for i in range(0, 5000, 3)]
+        db = cnestedlist.IntervalDB()
+        db.save_tuples(ivals)
+        tempdir = testutil.TempDir('nlmsa-test')
+        filename = tempdir.subfile('nlmsa')
+        db.write_binaries(filename, div=16) # force multiple blocks, sublists
+        fdb = cnestedlist.IntervalFileDB(filename)
+        mdb = cnestedlist.IntervalFileDB(filename, useMmap=True)
+        assert not fdb.is_mmapped()
+        assert mdb.is_mmapped()
+        for start, end in [(0, 10), (100, 400), (-600, -550), (4990, 6000),
+                           (7000, 8000)]:
+            l = db.find_overlap_list(start, end)
+            assert fdb.find_overlap_list(start, end) == l
+            assert mdb.find_overlap_list(start, end) == l
+            assert list(mdb.find_overlap(start, end)) == l
+        mdb.close()
+        fdb.close()
+
+    def test_filedb_compressed(self):
+        "NestedList filedb with compressed .idbz blocks"
+        ivals = [(i, i + 50 + (i % 7) * 20, i % 5, 2 * i,
+                  2 * i + 50 + (i % 7) * 20) for i in range(0, 5000, 3)]
+        db = cnestedlist.IntervalDB()
+        db.save_tuples(ivals)
+        tempdir = testutil.TempDir('nlmsa-test')
+        filename = tempdir.subfile('nlmsa')
+        db.write_binaries(filename, div=16, compress=True)
+        zdb = cnestedlist.IntervalFileDB(filename, cacheBlocks=4)
+        assert zdb.is_compressed()
+        assert zdb.cache_info() == dict(hits=0, misses=0, maxsize=4)
+        for start, end in [(0, 10), (100, 400), (-600, -550), (4990, 6000),
+                           (7000, 8000), (0, 5000)]:
+            l = db.find_overlap_list(start, end)
+            assert zdb.find_overlap_list(start, end) == l
+            assert list(zdb.find_overlap(start, end)) == l
+        info = zdb.cache_info()
+        assert info['hits'] > 0 and info['misses'] > 0
+        zdb.close()
+
+    def test_filedb_corrupt(self):
+        "NestedList filedb reports truncated or corrupt files as IOError"
+        import struct
+        ivals = [(i, i + 50 + (i % 7) * 20, 1, i, i + 50 + (i % 7) * 20)
+                 for i in range(0, 5000, 3)]
+        db = cnestedlist.IntervalDB()
+        db.save_tuples(ivals)
+        tempdir = testutil.TempDir('nlmsa-test')
+        filename = tempdir.subfile('nlmsa')
+        db.write_binaries(filename, div=16)
+        zfilename = tempdir.subfile('nlmsaz')
+        db.write_binaries(zfilename, div=16, compress=True)
+        size = os.path.getsize(filename + '.idb')
+        ifile = open(filename + '.idb', 'r+b')
+        ifile.truncate(size // 2) # drop the last half of the records
+        ifile.close()
+        size = os.path.getsize(zfilename + '.idbz')
+        ifile = open(zfilename + '.idbz', 'r+b')
+        ifile.seek(size // 2)
+        ifile.write('\xff' * (size - size // 2)) # undecodable blocks
+        ifile.close()
+        fdb = cnestedlist.IntervalFileDB(filename)
+        self.assertRaises(IOError, fdb.find_overlap_list, 4000, 5000)
+        self.assertRaises(IOError, list, fdb.scan())
+        fdb.close()
+        for useMmap in (False, True):
+            zdb = cnestedlist.IntervalFileDB(zfilename, useMmap=useMmap)
+            self.assertRaises(IOError, zdb.find_overlap_list, 0, 5000)
+            zdb.close()
+        zfilename = tempdir.subfile('nlmsaz2')
+        db.write_binaries(zfilename, div=16, compress=True)
+        ifile = open(zfilename + '.zindex', 'r+b')
+        nblocks = struct.unpack('i', ifile.read(4))[0]
+        ifile.seek(4 + 8 * nblocks) # the end-of-file offset
+        ifile.write(struct.pack('q', os.path.getsize(zfilename + '.idbz')
+                                + 4096)) # past the end of the .idbz
+        ifile.close()
+        for useMmap in (False, True):
+            self.assertRaises(IOError, cnestedlist.IntervalFileDB, zfilename,
+                              useMmap=useMmap)
+
+    def test_threaded_queries(self):
+        "NestedList searches and shared iterators from several threads"
+        import threading
+        ivals = [(i, i + 50 + (i % 7) * 20, i % 5, 2 * i,
+                  2 * i + 50 + (i % 7) * 20) for i in range(0, 20000, 3)]
+        db = cnestedlist.IntervalDB()
+        db.save_tuples(ivals)
+        tempdir = testutil.TempDir('nlmsa-test')
+        filename = tempdir.subfile('nlmsa')
+        db.write_binaries(filename, div=16)
+        zfilename = tempdir.subfile('nlmsaz')
+        db.write_binaries(zfilename, div=16, compress=True)
+        dbs = [db, cnestedlist.IntervalFileDB(filename),
+               cnestedlist.IntervalFileDB(filename, useMmap=True),
+               cnestedlist.IntervalFileDB(zfilename, cacheBlocks=4)]
+        queries = [(i, i + 2000) for i in range(-20000, 20000, 1700)]
+        expected = [db.find_overlap_list(start, end)
+                    for start, end in queries]
+        shared = [(d, d.find_overlap(-20000, 20000)) for d in dbs]
+        shared_hits = [[] for d in dbs]
+        errors = []
+
+        def run():
+            try:
+                for d in dbs:
+                    for (start, end), l in zip(queries, expected):
+                        assert d.find_overlap_list(start, end) == l
+                        assert list(d.find_overlap(start, end)) == l
+                for i, (d, it) in enumerate(shared):
+                    for ival in it: # SEVERAL THREADS CONSUME ONE ITERATOR
+                        shared_hits[i].append(ival)
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=run) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert errors == []
+        l = db.find_overlap_list(-20000, 20000)
+        l.sort()
+        for hits in shared_hits: # EACH HIT RETURNED EXACTLY ONCE
+            hits.sort()
+            assert hits == l
+        for d in dbs[1:]:
+            d.close()
+
+    def test_threaded_scan(self):
+        "IntervalFileDB scan() while other threads search the same db"
+        try:
+            import numpy
+        except ImportError:
+            raise SkipTest('numpy not installed')
+        import threading
+        ivals = [(i, i + 50 + (i % 7) * 20, i % 5, 2 * i,
+                  2 * i + 50 + (i % 7) * 20) for i in range(0, 20000, 3)]
+        db = cnestedlist.IntervalDB()
+        db.save_tuples(ivals)
+        tempdir = testutil.TempDir('nlmsa-test')
+        filename = tempdir.subfile('nlmsa')
+        db.write_binaries(filename, div=16)
+        zfilename = tempdir.subfile('nlmsaz')
+        db.write_binaries(zfilename, div=16, compress=True)
+        queries = [(i, i + 2000) for i in range(-20000, 20000, 1700)]
+        expected = [db.find_overlap_list(start, end)
+                    for start, end in queries]
+        for stem, kwargs in ((filename, {}), (filename, {'useMmap': True}),
+                             (zfilename, {'cacheBlocks': 4})):
+            fdb = cnestedlist.IntervalFileDB(stem, **kwargs)
+            errors = []
+            done = []
+
+            def run():
+                try:
+                    while not done: # search until the scan finishes
+                        for (start, end), l in zip(queries, expected):
+                            assert fdb.find_overlap_list(start, end) == l
+                except Exception, e:
+                    errors.append(e)
+            threads = [threading.Thread(target=run) for i in range(2)]
+            for t in threads:
+                t.start()
+            try:
+                for k in range(5):
+                    l = []
+                    for a in fdb.scan(blockSize=64):
+                        l += [tuple(x) for x in a]
+                    assert sorted(l) == sorted(ivals)
+            finally:
+                done.append(True)
+                for t in threads:
+                    t.join()
+            assert errors == []
+            fdb.close()
+
+    def test_filedb_format_version(self):
+        "NestedList filedb .size format version check"
+        db = cnestedlist.IntervalDB()
+        db.save_tuples([(i, i + 100, 1, i, i + 100)
+                        for i in range(0, 1000, 10)])
+        tempdir = testutil.TempDir('nlmsa-test')
+        filename = tempdir.subfile('nlmsa')
+        db.write_binaries(filename)
+        sizefile = filename + '.size'
+        fields = open(sizefile).read().split()
+        assert len(fields) == 6 # n ntop div nlists nii version
+        version = int(fields[5])
+        assert version in (1, 2)
+        l = db.find_overlap_list(50, 60)
+        assert cnestedlist.IntervalFileDB(filename).find_overlap_list(50, 60) \
+               == l
+
+        ifile = open(sizefile, 'w') # unversioned files used 32-bit records
+        ifile.write(' '.join(fields[:5]) + '\n')
+        ifile.close()
+        if version == 1:
+            fdb = cnestedlist.IntervalFileDB(filename)
+            assert fdb.find_overlap_list(50, 60) == l
+            fdb.close()
+        else:
+            self.assertRaises(IOError, cnestedlist.IntervalFileDB, filename)
+
+        ifile = open(sizefile, 'w') # a layout this build cannot read
+        ifile.write(' '.join(fields[:5] + ['99']) + '\n')
+        ifile.close()
+        self.assertRaises(IOError, cnestedlist.IntervalFileDB, filename)
+
 
 class NLMSA_SimpleTests(unittest.TestCase):
 
@@ -260,6 +472,830 @@ class NLMSA_BuildWithAlignedIntervals_Test(unittest.TestCase):
         n.add_aligned_intervals(cti(ivals))
         n.build()
 
+class NLMSA_Disk_Test(unittest.TestCase):
+    "Tests of on-disk NLMSA storage"
+
+    def setUp(self):
+        self.tempdir = testutil.TempDir('nlmsa-disk-test')
+        filename = self.tempdir.subfile('seqs.fasta')
+        ofile = file(filename, 'w')
+        try:
+            for i in range(4):
+                ofile.write('>seq%d\n%s\n' % (i, 'ACGT' * 500))
+        finally:
+            ofile.close()
+        self.db = seqdb.SequenceFileDB(filename)
+        self.pathstem = self.tempdir.subfile('diskmsa')
+        self._build(self.pathstem)
+
+    def _build(self, pathstem, nprocs=1, maxMemory=None, **kwargs):
+        msa = cnestedlist.NLMSA(pathstem, 'w', seqDict=self.db,
+                                pairwiseMode=True, **kwargs)
+        self._align(msa, range(1, 4))
+        msa.build(nprocs=nprocs, maxMemory=maxMemory)
+        msa.close()
+
+    def _align(self, msa, seqnums):
+        s0 = self.db['seq0']
+        for i in seqnums:
+            s = self.db['seq%d' % i]
+            for j in range(0, 1900, 7): # overlapping, nested intervals
+                msa += s0
+                msa[s0[j:j + 30 + i * 10]] += s[j:j + 30 + i * 10]
+
+    def tearDown(self):
+        self.db.close()
+
+    def _query_results(self, msa):
+        s0 = self.db['seq0']
+        l = []
+        for start, stop in [(0, 50), (100, 900), (1500, 2000), (1990, 2000)]:
+            ivals = [(str(src.id), src.start, src.stop,
+                      str(dest.id), dest.start, dest.stop)
+                     for src, dest, e in msa[s0[start:stop]].edges()]
+            ivals.sort()
+            l.append(ivals)
+        return l
+
+    def test_mmap(self):
+        "NLMSA mmap read mode gives same results as regular file reads"
+        msa = cnestedlist.NLMSA(self.pathstem, 'r', seqDict=self.db)
+        correct = self._query_results(msa)
+        assert len(correct[1]) > 0
+        msa.close()
+        msa = cnestedlist.NLMSA(self.pathstem, 'r', seqDict=self.db,
+                                useMmap=True)
+        assert msa.useMmap
+        assert self._query_results(msa) == correct
+        msa.close()
+
+    def test_query_many(self):
+        "NLMSA.query_many matches individual slice queries"
+        msa = cnestedlist.NLMSA(self.pathstem, 'r', seqDict=self.db)
+        s0 = self.db['seq0']
+        s3 = self.db['seq3']
+        ivals = [s0[1500:2000], s0[0:50], -s0[100:300], s3[10:20],
+                 s0[1995:2000], (s0, 400, 450)]
+        results = msa.query_many(ivals)
+        assert len(results) == len(ivals)
+        for ival, result in zip(ivals, results):
+            if isinstance(ival, tuple):
+                ival = ival[0][ival[1]:ival[2]]
+            assert result == msa[ival].rawIvals()
+        assert len(results[0]) > 1
+        assert len(results[2]) > 1
+        # a sequence that is not in the alignment has no results
+        other = sequence.Sequence('ACGT' * 10, 'other')
+        assert msa.query_many([other[0:10], s0[0:50]]) == [[], results[1]]
+        msa.close()
+
+    def test_parallel_build(self):
+        "NLMSA build(nprocs=N) gives same results as a serial build"
+        msa = cnestedlist.NLMSA(self.pathstem, 'r', seqDict=self.db)
+        correct = self._query_results(msa)
+        msa.close()
+        pathstem = self.tempdir.subfile('parallelmsa')
+        self._build(pathstem, nprocs=2)
+        assert not os.path.exists(pathstem + '1.build')
+        assert open(pathstem + '.NLMSAindex').read() == \
+               open(self.pathstem + '.NLMSAindex').read()
+        msa = cnestedlist.NLMSA(pathstem, 'r', seqDict=self.db)
+        assert self._query_results(msa) == correct
+        msa.close()
+
+    def test_compressed(self):
+        "NLMSA compressed .idbz storage gives same results"
+        msa = cnestedlist.NLMSA(self.pathstem, 'r', seqDict=self.db)
+        correct = self._query_results(msa)
+        msa.close()
+        pathstem = self.tempdir.subfile('zmsa')
+        self._build(pathstem, compressIdb=True)
+        assert not os.path.exists(pathstem + '1.idb')
+        assert os.path.exists(pathstem + '1.idbz')
+        msa = cnestedlist.NLMSA(pathstem, 'r', seqDict=self.db, cacheBlocks=2)
+        assert self._query_results(msa) == correct
+        msa.close()
+
+        cnestedlist.compress_nlmsa(self.pathstem) # convert existing files
+        assert not os.path.exists(self.pathstem + '1.idb')
+        msa = cnestedlist.NLMSA(self.pathstem, 'r', seqDict=self.db,
+                                useMmap=True)
+        assert self._query_results(msa) == correct
+        msa.close()
+
+    def test_external_sort(self):
+        "NLMSA build(maxMemory=N) sorts on disk, giving same results"
+        msa = cnestedlist.NLMSA(self.pathstem, 'r', seqDict=self.db)
+        correct = self._query_results(msa)
+        msa.close()
+        pathstem = self.tempdir.subfile('extmsa')
+        self._build(pathstem, maxMemory=1000) # forces many sorted runs
+        assert open(pathstem + '0.size').read() == \
+               open(self.pathstem + '0.size').read()
+        for suffix in ('.build', '.sorted', '.listed', '.run.0'):
+            assert not os.path.exists(pathstem + '0' + suffix)
+        msa = cnestedlist.NLMSA(pathstem, 'r', seqDict=self.db)
+        assert self._query_results(msa) == correct
+        msa.close()
+        for maxMemory in (None, 1000): # build arguments reach both paths
+            pathstem = self.tempdir.subfile('divmsa%s' % maxMemory)
+            msa = cnestedlist.NLMSA(pathstem, 'w', seqDict=self.db,
+                                    pairwiseMode=True)
+            self._align(msa, range(1, 4))
+            msa.build(maxMemory=maxMemory, buildInPlace=False, div=16)
+            msa.close()
+            assert open(pathstem + '0.size').read().split()[2] == '16'
+            msa = cnestedlist.NLMSA(pathstem, 'r', seqDict=self.db)
+            assert self._query_results(msa) == correct
+            msa.close()
+            msa = cnestedlist.NLMSA(pathstem + 'x', 'w', seqDict=self.db,
+                                    pairwiseMode=True)
+            self._align(msa, range(1, 2))
+            self.assertRaises(TypeError, msa.build, maxMemory=maxMemory,
+                              buildInPlace=False, bogus=1)
+            msa.close()
+
+    def _write_maf(self, filename, offset):
+        ofile = file(filename, 'w')
+        try:
+            ofile.write('##maf version=1\n')
+            for i in range(offset, offset + 40):
+                start = i * 40
+                ofile.write('a score=%d.0\n' % i)
+                for j in range(4):
+                    if (i + j) % 4 == 3: # leave a different seq out of each block
+                        continue
+                    text = 'ACGT' * 5
+                    if j == 1:
+                        text = 'AC--' + text[4:] # gapped
+                    ofile.write('s seq%d %d %d + 2000 %s\n'
+                                % (j, start, len(text.replace('-', '')), text))
+                ofile.write('\n')
+        finally:
+            ofile.close()
+
+    def test_maf_parallel(self):
+        "NLMSA reading mafFiles with nprocs=N gives same results as serial"
+        mafFiles = [self.tempdir.subfile('a.maf'),
+                    self.tempdir.subfile('b.maf')]
+        self._write_maf(mafFiles[0], 0)
+        self._write_maf(mafFiles[1], 40)
+        assert len(nlmsa_utils.split_maf_files(mafFiles, 8)) > 2
+        results = []
+        for nprocs in (1, 2):
+            pathstem = self.tempdir.subfile('maf%d' % nprocs)
+            msa = cnestedlist.NLMSA(pathstem, 'w', seqDict=self.db,
+                                    mafFiles=mafFiles, nprocs=nprocs)
+            msa.close()
+            assert not os.path.exists(pathstem + '.maf0')
+            msa = cnestedlist.NLMSA(pathstem, 'r', seqDict=self.db)
+            results.append((open(pathstem + '.NLMSAindex').read(),
+                            self._query_results(msa)))
+            msa.close()
+        assert len(results[0][1][1]) > 0
+        assert results[0] == results[1]
+
+    def test_conservation_arrays(self):
+        "NLMSASlice conservation arrays match per-interval string comparison"
+        try:
+            import numpy
+        except ImportError:
+            raise SkipTest('numpy not installed')
+        mafFile = self.tempdir.subfile('a.maf')
+        self._write_maf(mafFile, 0)
+        pathstem = self.tempdir.subfile('consmaf')
+        msa = cnestedlist.NLMSA(pathstem, 'w', seqDict=self.db,
+                                mafFiles=[mafFile])
+        msa.close()
+        msa = cnestedlist.NLMSA(pathstem, 'r', seqDict=self.db)
+        s0 = self.db['seq0']
+        myslice = msa[s0[50:700]]
+        seqs, aligned, identical = myslice.conservationArrays()
+        assert len(seqs) == 3
+        assert aligned.shape == identical.shape == (3, 650)
+        s = str(s0[50:700])
+        for i, ival in enumerate(seqs):
+            correct = numpy.zeros((2, 650), numpy.bool_)
+            for src, dest in myslice.matchIntervals(ival):
+                for j, c in enumerate(str(dest)):
+                    if 50 <= src.start + j < 700:
+                        correct[0, src.start + j - 50] = True
+                        correct[1, src.start + j - 50] = \
+                                s[src.start + j - 50] == c
+            assert (aligned[i] == correct[0]).all()
+            assert (identical[i] == correct[1]).all()
+        assert aligned[0].sum() > 0
+        pAligned, pIdentity = myslice.conservationProfile()
+        assert (pAligned == aligned.mean(axis=0)).all()
+        assert (pIdentity == identical.mean(axis=0)).all()
+        # VECTORIZED Seq2SeqEdge METHODS AGREE WITH THE PYTHON LOOPS
+        results = []
+        for useNumpy in (numpy, None):
+            sequence.numpy = useNumpy
+            try:
+                results.append([(e.pIdentity(), e.conservedSegment())
+                                for src, dest, e in myslice.edges()])
+            finally:
+                sequence.numpy = numpy
+        assert len(results[0]) > 0
+        assert results[0] == results[1]
+        msa.close()
+
+    def test_split_native(self):
+        "split() with only merge rules gives the known subslices"
+        msa = cnestedlist.NLMSA(self.pathstem, 'r', seqDict=self.db)
+        s0 = self.db['seq0']
+
+        def pairs(bounds):
+            return zip(bounds[:-1], bounds[1:])
+        # subslice boundaries computed by the python group-by that split()
+        # used before it ran natively.  That code raised IndexError for the
+        # minAligned=1 and pMinAligned cases, which give the same subslices
+        # as mergeAll=False here because every subslice passes them.
+        fwd = [100, 102, 103, 105, 106, 109, 110, 112, 113, 116, 117, 119,
+               120, 123, 124, 126, 127, 130]
+        rev = [-1530, -1527, -1526, -1524, -1523, -1520, -1519, -1517, -1516,
+               -1513, -1512, -1510, -1509, -1506, -1505, -1503, -1502, -1500]
+        for ival, bounds, gapMerged in ((s0[100:130], fwd, fwd[:1] + fwd[3:]),
+                                        (-s0[1500:1530], rev,
+                                         rev[:3] + rev[5:])):
+            myslice = msa[ival]
+            for kwargs, correct in (
+                ({}, []),
+                (dict(mergeAll=False), pairs(bounds)),
+                (dict(mergeAll=False, maxgap=5, maxinsert=5),
+                 pairs(gapMerged)),
+                (dict(mergeMost=True, minAligned=2),
+                 [(bounds[0], bounds[-1])]),
+                (dict(mergeAll=False, pMinAligned=0.5), pairs(bounds))):
+                native = [(x.start, x.stop) for x in myslice.split(**kwargs)]
+                assert native == correct
+                # filterSeqs=None changes nothing, but forces the generic
+                # groupByIntervals() / groupBySequences() path
+                generic = [(x.start, x.stop) for x in
+                           myslice.split(filterSeqs=None, **kwargs)]
+                assert generic == correct
+            assert [(x.start, x.stop) for x in
+                    myslice.split(mergeAll=False, minAligned=1)] == \
+                   pairs(bounds)
+        msa.close()
+
+    def test_maf_gzip(self):
+        "NLMSA reads gzipped MAF files and file-like streams"
+        import gzip
+        from StringIO import StringIO
+        mafFile = self.tempdir.subfile('a.maf')
+        self._write_maf(mafFile, 0)
+        text = open(mafFile).read()
+        ofile = gzip.GzipFile(mafFile + '.gz', 'wb')
+        ofile.write(text)
+        ofile.close()
+        results = []
+        for i, mafFiles, nprocs in ((0, [mafFile], 1),
+                                    (1, [mafFile + '.gz'], 1),
+                                    (2, [mafFile + '.gz'], 2),
+                                    (3, [StringIO(text)], 1)):
+            pathstem = self.tempdir.subfile('gzmaf%d' % i)
+            msa = cnestedlist.NLMSA(pathstem, 'w', seqDict=self.db,
+                                    mafFiles=mafFiles, nprocs=nprocs)
+            msa.close()
+            msa = cnestedlist.NLMSA(pathstem, 'r', seqDict=self.db)
+            results.append(self._query_results(msa))
+            msa.close()
+        assert len(results[0][1]) > 0
+        for result in results[1:]:
+            assert result == results[0]
+
+        class BadStream(object):
+            name = 'bad.maf'
+
+            def readline(self, size=-1):
+                raise ValueError('stream read failed')
+        pathstem = self.tempdir.subfile('badmaf')
+        # a read error is reported as such, not as a bad MAF header
+        self.assertRaises(ValueError, cnestedlist.NLMSA, pathstem, 'w',
+                          seqDict=self.db, mafFiles=[BadStream()])
+
+    def test_axtnet_gzip(self):
+        "NLMSA reads gzipped axtNet files and named file-like streams"
+        import gzip
+        from StringIO import StringIO
+        srcDB = seqdb.SequenceFileDB(self.db.filepath)
+        destDB = seqdb.SequenceFileDB(self.db.filepath)
+        genomes = seqdb.PrefixUnionDict(dict(src=srcDB, dest=destDB))
+        l = []
+        for i in range(40):
+            src, dest = 'ACGT' * 5, 'AC--' + 'ACGT' * 4
+            l.append('%d seq0 %d %d seq%d %d %d + 100\n%s\n%s\n\n'
+                     % (i, i * 40 + 1, i * 40 + 20, i % 3 + 1, i * 40 + 1,
+                        i * 40 + 18, src, dest))
+        text = ''.join(l)
+        axtFile = self.tempdir.subfile('chr.src.dest.net.axt')
+        ofile = file(axtFile, 'w')
+        ofile.write(text)
+        ofile.close()
+        ofile = gzip.GzipFile(axtFile + '.gz', 'wb')
+        ofile.write(text)
+        ofile.close()
+        stream = StringIO(text)
+        stream.name = axtFile
+        s0 = genomes['src.seq0']
+        results = []
+        for i, axtFiles in enumerate(([axtFile], [axtFile + '.gz'],
+                                      [stream])):
+            pathstem = self.tempdir.subfile('axtmsa%d' % i)
+            msa = cnestedlist.NLMSA(pathstem, 'w', seqDict=genomes,
+                                    axtFiles=axtFiles)
+            msa.close()
+            msa = cnestedlist.NLMSA(pathstem, 'r', seqDict=genomes)
+            results.append([(str(src), src.start, src.stop, str(dest.id),
+                             dest.start, dest.stop)
+                            for src, dest, e in msa[s0].edges()])
+            msa.close()
+        assert len(results[0]) == 80 # each gapped block gives 2 intervals
+        for result in results[1:]:
+            assert result == results[0]
+        pathstem = self.tempdir.subfile('noname')
+        self.assertRaises(IOError, cnestedlist.NLMSA, pathstem, 'w',
+                          seqDict=genomes, axtFiles=[StringIO(text)])
+        srcDB.close()
+        destDB.close()
+
+    def test_append(self):
+        "NLMSA mode='a' appends to an on-disk NLMSA, and compact() merges"
+        msa = cnestedlist.NLMSA(self.pathstem, 'r', seqDict=self.db)
+        correct = self._query_results(msa)
+        msa.close()
+        pathstem = self.tempdir.subfile('appendmsa')
+        msa = cnestedlist.NLMSA(pathstem, 'w', seqDict=self.db,
+                                pairwiseMode=True)
+        self._align(msa, [1])
+        msa.build()
+        msa.close()
+        for i in (2, 3): # second append must merge with the existing delta
+            msa = cnestedlist.NLMSA(pathstem, 'a', seqDict=self.db)
+            self._align(msa, [i])
+            msa.build()
+            msa.close()
+        assert os.path.exists(pathstem + '0.delta.idb')
+        msa = cnestedlist.NLMSA(pathstem, 'r', seqDict=self.db)
+        assert self._query_results(msa) == correct
+        msa.compact()
+        assert not os.path.exists(pathstem + '0.delta.idb')
+        assert self._query_results(msa) == correct
+        msa.close()
+        msa = cnestedlist.NLMSA(pathstem, 'r', seqDict=self.db)
+        assert self._query_results(msa) == correct
+        msa.close()
+        self.assertRaises(ValueError, cnestedlist.NLMSA, pathstem, 'a',
+                          seqDict=self.db, mafFiles=[])
+
+    def test_compact_interrupted(self):
+        "compact_nlmsa() swaps files safely, and finishes an interrupted swap"
+        msa = cnestedlist.NLMSA(self.pathstem, 'r', seqDict=self.db)
+        correct = self._query_results(msa)
+        msa.close()
+        pathstem = self.tempdir.subfile('crashmsa')
+        msa = cnestedlist.NLMSA(pathstem, 'w', seqDict=self.db,
+                                pairwiseMode=True)
+        self._align(msa, [1, 2])
+        msa.build()
+        msa.close()
+        msa = cnestedlist.NLMSA(pathstem, 'a', seqDict=self.db)
+        self._align(msa, [3])
+        msa.build()
+        msa.close()
+        stem = pathstem + '0'
+        calls = []
+        rename, remove = os.rename, os.remove
+        def crashing_rename(src, dest):
+            calls.append(('rename', dest[len(stem):]))
+            if len([c for c in calls if c[0] == 'rename']) == 2:
+                raise OSError('simulated crash')
+            rename(src, dest)
+        def logged_remove(path):
+            calls.append(('remove', path[len(stem):]))
+            remove(path)
+        os.rename, os.remove = crashing_rename, logged_remove
+        try:
+            self.assertRaises(OSError, cnestedlist.compact_nlmsa, pathstem)
+        finally:
+            os.rename, os.remove = rename, remove
+        swaps = [c for c in calls if c[1].startswith('.delta')
+                 or c[0] == 'rename']
+        assert swaps[0] == ('remove', '.delta.size') # delta vanishes first
+        kinds = [c[0] for c in swaps]
+        assert kinds == ['remove'] * (len(kinds) - 2) + ['rename'] * 2
+        assert swaps[-1][1] != '.size'
+        assert not os.path.exists(stem + '.delta.size')
+        assert os.path.exists(stem + '.compact.ready')
+        assert os.path.exists(stem + '.compact.size') # renamed last
+        cnestedlist.compact_nlmsa(pathstem) # finishes the swap
+        assert not os.path.exists(stem + '.compact.ready')
+        assert not os.path.exists(stem + '.compact.size')
+        msa = cnestedlist.NLMSA(pathstem, 'r', seqDict=self.db)
+        assert self._query_results(msa) == correct
+        msa.close()
+
+    def test_scan(self):
+        "NLMSA.scan() reads every stored interval, in coordinate order"
+        try:
+            import numpy
+        except ImportError:
+            raise SkipTest('numpy not installed')
+        pathstem = self.tempdir.subfile('scanmsa')
+        self._build(pathstem, compressIdb=True)
+        msa = cnestedlist.NLMSA(pathstem, 'a', seqDict=self.db)
+        self._align(msa, [2]) # SCAN MUST INCLUDE THE DELTA
+        s0 = self.db['seq0']
+        s3 = self.db['seq3']
+        for j in range(0, 1900, 50): # negative orientation alignments
+            msa[-s0[j:j + 20]] += s3[j + 5:j + 25]
+        msa.build()
+        msa.close()
+        assert os.path.exists(pathstem + '0.delta.idb')
+        msa = cnestedlist.NLMSA(pathstem, 'r', seqDict=self.db)
+        self.assertRaises(NotImplementedError, iter, msa)
+        correct = {}
+        for ns in msa.seqlist:
+            l = []
+            for stem in (ns.filestem, ns.filestem + '.delta'):
+                if not os.path.exists(stem + '.size'):
+                    continue
+                db = cnestedlist.IntervalFileDB(stem)
+                l += db.find_overlap_list(0, msa.maxlen)
+                # a negative orientation query returns the same intervals
+                l2 = [(-t[1], -t[0], t[2], -t[4], -t[3])
+                      for t in db.find_overlap_list(-msa.maxlen, 0)]
+                assert sorted(l2) == sorted(db.find_overlap_list(0,
+                                                                 msa.maxlen))
+                db.close()
+            correct[ns.id] = sorted(l)
+        # maxMemory=1000 forces the on-disk sort
+        for sort, maxMemory in ((True, 64000000), (True, 1000), (False, 0)):
+            results = dict([(ns.id, []) for ns in msa.seqlist])
+            for ns, ivals in msa.scan(sort=sort, blockSize=100,
+                                      maxMemory=maxMemory):
+                assert 0 < len(ivals) <= 100
+                results[ns.id] += [tuple(t) for t in ivals]
+            for nsID, l in results.items():
+                if sort:
+                    starts = [t[0] for t in l]
+                    assert starts == sorted(starts)
+                assert sorted(l) == correct[nsID]
+        assert len(correct[0]) > 0
+        assert [t for t in correct[0] if t[3] < 0] # both orientations
+        msa.close()
+
+    def test_numpy_arrays(self):
+        "NLMSASlice numpy arrays match rawIvals() and matchIntervals()"
+        try:
+            import numpy
+        except ImportError:
+            raise SkipTest('numpy not installed')
+        msa = cnestedlist.NLMSA(self.pathstem, 'r', seqDict=self.db)
+        s0 = self.db['seq0']
+        s2 = self.db['seq2']
+        myslice = msa[s0[100:900]]
+        a = myslice.intervalArray()
+        assert [tuple(t) for t in a] == myslice.rawIvals()
+        assert not a.flags.writeable
+        b = myslice.seqBoundsArray()
+        assert sorted(set(b['target_id'])) == sorted(set(a['target_id']))
+        for seq in (None, s2, -s2):
+            m = myslice.matchIntervalArray(seq)
+            l = [(ival1.start, ival1.stop, ival2.start, ival2.stop)
+                 for ival1, ival2 in myslice.matchIntervals(seq)]
+            assert [(t['start'], t['end'], t['target_start'], t['target_end'])
+                    for t in m] == l
+        assert len(myslice.matchIntervalArray(s2)) > 0
+        del myslice # arrays must keep the slice's memory alive
+        assert [tuple(t) for t in a] == msa[s0[100:900]].rawIvals()
+        # only aligned to its LPO coordinates, which are excluded
+        assert len(msa[self.db['seq3'][1990:2000]].matchIntervalArray()) == 0
+        empty = nlmsa_utils.EmptySlice(s0[0:10])
+        assert len(empty.intervalArray()) == 0
+        msa.close()
+
+    def _start_server(self):
+        'run a binary NLMSA server process, return (process, port)'
+        import subprocess
+        import sys
+        import time
+        from pygr import xnestedlist
+        portfile = self.tempdir.subfile('server_port')
+        script = '''import sys
+sys.path.insert(0, %r)
+from pygr import seqdb, xnestedlist
+db = seqdb.SequenceFileDB(%r)
+msa = xnestedlist.NLMSAServer(%r, seqDict=db)
+server = xnestedlist.NLMSABinaryServer(msa, 'localhost', 0)
+ofile = open(%r + '.tmp', 'w')
+ofile.write(str(server.port))
+ofile.close()
+import os
+os.rename(%r + '.tmp', %r)
+server.serve_forever()
+''' % (os.path.dirname(os.path.dirname(xnestedlist.__file__)),
+       self.tempdir.subfile('seqs.fasta'), self.pathstem, portfile,
+       portfile, portfile)
+        p = subprocess.Popen([sys.executable, '-c', script],
+                             stderr=subprocess.PIPE)
+        for i in range(100): # WAIT FOR THE SERVER TO START
+            if os.path.exists(portfile) or p.poll() is not None:
+                break
+            time.sleep(0.1)
+        if not os.path.exists(portfile):
+            if p.poll() is None:
+                p.terminate()
+            raise AssertionError(p.stderr.read())
+        return p, int(open(portfile).read())
+
+    def test_binary_server(self):
+        "NLMSAClient queries a binary protocol server process"
+        from pygr import xnestedlist
+        p, port = self._start_server()
+        try:
+            msa = cnestedlist.NLMSA(self.pathstem, 'r', seqDict=self.db)
+            correct = self._query_results(msa)
+            # an idle open connection must not block other clients
+            idle = xnestedlist.NLMSAClient('nlmsa://localhost:%d' % port,
+                                           seqDict=self.db)
+            client = xnestedlist.NLMSAClient('nlmsa://localhost:%d' % port,
+                                             seqDict=self.db, maxCacheBytes=0)
+            assert self._query_results(client) == correct
+            s0 = self.db['seq0']
+            ivals = [s0[1500:2000], s0[0:50], -s0[100:300], s0[1995:2000],
+                     (s0, 400, 450)] * 300 # SEVERAL PIPELINED FRAMES
+            results = client.query_many(ivals)
+            assert results == msa.query_many(ivals)
+            assert len(results[0]) > 1
+            client.close()
+            # sub-interval queries are answered from the client cache
+            client = xnestedlist.NLMSAClient('nlmsa://localhost:%d' % port,
+                                             seqDict=self.db)
+            ivals = [s0[0:2000], -s0[0:2000]]
+            assert client.query_many(ivals) == msa.query_many(ivals)
+            ivals = [s0[1500:2000], s0[0:50], -s0[100:300], s0[1995:2000],
+                     (s0, 400, 450)]
+            assert client.query_many(ivals) == msa.query_many(ivals)
+            info = client.sliceCache.cache_info()
+            assert (info['hits'], info['misses']) == (5, 2)
+            assert self._query_results(client) == correct
+            assert client.sliceCache.cache_info()['misses'] == 2
+            client.close()
+            assert self._query_results(idle) == correct
+            idle.close()
+            msa.close()
+        finally:
+            p.terminate()
+            p.wait()
+
+    def test_threaded_server(self):
+        "threaded binary and XMLRPC servers answer concurrent clients"
+        import threading
+        import xmlrpclib
+        from pygr import coordinator, xnestedlist
+        msa = cnestedlist.NLMSA(self.pathstem, 'r', seqDict=self.db)
+        correct = self._query_results(msa)
+        msa.close()
+        nlmsa = xnestedlist.NLMSAServer(self.pathstem, 'r', seqDict=self.db,
+                                        useMmap=True, maxOpenIndexes=1)
+        server = xnestedlist.NLMSABinaryServer(nlmsa, 'localhost', 0,
+                                               nthreads=4)
+        xmlrpc = coordinator.XMLRPCServerBase('nlmsa', 'localhost', 0,
+                                              nthreads=4)
+        xmlrpc['msa'] = nlmsa
+        serving = []
+        for s in (server, xmlrpc.server):
+            t = threading.Thread(target=s.serve_forever)
+            t.setDaemon(True)
+            t.start()
+            serving.append(t)
+        queries = [('seq0', 0, 50), ('seq0', 100, 900), ('seq0', -2000, -1500)]
+        url = 'http://localhost:%d' % xmlrpc.port
+        xmlrpcCorrect = xmlrpclib.ServerProxy(url).methodCall('msa',
+                                                              'getSlices',
+                                                              [queries])
+        results = []
+
+        def binary_client():
+            client = xnestedlist.NLMSAClient('nlmsa://localhost:%d'
+                                             % server.port, seqDict=self.db,
+                                             maxCacheBytes=0)
+            for i in range(5):
+                results.append(self._query_results(client) == correct)
+            client.close()
+
+        def xmlrpc_client(): # ONE PROXY PER THREAD: httplib IS NOT THREADSAFE
+            proxy = xmlrpclib.ServerProxy(url)
+            for i in range(5):
+                results.append(proxy.methodCall('msa', 'getSlices', [queries])
+                               == xmlrpcCorrect)
+        clients = [threading.Thread(target=f) for f in
+                   (binary_client, xmlrpc_client) * 4]
+        for t in clients:
+            t.start()
+        for t in clients:
+            t.join()
+        for s in (server, xmlrpc.server):
+            s.shutdown() # stop serve_forever() before closing the socket
+            s.server_close()
+        for t in serving:
+            t.join()
+        nlmsa.close()
+        assert len(xmlrpcCorrect[1][1]) > 0
+        assert results == [True] * 40
+
+    def test_xmlrpc_server_without_getslices(self):
+        "NLMSAClient.query_many() queries an older server one at a time"
+        import threading
+        from pygr import coordinator, xnestedlist
+
+        class OldNLMSAServer(xnestedlist.NLMSAServer):
+            xmlrpc_methods = {'getSlice': 0, 'getInfo': 0} # no getSlices
+        msa = cnestedlist.NLMSA(self.pathstem, 'r', seqDict=self.db)
+        nlmsa = OldNLMSAServer(self.pathstem, 'r', seqDict=self.db)
+        xmlrpc = coordinator.XMLRPCServerBase('nlmsa', 'localhost', 0)
+        xmlrpc['msa'] = nlmsa
+        serving = threading.Thread(target=xmlrpc.server.serve_forever)
+        serving.setDaemon(True)
+        serving.start()
+        try:
+            client = xnestedlist.NLMSAClient('http://localhost:%d'
+                                             % xmlrpc.port, 'msa',
+                                             seqDict=self.db)
+            assert not hasattr(client.server, 'getSlices')
+            s0 = self.db['seq0']
+            ivals = [s0[1500:2000], s0[0:50], -s0[100:300], (s0, 400, 450)]
+            results = [[tuple(t) for t in l] # xmlrpc sends lists
+                       for l in client.query_many(ivals)]
+            assert results == msa.query_many(ivals)
+            assert len(results[0]) > 1
+            client.close()
+        finally:
+            xmlrpc.server.shutdown()
+            xmlrpc.server.server_close()
+            serving.join()
+            nlmsa.close()
+            msa.close()
+
+    def test_packed_seq_index(self):
+        "NLMSA packed .seqIndex gives the same lookups as the shelve index"
+        msa = cnestedlist.NLMSA(self.pathstem, 'r', seqDict=self.db)
+        correct = self._query_results(msa)
+        shelveItems = sorted(msa.seqs.seqIDdict.iteritems())
+        msa.close()
+        pathstem = self.tempdir.subfile('packedmsa')
+        msa = cnestedlist.NLMSA(pathstem, 'w', seqDict=self.db,
+                                pairwiseMode=True)
+        self._align(msa, range(1, 4))
+        msa.build(packSeqIndex=True)
+        msa.close()
+        assert os.path.exists(pathstem + '.seqIndex')
+        msa = cnestedlist.NLMSA(pathstem, 'r', seqDict=self.db)
+        assert isinstance(msa.seqs.seqIDdict, nlmsa_utils.PackedSeqIDDict)
+        assert sorted(msa.seqs.seqIDdict.iteritems()) == shelveItems
+        for seqID, (nlmsaID, nsID, offset) in shelveItems:
+            assert msa.seqs.IDdict[str(nlmsaID)] == (seqID, nsID)
+        self.assertRaises(KeyError, msa.seqs.seqIDdict.__getitem__, 'foo')
+        self.assertRaises(KeyError, msa.seqs.IDdict.__getitem__, '-1')
+        assert self._query_results(msa) == correct
+        msa.close()
+        # appending updates the packed index
+        msa = cnestedlist.NLMSA(pathstem, 'a', seqDict=self.db)
+        other = sequence.Sequence('ACGT' * 10, 'other')
+        msa += other
+        msa[other[0:10]] += self.db['seq0'][0:10]
+        msa.build()
+        msa.close()
+        msa = cnestedlist.NLMSA(pathstem, 'r', seqDict=self.db)
+        assert len(msa.seqs.seqIDdict) == len(shelveItems) + 1
+        msa.close()
+
+    def test_open_index_budget(self):
+        "NLMSA maxOpenIndexes closes least recently queried indexes"
+        pathstem = self.tempdir.subfile('manyunions')
+        self._build(pathstem, maxlen=2500) # ONE UNION PER SEQUENCE
+        msa = cnestedlist.NLMSA(pathstem, 'r', seqDict=self.db)
+        assert len(msa.openIndexes) == 0 # NOTHING OPENED UNTIL QUERIED
+        correct = self._query_results(msa)
+        for seq in self.db.values():
+            msa[seq].keys()
+        assert len(msa.openIndexes) == 4
+        msa.close()
+        assert len(msa.openIndexes) == 0
+        msa = cnestedlist.NLMSA(pathstem, 'r', seqDict=self.db,
+                                maxOpenIndexes=1)
+        assert msa.maxOpenIndexes == 1
+        for i in range(3): # INDEXES REOPEN TRANSPARENTLY ON DEMAND
+            assert self._query_results(msa) == correct
+            assert len(msa.openIndexes) == 1
+            for seq in self.db.values(): # QUERY EVERY SEQUENCE'S INDEX
+                msa[seq].keys()
+            assert len(msa.openIndexes) == 1
+        msa.close()
+
+    def test_manifest(self):
+        "NLMSA opens from its binary .manifest, or the older index files"
+        pathstem = self.pathstem
+        assert os.path.exists(pathstem + '.manifest')
+        msa = cnestedlist.NLMSA(pathstem, 'r', seqDict=self.db)
+        assert isinstance(msa.seqs.seqIDdict, nlmsa_utils.PackedSeqIDDict)
+        correct = self._query_results(msa)
+        attrs = (msa.is_bidirectional, msa.pairwiseMode, msa.inlmsa)
+        seqItems = sorted(msa.seqs.seqIDdict.iteritems())
+        msa.close()
+        manifest = nlmsa_utils.read_manifest(pathstem)
+        assert manifest.sequences == nlmsa_utils.read_nlmsa_index(pathstem)
+        assert manifest.attrs == nlmsa_utils.read_attr_dict(pathstem)
+        seqIDdict = nlmsa_utils.PackedSeqIDDict(manifest.seqIndex)
+        assert sorted(seqIDdict.iteritems()) == seqItems
+
+        os.remove(pathstem + '.manifest') # OLDER NLMSA: USE THE OTHER FILES
+        msa = cnestedlist.NLMSA(pathstem, 'r', seqDict=self.db)
+        assert not isinstance(msa.seqs.seqIDdict,
+                              nlmsa_utils.PackedSeqIDDict)
+        assert sorted(msa.seqs.seqIDdict.iteritems()) == seqItems
+        assert (msa.is_bidirectional, msa.pairwiseMode, msa.inlmsa) == attrs
+        assert self._query_results(msa) == correct
+        msa.close()
+
+        nlmsa_utils.save_manifest(pathstem) # UPGRADE IT
+        data = file(pathstem + '.manifest', 'rb').read()
+        msa = cnestedlist.NLMSA(pathstem, 'r', seqDict=self.db)
+        assert isinstance(msa.seqs.seqIDdict, nlmsa_utils.PackedSeqIDDict)
+        assert (msa.is_bidirectional, msa.pairwiseMode, msa.inlmsa) == attrs
+        assert self._query_results(msa) == correct
+        msa.close()
+
+        ofile = file(pathstem + '.manifest', 'wb') # CORRUPT ITS LAST BYTE
+        ofile.write(data[:-1] + chr(ord(data[-1]) ^ 1))
+        ofile.close()
+        self.assertRaises(IOError, nlmsa_utils.NLMSAManifest,
+                          pathstem + '.manifest')
+        msa = cnestedlist.NLMSA(pathstem, 'r', seqDict=self.db)
+        assert self._query_results(msa) == correct
+        msa.close()
+
+
+class SliceCache_Test(unittest.TestCase):
+    "Tests of the NLMSAClient slice cache"
+
+    def test_clip(self):
+        "SliceCache clips cached intervals to sub-interval queries"
+        from pygr import xnestedlist
+        cache = xnestedlist.SliceCache()
+        ivals = [(0, 10, 1, 100, 110), (5, 20, 2, -320, -305)]
+        cache.save('seq1', 0, 20, 7, ivals)
+        assert cache.get('seq1', 0, 20) == (7, ivals)
+        assert cache.get('seq1', 8, 12) == (7, [(8, 12, 2, -317, -313),
+                                                (8, 10, 1, 108, 110)])
+        assert cache.get('seq1', 12, 20) == (7, [(12, 20, 2, -313, -305)])
+        self.assertRaises(KeyError, cache.get, 'seq1', 15, 25)
+        self.assertRaises(KeyError, cache.get, 'seq1', -20, -10)
+        self.assertRaises(KeyError, cache.get, 'seq2', 0, 10)
+        assert (cache.hits, cache.misses) == (3, 3)
+
+    def test_many_entries(self):
+        "SliceCache finds the one cached query that can contain a query"
+        from pygr import xnestedlist
+        cache = xnestedlist.SliceCache()
+        for i in range(0, 10000, 10): # disjoint queries, saved out of order
+            j = (i * 37) % 10000
+            cache.save('seq1', j, j + 10, j, [(j, j + 10, 1, j, j + 10)])
+        assert len(cache) == 1000
+        assert cache.get('seq1', 5002, 5008) == (5000, [(5002, 5008, 1,
+                                                         5002, 5008)])
+        self.assertRaises(KeyError, cache.get, 'seq1', 5005, 5015)
+        cache.save('seq1', 5000, 5030, 0, []) # replaces the three inside it
+        assert len(cache) == 998
+        assert cache.get('seq1', 5005, 5015) == (0, [])
+        cache.save('seq1', 5010, 5020, 1, []) # already covered
+        assert len(cache) == 998
+        assert cache.get('seq1', 5010, 5020) == (0, [])
+        assert cache.get('seq1', 9990, 10000)[0] == 9990
+        self.assertRaises(KeyError, cache.get, 'seq1', 10000, 10001)
+
+    def test_lru(self):
+        "SliceCache drops least recently used results to fit maxBytes"
+        from pygr import xnestedlist
+        ival = [(0, 10, 1, 100, 110)]
+        cache = xnestedlist.SliceCache(3 * (xnestedlist.SliceCache.entryBytes
+                                            + xnestedlist.SliceCache.ivalBytes))
+        for i in range(3):
+            cache.save('seq%d' % i, 0, 10, i, ival)
+        cache.get('seq0', 0, 10) # seq1 IS NOW LEAST RECENTLY USED
+        cache.save('seq3', 0, 10, 3, ival)
+        assert len(cache) == 3
+        self.assertRaises(KeyError, cache.get, 'seq1', 0, 10)
+        for i in (0, 2, 3):
+            assert cache.get('seq%d' % i, 2, 5)[0] == i
+        cache.save('seq3', 0, 20, 3, ival) # REPLACES seq3[0:10]
+        assert len(cache) == 3
+        assert cache.nbytes <= cache.maxBytes
+
+
 class NLMSASeqDict_Test(unittest.TestCase):
 
     def setUp(self):
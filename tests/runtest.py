@@ -115,7 +115,7 @@ if __name__ == '__main__':
 
         # list patterns matching files to be removed here
         patterns = [
-            "*.seqlen", "*.pureseq", "*.nin", "*.pin", "*.psd",
+            "*.seqlen", "*.seqidx", "*.pureseq", "*.nin", "*.pin", "*.psd",
             "*.psi", "*.psq", "*.psd", "*.nni", "*.nhr",
             "*.nsi", "*.nsd", "*.nsq", "*.nnd",
         ]
@@ -243,6 +243,52 @@ class SequenceFileDB_Test(unittest.TestCase):
         except KeyError, e:
             assert "no key 'foo' in database <SequenceFileDB" in str(e), str(e)
 
+    def test_mmap_strslice(self):
+        "SequenceFileDB useMmap=True gives the same slices as file reads"
+        import threading
+        db = SequenceFileDB(testutil.datafile('dnaseq.fasta'), useMmap=True)
+        try:
+            for seqID in ('seq1', 'seq2'):
+                n = len(self.db[seqID])
+                for start, end in [(0, n), (0, 10), (5, 17), (n - 3, n),
+                                   (4, 4)]:
+                    s = self.db.strslice(seqID, start, end)
+                    assert db.strslice(seqID, start, end) == s
+                    assert str(db.strslice(seqID, start, end,
+                                           asBuffer=True)) == s
+                    assert str(self.db.strslice(seqID, start, end,
+                                                asBuffer=True)) == s
+                assert str(db[seqID]) == str(self.db[seqID])
+                assert str(db[seqID][3:-2]) == str(self.db[seqID][3:-2])
+
+            correct = [(seqID, i, self.db.strslice(seqID, i, i + 7))
+                       for seqID in ('seq1', 'seq2') for i in range(0, 50, 3)]
+            errors = []
+
+            def run(d):
+                try:
+                    for j in range(20):
+                        for seqID, i, s in correct:
+                            assert d.strslice(seqID, i, i + 7) == s
+                except Exception, e:
+                    errors.append(e)
+            threads = [threading.Thread(target=run, args=(d, ))
+                       for d in (db, self.db) for k in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            assert errors == []
+            b = db.strslice('seq1', 0, 10, asBuffer=True)
+            import pickle
+            db2 = pickle.loads(pickle.dumps(db))
+            assert db2.useMmap
+            db2.close()
+        finally:
+            db.close()
+        assert str(b) == self.db.strslice('seq1', 0, 10) # still mapped
+        self.assertRaises(ValueError, db.strslice, 'seq1', 0, 10)
+
     def test_close(self):
         """SequenceFileDB close.
         Check closing behavior; access after close() --> ValueError """
@@ -267,13 +313,12 @@ class SequenceFileDB_Creation_Test(unittest.TestCase):
     """
 
     def trash_intermediate_files(self):
-        seqlen = testutil.datafile('dnaseq.fasta.seqlen')
-        pureseq = testutil.datafile('dnaseq.fasta.pureseq')
-        try:
-            os.unlink(seqlen)
-            os.unlink(pureseq)
-        except OSError:
-            pass
+        for suffix in ('.seqlen', '.seqlen.bak', '.seqlen.dat', '.seqlen.dir',
+                       '.seqidx', '.pureseq', '.2bit'): # incl. dumbdbm files
+            try:
+                os.unlink(testutil.datafile('dnaseq.fasta' + suffix))
+            except OSError:
+                pass
 
     def setUp(self):
         "Test setup"
@@ -291,6 +336,143 @@ class SequenceFileDB_Creation_Test(unittest.TestCase):
         finally:
             db.close()
 
+    def test_seqidx(self):
+        "SequenceFileDB builds and uses a binary .seqidx index"
+        from pygr import seqfmt, classutil
+        db = SequenceFileDB(self.dbfile)
+        try:
+            assert isinstance(db.seqLenDict, seqfmt.SeqLenIndex)
+            assert os.path.exists(self.dbfile + '.seqidx')
+            assert not os.path.exists(self.dbfile + '.seqlen')
+            d = dict(db.seqLenDict.items())
+            assert sorted(d) == db.seqLenDict.keys() == ['seq1', 'seq2']
+            assert len(db.seqLenDict) == 2
+            for seqID, (length, offset) in d.items():
+                assert db.seqLenDict[seqID] == (length, offset)
+                assert len(db[seqID]) == length
+            assert 'seq3' not in db.seqLenDict and 1 not in db.seqLenDict
+            self.assertRaises(KeyError, db.seqLenDict.__getitem__, 'seq')
+            self.assertRaises(KeyError, db.seqLenDict.__getitem__, 'seq10')
+            assert str(db['seq1']).startswith('atggtgtca')
+        finally:
+            db.close()
+        self.assertRaises(ValueError, db.seqLenDict.__getitem__, 'seq1')
+
+        # many IDs, including prefixes of each other and an empty one
+        ids = [''] + [str(i) for i in range(500)] + ['a' * 300]
+        fullpath = testutil.tempdatafile('test.seqidx')
+        seqfmt.write_seqlen_index(fullpath, dict([(seqID, (i, 3 * i))
+                                          for i, seqID in enumerate(ids)]))
+        idx = seqfmt.SeqLenIndex(fullpath)
+        try:
+            assert idx.keys() == sorted(ids)
+            for i, seqID in enumerate(ids):
+                assert idx[seqID] == (i, 3 * i)
+            assert '5000' not in idx and idx.get('a') is None
+        finally:
+            idx.close()
+        assert not os.path.exists(fullpath + '.tmp')
+        data = file(fullpath, 'rb').read()
+        file(fullpath, 'wb').write(data[:-1]) # names section cut short
+        self.assertRaises(IOError, seqfmt.SeqLenIndex, fullpath)
+        file(fullpath, 'wb').write('not an index at all')
+        self.assertRaises(IOError, seqfmt.SeqLenIndex, fullpath)
+
+        # a bad .seqidx falls back to an older .seqlen shelve
+        os.rename(self.dbfile + '.seqidx', fullpath)
+        seqlen = classutil.open_shelve(self.dbfile + '.seqlen', 'n')
+        seqlen.update(d)
+        seqlen.close()
+        file(self.dbfile + '.seqidx', 'wb').write('junk')
+        db = SequenceFileDB(self.dbfile)
+        try:
+            assert not isinstance(db.seqLenDict, seqfmt.SeqLenIndex)
+            assert str(db['seq2']).startswith('GTGTTGAA')
+        finally:
+            db.close()
+
+    def test_gzip_and_threads(self):
+        "SequenceFileDB indexes gzipped FASTA, and FASTA in threads"
+        import gzip
+        db = SequenceFileDB(self.dbfile)
+        try:
+            seqs = dict([(k, str(v)) for k, v in db.items()])
+        finally:
+            db.close()
+        text = file(self.dbfile).read() * 3 # same IDs, so the last ones win
+        gzfile = testutil.tempdatafile('dnaseq.fasta.gz')
+        ofile = gzip.GzipFile(gzfile, 'wb')
+        ofile.write(text)
+        ofile.close()
+        fafile = testutil.tempdatafile('dnaseq3.fasta')
+        file(fafile, 'w').write(text)
+        for filepath, nthreads in ((gzfile, 1), (fafile, 4)):
+            db = SequenceFileDB(filepath, nthreads=nthreads)
+            try:
+                assert dict([(k, str(v)) for k, v in db.items()]) == seqs
+                assert db.seqLenDict['seq2'][1] > 2 * len(text) / 3 - 100
+            finally:
+                db.close()
+        pureseq = file(fafile + '.pureseq').read()
+        assert pureseq == file(gzfile + '.pureseq').read()
+        assert pureseq == ''.join([seqs['seq1'], seqs['seq2']]) * 3
+
+    def test_twobit(self):
+        "SequenceFileDB twoBit=True gives the same (N-masked) sequences"
+        import pickle
+        from pygr import seqfmt
+        db = SequenceFileDB(self.dbfile)
+        tdb = SequenceFileDB(self.dbfile, twoBit=True)
+        try:
+            assert os.path.exists(self.dbfile + '.2bit')
+            assert sorted(tdb.keys()) == sorted(db.keys())
+            for seqID in db:
+                s = str(db[seqID])
+                assert len(tdb[seqID]) == len(s)
+                assert str(tdb[seqID]) == s
+                for start, end in [(0, 10), (3, 17), (len(s) - 5, len(s)),
+                                   (len(s) - 5, len(s) + 5), (7, 7)]:
+                    assert tdb.strslice(seqID, start, end) == s[start:end]
+                assert str(tdb.strslice(seqID, 2, 9, asBuffer=True)) == s[2:9]
+            tdb2 = pickle.loads(pickle.dumps(tdb))
+            assert tdb2.twoBit and str(tdb2['seq2']) == str(db['seq2'])
+            tdb2.close()
+        finally:
+            tdb.close()
+            db.close()
+        # the .2bit index is still in memory, but the file is not remapped
+        self.assertRaises(ValueError, tdb.strslice, 'seq2', 0, 10)
+
+        # N runs, soft-masking and other letters, via a custom reader
+        class InfoBag(object):
+
+            def __init__(self, **kw):
+                self.__dict__.update(kw)
+        seqs = [('a', 'NNNNacgtACGTnnnnACGTRYacgtNNNN' * 3 + 'G'),
+                ('b', 'acgtacg'), ('empty', '')]
+
+        def my_reader(fp, filename):
+            return [InfoBag(id=k, length=len(s), sequence=s)
+                    for k, s in seqs]
+        self.trash_intermediate_files()
+        tdb = SequenceFileDB(self.dbfile, reader=my_reader, twoBit=True)
+        try:
+            assert sorted(tdb.keys()) == ['a', 'b'] # empty seqs are omitted
+            for k, s in seqs[:2]:
+                s = s.replace('R', 'N').replace('Y', 'N')
+                assert str(tdb[k]) == s
+                for i in range(len(s)):
+                    for j in range(i, len(s) + 1, 3):
+                        assert tdb.strslice(k, i, j) == s[i:j]
+        finally:
+            tdb.close()
+        data = file(self.dbfile + '.2bit', 'rb').read()
+        assert data[:4] == '\x43\x27\x41\x1a' # UCSC .2bit signature
+        self.assertRaises(IOError, seqfmt.read_2bit_index, data[:20])
+        # data that is not a buffer is rejected, not read through a bad pointer
+        self.assertRaises(TypeError, seqfmt.read_2bit_index, 12345)
+        self.assertRaises(TypeError, seqfmt.twobit_slice, None, 16, 0, 4)
+
     def test_build_seqLenDict_with_reader(self):
         "Test that building things works properly when specifying a reader."
 
@@ -876,8 +1058,8 @@ class SeqDBCache_Test(unittest.TestCase):
             # get seq1
             seq1 = db['seq1']
 
-            # _cache is only created on first cache attempt
-            assert not hasattr(db, '_cache')
+            # the cache is empty until the first cache hint
+            assert len(db.sliceCache) == 0
 
             # build an 'owner' object
             class AnonymousOwner(object):
@@ -889,20 +1071,19 @@ class SeqDBCache_Test(unittest.TestCase):
             cacheHint(cacheDict, owner)
             del cacheDict                   # 'owner' now holds reference
 
-            # peek into _cache and assert that only the ival coordinates
+            # peek into the cache and assert that only the ival coordinates
             # are stored
-            v = db._cache.values()[0]
-            assert len(v['seq1']) == 2
-            del v
+            assert len(db.sliceCache) == 1
+            assert db.sliceCache.nbytes == 0
 
             # force a cache access & check that now we've stored actual string
             ival = str(seq1[5:10])
-            v = db._cache.values()[0]
-            # ...check that we've stored actual string
-            assert len(v['seq1']) == 3
+            assert db.sliceCache.nbytes == len(seq1)
+            assert db.sliceCache.loads == 1
 
             # again force cache access, this time to the stored sequence string
             ival = str(seq1[5:10])
+            assert db.sliceCache.loads == 1 and db.sliceCache.hits == 2
 
             # now, eliminate all references to the cache proxy dict
             del owner
@@ -913,8 +1094,94 @@ class SeqDBCache_Test(unittest.TestCase):
             gc.collect()
 
             # ok, cached values should now be gone.
-            v = db._cache.values()
-            assert len(v) == 0
+            assert len(db.sliceCache) == 0
+            assert db.sliceCache.nbytes == 0
+            assert len(db.sliceCache.owners) == 0
+        finally:
+            db.close()
+
+    def test_cache_limits(self):
+        "Sequence slice cache merging, byte limit and owner lifetimes"
+        dnaseq = testutil.datafile('dnaseq.fasta')
+        db = SequenceFileDB(dnaseq, maxCacheBytes=40)
+        try:
+            seq1, seq2 = db['seq1'], db['seq2']
+            s1, s2 = str(seq1), str(seq2)
+            assert len(s1) == 78 and len(s2) == 26
+
+            class AnonymousOwner(object):
+                pass
+            owner1, owner2 = AnonymousOwner(), AnonymousOwner()
+            cache = db.sliceCache
+            db.cacheHint({'seq1': (0, 20), 'seq2': (0, 10)}, owner1)
+            db.cacheHint({'seq1': (15, 30), 'seq2': (15, 20)}, owner2)
+            assert len(cache) == 4 # overlapping hints are kept apart
+            assert str(seq1[20:30]) == s1[20:30]
+            assert cache.loads == 1 and cache.nbytes == 15 # just (15, 30)
+            assert str(seq1[0:3]) == s1[0:3]
+            assert cache.loads == 2 and cache.nbytes == 35
+            assert str(seq1[16:19]) == s1[16:19] # in both, both cached
+            assert cache.loads == 2
+            assert str(seq2[2:8]) == s2[2:8]
+            assert cache.nbytes == 25 # least recently used (0, 20) dropped
+            assert str(seq2[16:19]) == s2[16:19]
+            assert str(seq1[0:3]) == s1[0:3] # reloaded
+            assert cache.loads == 5 and cache.nbytes == 35
+            misses = cache.misses
+            assert str(seq2[8:18]) == s2[8:18] # not within one hint
+            assert str(seq1[40:50]) == s1[40:50]
+            assert cache.misses == misses + 2
+
+            db.cacheHint({'seq1': (35, 78)}, owner2) # replaces its hints
+            assert len(cache) == 3 and cache.nbytes == 30
+            hits = cache.hits
+            assert str(seq1[50:60]) == s1[50:60] # too big to cache
+            assert str(seq2[16:19]) == s2[16:19] # not cached any more
+            assert cache.misses == misses + 4 and cache.hits == hits
+            del owner1
+            gc.collect()
+            assert len(cache) == 1 and cache.nbytes == 0
+            db.clear_cache()
+        finally:
+            db.close()
+
+    def test_cache_tiled_hints(self):
+        "Overlapping hints of many owners are cached one tile at a time"
+        seq = 'ACGTTGCA' * 3500
+        fafile = testutil.tempdatafile('tiled.fasta')
+        file(fafile, 'w').write('>tiled\n%s\n' % seq)
+        db = SequenceFileDB(fafile, maxCacheBytes=1000)
+        try:
+            class AnonymousOwner(object):
+                pass
+            owners = []
+            for i in range(300): # 100 bp tiles, each overlapping the next
+                owners.append(AnonymousOwner())
+                db.cacheHint({'tiled': (i * 90, i * 90 + 100)}, owners[-1])
+            cache = db.sliceCache
+            assert len(cache) == 300
+            s = db['tiled']
+            misses = cache.misses
+            assert str(s[1000:1010]) == seq[1000:1010]
+            assert str(s[1790:1800]) == seq[1790:1800] # in two tiles
+            assert cache.loads == 2 and cache.nbytes == 200
+            assert cache.hits == 2 and cache.misses == misses
+            for i in range(0, 300, 2): # read every other tile
+                assert str(s[i * 90 + 5:i * 90 + 95]) == \
+                       seq[i * 90 + 5:i * 90 + 95]
+            assert cache.nbytes <= 1000 # old tiles were dropped
+            del owners[:150]
+            gc.collect()
+            assert len(cache) == 150
+            db.cacheHint({'tiled': (13503, 13550)}, owners[0]) # replace
+            assert len(cache) == 150
+            misses = cache.misses
+            assert str(s[13500:13510]) == seq[13500:13510] # no tile now
+            assert str(s[13510:13520]) == seq[13510:13520]
+            assert cache.misses == misses + 1
+            del owners
+            gc.collect()
+            assert len(cache) == 0 and cache.nbytes == 0
         finally:
             db.close()
 
@@ -939,27 +1206,27 @@ class SeqDBCache_Test(unittest.TestCase):
             mymap.build()
 
             # check: no cache
-            assert not hasattr(db, '_cache'), 'should be no cache yet'
+            assert len(db.sliceCache) == 0, 'should be no cache yet'
 
             seq1, seq2 = db['seq1'], db['seq2'] # re-retrieve
             # now retrieve a NLMSASlice, forcing entry of seq into cache
             ival = seq1[5:10]
             x = mymap[ival]
 
-            assert len(db._cache.values()) != 0
+            assert len(db.sliceCache) != 0
 
-            n1 = len(db._cache)
-            assert n1 == 1, "should be exactly one cache entry, not %d" % \
+            n1 = len(db.sliceCache.owners)
+            assert n1 == 1, "should be exactly one cache owner, not %d" % \
                     (n1, )
 
             # ok, now trash referencing arguments & make sure of cleanup
             del x
             gc.collect()
 
-            assert len(db._cache.values()) == 0
+            assert len(db.sliceCache) == 0
 
 
-            n2 = len(db._cache)
+            n2 = len(db.sliceCache.owners)
             assert n2 == 0, '%d objects remain; cache memory leak!' % n2
             # FAIL because of __dealloc__ error in cnestedlist.NLMSASlice.
 